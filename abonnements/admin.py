@@ -3,7 +3,9 @@ from django.contrib import admin
 from .models import (
     PackAbonnement, Abonnement, PaiementWave, 
     PackFamilial, BonusParrainage, Parrainage, 
-    HistoriqueRenouvellement, PackPermissions
+    HistoriqueRenouvellement, PackPermissions, UsageMensuelle, ConsultationExamen,
+    AbonnementActuel, EcheanceAbonnement, VerrouPlanificateur, EvenementWave, EvenementCommission,
+    RevenuJournalier, CohorteConversion
 )
 
 
@@ -21,6 +23,7 @@ class PackPermissionsAdmin(admin.ModelAdmin):
     list_filter = ['upgrade_reminder', 'teaser_content', 'restriction_temps', 'restriction_contenu']
     search_fields = ['pack__nom']
     ordering = ['pack__prix']
+    readonly_fields = ['masque_fonctionnalites', 'version']
 
 
 @admin.register(Abonnement)
@@ -52,8 +55,8 @@ class AbonnementAdmin(admin.ModelAdmin):
 
 @admin.register(PaiementWave)
 class PaiementWaveAdmin(admin.ModelAdmin):
-    list_display = ['transaction_id', 'abonnement', 'montant', 'devise', 'statut', 'date_creation']
-    list_filter = ['statut', 'devise', 'date_creation']
+    list_display = ['transaction_id', 'abonnement', 'montant', 'devise', 'statut', 'date_creation', 'date_rapprochement']
+    list_filter = ['statut', 'devise', 'date_creation', 'date_rapprochement']
     search_fields = ['transaction_id', 'abonnement__utilisateur__username']
     readonly_fields = ['date_creation', 'date_mise_a_jour', 'est_reussi']
     
@@ -62,7 +65,7 @@ class PaiementWaveAdmin(admin.ModelAdmin):
             'fields': ('transaction_id', 'abonnement', 'montant', 'devise', 'statut')
         }),
         ('Informations Wave', {
-            'fields': ('wave_reference', 'wave_phone', 'wave_email')
+            'fields': ('wave_reference', 'wave_phone', 'wave_email', 'date_rapprochement')
         }),
         ('Données', {
             'fields': ('callback_data', 'date_creation', 'date_mise_a_jour', 'est_reussi'),
@@ -154,4 +157,85 @@ class HistoriqueRenouvellementAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(UsageMensuelle)
+class UsageMensuelleAdmin(admin.ModelAdmin):
+    list_display = ['utilisateur', 'ressource', 'mois', 'annee', 'compteur', 'date_mise_a_jour']
+    list_filter = ['ressource', 'annee', 'mois']
+    search_fields = ['utilisateur__email', 'utilisateur__username']
+    readonly_fields = ['date_mise_a_jour']
 
+
+@admin.register(ConsultationExamen)
+class ConsultationExamenAdmin(admin.ModelAdmin):
+    list_display = ['utilisateur', 'examen', 'mois', 'annee', 'date_consultation']
+    list_filter = ['annee', 'mois']
+    search_fields = ['utilisateur__email', 'examen__titre']
+    readonly_fields = ['date_consultation']
+
+
+@admin.register(AbonnementActuel)
+class AbonnementActuelAdmin(admin.ModelAdmin):
+    list_display = ['utilisateur', 'abonnement', 'date_mise_a_jour']
+    search_fields = ['utilisateur__email', 'utilisateur__username']
+    raw_id_fields = ['utilisateur', 'abonnement']
+    readonly_fields = ['date_mise_a_jour']
+
+
+@admin.register(EcheanceAbonnement)
+class EcheanceAbonnementAdmin(admin.ModelAdmin):
+    list_display = ['abonnement', 'type_echeance', 'date_echeance', 'date_traitement', 'resultat', 'tentatives']
+    list_filter = ['type_echeance', 'resultat']
+    search_fields = ['abonnement__utilisateur__email']
+    raw_id_fields = ['abonnement']
+    date_hierarchy = 'date_echeance'
+
+
+@admin.register(VerrouPlanificateur)
+class VerrouPlanificateurAdmin(admin.ModelAdmin):
+    list_display = ['nom', 'detenteur', 'expire_le']
+
+
+@admin.register(EvenementWave)
+class EvenementWaveAdmin(admin.ModelAdmin):
+    list_display = ['transaction_id', 'statut_wave', 'statut', 'tentatives', 'date_reception', 'date_traitement']
+    list_filter = ['statut', 'statut_wave']
+    search_fields = ['transaction_id', 'cle_dedoublonnage']
+    readonly_fields = ['date_reception', 'date_traitement']
+
+
+@admin.register(EvenementCommission)
+class EvenementCommissionAdmin(admin.ModelAdmin):
+    list_display = ['abonnement', 'statut', 'tentatives', 'date_creation', 'date_traitement']
+    list_filter = ['statut']
+    search_fields = ['abonnement__utilisateur__email']
+    raw_id_fields = ['abonnement']
+    readonly_fields = ['date_creation', 'date_traitement']
+
+
+@admin.register(RevenuJournalier)
+class RevenuJournalierAdmin(admin.ModelAdmin):
+    """Lecture seule : la table est réécrite par la commande construire_revenus_journaliers"""
+    list_display = ['jour', 'pack_id', 'pack_familial', 'statut', 'famille', 'paye_par_parent', 'nombre', 'montant', 'date_calcul']
+    list_filter = ['statut', 'famille', 'pack_familial', 'paye_par_parent']
+    date_hierarchy = 'jour'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(CohorteConversion)
+class CohorteConversionAdmin(admin.ModelAdmin):
+    """Lecture seule : la table est reconstruite par la commande construire_entonnoir_conversion"""
+    list_display = ['semaine', 'source', 'code_partenaire', 'inscrits', 'essais', 'payants', 'renouveles', 'date_calcul']
+    list_filter = ['source']
+    search_fields = ['code_partenaire']
+    date_hierarchy = 'semaine'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AbonnementsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'abonnements'
+
+    def ready(self):
+        from . import checks  # noqa: F401
@@ -0,0 +1,20 @@
+# abonnements/checks.py
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches)
+def verifier_cache_partage(app_configs, **kwargs):
+    """Signale un cache non partagé entre les workers (REDIS_URL absent) hors développement"""
+    from .services import CacheDroitsService
+
+    if settings.DEBUG or CacheDroitsService.cache_partage():
+        return []
+    return [
+        Warning(
+            "Le cache par défaut n'est pas partagé entre les processus : le cache des droits d'abonnement "
+            "est désactivé et chaque worker recharge le référentiel à intervalle court.",
+            hint="Définir REDIS_URL (paquet redis) pour un déploiement à plusieurs workers.",
+            id='abonnements.W001',
+        )
+    ]
@@ -0,0 +1,40 @@
+"""
+Commande Django pour reconstruire les cohortes de l'entonnoir de conversion
+(inscription → essai → premier paiement → renouvellement, par semaine d'inscription et par source)
+Usage: python manage.py construire_entonnoir_conversion [--chunk-size 10000]
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from abonnements.services import EntonnoirConversionService
+
+
+class Command(BaseCommand):
+    help = "Reconstruit les cohortes CohorteConversion en un parcours par tranches des utilisateurs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=10000,
+            help='Nombre d\'utilisateurs lus par tranche (défaut: 10000)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            self.style.SUCCESS(f'🔄 Construction de l\'entonnoir de conversion - {timezone.now().strftime("%Y-%m-%d %H:%M:%S")}')
+        )
+
+        resultats = EntonnoirConversionService.construire(taille_lot=options['chunk_size'])
+        entonnoir = EntonnoirConversionService.get_entonnoir()['total']
+
+        self.stdout.write(f"👥 {resultats['utilisateurs']} utilisateurs en {resultats['cohortes']} cohortes ({resultats['duree']}s)")
+        self.stdout.write("\n📊 Entonnoir global:")
+        self.stdout.write(f"   📝 Inscrits: {entonnoir['inscrits']}")
+        self.stdout.write(f"   🎁 Essais: {entonnoir['essais']} ({entonnoir['taux_essai']}%)")
+        self.stdout.write(
+            f"   💳 Payants: {entonnoir['payants']} ({entonnoir['taux_conversion']}%, "
+            f"{entonnoir['taux_conversion_essai']}% des essais)"
+        )
+        self.stdout.write(f"   🔁 Renouvelés: {entonnoir['renouveles']} ({entonnoir['taux_renouvellement']}% des payants)")
+
+        self.stdout.write(self.style.SUCCESS(f"\n✅ {resultats['cohortes']} cohortes écrites"))
@@ -0,0 +1,67 @@
+"""
+Commande Django pour (re)construire les cumuls quotidiens de revenus et paiements Wave (RevenuJournalier)
+Usage: python manage.py construire_revenus_journaliers [--jours 7] [--debut AAAA-MM-JJ --fin AAAA-MM-JJ] [--incremental]
+
+Sans option : calcul de nuit, les 7 derniers jours (paiements supprimés compris) et les jours modifiés.
+--incremental : seulement les jours des paiements modifiés depuis le calcul précédent (toutes les quelques minutes).
+--debut / --fin : reconstruction d'une période passée ; la commande peut être relancée sans double comptage.
+"""
+import time
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from abonnements.services import RevenusJournaliersService
+
+
+class Command(BaseCommand):
+    help = "Réécrit les cumuls quotidiens de revenus (par pack, statut, famille et payeur) depuis PaiementWave"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--jours',
+            type=int,
+            default=7,
+            help='Nombre de derniers jours réécrits (défaut: 7)',
+        )
+        parser.add_argument(
+            '--debut',
+            help='Premier jour de la période à reconstruire (AAAA-MM-JJ)',
+        )
+        parser.add_argument(
+            '--fin',
+            help='Dernier jour inclus de la période à reconstruire (AAAA-MM-JJ, défaut: aujourd\'hui)',
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Réécrit seulement les jours des paiements modifiés depuis le calcul précédent',
+        )
+
+    def _date(self, valeur, option):
+        try:
+            return datetime.strptime(valeur, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f"{option} invalide : {valeur} (format attendu : AAAA-MM-JJ)")
+
+    def handle(self, *args, **options):
+        debut, fin = None, None
+        if not options['incremental']:
+            fin = self._date(options['fin'], '--fin') if options['fin'] else timezone.localdate()
+            if options['debut']:
+                debut = self._date(options['debut'], '--debut')
+            else:
+                debut = fin - timedelta(days=max(options['jours'], 1) - 1)
+            if debut > fin:
+                raise CommandError('--debut doit précéder --fin')
+            self.stdout.write(f"🔄 Réécriture des revenus du {debut:%d/%m/%Y} au {fin:%d/%m/%Y} et des jours modifiés...")
+        else:
+            self.stdout.write("🔄 Réécriture des jours modifiés depuis le calcul précédent...")
+
+        chrono = time.perf_counter()
+        resultats = RevenusJournaliersService.calculer(debut, fin)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"✅ {resultats['jours']} jours recalculés, {resultats['lignes']} lignes écrites "
+                f"({time.perf_counter() - chrono:.2f}s)"
+            )
+        )
@@ -0,0 +1,84 @@
+"""
+Commande Django pour (re)construire les compteurs d'utilisation mensuelle
+à partir de l'historique des progressions, des tentatives de quiz et des consultations d'examens
+Usage: python manage.py construire_usages_mensuels [--dry-run]
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.utils import timezone
+from abonnements.models import UsageMensuelle, ConsultationExamen
+from progression.models import ProgressionContenu
+from quiz.models import TentativeQuiz
+
+
+class Command(BaseCommand):
+    help = "Construit les compteurs UsageMensuelle depuis ProgressionContenu, TentativeQuiz et ConsultationExamen"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Simulation sans modification des données',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Nombre de compteurs écrits par requête (défaut: 1000)',
+        )
+
+    def _agreger(self, lignes, ressource, champ_utilisateur):
+        """Un GROUP BY (utilisateur, année, mois) par ressource"""
+        lignes = lignes.values(champ_utilisateur, 'annee', 'mois').annotate(total=Count('id')).order_by()
+
+        return [
+            UsageMensuelle(
+                utilisateur_id=ligne[champ_utilisateur],
+                annee=ligne['annee'],
+                mois=ligne['mois'],
+                ressource=ressource,
+                compteur=ligne['total']
+            )
+            for ligne in lignes
+        ]
+
+    def _par_date_debut(self, queryset):
+        return queryset.annotate(annee=ExtractYear('date_debut'), mois=ExtractMonth('date_debut'))
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            self.style.SUCCESS(f'🔄 Construction des compteurs mensuels - {timezone.now().strftime("%Y-%m-%d %H:%M:%S")}')
+        )
+
+        compteurs = (
+            self._agreger(self._par_date_debut(ProgressionContenu.objects.all()), UsageMensuelle.RESSOURCE_COURS, 'etudiant_id')
+            + self._agreger(self._par_date_debut(TentativeQuiz.objects.all()), UsageMensuelle.RESSOURCE_QUIZ, 'etudiant_id')
+            + self._agreger(ConsultationExamen.objects.all(), UsageMensuelle.RESSOURCE_EXAMEN, 'utilisateur_id')
+        )
+
+        for code, libelle in UsageMensuelle.RESSOURCE_CHOICES:
+            total = sum(c.compteur for c in compteurs if c.ressource == code)
+            lignes = sum(1 for c in compteurs if c.ressource == code)
+            self.stdout.write(f"📊 {libelle}: {total} consommations sur {lignes} compteurs")
+
+        if options['dry_run']:
+            self.stdout.write(
+                self.style.WARNING('⚠️  MODE SIMULATION - Relancez sans --dry-run pour écrire les compteurs')
+            )
+            return
+
+        # Les compteurs existants sont remplacés : la commande peut être relancée sans double comptage
+        with transaction.atomic():
+            UsageMensuelle.objects.bulk_create(
+                compteurs,
+                batch_size=options['batch_size'],
+                update_conflicts=True,
+                unique_fields=['utilisateur', 'annee', 'mois', 'ressource'],
+                update_fields=['compteur', 'date_mise_a_jour']
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(f'✅ {len(compteurs)} compteurs mensuels écrits')
+        )
@@ -1,5 +1,7 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from abonnements.models import PackAbonnement
+from abonnements.services import CacheDroitsService, ReferentielService
 
 class Command(BaseCommand):
     help = 'Crée les packs familiaux dans la base de données'
@@ -48,22 +50,33 @@ class Command(BaseCommand):
             },
         ]
 
-        created_count = 0
-        for pack_data in family_packs:
-            pack, created = PackAbonnement.objects.get_or_create(
-                nom=pack_data['nom'],
-                defaults=pack_data
+        # Une requête pour les packs existants, une insertion pour les nouveaux
+        existants = dict(
+            PackAbonnement.objects.filter(
+                nom__in=[pack_data['nom'] for pack_data in family_packs]
+            ).values_list('nom', 'id')
+        )
+        for nom, pack_id in existants.items():
+            self.stdout.write(
+                self.style.WARNING(f'⚠️ Pack existe déjà: {nom} (ID: {pack_id})')
+            )
+
+        with transaction.atomic():
+            packs = PackAbonnement.objects.bulk_create([
+                PackAbonnement(**pack_data)
+                for pack_data in family_packs
+                if pack_data['nom'] not in existants
+            ])
+            if packs:
+                # bulk_create ne déclenche pas post_save : invalidation du référentiel et des droits en cache
+                transaction.on_commit(ReferentielService.invalider)
+                transaction.on_commit(CacheDroitsService.invalider_packs)
+
+        for pack in packs:
+            self.stdout.write(
+                self.style.SUCCESS(f'✅ Pack créé: {pack.nom} (ID: {pack.id})')
             )
-            if created:
-                created_count += 1
-                self.stdout.write(
-                    self.style.SUCCESS(f'✅ Pack créé: {pack.nom} (ID: {pack.id})')
-                )
-            else:
-                self.stdout.write(
-                    self.style.WARNING(f'⚠️ Pack existe déjà: {pack.nom} (ID: {pack.id})')
-                )
 
         self.stdout.write(
-            self.style.SUCCESS(f'🎉 {created_count} nouveaux packs familiaux créés')
+            self.style.SUCCESS(f'🎉 {len(packs)} nouveaux packs familiaux créés')
         )
@@ -0,0 +1,67 @@
+"""
+Commande Django pour mesurer l'index d'intervalles et le balayage sur un jeu synthétique (sans base de données)
+Usage: python manage.py mesurer_rapport_abonnes [--nombre 1000000] [--graine 42]
+"""
+import random
+import time
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand
+from abonnements.services import IndexIntervallesAbonnements
+
+
+TYPES_PACK = ['standard', 'premium', 'famille', 'gratuit']
+DUREES_JOURS = [7, 30, 90, 365]
+
+
+class Command(BaseCommand):
+    help = "Mesure construction de l'index et balayage (90 jours, 1 an, 3 ans) sur N abonnements synthétiques"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--nombre',
+            type=int,
+            default=1000000,
+            help="Nombre d'abonnements synthétiques (défaut: 1000000)",
+        )
+        parser.add_argument(
+            '--graine',
+            type=int,
+            default=42,
+            help='Graine du générateur aléatoire (défaut: 42)',
+        )
+
+    def _lignes(self, nombre, graine, origine):
+        """Abonnements synthétiques sur 3 ans, triés par date de début"""
+        aleatoire = random.Random(graine)
+        decalages = sorted(aleatoire.randrange(3 * 365 * 24) for _ in range(nombre))
+        for decalage in decalages:
+            date_debut = origine + timedelta(hours=decalage)
+            type_pack = aleatoire.choice(TYPES_PACK)
+            duree = aleatoire.choice(DUREES_JOURS)
+            montant = 0 if type_pack == 'gratuit' else duree * 100
+            # Un quart des abonnés renouvellent : l'abonnement suivant commence à la fin du précédent
+            date_suivant = date_debut + timedelta(days=duree) if aleatoire.random() < 0.25 else None
+            yield date_debut, date_debut + timedelta(days=duree), date_suivant, type_pack, montant, False
+
+    def handle(self, *args, **options):
+        nombre = options['nombre']
+        origine = datetime(2023, 1, 1)
+
+        etape = time.perf_counter()
+        lignes = list(self._lignes(nombre, options['graine'], origine))
+        self.stdout.write(f"🧪 {nombre} abonnements synthétiques générés en {time.perf_counter() - etape:.2f}s")
+
+        etape = time.perf_counter()
+        index = IndexIntervallesAbonnements.construire(lignes)
+        duree = time.perf_counter() - etape
+        self.stdout.write(f"📦 Index construit en {duree:.2f}s ({len(index) / duree:.0f} abonnements/s)")
+
+        fin = (origine + timedelta(days=3 * 365)).date()
+        self.stdout.write(f"\n{'Période':<10} {'Jours':>6} {'Durée':>10} {'Abonnements/s':>15}")
+        for libelle, jours in (('90 jours', 90), ('1 an', 365), ('3 ans', 3 * 365)):
+            etape = time.perf_counter()
+            series = index.balayer(fin - timedelta(days=jours - 1), fin)
+            duree = time.perf_counter() - etape
+            self.stdout.write(f"{libelle:<10} {len(series):>6} {duree * 1000:>7.0f} ms {len(index) / duree:>15.0f}")
+
+        self.stdout.write(self.style.SUCCESS(f"\n✅ Mesures sur {len(index)} intervalles"))
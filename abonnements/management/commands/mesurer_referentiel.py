@@ -0,0 +1,113 @@
+"""
+Commande Django pour mesurer le gain du référentiel en mémoire (requêtes SQL et temps par appel)
+Usage: python manage.py mesurer_referentiel [--iterations 200]
+"""
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from abonnements.models import PackAbonnement, PackFamilial
+from abonnements.serializers import PackAbonnementSerializer
+from abonnements.services import CataloguePacksService, ReferentielService
+from academic_structure.models import NiveauScolaire
+from academic_structure.serializers import NiveauScolaireSerializer
+from academic_structure.views import NiveauScolaireViewSet
+from examens.models import TypeExamen
+from examens.serializers import TypeExamenSerializer
+from examens.views import TypeExamenViewSet
+from utilisateurs.models import ConfigurationPartenaire
+
+
+class Command(BaseCommand):
+    help = "Compare requêtes SQL et temps par appel avant/après le référentiel en mémoire"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help="Nombre d'appels mesurés par scénario (défaut: 200)",
+        )
+
+    def _mesurer(self, fonction, iterations):
+        """Retourne (requêtes par appel, millisecondes par appel)"""
+        with CaptureQueriesContext(connection) as requetes:
+            fonction()
+        debut = time.perf_counter()
+        for _ in range(iterations):
+            fonction()
+        duree_ms = (time.perf_counter() - debut) * 1000 / iterations
+        return len(requetes.captured_queries), duree_ms
+
+    def _ancien_pack_paiement(self, pack_id):
+        try:
+            return PackAbonnement.objects.get(id=pack_id)
+        except PackAbonnement.DoesNotExist:
+            return PackFamilial.objects.filter(id=pack_id).first()
+
+    def _appel_vue(self, vue):
+        requete = APIRequestFactory().get('/')
+        return vue.as_view({'get': 'list'})(requete).data
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        pack_familial = PackFamilial.objects.order_by('id').first()
+        pack_id = pack_familial.id if pack_familial else 0
+
+        # Coût d'un chargement complet (premier accès ou après une modification)
+        ReferentielService._donnees = None
+        with CaptureQueriesContext(connection) as chargement:
+            ReferentielService.get_pack_gratuit()
+        self.stdout.write(f"📦 Chargement du référentiel : {len(chargement.captured_queries)} requêtes")
+
+        scenarios = [
+            (
+                "Pack Gratuit",
+                lambda: PackAbonnement.objects.filter(
+                    type_pack='gratuit', nom='Gratuit', actif=True
+                ).select_related('permissions').first(),
+                ReferentielService.get_pack_gratuit,
+            ),
+            (
+                "Configuration partenaire",
+                ConfigurationPartenaire.charger_configuration_active,
+                ConfigurationPartenaire.get_configuration_active,
+            ),
+            (
+                "Pack de paiement (standard puis familial)",
+                lambda: self._ancien_pack_paiement(pack_id),
+                lambda: ReferentielService.get_pack_ou_pack_familial(pack_id),
+            ),
+            (
+                "Catalogue des packs (paiements enfants)",
+                lambda: PackAbonnementSerializer(
+                    PackAbonnement.objects.filter(actif=True).exclude(
+                        nom="Pack de Bienvenue Parrainage"
+                    ).exclude(type_pack='famille'),
+                    many=True
+                ).data,
+                lambda: CataloguePacksService.get_catalogue('tous'),
+            ),
+            (
+                "Liste des niveaux scolaires",
+                lambda: NiveauScolaireSerializer(NiveauScolaire.objects.all(), many=True).data,
+                lambda: self._appel_vue(NiveauScolaireViewSet),
+            ),
+            (
+                "Liste des types d'examen",
+                lambda: TypeExamenSerializer(TypeExamen.objects.all(), many=True).data,
+                lambda: self._appel_vue(TypeExamenViewSet),
+            ),
+        ]
+
+        self.stdout.write(f"\n{'Scénario':<45} {'Avant':>18} {'Après':>18}")
+        for nom, ancien, nouveau in scenarios:
+            requetes_avant, ms_avant = self._mesurer(ancien, iterations)
+            requetes_apres, ms_apres = self._mesurer(nouveau, iterations)
+            self.stdout.write(
+                f"{nom:<45} {requetes_avant:>4} req {ms_avant:>7.3f} ms"
+                f" {requetes_apres:>4} req {ms_apres:>7.3f} ms"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"\n✅ Mesures sur {iterations} appels par scénario"))
@@ -1,111 +1,167 @@
+"""
+Commande Django pour nettoyer et corriger les abonnements incohérents, en requêtes ensemblistes par lots
+Usage: python manage.py nettoyer_abonnements [--chunk-size 1000] [--summary]
+"""
+import time
+from datetime import timedelta
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from django.db import transaction
-from abonnements.models import Abonnement
-from datetime import timedelta
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from abonnements.models import Abonnement, EcheanceAbonnement
+from abonnements.services import AbonnementService, CacheDroitsService
+
+
+# Écart toléré entre date_fin et date_debut + durée du pack (date_debut et date_fin sont horodatées séparément à la création)
+TOLERANCE_DATE_FIN = timedelta(hours=1)
+
 
 class Command(BaseCommand):
     help = 'Nettoie et corrige les abonnements incohérents'
 
-    def handle(self, *args, **options):
-        self.stdout.write("🧹 Début du nettoyage des abonnements...")
-        
-        # 1. Désactiver tous les abonnements expirés
-        maintenant = timezone.now()
-        abonnements_expires = Abonnement.objects.filter(
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Nombre d\'abonnements modifiés par transaction (défaut: 1000)',
+        )
+        parser.add_argument(
+            '--summary',
+            action='store_true',
+            help='Affiche uniquement le résumé (pas le détail des abonnements modifiés)',
+        )
+
+    def _details(self, ids, format_ligne):
+        """Détail des abonnements d'un lot, en une requête (mode non résumé uniquement)"""
+        if self.resume:
+            return
+        lignes = Abonnement.objects.filter(id__in=ids).values_list(
+            'utilisateur__email', 'pack__nom', 'date_debut', 'date_fin'
+        )
+        for email, pack, date_debut, date_fin in lignes:
+            self.stdout.write(format_ligne(email, pack, date_debut, date_fin))
+
+    def _par_lots(self, ids):
+        taille = self.taille_lot
+        for debut in range(0, len(ids), taille):
+            yield ids[debut:debut + taille]
+
+    def _desactiver_expires(self, maintenant):
+        """Phase 1 : désactive les abonnements échus, un UPDATE par lot"""
+        expires = Abonnement.objects.filter(
             actif=True,
             date_fin__lt=maintenant,
             statut__in=['actif', 'essai']
         ).exclude(
             pack__type_pack='gratuit'  # Ne pas traiter les packs gratuits
         )
-        
-        self.stdout.write(f"📅 {abonnements_expires.count()} abonnements expirés trouvés")
-        
-        with transaction.atomic():
-            for abonnement in abonnements_expires:
-                abonnement.actif = False
-                abonnement.statut = 'expire'
-                abonnement.save()
-                self.stdout.write(f"   ✅ {abonnement.utilisateur.email} - {abonnement.pack.nom} (expiré le {abonnement.date_fin.strftime('%d/%m/%Y')})")
-        
-        # 2. Identifier et corriger les abonnements multiples actifs pour le même utilisateur
-        self.stdout.write("\n🔍 Recherche des abonnements multiples actifs...")
-        
-        # Grouper par utilisateur
-        from django.db.models import Count
-        utilisateurs_multiples = Abonnement.objects.filter(
+
+        total = 0
+        while True:
+            with transaction.atomic():
+                lot = list(expires.order_by('id').values_list('id', 'utilisateur_id')[:self.taille_lot])
+                if not lot:
+                    break
+                ids = [abonnement_id for abonnement_id, _ in lot]
+                self._details(ids, lambda email, pack, debut, fin: (
+                    f"   ✅ {email} - {pack} (expiré le {fin.strftime('%d/%m/%Y')})"
+                ))
+                total += Abonnement.objects.filter(id__in=ids, actif=True).update(actif=False, statut='expire')
+                EcheanceAbonnement.objects.filter(
+                    abonnement_id__in=ids, date_traitement__isnull=True
+                ).update(date_traitement=maintenant, resultat=EcheanceAbonnement.RESULTAT_OBSOLETE)
+                AbonnementService.synchroniser_abonnements_actuels({uid for _, uid in lot})
+        return total
+
+    def _desactiver_doublons(self):
+        """Phase 2 : garde l'abonnement actif le plus récent par utilisateur (fonction de fenêtre)"""
+        # La contrainte abonnement_un_actif_par_utilisateur rend ce cas impossible ; la phase reste un filet de sécurité
+        rangs = Abonnement.objects.filter(
             actif=True,
             statut__in=['actif', 'essai']
-        ).values('utilisateur').annotate(
-            count=Count('id')
-        ).filter(count__gt=1)
-        
-        self.stdout.write(f"👥 {utilisateurs_multiples.count()} utilisateurs avec des abonnements multiples")
-        
-        for user_data in utilisateurs_multiples:
-            utilisateur_id = user_data['utilisateur']
-            abonnements_actifs = Abonnement.objects.filter(
-                utilisateur_id=utilisateur_id,
-                actif=True,
-                statut__in=['actif', 'essai']
-            ).order_by('-date_debut')
-            
-            # Garder seulement le plus récent, désactiver les autres
-            abonnement_principal = abonnements_actifs.first()
-            abonnements_a_desactiver = abonnements_actifs[1:]
-            
-            self.stdout.write(f"\n👤 {abonnement_principal.utilisateur.email}:")
-            self.stdout.write(f"   ✅ Garde: {abonnement_principal.pack.nom} (début: {abonnement_principal.date_debut.strftime('%d/%m/%Y')})")
-            
-            for abonnement in abonnements_a_desactiver:
-                abonnement.actif = False
-                abonnement.statut = 'remplace'
-                abonnement.save()
-                self.stdout.write(f"   ❌ Désactivé: {abonnement.pack.nom} (début: {abonnement.date_debut.strftime('%d/%m/%Y')})")
-        
-        # 3. Corriger les abonnements avec des dates incohérentes
-        self.stdout.write("\n📅 Correction des dates incohérentes...")
-        
-        abonnements_a_corriger = Abonnement.objects.filter(
+        ).annotate(
+            rang=Window(RowNumber(), partition_by=[F('utilisateur_id')], order_by=[F('date_debut').desc(), F('id').desc()])
+        )
+        lignes = list(rangs.filter(rang__gt=1).values_list('id', 'utilisateur_id'))
+
+        total = 0
+        for lot in self._par_lots(lignes):
+            with transaction.atomic():
+                ids = [abonnement_id for abonnement_id, _ in lot]
+                self._details(ids, lambda email, pack, debut, fin: (
+                    f"   ❌ Désactivé: {email} - {pack} (début: {debut.strftime('%d/%m/%Y')})"
+                ))
+                total += Abonnement.objects.filter(id__in=ids, actif=True).update(actif=False, statut='remplace')
+                AbonnementService.synchroniser_abonnements_actuels({uid for _, uid in lot})
+        return total
+
+    def _corriger_dates(self):
+        """Phase 3 : recale date_fin sur date_debut + durée du pack, un UPDATE par pack et par lot"""
+        actifs = Abonnement.objects.filter(
             actif=True,
-            statut__in=['actif', 'essai']
+            statut__in=['actif', 'essai'],
+            date_renouvellement__isnull=True  # Un renouvellement prolonge volontairement la date de fin
         ).exclude(
             pack__type_pack='gratuit'
         )
-        
-        for abonnement in abonnements_a_corriger:
-            # Vérifier si la date de fin est cohérente avec la durée du pack
-            if abonnement.date_debut and abonnement.pack.duree_jours:
-                date_fin_calculee = abonnement.date_debut + timedelta(days=abonnement.pack.duree_jours)
-                
-                # Si la date de fin ne correspond pas, la corriger
-                if abonnement.date_fin != date_fin_calculee:
-                    ancienne_date = abonnement.date_fin
-                    abonnement.date_fin = date_fin_calculee
-                    abonnement.save()
-                    self.stdout.write(f"   🔧 {abonnement.utilisateur.email} - {abonnement.pack.nom}: {ancienne_date.strftime('%d/%m/%Y')} → {date_fin_calculee.strftime('%d/%m/%Y')}")
-        
-        # 4. Statistiques finales
-        self.stdout.write("\n📊 Statistiques finales:")
-        total_actifs = Abonnement.objects.filter(actif=True).count()
-        total_expires = Abonnement.objects.filter(statut='expire').count()
-        total_remplaces = Abonnement.objects.filter(statut='remplace').count()
-        
-        self.stdout.write(f"   ✅ Abonnements actifs: {total_actifs}")
-        self.stdout.write(f"   ❌ Abonnements expirés: {total_expires}")
-        self.stdout.write(f"   🔄 Abonnements remplacés: {total_remplaces}")
-        
-        # 5. Afficher les abonnements actifs restants
-        self.stdout.write("\n👥 Abonnements actifs restants:")
-        abonnements_actifs = Abonnement.objects.filter(actif=True).select_related('utilisateur', 'pack')
-        
-        for abonnement in abonnements_actifs:
-            jours_restants = "Illimité"
-            if abonnement.date_fin:
-                jours_restants = (abonnement.date_fin - maintenant).days
-                jours_restants = f"{jours_restants} jours" if jours_restants > 0 else "Expiré"
-            
-            self.stdout.write(f"   • {abonnement.utilisateur.email} - {abonnement.pack.nom} - {jours_restants}")
-        
+        durees = actifs.filter(pack__duree_jours__gt=0).values_list('pack_id', 'pack__duree_jours').distinct().order_by()
+
+        total = 0
+        for pack_id, duree_jours in durees:
+            date_fin_calculee = F('date_debut') + timedelta(days=duree_jours)
+            incoherents = actifs.filter(pack_id=pack_id).filter(
+                Q(date_fin__isnull=True)
+                | Q(date_fin__lt=date_fin_calculee - TOLERANCE_DATE_FIN)
+                | Q(date_fin__gt=date_fin_calculee + TOLERANCE_DATE_FIN)
+            )
+            while True:
+                with transaction.atomic():
+                    ids = list(incoherents.order_by('id').values_list('id', flat=True)[:self.taille_lot])
+                    if not ids:
+                        break
+                    self._details(ids, lambda email, pack, debut, fin: (
+                        f"   🔧 {email} - {pack}: {fin.strftime('%d/%m/%Y') if fin else '—'} → "
+                        f"{(debut + timedelta(days=duree_jours)).strftime('%d/%m/%Y')}"
+                    ))
+                    total += Abonnement.objects.filter(id__in=ids).update(date_fin=date_fin_calculee)
+        return total
+
+    def handle(self, *args, **options):
+        self.taille_lot = options['chunk_size']
+        self.resume = options['summary']
+        debut = time.perf_counter()
+        maintenant = timezone.now()
+        self.stdout.write("🧹 Début du nettoyage des abonnements...")
+
+        # 1. Désactiver tous les abonnements expirés
+        self.stdout.write("\n📅 Désactivation des abonnements expirés...")
+        etape = time.perf_counter()
+        expires = self._desactiver_expires(maintenant)
+        self.stdout.write(f"📅 {expires} abonnements expirés désactivés ({time.perf_counter() - etape:.2f}s)")
+
+        # 2. Identifier et corriger les abonnements multiples actifs pour le même utilisateur
+        self.stdout.write("\n🔍 Recherche des abonnements multiples actifs...")
+        etape = time.perf_counter()
+        doublons = self._desactiver_doublons()
+        self.stdout.write(f"👥 {doublons} abonnements en double désactivés ({time.perf_counter() - etape:.2f}s)")
+
+        # 3. Corriger les abonnements avec des dates incohérentes
+        self.stdout.write("\n📅 Correction des dates incohérentes...")
+        etape = time.perf_counter()
+        dates_corrigees = self._corriger_dates()
+        self.stdout.write(f"🔧 {dates_corrigees} dates de fin corrigées ({time.perf_counter() - etape:.2f}s)")
+
+        # Les droits en cache reposent sur l'abonnement et sa date de fin : invalidation globale en une écriture
+        if doublons or dates_corrigees:
+            CacheDroitsService.invalider_packs()
+
+        # 4. Résumé
+        self.stdout.write("\n📊 Résumé:")
+        self.stdout.write(f"   ❌ Abonnements expirés: {expires}")
+        self.stdout.write(f"   🔄 Abonnements remplacés: {doublons}")
+        self.stdout.write(f"   🔧 Dates corrigées: {dates_corrigees}")
+        self.stdout.write(f"   ⏱️  Durée totale: {time.perf_counter() - debut:.2f}s")
+
         self.stdout.write("\n🎉 Nettoyage terminé !")
@@ -0,0 +1,107 @@
+"""
+Commande Django (processus longue durée) qui exécute les échéances d'abonnements à l'heure dite :
+fin d'essai, expiration et rappel trois jours avant la fin
+Usage: python manage.py planifier_echeances [--once] [--intervalle 60] [--chunk-size 200] [--bail 120]
+"""
+import os
+import signal
+import socket
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from abonnements.services import PlanificateurService
+
+
+class Command(BaseCommand):
+    help = "Traite les échéances d'abonnements dès qu'elles arrivent à terme (une seule instance active grâce au bail)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Traite les échéances dues puis s\'arrête (usage cron)',
+        )
+        parser.add_argument(
+            '--intervalle',
+            type=int,
+            default=60,
+            help='Attente maximale (secondes) entre deux passages (défaut: 60)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Nombre d\'échéances traitées par lot (défaut: 200)',
+        )
+        parser.add_argument(
+            '--bail',
+            type=int,
+            default=120,
+            help='Durée (secondes) du bail, renouvelé à chaque passage (défaut: 120)',
+        )
+
+    def _arreter(self, *args):
+        self.arret_demande = True
+
+    def _attendre(self, secondes):
+        """Sommeil interruptible par SIGTERM / SIGINT"""
+        fin = time.monotonic() + secondes
+        while not self.arret_demande and time.monotonic() < fin:
+            time.sleep(min(1, fin - time.monotonic()))
+
+    def _passage(self, detenteur, options):
+        """Traite les échéances dues lot par lot ; retourne le nombre d'échéances traitées"""
+        total = 0
+        while not self.arret_demande:
+            # Le bail est prolongé avant chaque lot : un lot ne déborde jamais d'un bail perdu
+            if not PlanificateurService.acquerir_bail(detenteur, options['bail']):
+                self.stdout.write(self.style.WARNING('⚠️  Bail perdu, une autre instance a pris le relais'))
+                break
+
+            debut = time.perf_counter()
+            resultats = PlanificateurService.traiter_echeances(limite=options['chunk_size'])
+            if not resultats['traitees']:
+                break
+            total += resultats['traitees']
+            self.stdout.write(
+                f"⏱️  {timezone.now().strftime('%H:%M:%S')} - {resultats['traitees']} échéances en "
+                f"{(time.perf_counter() - debut) * 1000:.0f} ms : {resultats['expires']} expirations, "
+                f"{resultats['rappels']} rappels, {resultats['replanifiees']} replanifiées, "
+                f"{resultats['obsoletes']} sans objet, {resultats['erreurs']} erreurs"
+            )
+            if resultats['traitees'] < options['chunk_size']:
+                break
+        return total
+
+    def handle(self, *args, **options):
+        detenteur = f"{socket.gethostname()}:{os.getpid()}"
+        self.arret_demande = False
+        signal.signal(signal.SIGTERM, self._arreter)
+        signal.signal(signal.SIGINT, self._arreter)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'🕒 Planificateur des échéances démarré ({detenteur})')
+        )
+
+        try:
+            while not self.arret_demande:
+                close_old_connections()
+
+                if PlanificateurService.acquerir_bail(detenteur, options['bail']):
+                    self._passage(detenteur, options)
+                    attente = options['intervalle']
+                    prochaine = PlanificateurService.get_prochaine_echeance()
+                    if prochaine:
+                        # Réveil à l'heure de la prochaine échéance, sans dépasser l'intervalle (renouvellement du bail)
+                        attente = min(attente, max(1, (prochaine - timezone.now()).total_seconds()))
+                else:
+                    attente = options['intervalle']
+                    self.stdout.write('⏸️  Bail détenu par une autre instance, nouvelle tentative plus tard')
+
+                if options['once']:
+                    break
+                self._attendre(attente)
+        finally:
+            PlanificateurService.liberer_bail(detenteur)
+            self.stdout.write(self.style.SUCCESS('✅ Planificateur arrêté, bail libéré'))
@@ -0,0 +1,104 @@
+"""
+Commande Django pour rapprocher un relevé Wave exporté (CSV, JSON ou JSON Lines) avec les paiements
+Usage: python manage.py rapprocher_releve_wave releve.csv [--format csv] [--rapport anomalies.csv] [--chunk-size 5000] [--dry-run]
+"""
+import csv
+import os
+from django.core.management.base import BaseCommand, CommandError
+from abonnements.services import RapprochementWaveService
+
+
+FORMATS = {'.csv': 'csv', '.json': 'json', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+LIBELLES = [
+    ('rapproches', '✅ Rapprochés'),
+    ('deja_rapproches', '☑️  Déjà rapprochés'),
+    ('actives', '🔓 Paiements en attente activés'),
+    ('erreurs_activation', '❌ Erreurs d\'activation'),
+    ('ecart_montant', '💸 Écarts de montant'),
+    ('ecart_telephone', '📱 Écarts de téléphone'),
+    ('ecart_statut', '⚠️  Réussis chez Wave, échoués/annulés ici'),
+    ('orphelin_releve', '❓ Lignes du relevé sans paiement'),
+    ('orphelin_base', '❓ Paiements réussis absents du relevé'),
+    ('doublon_releve', '🔁 Doublons dans le relevé'),
+    ('sans_identifiant', '🚫 Lignes sans transaction_id'),
+    ('ignores', '⏭️  Lignes non réussies ignorées'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Rapproche un relevé Wave avec les paiements (lecture en flux, mémoire bornée) et liste les anomalies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichier', help='Relevé Wave exporté')
+        parser.add_argument(
+            '--format',
+            choices=sorted(set(FORMATS.values())),
+            help='Format du relevé (déduit de l\'extension par défaut)',
+        )
+        parser.add_argument(
+            '--rapport',
+            help='Fichier CSV où écrire les anomalies (orphelins et écarts)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Nombre de lignes du relevé rapprochées par lot (défaut: 5000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Affiche le résultat sans marquer ni activer les paiements',
+        )
+
+    def handle(self, *args, **options):
+        chemin = options['fichier']
+        format_releve = options['format'] or FORMATS.get(os.path.splitext(chemin)[1].lower())
+        if not format_releve:
+            raise CommandError('Format du relevé inconnu : préciser --format')
+        if not os.path.exists(chemin):
+            raise CommandError(f'Fichier introuvable : {chemin}')
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('🔍 MODE TEST - Aucun paiement ne sera modifié'))
+        self.stdout.write(f"🔄 Rapprochement du relevé {chemin} ({format_releve})...")
+
+        rapport = open(options['rapport'], 'w', newline='', encoding='utf-8') if options['rapport'] else None
+        try:
+            signaler = None
+            if rapport:
+                colonnes = ['anomalie', 'transaction_id', 'montant_releve', 'montant_base',
+                            'telephone_releve', 'telephone_base', 'statut_base', 'reference']
+                ecrivain = csv.DictWriter(rapport, fieldnames=colonnes, extrasaction='ignore')
+                ecrivain.writeheader()
+                signaler = lambda anomalie, transaction_id, details: ecrivain.writerow(
+                    {'anomalie': anomalie, 'transaction_id': transaction_id, **details}
+                )
+
+            with open(chemin, newline='', encoding='utf-8-sig') as fichier:
+                resultats = RapprochementWaveService.rapprocher(
+                    RapprochementWaveService.lire_releve(fichier, format_releve),
+                    taille_lot=options['chunk_size'],
+                    appliquer=not options['dry_run'],
+                    signaler=signaler,
+                )
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if rapport:
+                rapport.close()
+
+        self.stdout.write(f"\n📊 {resultats.get('lignes', 0)} lignes lues :")
+        for cle, libelle in LIBELLES:
+            if resultats.get(cle):
+                self.stdout.write(f"   {libelle}: {resultats[cle]}")
+        if options['dry_run']:
+            self.stdout.write("   (paiements réussis absents du relevé : non calculés en mode test)")
+        self.stdout.write(
+            f"   ⏱️  Durée: {resultats['duree_secondes']:.2f}s ({resultats['lignes_par_seconde']:.0f} lignes/s)"
+        )
+        if options['rapport']:
+            self.stdout.write(f"📄 Anomalies écrites dans {options['rapport']}")
+
+        self.stdout.write(self.style.SUCCESS('✅ Rapprochement terminé'))
@@ -0,0 +1,72 @@
+"""
+Commande Django pour renouveler en lot les abonnements en renouvellement automatique arrivant à échéance
+Usage: python manage.py renouveler_abonnements [--fenetre-jours 3] [--chunk-size 200] [--workers 4] [--passerelle chemin.Classe] [--dry-run]
+"""
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from abonnements.services import RenouvellementService
+
+
+class Command(BaseCommand):
+    help = 'Renouvelle par lots (pool de workers borné) les abonnements en renouvellement automatique'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fenetre-jours',
+            type=int,
+            default=3,
+            help='Renouvelle les abonnements dont la fin tombe dans ce nombre de jours (défaut: 3)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Nombre d\'abonnements (d\'un même pack) par lot (défaut: 200)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Nombre de lots traités en parallèle (défaut: 4)',
+        )
+        parser.add_argument(
+            '--passerelle',
+            help='Classe de passerelle de paiement (défaut: réglage ABONNEMENTS_PASSERELLE_RENOUVELLEMENT)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Affiche les lots sans créer de paiement ni prolonger d\'abonnement',
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('🔍 MODE TEST - Aucun renouvellement ne sera effectué'))
+
+        passerelle = RenouvellementService.get_passerelle(options['passerelle'])
+        self.stdout.write(
+            f"🔄 Renouvellement des abonnements dus sous {options['fenetre_jours']} jours "
+            f"({type(passerelle).__name__}, {options['workers']} workers)..."
+        )
+
+        resultats = RenouvellementService.renouveler(
+            fenetre=timedelta(days=options['fenetre_jours']),
+            taille_lot=options['chunk_size'],
+            workers=options['workers'],
+            passerelle=passerelle,
+            appliquer=not options['dry_run'],
+        )
+
+        self.stdout.write(f"\n📦 {resultats['abonnements']} abonnements en {resultats['lots']} lots :")
+        self.stdout.write(f"   ✅ Renouvelés: {resultats['renouveles']}")
+        if resultats['nouveaux']:
+            self.stdout.write(f"   🆕 Remplacés entre-temps, nouvel abonnement créé: {resultats['nouveaux']}")
+        self.stdout.write(f"   ⏳ Paiements en attente: {resultats['en_attente']}")
+        self.stdout.write(f"   💳 Paiements refusés: {resultats['echoues']}")
+        self.stdout.write(f"   ❌ Erreurs: {resultats['erreurs']}")
+        duree = resultats['duree_secondes']
+        self.stdout.write(
+            f"   ⏱️  Durée: {duree:.2f}s ({resultats['abonnements'] / duree if duree else 0:.0f} abonnements/s)"
+        )
+
+        self.stdout.write(self.style.SUCCESS('✅ Renouvellement terminé'))
@@ -0,0 +1,66 @@
+"""
+Commande Django (worker) qui attribue les commissions partenaires des abonnements payants mis en file
+Usage: python manage.py traiter_commissions [--once] [--intervalle 2] [--chunk-size 500]
+"""
+import signal
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from abonnements.models import EvenementCommission
+from abonnements.services import CommissionService
+
+
+class Command(BaseCommand):
+    help = 'Attribue par lots les commissions partenaires (un UPDATE F() par partenaire et par transaction)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Vide la file puis s\'arrête (usage cron)',
+        )
+        parser.add_argument(
+            '--intervalle',
+            type=float,
+            default=2,
+            help='Attente (secondes) quand la file est vide (défaut: 2)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Nombre d\'événements traités par transaction (défaut: 500)',
+        )
+
+    def _arreter(self, *args):
+        self.arret_demande = True
+
+    def handle(self, *args, **options):
+        self.arret_demande = False
+        signal.signal(signal.SIGTERM, self._arreter)
+        signal.signal(signal.SIGINT, self._arreter)
+
+        self.stdout.write(self.style.SUCCESS('🔄 Worker des commissions démarré'))
+
+        while not self.arret_demande:
+            close_old_connections()
+            debut = time.perf_counter()
+            resultats = CommissionService.traiter_evenements(limite=options['chunk_size'])
+
+            if resultats['lus']:
+                duree = time.perf_counter() - debut
+                self.stdout.write(
+                    f"📦 {resultats['lus']} abonnements en {duree * 1000:.0f} ms "
+                    f"({resultats['lus'] / duree:.0f}/s) : "
+                    f"✅ {resultats[EvenementCommission.STATUT_TRAITE]} commissionnés, "
+                    f"⏭️  {resultats[EvenementCommission.STATUT_IGNORE]} sans partenaire, "
+                    f"🔁 {resultats[EvenementCommission.STATUT_A_TRAITER]} à retenter, "
+                    f"❌ {resultats[EvenementCommission.STATUT_ERREUR]} en erreur"
+                )
+
+            if resultats['lus'] < options['chunk_size']:
+                if options['once']:
+                    break
+                time.sleep(options['intervalle'])
+
+        self.stdout.write(self.style.SUCCESS('✅ Worker arrêté'))
@@ -0,0 +1,66 @@
+"""
+Commande Django (worker) qui traite les callbacks Wave enregistrés par la vue wave_callback
+Usage: python manage.py traiter_evenements_wave [--once] [--intervalle 2] [--chunk-size 100]
+"""
+import signal
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from abonnements.models import EvenementWave
+from abonnements.services import WaveCallbackService
+
+
+class Command(BaseCommand):
+    help = 'Traite par lots les callbacks Wave reçus (activation des abonnements, une seule fois par transaction)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Vide la file puis s\'arrête (usage cron)',
+        )
+        parser.add_argument(
+            '--intervalle',
+            type=float,
+            default=2,
+            help='Attente (secondes) quand la file est vide (défaut: 2)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=100,
+            help='Nombre d\'événements lus par lot (défaut: 100)',
+        )
+
+    def _arreter(self, *args):
+        self.arret_demande = True
+
+    def handle(self, *args, **options):
+        self.arret_demande = False
+        signal.signal(signal.SIGTERM, self._arreter)
+        signal.signal(signal.SIGINT, self._arreter)
+
+        self.stdout.write(self.style.SUCCESS('🔄 Worker des callbacks Wave démarré'))
+
+        while not self.arret_demande:
+            close_old_connections()
+            debut = time.perf_counter()
+            resultats = WaveCallbackService.traiter_evenements(limite=options['chunk_size'])
+
+            if resultats['lus']:
+                duree = time.perf_counter() - debut
+                self.stdout.write(
+                    f"📦 {resultats['lus']} événements en {duree * 1000:.0f} ms "
+                    f"({resultats['lus'] / duree:.0f}/s) : "
+                    f"✅ {resultats[EvenementWave.STATUT_TRAITE]} traités, "
+                    f"⏭️  {resultats[EvenementWave.STATUT_IGNORE]} ignorés, "
+                    f"🔁 {resultats[EvenementWave.STATUT_RECU]} à retenter, "
+                    f"❌ {resultats[EvenementWave.STATUT_ERREUR]} en erreur"
+                )
+
+            if resultats['lus'] < options['chunk_size']:
+                if options['once']:
+                    break
+                time.sleep(options['intervalle'])
+
+        self.stdout.write(self.style.SUCCESS('✅ Worker arrêté'))
@@ -1,7 +1,8 @@
 """
 Commande Django pour traiter les abonnements expirés
-Usage: python manage.py traiter_expirations
+Usage: python manage.py traiter_expirations [--dry-run] [--chunk-size 500] [--limit N]
 """
+import time
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from abonnements.services import ExpirationService
@@ -21,6 +22,18 @@ class Command(BaseCommand):
             action='store_true',
             help='Affichage détaillé',
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Nombre d\'abonnements traités (et validés) par transaction (défaut: 500)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Nombre maximum d\'abonnements à traiter lors de cette exécution',
+        )
 
     def handle(self, *args, **options):
         self.stdout.write(
@@ -34,24 +47,22 @@ class Command(BaseCommand):
         
         try:
             if options['dry_run']:
-                # Mode simulation
-                from abonnements.models import Abonnement
+                # Mode simulation : une seule requête d'agrégat, quel que soit le volume
+                debut = time.perf_counter()
+                apercu = ExpirationService.compter_expirations()
+                duree_ms = (time.perf_counter() - debut) * 1000
                 
-                abonnements_expires = Abonnement.objects.filter(
-                    actif=True,
-                    date_fin__lt=timezone.now(),
-                    statut__in=['actif', 'essai']
-                ).exclude(
-                    pack__type_pack='gratuit'
+                self.stdout.write(
+                    f"📊 {apercu['total']} abonnements expirés trouvés ({apercu['utilisateurs']} utilisateurs)"
                 )
-                
-                self.stdout.write(f"📊 {abonnements_expires.count()} abonnements expirés trouvés")
-                
-                for abonnement in abonnements_expires:
+                if apercu['total']:
                     self.stdout.write(
-                        f"  - {abonnement.utilisateur.email}: {abonnement.pack.nom} "
-                        f"(expiré le {abonnement.date_fin.strftime('%d/%m/%Y')})"
+                        f"  📅 Échéances du {apercu['plus_ancienne'].strftime('%d/%m/%Y')} "
+                        f"au {apercu['plus_recente'].strftime('%d/%m/%Y')}"
                     )
+                    lots = -(-apercu['total'] // options['chunk_size'])
+                    self.stdout.write(f"  📦 {lots} lots de {options['chunk_size']} au plus")
+                self.stdout.write(f"  ⏱️  Aperçu calculé en {duree_ms:.1f} ms")
                 
                 self.stdout.write(
                     self.style.WARNING('🔄 Relancez sans --dry-run pour traiter les expirations')
@@ -59,11 +70,17 @@ class Command(BaseCommand):
                 
             else:
                 # Traitement réel
-                resultats = ExpirationService.verifier_et_traiter_expirations()
+                resultats = ExpirationService.verifier_et_traiter_expirations(
+                    taille_lot=options['chunk_size'],
+                    limite=options['limit']
+                )
                 
+                debit = resultats['traites'] / resultats['duree_secondes'] if resultats['duree_secondes'] else 0
                 self.stdout.write(f"📊 RÉSULTATS:")
                 self.stdout.write(f"  ✅ Traités avec succès: {resultats['traites']}")
+                self.stdout.write(f"  📦 Lots validés: {resultats['lots']}")
                 self.stdout.write(f"  ❌ Erreurs: {resultats['erreurs']}")
+                self.stdout.write(f"  ⏱️  Durée: {resultats['duree_secondes']:.2f}s ({debit:.0f} abonnements/s)")
                 
                 if options['verbose'] or resultats['erreurs'] > 0:
                     self.stdout.write(f"\n📋 DÉTAILS:")
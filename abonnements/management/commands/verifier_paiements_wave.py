@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 Commande de gestion pour vérifier et activer automatiquement les paiements Wave en attente
-Usage: python manage.py verifier_paiements_wave
+(sandbox : l'activation sans preuve de paiement exige WAVE_ACTIVATION_AUTOMATIQUE=True)
+Usage: python manage.py verifier_paiements_wave [--chunk-size 200] [--limit N]
 """
 
 from django.core.management.base import BaseCommand
@@ -19,6 +20,18 @@ class Command(BaseCommand):
             action='store_true',
             help='Forcer l\'activation de tous les paiements en attente',
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Nombre de paiements activés par transaction (défaut: 200)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Nombre maximal de paiements lus lors de ce passage',
+        )
 
     def handle(self, *args, **options):
         self.stdout.write(
@@ -27,8 +40,28 @@ class Command(BaseCommand):
         
         try:
             # Vérifier les paiements en attente
-            WaveCallbackService.verifier_paiements_en_attente()
+            resultats = WaveCallbackService.verifier_paiements_en_attente(
+                taille_lot=options['chunk_size'],
+                limite=options['limit']
+            )
+            
+            if not resultats['activation_automatique']:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"⏸️  Activation automatique désactivée (WAVE_ACTIVATION_AUTOMATIQUE) : "
+                        f"{resultats['en_attente']} paiements en attente depuis plus de 5 minutes, "
+                        f"activés par le callback Wave ou par rapprocher_releve_wave"
+                    )
+                )
+                return
             
+            self.stdout.write(f"📦 {resultats['lus']} paiements lus en {resultats['lots']} lots")
+            self.stdout.write(f"   ✅ Activés: {resultats['actives']}")
+            self.stdout.write(f"   ❌ Erreurs: {resultats['erreurs']}")
+            self.stdout.write(
+                f"   ⏱️  Durée: {resultats['duree_secondes']:.2f}s "
+                f"({resultats['paiements_par_seconde']:.0f} paiements/s)"
+            )
             self.stdout.write(
                 self.style.SUCCESS('✅ Vérification terminée avec succès')
             )
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-17 01:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageMensuelle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('annee', models.PositiveSmallIntegerField()),
+                ('mois', models.PositiveSmallIntegerField()),
+                ('ressource', models.CharField(choices=[('cours', 'Cours'), ('quiz', 'Quiz')], max_length=20)),
+                ('compteur', models.PositiveIntegerField(default=0)),
+                ('date_mise_a_jour', models.DateTimeField(auto_now=True)),
+                ('utilisateur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usages_mensuels', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Utilisation mensuelle',
+                'verbose_name_plural': 'Utilisations mensuelles',
+                'unique_together': {('utilisateur', 'annee', 'mois', 'ressource')},
+            },
+        ),
+    ]
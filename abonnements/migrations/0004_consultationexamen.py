@@ -0,0 +1,39 @@
+# Generated by Django 5.1.2 on 2026-10-17 01:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0003_usagemensuelle'),
+        ('examens', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usagemensuelle',
+            name='ressource',
+            field=models.CharField(choices=[('cours', 'Cours'), ('quiz', 'Quiz'), ('examen', 'Examens')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='ConsultationExamen',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('annee', models.PositiveSmallIntegerField()),
+                ('mois', models.PositiveSmallIntegerField()),
+                ('date_consultation', models.DateTimeField(auto_now_add=True)),
+                ('examen', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consultations', to='examens.examen')),
+                ('utilisateur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consultations_examens', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': "Consultation d'examen",
+                'verbose_name_plural': "Consultations d'examens",
+                'ordering': ['-date_consultation'],
+                'unique_together': {('utilisateur', 'examen', 'annee', 'mois')},
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.2 on 2026-10-17 01:36
+
+from django.db import migrations, models
+
+
+# Copie figée de PackPermissions.FONCTIONNALITES au moment de la migration
+FONCTIONNALITES = (
+    'acces_cours_premium', 'acces_ia_standard', 'acces_ia_prioritaire', 'acces_certificats',
+    'acces_contenu_hors_ligne', 'acces_communautaire', 'support_prioritaire',
+    'acces_prioritaire_nouveautes', 'specialisation_examens', 'contenu_examens_prioritaire',
+    'profils_separes', 'suivi_familial', 'upgrade_reminder', 'teaser_content',
+    'restriction_temps', 'restriction_contenu', 'restriction_examens', 'bonus_parrainage',
+    'bonus_inscription', 'bonus_conversion_parrainage', 'bonus_conversion_standard',
+    'bonus_annuel', 'acces_exclusif', 'source_parrainage', 'source_inscription',
+)
+
+
+def compiler_masques(apps, schema_editor):
+    """Compile le masque de bits des permissions existantes"""
+    PackPermissions = apps.get_model('abonnements', 'PackPermissions')
+    for permissions in PackPermissions.objects.all():
+        masque = 0
+        for position, fonctionnalite in enumerate(FONCTIONNALITES):
+            if getattr(permissions, fonctionnalite):
+                masque |= 1 << position
+        PackPermissions.objects.filter(pk=permissions.pk).update(masque_fonctionnalites=masque, version=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0004_consultationexamen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='packpermissions',
+            name='masque_fonctionnalites',
+            field=models.PositiveBigIntegerField(default=0, editable=False, help_text='Masque de bits des fonctionnalités (ordre de FONCTIONNALITES)'),
+        ),
+        migrations.AddField(
+            model_name='packpermissions',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Incrémentée à chaque modification'),
+        ),
+        migrations.RunPython(compiler_masques, migrations.RunPython.noop),
+    ]
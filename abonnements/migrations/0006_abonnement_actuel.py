@@ -0,0 +1,89 @@
+# Generated by Django 5.1.2 on 2026-10-17 01:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def dedoublonner_abonnements_actifs(apps, schema_editor):
+    """Ne garde qu'un abonnement actif par utilisateur, celui que la résolution des droits retenait"""
+    Abonnement = apps.get_model('abonnements', 'Abonnement')
+    maintenant = timezone.now()
+    
+    doublons = Abonnement.objects.filter(actif=True).values('utilisateur_id').annotate(
+        total=models.Count('id')
+    ).filter(total__gt=1).order_by()
+    
+    for ligne in doublons:
+        # Non expiré d'abord, puis limité dans le temps avant illimité, puis le plus récent
+        conserve = Abonnement.objects.filter(utilisateur_id=ligne['utilisateur_id'], actif=True).annotate(
+            expire=models.Case(
+                models.When(date_fin__lt=maintenant, then=models.Value(1)),
+                default=models.Value(0),
+                output_field=models.IntegerField()
+            ),
+            illimite=models.Case(
+                models.When(date_fin__isnull=True, then=models.Value(1)),
+                default=models.Value(0),
+                output_field=models.IntegerField()
+            )
+        ).order_by('expire', 'illimite', '-date_debut', '-id').first()
+        
+        Abonnement.objects.filter(
+            utilisateur_id=ligne['utilisateur_id'], actif=True
+        ).exclude(pk=conserve.pk).update(actif=False, statut='remplace')
+
+
+def remplir_abonnements_actuels(apps, schema_editor):
+    """Crée la référence vers l'abonnement actif de chaque utilisateur"""
+    Abonnement = apps.get_model('abonnements', 'Abonnement')
+    AbonnementActuel = apps.get_model('abonnements', 'AbonnementActuel')
+    
+    AbonnementActuel.objects.bulk_create(
+        [
+            AbonnementActuel(utilisateur_id=utilisateur_id, abonnement_id=abonnement_id)
+            for abonnement_id, utilisateur_id in Abonnement.objects.filter(actif=True).values_list('id', 'utilisateur_id')
+        ],
+        batch_size=1000,
+        ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0005_permissions_masque'),
+        ('utilisateurs', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(dedoublonner_abonnements_actifs, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='AbonnementActuel',
+            fields=[
+                ('utilisateur', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='abonnement_actuel_ref', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('date_mise_a_jour', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Abonnement actuel',
+                'verbose_name_plural': 'Abonnements actuels',
+            },
+        ),
+        migrations.AlterField(
+            model_name='abonnement',
+            name='statut',
+            field=models.CharField(choices=[('actif', 'Actif'), ('inactif', 'Inactif'), ('expire', 'Expiré'), ('suspendu', 'Suspendu'), ('essai', 'Essai gratuit'), ('remplace', 'Remplacé')], default='actif', max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='abonnement',
+            constraint=models.UniqueConstraint(condition=models.Q(('actif', True)), fields=('utilisateur',), name='abonnement_un_actif_par_utilisateur'),
+        ),
+        migrations.AddField(
+            model_name='abonnementactuel',
+            name='abonnement',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='references_actuelles', to='abonnements.abonnement'),
+        ),
+        migrations.RunPython(remplir_abonnements_actuels, migrations.RunPython.noop),
+    ]
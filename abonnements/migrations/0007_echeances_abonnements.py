@@ -0,0 +1,74 @@
+# Generated by Django 5.1.2 on 2026-10-17 01:46
+
+import django.db.models.deletion
+from datetime import timedelta
+from django.db import migrations, models
+
+
+def planifier_abonnements_existants(apps, schema_editor):
+    """Planifie les échéances des abonnements actifs à durée limitée (même règles que PlanificateurService)"""
+    Abonnement = apps.get_model('abonnements', 'Abonnement')
+    EcheanceAbonnement = apps.get_model('abonnements', 'EcheanceAbonnement')
+    
+    echeances = []
+    abonnements = Abonnement.objects.filter(actif=True, date_fin__isnull=False).only(
+        'id', 'date_debut', 'date_fin', 'date_fin_essai', 'est_essai_gratuit'
+    )
+    for abonnement in abonnements.iterator(chunk_size=2000):
+        if abonnement.est_essai_gratuit:
+            echeances.append(EcheanceAbonnement(
+                abonnement_id=abonnement.id, type_echeance='fin_essai',
+                date_echeance=abonnement.date_fin_essai or abonnement.date_fin
+            ))
+        else:
+            echeances.append(EcheanceAbonnement(
+                abonnement_id=abonnement.id, type_echeance='expiration', date_echeance=abonnement.date_fin
+            ))
+        date_rappel = abonnement.date_fin - timedelta(days=3)
+        if date_rappel > abonnement.date_debut:
+            echeances.append(EcheanceAbonnement(
+                abonnement_id=abonnement.id, type_echeance='rappel_3_jours', date_echeance=date_rappel
+            ))
+    EcheanceAbonnement.objects.bulk_create(echeances, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0006_abonnement_actuel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VerrouPlanificateur',
+            fields=[
+                ('nom', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('detenteur', models.CharField(blank=True, max_length=100)),
+                ('expire_le', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Verrou du planificateur',
+                'verbose_name_plural': 'Verrous du planificateur',
+            },
+        ),
+        migrations.CreateModel(
+            name='EcheanceAbonnement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_echeance', models.CharField(choices=[('fin_essai', "Fin d'essai"), ('expiration', 'Expiration'), ('rappel_3_jours', 'Rappel 3 jours avant la fin')], max_length=20)),
+                ('date_echeance', models.DateTimeField()),
+                ('date_traitement', models.DateTimeField(blank=True, null=True)),
+                ('resultat', models.CharField(blank=True, max_length=20)),
+                ('tentatives', models.PositiveSmallIntegerField(default=0)),
+                ('abonnement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='echeances', to='abonnements.abonnement')),
+            ],
+            options={
+                'verbose_name': "Échéance d'abonnement",
+                'verbose_name_plural': "Échéances d'abonnements",
+                'ordering': ['date_echeance'],
+                'indexes': [models.Index(condition=models.Q(('date_traitement__isnull', True)), fields=['date_echeance'], name='echeance_en_attente_idx')],
+                'unique_together': {('abonnement', 'type_echeance')},
+            },
+        ),
+        migrations.RunPython(planifier_abonnements_existants, migrations.RunPython.noop),
+    ]
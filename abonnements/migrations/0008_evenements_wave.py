@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-17 01:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0007_echeances_abonnements'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EvenementWave',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cle_dedoublonnage', models.CharField(help_text="Identifiant d'événement Wave, sinon transaction et statut", max_length=150, unique=True)),
+                ('transaction_id', models.CharField(db_index=True, max_length=100)),
+                ('statut_wave', models.CharField(blank=True, max_length=50)),
+                ('donnees', models.JSONField(blank=True, default=dict)),
+                ('statut', models.CharField(choices=[('recu', 'Reçu'), ('traite', 'Traité'), ('ignore', 'Ignoré'), ('erreur', 'En erreur')], default='recu', max_length=20)),
+                ('tentatives', models.PositiveSmallIntegerField(default=0)),
+                ('derniere_erreur', models.TextField(blank=True)),
+                ('date_reception', models.DateTimeField(auto_now_add=True)),
+                ('date_traitement', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Événement Wave',
+                'verbose_name_plural': 'Événements Wave',
+                'ordering': ['-date_reception'],
+                'indexes': [models.Index(condition=models.Q(('statut', 'recu')), fields=['date_reception'], name='evenement_wave_a_traiter_idx')],
+            },
+        ),
+    ]
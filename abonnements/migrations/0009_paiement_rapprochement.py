@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-17 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0008_evenements_wave'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paiementwave',
+            name='date_rapprochement',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='Date du rapprochement avec un relevé Wave', null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.2 on 2026-10-17 02:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0009_paiement_rapprochement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EvenementCommission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('statut', models.CharField(choices=[('a_traiter', 'À traiter'), ('traite', 'Commission attribuée'), ('ignore', 'Sans commission'), ('erreur', 'En erreur')], default='a_traiter', max_length=20)),
+                ('tentatives', models.PositiveSmallIntegerField(default=0)),
+                ('derniere_erreur', models.TextField(blank=True)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+                ('date_traitement', models.DateTimeField(blank=True, null=True)),
+                ('abonnement', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='evenement_commission', to='abonnements.abonnement')),
+            ],
+            options={
+                'verbose_name': 'Événement de commission',
+                'verbose_name_plural': 'Événements de commission',
+                'indexes': [models.Index(condition=models.Q(('statut', 'a_traiter')), fields=['id'], name='evenement_commission_file_idx')],
+            },
+        ),
+    ]
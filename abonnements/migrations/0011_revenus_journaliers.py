@@ -0,0 +1,48 @@
+# Generated by Django 5.1.2 on 2026-10-17 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0010_evenements_commission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenuJournalier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jour', models.DateField()),
+                ('pack_id', models.IntegerField(blank=True, help_text="ID du pack payé (celui de l'abonnement à défaut)", null=True)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('reussi', 'Réussi'), ('echoue', 'Échoué'), ('annule', 'Annulé')], max_length=20)),
+                ('famille', models.BooleanField(default=False, help_text="Paiement d'un pack familial")),
+                ('paye_par_parent', models.BooleanField(default=False, help_text='Abonnement enfant payé par un parent')),
+                ('nombre', models.IntegerField(default=0, help_text='Nombre de paiements')),
+                ('montant', models.DecimalField(decimal_places=2, default=0, help_text='Montant total (en FCFA)', max_digits=14)),
+                ('date_calcul', models.DateTimeField(help_text='Début du calcul qui a écrit la ligne (repère du calcul incrémental)')),
+            ],
+            options={
+                'verbose_name': 'Revenu journalier',
+                'verbose_name_plural': 'Revenus journaliers',
+                'ordering': ['jour'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='paiementwave',
+            index=models.Index(fields=['date_creation'], name='paiement_wave_creation_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paiementwave',
+            index=models.Index(fields=['date_mise_a_jour'], name='paiement_wave_maj_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='revenujournalier',
+            index=models.Index(fields=['jour'], name='revenu_journalier_jour_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='revenujournalier',
+            index=models.Index(fields=['date_calcul'], name='revenu_journalier_calcul_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.2 on 2026-10-17 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0011_revenus_journaliers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CohorteConversion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('semaine', models.DateField(help_text="Lundi de la semaine d'inscription")),
+                ('source', models.CharField(choices=[('direct', 'Inscription directe'), ('parrainage', 'Parrainage'), ('partenaire', 'Code partenaire')], max_length=20)),
+                ('code_partenaire', models.CharField(blank=True, help_text='Code du partenaire (source partenaire)', max_length=8)),
+                ('inscrits', models.IntegerField(default=0)),
+                ('essais', models.IntegerField(default=0, help_text='Inscrits ayant commencé un essai (Pack Découverte, essai gratuit)')),
+                ('payants', models.IntegerField(default=0, help_text='Inscrits ayant payé au moins un pack')),
+                ('payants_apres_essai', models.IntegerField(default=0, help_text='Premier paiement après un essai')),
+                ('payants_30_jours', models.IntegerField(default=0, help_text="Premier paiement dans les 30 jours suivant l'inscription")),
+                ('renouveles', models.IntegerField(default=0, help_text='Payants ayant renouvelé ou payé une deuxième fois')),
+                ('secondes_avant_paiement', models.BigIntegerField(default=0, help_text='Somme des délais inscription → premier paiement')),
+                ('date_calcul', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Cohorte de conversion',
+                'verbose_name_plural': 'Cohortes de conversion',
+                'ordering': ['semaine', 'source', 'code_partenaire'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='paiementwave',
+            index=models.Index(fields=['utilisateur_id'], name='paiement_wave_utilisateur_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='cohorteconversion',
+            constraint=models.UniqueConstraint(fields=('semaine', 'source', 'code_partenaire'), name='cohorte_conversion_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-17 02:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0012_cohortes_conversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paiementwave',
+            name='lien_paiement',
+            field=models.URLField(blank=True, default='', help_text="Lien Wave transmis à l'abonné (renouvellements)", max_length=500),
+        ),
+    ]
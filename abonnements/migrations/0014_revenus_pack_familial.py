@@ -0,0 +1,24 @@
+# Generated by Django 5.1.2 on 2026-10-17 02:35
+
+from django.db import migrations, models
+
+
+def vider_revenus_journaliers(apps, schema_editor):
+    """Cumuls calculés avec l'ancien classement des paiements familiaux : le prochain calcul reprend tout l'historique"""
+    apps.get_model('abonnements', 'RevenuJournalier').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0013_lien_paiement_renouvellement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='revenujournalier',
+            name='pack_familial',
+            field=models.BooleanField(default=False, help_text='pack_id désigne un PackFamilial (sinon un PackAbonnement)'),
+        ),
+        migrations.RunPython(vider_revenus_journaliers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-17 02:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0014_revenus_pack_familial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cohorteconversion',
+            name='code_partenaire',
+            field=models.CharField(blank=True, help_text='Code du partenaire (source partenaire)', max_length=20),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.2 on 2026-10-17 04:10
+
+from django.db import migrations, models
+
+
+def marquer_paiements_pack_familial(apps, schema_editor):
+    """Paiements existants : pack_id résolu comme sur l'ancien chemin de paiement (PackAbonnement d'abord)"""
+    PackAbonnement = apps.get_model('abonnements', 'PackAbonnement')
+    PackFamilial = apps.get_model('abonnements', 'PackFamilial')
+    PaiementWave = apps.get_model('abonnements', 'PaiementWave')
+
+    ids_familiaux = set(PackFamilial.objects.values_list('id', flat=True)) - set(
+        PackAbonnement.objects.values_list('id', flat=True)
+    )
+    if ids_familiaux:
+        PaiementWave.objects.filter(pack_id__in=ids_familiaux).update(pack_familial=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0015_cohorte_code_partenaire'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paiementwave',
+            name='pack_familial',
+            field=models.BooleanField(default=False, help_text='pack_id désigne un PackFamilial (sinon un PackAbonnement)'),
+        ),
+        migrations.RunPython(marquer_paiements_pack_familial, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-17 04:40
+
+from django.db import migrations
+
+
+def vider_revenus_journaliers(apps, schema_editor):
+    """Cumuls calculés avant PaiementWave.pack_familial : le prochain calcul reprend tout l'historique"""
+    apps.get_model('abonnements', 'RevenuJournalier').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('abonnements', '0016_paiement_pack_familial'),
+    ]
+
+    operations = [
+        migrations.RunPython(vider_revenus_journaliers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# abonnements/mixins.py
+from django.db.models import Count
+from rest_framework.response import Response
+
+
+class ListeReferentielMixin:
+    """
+    list() d'un ViewSet en lecture seule servi depuis le référentiel en mémoire (ReferentielService).
+    Les comptes affichés par le serializer sont calculés en une requête (GROUP BY champ_compteurs
+    sur queryset_compteurs) et passés dans son contexte sous cle_compteurs.
+    """
+    referentiel = None  # Nom de la méthode de ReferentielService qui retourne les objets
+    cle_compteurs = None
+    champ_compteurs = None
+    queryset_compteurs = None  # Objets comptés, par défaut le queryset du ViewSet
+
+    def get_queryset_compteurs(self):
+        queryset = self.queryset_compteurs if self.queryset_compteurs is not None else self.queryset
+        return queryset.all()
+
+    def list(self, request, *args, **kwargs):
+        from abonnements.services import ReferentielService
+
+        context = self.get_serializer_context()
+        if self.cle_compteurs:
+            context[self.cle_compteurs] = dict(
+                self.get_queryset_compteurs().values(self.champ_compteurs).annotate(total=Count('id'))
+                .order_by().values_list(self.champ_compteurs, 'total')
+            )
+        objets = getattr(ReferentielService, self.referentiel)()
+        serializer = self.get_serializer(objets, many=True, context=context)
+        return Response(serializer.data)
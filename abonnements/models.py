@@ -1,8 +1,11 @@
 # abonnements/models.py
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from utilisateurs.models import Utilisateur
 from django.utils import timezone
 from datetime import timedelta
+from collections import namedtuple
 import uuid
 
 
@@ -78,8 +81,46 @@ class PackAbonnement(models.Model):
             return f"pack-{self.id}"
 
 
+# Forme compilée et immuable des permissions d'un pack : masque de bits + limites mensuelles
+VecteurPermissions = namedtuple('VecteurPermissions', ['masque', 'limites', 'version'])
+
+# Vecteurs compilés gardés en mémoire du processus, par id de PackPermissions
+_VECTEURS_PERMISSIONS = {}
+
+
 class PackPermissions(models.Model):
     """Modèle pour définir les permissions et restrictions de chaque pack"""
+    # Fonctionnalités booléennes compilées dans masque_fonctionnalites : la position dans le tuple
+    # est le numéro du bit. Exposé aux clients, l'ordre ne doit jamais changer (ajouter en fin uniquement).
+    FONCTIONNALITES = (
+        'acces_cours_premium',
+        'acces_ia_standard',
+        'acces_ia_prioritaire',
+        'acces_certificats',
+        'acces_contenu_hors_ligne',
+        'acces_communautaire',
+        'support_prioritaire',
+        'acces_prioritaire_nouveautes',
+        'specialisation_examens',
+        'contenu_examens_prioritaire',
+        'profils_separes',
+        'suivi_familial',
+        'upgrade_reminder',
+        'teaser_content',
+        'restriction_temps',
+        'restriction_contenu',
+        'restriction_examens',
+        'bonus_parrainage',
+        'bonus_inscription',
+        'bonus_conversion_parrainage',
+        'bonus_conversion_standard',
+        'bonus_annuel',
+        'acces_exclusif',
+        'source_parrainage',
+        'source_inscription',
+    )
+    BITS = {fonctionnalite: 1 << position for position, fonctionnalite in enumerate(FONCTIONNALITES)}
+    
     pack = models.OneToOneField(PackAbonnement, on_delete=models.CASCADE, related_name='permissions')
     
     # Limites de contenu mensuelles
@@ -131,6 +172,10 @@ class PackPermissions(models.Model):
     source_parrainage = models.BooleanField(default=False, help_text="Source parrainage")
     source_inscription = models.BooleanField(default=False, help_text="Source inscription")
     
+    # Forme compilée, recalculée à chaque sauvegarde
+    masque_fonctionnalites = models.PositiveBigIntegerField(default=0, editable=False, help_text="Masque de bits des fonctionnalités (ordre de FONCTIONNALITES)")
+    version = models.PositiveIntegerField(default=0, editable=False, help_text="Incrémentée à chaque modification")
+    
     class Meta:
         verbose_name = "Permissions du pack"
         verbose_name_plural = "Permissions des packs"
@@ -138,6 +183,43 @@ class PackPermissions(models.Model):
     def __str__(self):
         return f"Permissions - {self.pack.nom}"
     
+    def compiler_masque(self):
+        """Calcule le masque de bits à partir des champs booléens"""
+        masque = 0
+        for fonctionnalite, bit in self.BITS.items():
+            if getattr(self, fonctionnalite):
+                masque |= bit
+        return masque
+    
+    def save(self, *args, **kwargs):
+        self.masque_fonctionnalites = self.compiler_masque()
+        self.version += 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'masque_fonctionnalites', 'version'}
+        super().save(*args, **kwargs)
+        _VECTEURS_PERMISSIONS.pop(self.pk, None)
+    
+    @property
+    def vecteur(self):
+        """Vecteur compilé (masque, limites, version), partagé en mémoire pour une même version"""
+        vecteur = _VECTEURS_PERMISSIONS.get(self.pk)
+        if vecteur is None or vecteur.version != self.version:
+            vecteur = VecteurPermissions(
+                masque=self.masque_fonctionnalites,
+                limites=(self.max_cours_par_mois, self.max_quiz_par_mois, self.max_examens_par_mois),
+                version=self.version
+            )
+            _VECTEURS_PERMISSIONS[self.pk] = vecteur
+        return vecteur
+    
+    def a_fonctionnalite(self, *fonctionnalites):
+        """True si au moins une des fonctionnalités est incluse (simple test de bits)"""
+        bits = 0
+        for fonctionnalite in fonctionnalites:
+            bits |= self.BITS[fonctionnalite]
+        return bool(self.vecteur.masque & bits)
+    
     def get_message_restriction_dynamique(self, jours_restants=None, cours_utilises=None, quiz_utilises=None):
         """Retourne le message de restriction avec des variables dynamiques"""
         message = self.message_restriction
@@ -164,6 +246,7 @@ class Abonnement(models.Model):
         ('expire', 'Expiré'),
         ('suspendu', 'Suspendu'),
         ('essai', 'Essai gratuit'),
+        ('remplace', 'Remplacé'),
     ]
     
     utilisateur = models.ForeignKey(Utilisateur, on_delete=models.CASCADE)
@@ -195,6 +278,14 @@ class Abonnement(models.Model):
     class Meta:
         verbose_name = "Abonnement"
         verbose_name_plural = "Abonnements"
+        constraints = [
+            # Un seul abonnement actif par utilisateur : les doublons sont refusés par la base
+            models.UniqueConstraint(
+                fields=['utilisateur'],
+                condition=models.Q(actif=True),
+                name='abonnement_un_actif_par_utilisateur'
+            ),
+        ]
     
     def __str__(self):
         return f"Abonnement {self.pack.nom} de {self.utilisateur.email}"
@@ -249,6 +340,78 @@ class Abonnement(models.Model):
         return "Expiré"
 
 
+class AbonnementActuel(models.Model):
+    """Référence vers l'abonnement actif de chaque utilisateur (résolution du plan par clé primaire)"""
+    utilisateur = models.OneToOneField(
+        Utilisateur, on_delete=models.CASCADE, primary_key=True, related_name='abonnement_actuel_ref'
+    )
+    abonnement = models.ForeignKey(
+        Abonnement, on_delete=models.SET_NULL, null=True, blank=True, related_name='references_actuelles'
+    )
+    date_mise_a_jour = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Abonnement actuel"
+        verbose_name_plural = "Abonnements actuels"
+    
+    def __str__(self):
+        return f"{self.utilisateur.email} → {self.abonnement_id or 'aucun'}"
+
+
+class EcheanceAbonnement(models.Model):
+    """File des transitions d'un abonnement à date fixe (fin d'essai, expiration, rappel J-3)"""
+    TYPE_FIN_ESSAI = 'fin_essai'
+    TYPE_EXPIRATION = 'expiration'
+    TYPE_RAPPEL = 'rappel_3_jours'
+    TYPE_CHOICES = [
+        (TYPE_FIN_ESSAI, "Fin d'essai"),
+        (TYPE_EXPIRATION, 'Expiration'),
+        (TYPE_RAPPEL, 'Rappel 3 jours avant la fin'),
+    ]
+    
+    RESULTAT_TRAITE = 'traite'
+    RESULTAT_OBSOLETE = 'obsolete'
+    RESULTAT_ERREUR = 'erreur'
+    
+    abonnement = models.ForeignKey(Abonnement, on_delete=models.CASCADE, related_name='echeances')
+    type_echeance = models.CharField(max_length=20, choices=TYPE_CHOICES)
+    date_echeance = models.DateTimeField()
+    date_traitement = models.DateTimeField(null=True, blank=True)
+    resultat = models.CharField(max_length=20, blank=True)
+    tentatives = models.PositiveSmallIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Échéance d'abonnement"
+        verbose_name_plural = "Échéances d'abonnements"
+        unique_together = ['abonnement', 'type_echeance']
+        ordering = ['date_echeance']
+        indexes = [
+            # Seules les échéances en attente sont parcourues, dans l'ordre de leur date
+            models.Index(
+                fields=['date_echeance'],
+                condition=models.Q(date_traitement__isnull=True),
+                name='echeance_en_attente_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_type_echeance_display()} - abonnement {self.abonnement_id} ({self.date_echeance:%d/%m/%Y %H:%M})"
+
+
+class VerrouPlanificateur(models.Model):
+    """Bail exclusif : une seule instance du planificateur agit à la fois"""
+    nom = models.CharField(max_length=50, primary_key=True)
+    detenteur = models.CharField(max_length=100, blank=True)
+    expire_le = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = "Verrou du planificateur"
+        verbose_name_plural = "Verrous du planificateur"
+    
+    def __str__(self):
+        return f"{self.nom} ({self.detenteur or 'libre'})"
+
+
 class PaiementWave(models.Model):
     """Modèle pour gérer les paiements via Wave"""
     STATUT_CHOICES = [
@@ -271,9 +434,11 @@ class PaiementWave(models.Model):
     wave_reference = models.CharField(max_length=100, blank=True, null=True)
     wave_phone = models.CharField(max_length=20, blank=True, null=True)
     wave_email = models.EmailField(blank=True, null=True)
+    lien_paiement = models.URLField(max_length=500, blank=True, default='', help_text="Lien Wave transmis à l'abonné (renouvellements)")
     
     # Informations temporaires pour créer l'abonnement après paiement
     pack_id = models.IntegerField(null=True, blank=True, help_text="ID du pack à créer après paiement")
+    pack_familial = models.BooleanField(default=False, help_text="pack_id désigne un PackFamilial (sinon un PackAbonnement)")
     utilisateur_id = models.IntegerField(null=True, blank=True, help_text="ID de l'utilisateur")
     parent_id = models.IntegerField(null=True, blank=True, help_text="ID du parent qui effectue le paiement (pour les abonnements enfants)")
     renouvellement_auto = models.BooleanField(default=False, help_text="Renouvellement automatique")
@@ -281,9 +446,19 @@ class PaiementWave(models.Model):
     # Données de callback
     callback_data = models.JSONField(default=dict, blank=True)
     
+    # Rapprochement avec les relevés Wave
+    date_rapprochement = models.DateTimeField(null=True, blank=True, db_index=True, help_text="Date du rapprochement avec un relevé Wave")
+    
     class Meta:
         verbose_name = "Paiement Wave"
         verbose_name_plural = "Paiements Wave"
+        indexes = [
+            # Cumuls des revenus journaliers : lecture par jour de création et repérage des paiements modifiés
+            models.Index(fields=['date_creation'], name='paiement_wave_creation_idx'),
+            models.Index(fields=['date_mise_a_jour'], name='paiement_wave_maj_idx'),
+            # Entonnoir de conversion : paiements lus par tranche d'utilisateurs
+            models.Index(fields=['utilisateur_id'], name='paiement_wave_utilisateur_idx'),
+        ]
     
     def __str__(self):
         return f"Paiement {self.transaction_id} - {self.montant} {self.devise}"
@@ -293,6 +468,153 @@ class PaiementWave(models.Model):
         return self.statut == 'reussi'
 
 
+class EvenementWave(models.Model):
+    """Callback Wave brut, enregistré à la réception puis traité par le worker (une seule fois par clé)"""
+    STATUT_RECU = 'recu'
+    STATUT_TRAITE = 'traite'
+    STATUT_IGNORE = 'ignore'
+    STATUT_ERREUR = 'erreur'
+    STATUT_CHOICES = [
+        (STATUT_RECU, 'Reçu'),
+        (STATUT_TRAITE, 'Traité'),
+        (STATUT_IGNORE, 'Ignoré'),
+        (STATUT_ERREUR, 'En erreur'),
+    ]
+    
+    cle_dedoublonnage = models.CharField(max_length=150, unique=True, help_text="Identifiant d'événement Wave, sinon transaction et statut")
+    transaction_id = models.CharField(max_length=100, db_index=True)
+    statut_wave = models.CharField(max_length=50, blank=True)
+    donnees = models.JSONField(default=dict, blank=True)
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default=STATUT_RECU)
+    tentatives = models.PositiveSmallIntegerField(default=0)
+    derniere_erreur = models.TextField(blank=True)
+    date_reception = models.DateTimeField(auto_now_add=True)
+    date_traitement = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = "Événement Wave"
+        verbose_name_plural = "Événements Wave"
+        ordering = ['-date_reception']
+        indexes = [
+            # Le worker ne parcourt que la file des événements à traiter
+            models.Index(
+                fields=['date_reception'],
+                condition=models.Q(statut='recu'),
+                name='evenement_wave_a_traiter_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Événement Wave {self.transaction_id} ({self.statut_wave}) - {self.get_statut_display()}"
+
+
+class EvenementCommission(models.Model):
+    """
+    Abonnement payant créé, en attente d'attribution de commission partenaire.
+    Écrit dans la transaction de création de l'abonnement, traité par lots par le worker traiter_commissions.
+    """
+    STATUT_A_TRAITER = 'a_traiter'
+    STATUT_TRAITE = 'traite'
+    STATUT_IGNORE = 'ignore'
+    STATUT_ERREUR = 'erreur'
+    STATUT_CHOICES = [
+        (STATUT_A_TRAITER, 'À traiter'),
+        (STATUT_TRAITE, 'Commission attribuée'),
+        (STATUT_IGNORE, 'Sans commission'),
+        (STATUT_ERREUR, 'En erreur'),
+    ]
+    
+    # Un seul événement par abonnement : la commission ne peut pas être attribuée deux fois
+    abonnement = models.OneToOneField(Abonnement, on_delete=models.CASCADE, related_name='evenement_commission')
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default=STATUT_A_TRAITER)
+    tentatives = models.PositiveSmallIntegerField(default=0)
+    derniere_erreur = models.TextField(blank=True)
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_traitement = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = "Événement de commission"
+        verbose_name_plural = "Événements de commission"
+        indexes = [
+            # Le worker ne parcourt que la file des événements à traiter
+            models.Index(
+                fields=['id'],
+                condition=models.Q(statut='a_traiter'),
+                name='evenement_commission_file_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Commission de l'abonnement {self.abonnement_id} - {self.get_statut_display()}"
+
+
+class RevenuJournalier(models.Model):
+    """
+    Cumul quotidien des paiements Wave par pack, statut, famille / individuel et payeur (parent ou non).
+    Table dérivée de PaiementWave, réécrite jour par jour par RevenusJournaliersService (jamais modifiée à la main).
+    """
+    jour = models.DateField()
+    pack_id = models.IntegerField(null=True, blank=True, help_text="ID du pack payé (celui de l'abonnement à défaut)")
+    pack_familial = models.BooleanField(default=False, help_text="pack_id désigne un PackFamilial (sinon un PackAbonnement)")
+    statut = models.CharField(max_length=20, choices=PaiementWave.STATUT_CHOICES)
+    famille = models.BooleanField(default=False, help_text="Paiement d'un pack familial")
+    paye_par_parent = models.BooleanField(default=False, help_text="Abonnement enfant payé par un parent")
+    nombre = models.IntegerField(default=0, help_text="Nombre de paiements")
+    montant = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Montant total (en FCFA)")
+    date_calcul = models.DateTimeField(help_text="Début du calcul qui a écrit la ligne (repère du calcul incrémental)")
+
+    class Meta:
+        verbose_name = "Revenu journalier"
+        verbose_name_plural = "Revenus journaliers"
+        ordering = ['jour']
+        indexes = [
+            models.Index(fields=['jour'], name='revenu_journalier_jour_idx'),
+            models.Index(fields=['date_calcul'], name='revenu_journalier_calcul_idx'),
+        ]
+
+    def __str__(self):
+        type_pack = 'pack familial' if self.pack_familial else 'pack'
+        return f"{self.jour} - {type_pack} {self.pack_id} ({self.get_statut_display()}) : {self.nombre} paiements, {self.montant} FCFA"
+
+
+class CohorteConversion(models.Model):
+    """
+    Entonnoir inscription → essai → premier paiement → renouvellement d'une cohorte
+    (semaine d'inscription, source, code partenaire). Table dérivée, reconstruite par EntonnoirConversionService.
+    """
+    SOURCE_DIRECT = 'direct'
+    SOURCE_PARRAINAGE = 'parrainage'
+    SOURCE_PARTENAIRE = 'partenaire'
+    SOURCE_CHOICES = [
+        (SOURCE_DIRECT, 'Inscription directe'),
+        (SOURCE_PARRAINAGE, 'Parrainage'),
+        (SOURCE_PARTENAIRE, 'Code partenaire'),
+    ]
+
+    semaine = models.DateField(help_text="Lundi de la semaine d'inscription")
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    code_partenaire = models.CharField(max_length=20, blank=True, help_text="Code du partenaire (source partenaire)")
+    inscrits = models.IntegerField(default=0)
+    essais = models.IntegerField(default=0, help_text="Inscrits ayant commencé un essai (Pack Découverte, essai gratuit)")
+    payants = models.IntegerField(default=0, help_text="Inscrits ayant payé au moins un pack")
+    payants_apres_essai = models.IntegerField(default=0, help_text="Premier paiement après un essai")
+    payants_30_jours = models.IntegerField(default=0, help_text="Premier paiement dans les 30 jours suivant l'inscription")
+    renouveles = models.IntegerField(default=0, help_text="Payants ayant renouvelé ou payé une deuxième fois")
+    secondes_avant_paiement = models.BigIntegerField(default=0, help_text="Somme des délais inscription → premier paiement")
+    date_calcul = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Cohorte de conversion"
+        verbose_name_plural = "Cohortes de conversion"
+        ordering = ['semaine', 'source', 'code_partenaire']
+        constraints = [
+            models.UniqueConstraint(fields=['semaine', 'source', 'code_partenaire'], name='cohorte_conversion_unique'),
+        ]
+
+    def __str__(self):
+        return f"Semaine du {self.semaine} - {self.get_source_display()} {self.code_partenaire} : {self.payants}/{self.inscrits} payants"
+
+
 class PackFamilial(models.Model):
     """Modèle pour les packs familiaux"""
     TYPE_CHOICES = [
@@ -448,16 +770,19 @@ class Parrainage(models.Model):
                 date_debut = timezone.now()
                 date_fin = date_debut + timedelta(days=7)
                 
-                abonnement = Abonnement.objects.create(
-                    utilisateur=self.filleul,
-                    pack=pack_bienvenue,
-                    date_debut=date_debut,
-                    date_fin=date_fin,
-                    statut='actif',
-                    actif=True,
-                    est_essai_gratuit=True,
-                    source_parrainage=True
-                )
+                from .services import AbonnementService
+                with transaction.atomic():
+                    AbonnementService.liberer_abonnement_actif(self.filleul)
+                    abonnement = Abonnement.objects.create(
+                        utilisateur=self.filleul,
+                        pack=pack_bienvenue,
+                        date_debut=date_debut,
+                        date_fin=date_fin,
+                        statut='actif',
+                        actif=True,
+                        est_essai_gratuit=True,
+                        source_parrainage=True
+                    )
                 
                 # Marquer le bonus comme attribué
                 self.filleul_bonus_attribue = True
@@ -498,3 +823,137 @@ class HistoriqueRenouvellement(models.Model):
         return f"Renouvellement {self.abonnement.pack.nom} +{self.duree_ajoutee}j ({self.date_renouvellement.strftime('%d/%m/%Y')})"
 
 
+class UsageMensuelle(models.Model):
+    """Compteur d'utilisation mensuelle d'une ressource soumise à quota (cours, quiz...)"""
+    RESSOURCE_COURS = 'cours'
+    RESSOURCE_QUIZ = 'quiz'
+    RESSOURCE_EXAMEN = 'examen'
+    RESSOURCE_CHOICES = [
+        (RESSOURCE_COURS, 'Cours'),
+        (RESSOURCE_QUIZ, 'Quiz'),
+        (RESSOURCE_EXAMEN, 'Examens'),
+    ]
+    
+    utilisateur = models.ForeignKey(Utilisateur, on_delete=models.CASCADE, related_name='usages_mensuels')
+    annee = models.PositiveSmallIntegerField()
+    mois = models.PositiveSmallIntegerField()
+    ressource = models.CharField(max_length=20, choices=RESSOURCE_CHOICES)
+    compteur = models.PositiveIntegerField(default=0)
+    date_mise_a_jour = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Utilisation mensuelle"
+        verbose_name_plural = "Utilisations mensuelles"
+        unique_together = ['utilisateur', 'annee', 'mois', 'ressource']
+    
+    def __str__(self):
+        return f"{self.utilisateur.email} - {self.ressource} {self.mois:02d}/{self.annee}: {self.compteur}"
+
+
+class ConsultationExamen(models.Model):
+    """Première consultation d'un examen par un utilisateur pour un mois donné"""
+    utilisateur = models.ForeignKey(Utilisateur, on_delete=models.CASCADE, related_name='consultations_examens')
+    examen = models.ForeignKey('examens.Examen', on_delete=models.CASCADE, related_name='consultations')
+    annee = models.PositiveSmallIntegerField()
+    mois = models.PositiveSmallIntegerField()
+    date_consultation = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Consultation d'examen"
+        verbose_name_plural = "Consultations d'examens"
+        unique_together = ['utilisateur', 'examen', 'annee', 'mois']
+        ordering = ['-date_consultation']
+    
+    def __str__(self):
+        return f"{self.utilisateur.email} - {self.examen_id} ({self.mois:02d}/{self.annee})"
+
+
+
+
+
+@receiver([post_save, post_delete], sender=Abonnement)
+def abonnement_modifie(sender, instance, **kwargs):
+    """Invalide les droits en cache de l'utilisateur une fois la transaction validée"""
+    from .services import CacheDroitsService
+    utilisateur_id = instance.utilisateur_id
+    transaction.on_commit(lambda: CacheDroitsService.invalider_utilisateur(utilisateur_id))
+
+
+@receiver([post_save, post_delete], sender=PaiementWave)
+def paiement_modifie(sender, instance, **kwargs):
+    """Remplace le jeton de version de l'utilisateur, dont dépendent ses statistiques en cache"""
+    from .services import CacheDroitsService
+    utilisateur_id = instance.utilisateur_id
+    if utilisateur_id is not None:
+        transaction.on_commit(lambda: CacheDroitsService.invalider_utilisateur(utilisateur_id))
+
+
+@receiver(post_save, sender=Abonnement)
+def abonnement_actuel_synchronise(sender, instance, raw=False, **kwargs):
+    """Tient à jour la référence vers l'abonnement actif, dans la transaction de l'enregistrement"""
+    if raw:
+        return
+    if instance.actif:
+        AbonnementActuel.objects.update_or_create(
+            utilisateur_id=instance.utilisateur_id, defaults={'abonnement': instance}
+        )
+    else:
+        AbonnementActuel.objects.filter(
+            utilisateur_id=instance.utilisateur_id, abonnement=instance
+        ).update(abonnement=None)
+
+
+@receiver(post_save, sender=Abonnement)
+def abonnement_echeances_planifiees(sender, instance, raw=False, **kwargs):
+    """Replanifie fin d'essai, expiration et rappel quand les dates ou l'état de l'abonnement changent"""
+    if raw:
+        return
+    from .services import PlanificateurService
+    PlanificateurService.planifier_abonnement(instance)
+
+
+@receiver(post_save, sender=Abonnement)
+def abonnement_commission_signalee(sender, instance, created, raw=False, **kwargs):
+    """Met un abonnement payant en file pour l'attribution de commission (même transaction que sa création)"""
+    if raw or not created or not instance.montant_paye or instance.montant_paye <= 0:
+        return
+    EvenementCommission.objects.create(abonnement=instance)
+
+
+@receiver([post_save, post_delete], sender=PackAbonnement)
+@receiver([post_save, post_delete], sender=PackPermissions)
+def pack_modifie(sender, instance, **kwargs):
+    """Invalide les droits en cache de tous les utilisateurs quand un pack ou ses permissions changent"""
+    from .services import CacheDroitsService, ReferentielService
+    transaction.on_commit(CacheDroitsService.invalider_packs)
+    transaction.on_commit(ReferentielService.invalider)
+
+
+@receiver([post_save, post_delete], sender=PackFamilial)
+@receiver([post_save, post_delete], sender='utilisateurs.ConfigurationPartenaire')
+@receiver([post_save, post_delete], sender='examens.TypeExamen')
+@receiver([post_save, post_delete], sender='academic_structure.NiveauScolaire')
+def referentiel_modifie(sender, instance, **kwargs):
+    """Recharge le référentiel en mémoire dans tous les workers"""
+    from .services import ReferentielService
+    transaction.on_commit(ReferentielService.invalider)
+
+
+@receiver(post_save, sender='progression.ProgressionContenu')
+def progression_contenu_creee(sender, instance, created, **kwargs):
+    """Comptabilise un nouveau contenu consulté, sauf si le quota a déjà été réservé"""
+    if created and not getattr(instance, '_quota_reserve', False):
+        from .services import UsageMensuelleService
+        UsageMensuelleService.incrementer(
+            instance.etudiant_id, UsageMensuelle.RESSOURCE_COURS, instance.date_debut
+        )
+
+
+@receiver(post_save, sender='quiz.TentativeQuiz')
+def tentative_quiz_creee(sender, instance, created, **kwargs):
+    """Comptabilise une nouvelle tentative de quiz, sauf si le quota a déjà été réservé"""
+    if created and not getattr(instance, '_quota_reserve', False):
+        from .services import UsageMensuelleService
+        UsageMensuelleService.incrementer(
+            instance.etudiant_id, UsageMensuelle.RESSOURCE_QUIZ, instance.date_debut
+        )
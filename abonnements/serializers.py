@@ -21,6 +21,9 @@ class PackAbonnementSerializer(serializers.ModelSerializer):
     certificats_inclus_permissions = serializers.SerializerMethodField()
     contenu_hors_ligne_permissions = serializers.SerializerMethodField()
     
+    # Toutes les fonctionnalités sous forme de masque de bits (ordre de PackPermissions.FONCTIONNALITES)
+    masque_fonctionnalites = serializers.SerializerMethodField()
+    
     class Meta:
         model = PackAbonnement
         fields = '__all__'
@@ -66,6 +69,12 @@ class PackAbonnementSerializer(serializers.ModelSerializer):
         if hasattr(obj, 'permissions'):
             return obj.permissions.acces_contenu_hors_ligne
         return False  # Fallback si aucune permission configurée
+    
+    def get_masque_fonctionnalites(self, obj):
+        """Récupère le masque de bits des fonctionnalités depuis PackPermissions"""
+        if hasattr(obj, 'permissions'):
+            return obj.permissions.vecteur.masque
+        return 0  # Fallback si aucune permission configurée
 
 
 class PackFamilialSerializer(serializers.ModelSerializer):
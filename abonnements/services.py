@@ -1,20 +1,28 @@
 # abonnements/services.py
 import requests
+import csv
+import hashlib
 import json
 import uuid
 import time
 import logging
-from datetime import datetime, timedelta
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
-from django.db import transaction, models
+from django.db import IntegrityError, connection, transaction, models
 
 logger = logging.getLogger(__name__)
 from .models import (
-    Abonnement, PackAbonnement, PaiementWave, 
-    PackFamilial, BonusParrainage, Parrainage, PackPermissions
+    Abonnement, AbonnementActuel, EcheanceAbonnement, VerrouPlanificateur, PackAbonnement, PaiementWave,
+    EvenementWave, EvenementCommission, RevenuJournalier, CohorteConversion,
+    PackFamilial, BonusParrainage, Parrainage, PackPermissions, UsageMensuelle
 )
-from utilisateurs.models import Utilisateur, Commission
+from utilisateurs.models import Utilisateur, Commission, enregistrer_commissions
 
 
 class WaveService:
@@ -30,14 +38,14 @@ class WaveService:
         try:
             # Récupérer le pack depuis les informations stockées
             if paiement.pack_id:
-                # 🔧 CORRECTION : Chercher d'abord dans PackAbonnement, puis dans PackFamilial
-                # Car les packs spéciaux (Pack Vacances, etc.) sont dans PackAbonnement
-                try:
-                    pack = PackAbonnement.objects.get(id=paiement.pack_id)
-                    print(f"📦 Pack standard trouvé pour paiement: {pack.nom} - {pack.prix} FCFA")
-                except PackAbonnement.DoesNotExist:
-                    pack = PackFamilial.objects.get(id=paiement.pack_id)
-                    print(f"📦 Pack familial trouvé pour paiement: {pack.nom} - {pack.prix} FCFA")
+                # PackFamilial ou PackAbonnement, selon le type enregistré à l'initiation
+                pack = ReferentielService.get_pack_paye(paiement)
+                if not pack:
+                    return {
+                        'success': False,
+                        'error': 'Pack non trouvé'
+                    }
+                print(f"📦 Pack trouvé pour paiement: {pack.nom} - {pack.prix} FCFA")
             else:
                 return {
                     'success': False,
@@ -75,10 +83,10 @@ class WaveService:
         try:
             # Récupérer le pack familial depuis les informations stockées
             if paiement.pack_id:
-                try:
-                    pack = PackFamilial.objects.get(id=paiement.pack_id)
+                pack = ReferentielService.get_pack_familial(paiement.pack_id)
+                if pack:
                     print(f"📦 Pack familial trouvé pour paiement: {pack.nom} - {pack.prix} FCFA")
-                except PackFamilial.DoesNotExist:
+                else:
                     return {
                         'success': False,
                         'error': 'Pack familial non trouvé'
@@ -110,12 +118,13 @@ class WaveService:
             logger.error(f"Erreur lors de l'initiation du paiement familial Wave: {e}")
             return {'success': False, 'error': str(e)}
     
-    def generer_lien_wave(self, pack):
+    def generer_lien_wave(self, pack, reference=None):
         """
         Génère un lien Wave dynamique basé sur le pack sélectionné
         
         Args:
             pack: Instance de PackAbonnement
+            reference: transaction_id du paiement, renvoyé par Wave (client_reference) au callback et dans le relevé
             
         Returns:
             str: Lien Wave généré dynamiquement
@@ -131,6 +140,8 @@ class WaveService:
             
             # Générer le lien Wave avec le prix exact du pack
             lien_wave = f"{self.base_url}?amount={prix_pack}"
+            if reference:
+                lien_wave += f"&{urlencode({'client_reference': reference})}"
             
             logger.info(f"Lien Wave généré pour pack '{pack.nom}': {prix_pack}FCFA -> {lien_wave}")
             return lien_wave
@@ -164,71 +175,502 @@ class WaveService:
             return None
 
 
+class ReferentielService:
+    """
+    Registre en mémoire des petites tables de référence lues sur les chemins chauds :
+    packs (avec permissions), packs familiaux, pack Gratuit, configuration partenaire,
+    types d'examen et niveaux scolaires.
+    
+    Chargé au premier accès puis servi depuis la mémoire du processus. Toute modification
+    de ces modèles change une version dans le cache partagé ; chaque worker la compare au plus
+    toutes les ABONNEMENTS_REFERENTIEL_VERIFICATION_SECONDES et recharge si elle a changé.
+    Le registre est aussi rechargé après ABONNEMENTS_REFERENTIEL_AGE_MAX_SECONDES même sans
+    changement de version (version perdue, écriture hors signal), et à chaque vérification quand
+    le cache n'est pas partagé entre les workers.
+    Les objets retournés sont partagés entre requêtes : ne pas les modifier.
+    """
+    CLE_VERSION = 'abonnements:referentiel:version'
+    
+    _donnees = None
+    _version = None
+    _verifie_a = 0.0
+    _charge_a = 0.0
+    _verrou = threading.Lock()
+    
+    @staticmethod
+    def _intervalle_verification():
+        return getattr(settings, 'ABONNEMENTS_REFERENTIEL_VERIFICATION_SECONDES', 5)
+    
+    @classmethod
+    def _age_max(cls):
+        if not CacheDroitsService.cache_partage():
+            # Version locale au processus : les modifications faites par les autres workers sont invisibles
+            return cls._intervalle_verification()
+        return getattr(settings, 'ABONNEMENTS_REFERENTIEL_AGE_MAX_SECONDES', 300)
+    
+    @classmethod
+    def _get_version_partagee(cls):
+        try:
+            from django.core.cache import cache
+            version = cache.get(cls.CLE_VERSION)
+            if version is None:
+                cache.add(cls.CLE_VERSION, uuid.uuid4().hex, timeout=None)
+                version = cache.get(cls.CLE_VERSION)
+            return version
+        except Exception as e:
+            logger.warning(f"Version du référentiel indisponible: {e}")
+            return None
+    
+    @staticmethod
+    def _charger():
+        from utilisateurs.models import ConfigurationPartenaire
+        from examens.models import TypeExamen
+        from academic_structure.models import NiveauScolaire
+        
+        packs = {pack.id: pack for pack in PackAbonnement.objects.select_related('permissions').order_by('id')}
+        pack_gratuit = next(
+            (pack for pack in packs.values() if pack.type_pack == 'gratuit' and pack.nom == 'Gratuit' and pack.actif),
+            None
+        )
+        return {
+            'packs': packs,
+            'packs_familiaux': {pack.id: pack for pack in PackFamilial.objects.order_by('id')},
+            'pack_gratuit': pack_gratuit,
+            'configuration_partenaire': ConfigurationPartenaire.charger_configuration_active(),
+            'types_examen': list(TypeExamen.objects.all()),
+            'niveaux': list(NiveauScolaire.objects.all()),
+            # Valeurs dérivées (catalogues sérialisés...), calculées à la demande pour cette version
+            'derives': {},
+        }
+    
+    @classmethod
+    def _get_donnees(cls):
+        maintenant = time.monotonic()
+        donnees = cls._donnees
+        if donnees is not None and maintenant - cls._verifie_a < cls._intervalle_verification():
+            return donnees
+        
+        with cls._verrou:
+            version = cls._get_version_partagee()
+            if (cls._donnees is None or version is None or version != cls._version
+                    or maintenant - cls._charge_a >= cls._age_max()):
+                cls._donnees = cls._charger()
+                cls._version = version
+                cls._charge_a = maintenant
+            cls._verifie_a = maintenant
+            return cls._donnees
+    
+    @classmethod
+    def invalider(cls):
+        """Force le rechargement dans tous les workers (appelé après une modification)"""
+        cls._donnees = None
+        try:
+            from django.core.cache import cache
+            cache.set(cls.CLE_VERSION, uuid.uuid4().hex, timeout=None)
+        except Exception as e:
+            logger.warning(f"Impossible d'invalider le référentiel partagé: {e}")
+    
+    @classmethod
+    def get_pack_gratuit(cls):
+        """Pack 'Gratuit' actif (avec ses permissions préchargées), ou None"""
+        return cls._get_donnees()['pack_gratuit']
+    
+    @classmethod
+    def get_pack(cls, pack_id, actif_seulement=False):
+        try:
+            pack = cls._get_donnees()['packs'].get(int(pack_id))
+        except (TypeError, ValueError):
+            return None
+        if pack is None or (actif_seulement and not pack.actif):
+            return None
+        return pack
+    
+    @classmethod
+    def get_pack_ou_pack_familial(cls, pack_id, actif_seulement=False, pack_familial=None):
+        """
+        Cherche d'abord dans PackAbonnement puis dans PackFamilial
+        (les packs spéciaux comme le Pack Vacances sont dans PackAbonnement).
+        pack_familial=True ou False limite la recherche à PackFamilial ou à PackAbonnement
+        (un même id peut exister dans les deux tables)
+        """
+        if pack_familial:
+            return cls.get_pack_familial(pack_id, actif_seulement)
+        pack = cls.get_pack(pack_id, actif_seulement)
+        if pack is None and pack_familial is None:
+            pack = cls.get_pack_familial(pack_id, actif_seulement)
+        return pack
+    
+    @classmethod
+    def get_pack_familial(cls, pack_id, actif_seulement=False):
+        try:
+            pack = cls._get_donnees()['packs_familiaux'].get(int(pack_id))
+        except (TypeError, ValueError):
+            return None
+        if pack is None or (actif_seulement and not pack.actif):
+            return None
+        return pack
+    
+    @classmethod
+    def get_pack_paye(cls, paiement):
+        """Pack choisi à l'initiation d'un paiement : PackFamilial si paiement.pack_familial, PackAbonnement sinon"""
+        return cls.get_pack_ou_pack_familial(paiement.pack_id, pack_familial=paiement.pack_familial)
+    
+    @classmethod
+    def get_pack_provisionne(cls, pack_familial):
+        """
+        PackAbonnement familial actif provisionné par un PackFamilial (les abonnements pointent vers
+        PackAbonnement) : celui qui couvre le même nombre d'enfants au catalogue, ou None
+        """
+        def construire():
+            # Même rang que le catalogue : 2, 3, 4 enfants du moins cher au plus cher
+            familles = sorted(
+                (pack for pack in cls.get_packs() if pack.type_pack == 'famille' and pack.actif),
+                key=lambda pack: (pack.prix, pack.id)
+            )
+            return {2 + i: pack for i, pack in enumerate(familles)}
+        
+        return cls.get_derive('packs_famille_par_enfants', construire).get(pack_familial.nombre_enfants)
+    
+    @classmethod
+    def get_packs(cls):
+        """Tous les packs (permissions préchargées), par id croissant"""
+        return list(cls._get_donnees()['packs'].values())
+    
+    @classmethod
+    def get_packs_familiaux(cls):
+        return list(cls._get_donnees()['packs_familiaux'].values())
+    
+    @classmethod
+    def get_derive(cls, cle, construire):
+        """
+        Valeur dérivée du référentiel (ex. un catalogue sérialisé), calculée au premier appel
+        puis conservée jusqu'au prochain rechargement
+        """
+        derives = cls._get_donnees()['derives']
+        valeur = derives.get(cle)
+        if valeur is None:
+            valeur = derives[cle] = construire()
+        return valeur
+    
+    @classmethod
+    def get_configuration_partenaire(cls):
+        return cls._get_donnees()['configuration_partenaire']
+    
+    @classmethod
+    def get_types_examen(cls):
+        return cls._get_donnees()['types_examen']
+    
+    @classmethod
+    def get_niveaux(cls):
+        return cls._get_donnees()['niveaux']
+
+
+class DroitsAbonnement:
+    """
+    Instantané des droits d'un utilisateur pour la requête en cours :
+    abonnement actuel, pack, permissions du pack et repli sur le pack Gratuit
+    """
+    
+    def __init__(self, abonnement=None, pack=None, permissions=None):
+        self.abonnement = abonnement
+        self.pack = pack
+        self.permissions = permissions
+    
+    @property
+    def pack_gratuit_par_defaut(self):
+        """True si aucun abonnement actif et que les droits viennent du pack Gratuit"""
+        return self.abonnement is None and self.permissions is not None
+
+
+class CacheDroitsService:
+    """
+    Cache partagé entre les workers des droits résolus de chaque utilisateur.
+    
+    Les entrées sont indexées par l'id utilisateur, un jeton de version propre à
+    l'utilisateur et un jeton de version global des packs. Invalider revient à
+    remplacer le jeton : les anciennes entrées deviennent inatteignables, y compris
+    celles écrites par un worker qui lisait la base pendant l'invalidation.
+    
+    Sans cache partagé (cache en mémoire du processus), une invalidation n'atteindrait que le worker
+    qui l'a faite : le cache des droits est alors contourné et les droits relus à chaque requête.
+    """
+    PREFIXE = 'abonnements:droits'
+    CLE_VERSION_PACKS = 'abonnements:droits:version_packs'
+    BACKENDS_LOCAUX = (
+        'django.core.cache.backends.locmem.LocMemCache',
+        'django.core.cache.backends.dummy.DummyCache',
+    )
+    
+    @staticmethod
+    def cache_partage():
+        """Vrai si le cache par défaut est partagé entre les processus (Redis...)"""
+        return settings.CACHES.get('default', {}).get('BACKEND') not in CacheDroitsService.BACKENDS_LOCAUX
+    
+    @staticmethod
+    def _duree_max():
+        return getattr(settings, 'ABONNEMENTS_CACHE_DROITS_SECONDES', 300)
+    
+    @staticmethod
+    def _cle_version_utilisateur(utilisateur_id):
+        return f"{CacheDroitsService.PREFIXE}:version_utilisateur:{utilisateur_id}"
+    
+    @staticmethod
+    def _get_versions(utilisateur_id):
+        """Récupère (ou initialise) les jetons de version utilisateur et packs en un aller-retour"""
+        from django.core.cache import cache
+        cle_utilisateur = CacheDroitsService._cle_version_utilisateur(utilisateur_id)
+        cles = [cle_utilisateur, CacheDroitsService.CLE_VERSION_PACKS]
+        versions = cache.get_many(cles)
+        for cle in cles:
+            if cle not in versions:
+                cache.add(cle, uuid.uuid4().hex, timeout=None)
+                versions[cle] = cache.get(cle)
+        return versions[cle_utilisateur], versions[CacheDroitsService.CLE_VERSION_PACKS]
+    
+    @staticmethod
+    def get_cle(utilisateur_id):
+        """Clé de cache des droits pour les versions actuelles (None si le cache est indisponible ou local)"""
+        if not CacheDroitsService.cache_partage():
+            return None
+        try:
+            version_utilisateur, version_packs = CacheDroitsService._get_versions(utilisateur_id)
+            return f"{CacheDroitsService.PREFIXE}:{utilisateur_id}:{version_utilisateur}:{version_packs}"
+        except Exception as e:
+            logger.warning(f"Cache des droits indisponible: {e}")
+            return None
+    
+    @staticmethod
+    def lire(cle):
+        """Retourne les droits en cache, ou None si absents, invalidés ou arrivés à échéance"""
+        if cle is None:
+            return None
+        try:
+            from django.core.cache import cache
+            droits = cache.get(cle)
+        except Exception as e:
+            logger.warning(f"Cache des droits indisponible: {e}")
+            return None
+        
+        if droits is None:
+            return None
+        
+        # Sécurité : une date_fin dépassée sans aucune écriture ne doit jamais servir un pack expiré
+        abonnement = droits.abonnement
+        if abonnement and abonnement.date_fin and abonnement.date_fin < timezone.now():
+            return None
+        return droits
+    
+    @staticmethod
+    def ecrire(cle, droits):
+        """Met les droits en cache, au plus jusqu'à la date de fin de l'abonnement"""
+        if cle is None:
+            return
+        timeout = CacheDroitsService._duree_max()
+        abonnement = droits.abonnement
+        if abonnement and abonnement.date_fin:
+            timeout = min(timeout, int((abonnement.date_fin - timezone.now()).total_seconds()))
+        if timeout <= 0:
+            return
+        
+        try:
+            from django.core.cache import cache
+            cache.set(cle, droits, timeout=timeout)
+        except Exception as e:
+            logger.warning(f"Cache des droits indisponible: {e}")
+    
+    @staticmethod
+    def invalider_utilisateur(utilisateur_id):
+        """Invalide les droits en cache d'un utilisateur (tous workers confondus)"""
+        if utilisateur_id is None:
+            return
+        try:
+            from django.core.cache import cache
+            cache.set(CacheDroitsService._cle_version_utilisateur(utilisateur_id), uuid.uuid4().hex, timeout=None)
+        except Exception as e:
+            logger.warning(f"Invalidation du cache des droits impossible: {e}")
+    
+    @staticmethod
+    def invalider_utilisateurs(utilisateur_ids):
+        """Invalide en un aller-retour les droits en cache d'un lot d'utilisateurs"""
+        if not utilisateur_ids:
+            return
+        try:
+            from django.core.cache import cache
+            cache.set_many(
+                {CacheDroitsService._cle_version_utilisateur(uid): uuid.uuid4().hex for uid in utilisateur_ids},
+                timeout=None
+            )
+        except Exception as e:
+            logger.warning(f"Invalidation du cache des droits impossible: {e}")
+    
+    @staticmethod
+    def invalider_packs():
+        """Invalide les droits en cache de tous les utilisateurs (pack ou permissions modifiés)"""
+        try:
+            from django.core.cache import cache
+            cache.set(CacheDroitsService.CLE_VERSION_PACKS, uuid.uuid4().hex, timeout=None)
+        except Exception as e:
+            logger.warning(f"Invalidation du cache des droits impossible: {e}")
+
+
+class UsageMensuelleService:
+    """Compteurs d'utilisation mensuelle (une ligne par utilisateur, mois et ressource)"""
+    
+    @staticmethod
+    def _periode(date=None):
+        date = date or timezone.now()
+        return date.year, date.month
+    
+    @staticmethod
+    def incrementer(utilisateur_id, ressource, date=None):
+        """Incrémente le compteur sans condition (consommation déjà autorisée)"""
+        annee, mois = UsageMensuelleService._periode(date)
+        compteurs = UsageMensuelle.objects.filter(
+            utilisateur_id=utilisateur_id, annee=annee, mois=mois, ressource=ressource
+        )
+        if not compteurs.update(compteur=models.F('compteur') + 1):
+            UsageMensuelle.objects.get_or_create(
+                utilisateur_id=utilisateur_id, annee=annee, mois=mois, ressource=ressource
+            )
+            compteurs.update(compteur=models.F('compteur') + 1)
+    
+    @staticmethod
+    def reserver(utilisateur_id, ressource, limite, date=None):
+        """
+        Réserve une unité de quota en une seule mise à jour conditionnelle.
+        Retourne False si la limite est atteinte (limite <= 0 : illimité).
+        """
+        if limite <= 0:
+            UsageMensuelleService.incrementer(utilisateur_id, ressource, date)
+            return True
+        
+        annee, mois = UsageMensuelleService._periode(date)
+        compteurs = UsageMensuelle.objects.filter(
+            utilisateur_id=utilisateur_id, annee=annee, mois=mois, ressource=ressource,
+            compteur__lt=limite
+        )
+        if compteurs.update(compteur=models.F('compteur') + 1):
+            return True
+        
+        # Ligne absente (première consommation du mois) ou limite atteinte : créer si besoin puis retenter
+        UsageMensuelle.objects.get_or_create(
+            utilisateur_id=utilisateur_id, annee=annee, mois=mois, ressource=ressource
+        )
+        return bool(compteurs.update(compteur=models.F('compteur') + 1))
+    
+    @staticmethod
+    def get_compteurs(utilisateur_id, date=None):
+        """Retourne {ressource: compteur} pour le mois demandé (mois courant par défaut)"""
+        annee, mois = UsageMensuelleService._periode(date)
+        compteurs = dict.fromkeys((code for code, _ in UsageMensuelle.RESSOURCE_CHOICES), 0)
+        compteurs.update(
+            UsageMensuelle.objects.filter(
+                utilisateur_id=utilisateur_id, annee=annee, mois=mois
+            ).values_list('ressource', 'compteur')
+        )
+        return compteurs
+    
+    @staticmethod
+    def get_compteur(utilisateur_id, ressource, date=None):
+        annee, mois = UsageMensuelleService._periode(date)
+        return UsageMensuelle.objects.filter(
+            utilisateur_id=utilisateur_id, annee=annee, mois=mois, ressource=ressource
+        ).values_list('compteur', flat=True).first() or 0
+
+
 class PermissionService:
     """Service pour vérifier et gérer les permissions des packs d'abonnement"""
     
     @staticmethod
-    def get_abonnement_actuel(utilisateur):
-        """Récupère l'abonnement actuel de l'utilisateur"""
+    def get_droits(utilisateur):
+        """
+        Retourne l'instantané des droits de l'utilisateur.
+        Résolu une seule fois puis attaché à l'utilisateur de la requête (request.user),
+        de sorte que tous les verifier_acces_* d'une même requête le partagent.
+        """
+        droits = getattr(utilisateur, '_droits_abonnement', None)
+        if droits is None:
+            droits = PermissionService._resoudre_droits(utilisateur)
+            utilisateur._droits_abonnement = droits
+        return droits
+    
+    @staticmethod
+    def invalider_droits(utilisateur):
+        """Oublie l'instantané des droits (à appeler après une modification d'abonnement)"""
+        if utilisateur is not None:
+            utilisateur.__dict__.pop('_droits_abonnement', None)
+            CacheDroitsService.invalider_utilisateur(utilisateur.pk)
+    
+    @staticmethod
+    def _resoudre_droits(utilisateur):
+        """Résout les droits depuis le cache partagé, sinon depuis la base"""
+        utilisateur_id = getattr(utilisateur, 'pk', None)
+        if utilisateur_id is None:
+            return PermissionService._resoudre_droits_base(utilisateur)
+        
+        cle = CacheDroitsService.get_cle(utilisateur_id)
+        droits = CacheDroitsService.lire(cle)
+        if droits is None:
+            droits = PermissionService._resoudre_droits_base(utilisateur)
+            CacheDroitsService.ecrire(cle, droits)
+        return droits
+    
+    @staticmethod
+    def _resoudre_droits_base(utilisateur):
+        """Résout abonnement, pack et permissions en une requête par clé primaire (repli pack Gratuit en mémoire)"""
+        abonnement = None
         try:
-            # D'abord essayer de récupérer un abonnement non expiré (le plus récent)
-            abonnement = Abonnement.objects.filter(
-                utilisateur=utilisateur,
-                actif=True,
-                date_fin__gte=timezone.now()
-            ).order_by('-date_debut').first()
-            
-            if abonnement:
-                return abonnement
-                
-            # Si pas d'abonnement non expiré, chercher les abonnements illimités (pack gratuit)
-            return Abonnement.objects.filter(
-                utilisateur=utilisateur,
-                actif=True,
-                date_fin__isnull=True
-            ).order_by('-date_debut').first()
+            # Référence vers l'unique abonnement actif, tant qu'il n'est pas expiré
+            reference = AbonnementActuel.objects.filter(
+                utilisateur_id=getattr(utilisateur, 'pk', None),
+                abonnement__actif=True
+            ).filter(
+                models.Q(abonnement__date_fin__gte=timezone.now()) | models.Q(abonnement__date_fin__isnull=True)
+            ).select_related('abonnement__pack__permissions').first()
+            abonnement = reference.abonnement if reference else None
+        except Exception:
+            abonnement = None
+        
+        if abonnement:
+            try:
+                permissions = abonnement.pack.permissions if abonnement.pack else None
+            except PackPermissions.DoesNotExist:
+                permissions = None
+            return DroitsAbonnement(abonnement, abonnement.pack, permissions)
+        
+        # 🔧 CORRECTION: Si pas d'abonnement, utiliser les permissions du pack Gratuit par défaut
+        try:
+            pack_gratuit = ReferentielService.get_pack_gratuit()
             
+            if pack_gratuit and hasattr(pack_gratuit, 'permissions'):
+                return DroitsAbonnement(None, pack_gratuit, pack_gratuit.permissions)
         except Exception:
-            return None
+            pass
+        return DroitsAbonnement()
+    
+    @staticmethod
+    def get_abonnement_actuel(utilisateur):
+        """Récupère l'abonnement actuel de l'utilisateur"""
+        return PermissionService.get_droits(utilisateur).abonnement
     
     @staticmethod
     def get_permissions_utilisateur(utilisateur):
         """Récupère les permissions de l'utilisateur basées sur son abonnement"""
-        abonnement = PermissionService.get_abonnement_actuel(utilisateur)
-        if not abonnement:
-            # 🔧 CORRECTION: Si pas d'abonnement, retourner les permissions du pack Gratuit par défaut
-            try:
-                from .models import PackAbonnement
-                pack_gratuit = PackAbonnement.objects.filter(
-                    type_pack='gratuit', 
-                    nom='Gratuit',
-                    actif=True
-                ).first()
-                
-                if pack_gratuit and hasattr(pack_gratuit, 'permissions'):
-                    return pack_gratuit.permissions
-            except Exception:
-                pass
-            return None
-        
-        try:
-            return abonnement.pack.permissions
-        except PackPermissions.DoesNotExist:
-            return None
+        return PermissionService.get_droits(utilisateur).permissions
     
     @staticmethod
     def verifier_acces_cours(utilisateur, contenu_id=None):
         """Vérifie si l'utilisateur peut accéder à un cours/contenu"""
-        permissions = PermissionService.get_permissions_utilisateur(utilisateur)
+        droits = PermissionService.get_droits(utilisateur)
+        permissions = droits.permissions
         if not permissions:
             return False, "Aucun abonnement actif"
         
         # 🔧 NOUVEAUTÉ: Vérifier d'abord si l'abonnement a expiré
-        abonnement_actuel = PermissionService.get_abonnement_actuel(utilisateur)
-        if not abonnement_actuel:
+        if not droits.abonnement:
             # Abonnement expiré, vérifier accès pack gratuit
             print(f"⚠️ Abonnement expiré pour {utilisateur.email}, vérification pack gratuit")
-            if permissions.pack.type_pack == 'gratuit' and contenu_id:
+            if droits.pack.type_pack == 'gratuit' and contenu_id:
                 return ExpirationService.utilisateur_peut_acceder_contenu_gratuit(utilisateur, contenu_id)
         
         # Si contenu_id fourni, vérifier s'il a déjà été consulté
@@ -253,13 +695,8 @@ class PermissionService:
         """Vérifie si un contenu a déjà été consulté par l'utilisateur"""
         try:
             from progression.models import ProgressionContenu
-            from cours.models import ContenuChapitre
             
-            # Vérifier si le contenu existe d'abord
-            if not ContenuChapitre.objects.filter(id=contenu_id).exists():
-                return False
-            
-            # Vérifier si une progression existe pour ce contenu
+            # Une progression ne peut exister que pour un contenu existant (clé étrangère)
             return ProgressionContenu.objects.filter(
                 etudiant=utilisateur,
                 contenu_id=contenu_id
@@ -288,16 +725,28 @@ class PermissionService:
                 return False, f"Contenu avec ID {contenu_id} n'existe pas"
             
             # Créer la progression du contenu SANS le marquer comme lu (juste commencé)
-            progression, created = ProgressionContenu.objects.get_or_create(
-                etudiant=utilisateur,
-                contenu=contenu,
-                defaults={
-                    'lu': False,  # CORRECT: Pas encore terminé, juste commencé
-                    'temps_lecture': 1,  # Temps minimal pour comptabiliser l'accès
-                    'date_debut': timezone.now(),
-                    'date_completion': None  # Pas encore terminé
-                }
-            )
+            progression = ProgressionContenu.objects.filter(etudiant=utilisateur, contenu=contenu).first()
+            created = progression is None
+            if created:
+                try:
+                    with transaction.atomic():
+                        # Réserver le quota et créer la progression dans la même transaction
+                        reserve, message = PermissionService.reserver_quota(utilisateur, UsageMensuelle.RESSOURCE_COURS)
+                        if not reserve:
+                            return False, message
+                        progression = ProgressionContenu(
+                            etudiant=utilisateur,
+                            contenu=contenu,
+                            lu=False,  # CORRECT: Pas encore terminé, juste commencé
+                            temps_lecture=1,  # Temps minimal pour comptabiliser l'accès
+                            date_completion=None  # Pas encore terminé
+                        )
+                        progression._quota_reserve = True
+                        progression.save()
+                except IntegrityError:
+                    # Requête concurrente : la progression existe déjà, la réservation a été annulée
+                    progression = ProgressionContenu.objects.get(etudiant=utilisateur, contenu=contenu)
+                    created = False
             
             # Si déjà existant, juste ajouter un peu de temps (re-consultation)
             if not created:
@@ -472,8 +921,7 @@ class PermissionService:
             
             if quiz_ce_mois >= permissions.max_quiz_par_mois:
                 message = permissions.get_message_restriction_dynamique(
-                    quiz_utilises=quiz_ce_mois,
-                    max_quiz=permissions.max_quiz_par_mois
+                    quiz_utilises=quiz_ce_mois
                 )
                 return False, message
         
@@ -486,78 +934,87 @@ class PermissionService:
         if not permissions:
             return False, "Aucun abonnement actif"
         
-        # Si examen_id fourni, vérifier s'il a déjà été consulté
-        if examen_id:
-            deja_consulte = PermissionService.examen_deja_consulte(utilisateur, examen_id)
-            
-            if deja_consulte:
-                # L'utilisateur peut toujours revoir un examen déjà consulté
-                return True, "Accès autorisé (examen déjà consulté)"
+        if not examen_id and permissions.max_examens_par_mois <= 0:
+            return True, "Accès autorisé"
+        
+        examens_ce_mois, deja_consulte = PermissionService.get_etat_examens(utilisateur, examen_id)
+        
+        # L'utilisateur peut toujours revoir un examen déjà consulté
+        if deja_consulte:
+            return True, "Accès autorisé (examen déjà consulté)"
         
         # Vérifier la limite mensuelle des examens pour les nouveaux examens
-        if permissions.max_examens_par_mois > 0:
-            examens_ce_mois = PermissionService.compter_examens_mois_courant(utilisateur)
-            
-            if examens_ce_mois >= permissions.max_examens_par_mois:
-                return False, f"Limite atteinte : vous avez consulté {examens_ce_mois}/{permissions.max_examens_par_mois} examens ce mois-ci. Vous pouvez toujours revoir les examens déjà consultés."
+        if permissions.max_examens_par_mois > 0 and examens_ce_mois >= permissions.max_examens_par_mois:
+            return False, f"Limite atteinte : vous avez consulté {examens_ce_mois}/{permissions.max_examens_par_mois} examens ce mois-ci. Vous pouvez toujours revoir les examens déjà consultés."
         
         return True, "Accès autorisé"
     
+    @staticmethod
+    def get_etat_examens(utilisateur, examen_id=None):
+        """
+        Retourne (examens consultés ce mois, examen_id déjà consulté ce mois) en une seule requête.
+        La ligne de compteur est créée avec la première consultation du mois : sans elle, rien n'a été consulté.
+        """
+        from .models import ConsultationExamen
+        
+        annee, mois = UsageMensuelleService._periode()
+        compteurs = UsageMensuelle.objects.filter(
+            utilisateur_id=utilisateur.id, annee=annee, mois=mois,
+            ressource=UsageMensuelle.RESSOURCE_EXAMEN
+        )
+        if examen_id:
+            compteurs = compteurs.annotate(deja_consulte=models.Exists(
+                ConsultationExamen.objects.filter(
+                    utilisateur_id=utilisateur.id, examen_id=examen_id, annee=annee, mois=mois
+                )
+            ))
+        else:
+            compteurs = compteurs.annotate(deja_consulte=models.Value(False))
+        
+        etat = compteurs.values_list('compteur', 'deja_consulte').first()
+        return etat if etat else (0, False)
+    
     @staticmethod
     def examen_deja_consulte(utilisateur, examen_id):
-        """Vérifie si un examen a déjà été consulté par l'utilisateur"""
-        try:
-            from examens.models import Examen
-            
-            # Vérifier si l'examen existe d'abord
-            if not Examen.objects.filter(id=examen_id).exists():
-                return False
-            
-            # Pour l'instant, nous utilisons un système simple basé sur le cache ou les sessions
-            # TODO: Créer un modèle ConsultationExamen pour un suivi plus précis
-            from django.core.cache import cache
-            cache_key = f"examen_consulte_{utilisateur.id}_{examen_id}"
-            return cache.get(cache_key, False)
-            
-        except ImportError:
-            return False
-        except Exception:
-            return False
+        """Vérifie si un examen a déjà été consulté par l'utilisateur ce mois-ci"""
+        return PermissionService.get_etat_examens(utilisateur, examen_id)[1]
     
     @staticmethod
     def marquer_examen_consulte(utilisateur, examen_id):
-        """Marque un examen comme consulté"""
+        """
+        Enregistre la première consultation du mois d'un examen.
+        Le quota mensuel est réservé dans la même transaction que l'écriture dans le registre.
+        """
+        from examens.models import Examen
+        from .models import ConsultationExamen
+        
         try:
-            from examens.models import Examen
-            from django.core.cache import cache
-            from django.utils import timezone
-            
-            # Vérifier si l'examen existe
-            try:
-                examen = Examen.objects.get(id=examen_id)
-            except Examen.DoesNotExist:
-                return False, f"Examen avec ID {examen_id} n'existe pas"
-            
-            # Marquer comme consulté dans le cache (durée: 1 mois)
-            cache_key = f"examen_consulte_{utilisateur.id}_{examen_id}"
-            
-            # Vérifier si c'est la première consultation ce mois-ci
-            if not cache.get(cache_key, False):
-                cache.set(cache_key, True, timeout=30*24*60*60)  # 30 jours
-                
-                # Incrémenter le compteur seulement pour les nouvelles consultations
-                PermissionService.incrementer_compteur_examens(utilisateur)
-                
-                # Marquer aussi la date de consultation
-                date_key = f"examen_date_{utilisateur.id}_{examen_id}"
-                cache.set(date_key, timezone.now().isoformat(), timeout=30*24*60*60)
-                
-                return True, f"Examen {examen.titre} marqué comme consulté (nouvelle consultation)"
-            else:
-                return True, f"Examen {examen.titre} déjà consulté ce mois"
-            
-        except Exception as e:
-            return False, f"Erreur lors du marquage: {str(e)}"
+            examen = Examen.objects.get(id=examen_id)
+        except Examen.DoesNotExist:
+            return False, f"Examen avec ID {examen_id} n'existe pas"
+        
+        permissions = PermissionService.get_permissions_utilisateur(utilisateur)
+        if not permissions:
+            return False, "Aucun abonnement actif"
+        
+        annee, mois = UsageMensuelleService._periode()
+        try:
+            with transaction.atomic():
+                ConsultationExamen.objects.create(
+                    utilisateur=utilisateur, examen=examen, annee=annee, mois=mois
+                )
+                if not UsageMensuelleService.reserver(
+                    utilisateur.id, UsageMensuelle.RESSOURCE_EXAMEN, permissions.max_examens_par_mois
+                ):
+                    # Quota épuisé : annuler l'écriture dans le registre
+                    transaction.set_rollback(True)
+                    limite = permissions.max_examens_par_mois
+                    return False, f"Limite atteinte : vous avez consulté {limite}/{limite} examens ce mois-ci. Vous pouvez toujours revoir les examens déjà consultés."
+        except IntegrityError:
+            # Déjà consulté ce mois : ne consomme pas de quota
+            return True, f"Examen {examen.titre} déjà consulté ce mois"
+        
+        return True, f"Examen {examen.titre} marqué comme consulté (nouvelle consultation)"
     
     @staticmethod
     def verifier_acces_ia(utilisateur, type_ia='standard'):
@@ -566,10 +1023,10 @@ class PermissionService:
         if not permissions:
             return False, "Aucun abonnement actif"
         
-        if type_ia == 'prioritaire' and not permissions.acces_ia_prioritaire:
+        if type_ia == 'prioritaire' and not permissions.a_fonctionnalite('acces_ia_prioritaire'):
             return False, "Support IA prioritaire non disponible avec votre pack"
         
-        if not permissions.acces_ia_standard and not permissions.acces_ia_prioritaire:
+        if not permissions.a_fonctionnalite('acces_ia_standard', 'acces_ia_prioritaire'):
             return False, "Support IA non disponible avec votre pack"
         
         return True, "Accès IA autorisé"
@@ -581,7 +1038,7 @@ class PermissionService:
         if not permissions:
             return False, "Aucun abonnement actif"
         
-        if not permissions.acces_certificats:
+        if not permissions.a_fonctionnalite('acces_certificats'):
             return False, "Certificats non disponibles avec votre pack"
         
         return True, "Accès aux certificats autorisé"
@@ -593,159 +1050,168 @@ class PermissionService:
         if not permissions:
             return False, "Aucun abonnement actif"
         
-        if not permissions.acces_contenu_hors_ligne:
+        if not permissions.a_fonctionnalite('acces_contenu_hors_ligne'):
             return False, "Téléchargement non disponible avec votre pack"
         
         return True, "Téléchargement autorisé"
     
     @staticmethod
-    def compter_cours_mois_courant(utilisateur):
-        """Compte le nombre de cours suivis ce mois"""
-        try:
+    def verifier_acces_multiple(utilisateur, contenu_ids=(), quiz_ids=(), examen_ids=()):
+        """
+        Vérifie l'accès à plusieurs contenus, quiz et examens en une fois.
+        Mêmes règles que verifier_acces_cours / _quiz / _examen, mais les droits sont résolus une fois,
+        les ressources déjà consultées sont lues avec une requête IN par type et les limites
+        mensuelles sont appliquées en mémoire.
+        """
+        resultats = {'contenus': [], 'quiz': [], 'examens': []}
+        
+        droits = PermissionService.get_droits(utilisateur)
+        permissions = droits.permissions
+        if not permissions:
+            for cle, ids in (('contenus', contenu_ids), ('quiz', quiz_ids), ('examens', examen_ids)):
+                resultats[cle] = [
+                    {'id': ressource_id, 'acces': False, 'message': "Aucun abonnement actif", 'deja_consulte': False}
+                    for ressource_id in ids
+                ]
+            return resultats
+        
+        compteurs = UsageMensuelleService.get_compteurs(utilisateur.id)
+        annee, mois = UsageMensuelleService._periode()
+        
+        if contenu_ids:
             from progression.models import ProgressionContenu
-            mois_courant = timezone.now().month
-            annee_courante = timezone.now().year
             
-            # Compter les cours commencés ce mois (dès l'accès, pas seulement complétés)
-            return ProgressionContenu.objects.filter(
-                etudiant=utilisateur,
-                date_debut__month=mois_courant,
-                date_debut__year=annee_courante
-            ).count()
-        except ImportError:
-            # Si le modèle n'existe pas encore, retourner 0
-            return 0
-    
-    @staticmethod
-    def compter_quiz_mois_courant(utilisateur):
-        """Compte le nombre de quiz réalisés ce mois"""
-        try:
-            from quiz.models import TentativeQuiz
-            mois_courant = timezone.now().month
-            annee_courante = timezone.now().year
-            
-            return TentativeQuiz.objects.filter(
-                etudiant=utilisateur,
-                date_debut__month=mois_courant,
-                date_debut__year=annee_courante
-            ).count()
-        except ImportError:
-            # Si le modèle n'existe pas encore, retourner 0
-            return 0
+            consultes = ProgressionContenu.objects.filter(etudiant=utilisateur, contenu_id__in=contenu_ids)
+            # Abonnement expiré sur le pack gratuit : seuls les contenus vus ce mois restent accessibles
+            gratuit_expire = not droits.abonnement and droits.pack.type_pack == 'gratuit'
+            if gratuit_expire:
+                debut_mois = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+                consultes = consultes.filter(date_completion__gte=debut_mois)
+            consultes = set(consultes.values_list('contenu_id', flat=True))
+            
+            cours_ce_mois = compteurs[UsageMensuelle.RESSOURCE_COURS]
+            limite_cours = permissions.max_cours_par_mois
+            limite_atteinte = limite_cours > 0 and cours_ce_mois >= limite_cours
+            
+            for contenu_id in contenu_ids:
+                if contenu_id in consultes:
+                    acces = True
+                    message = "Contenu déjà consulté ce mois" if gratuit_expire else "Accès autorisé (contenu déjà consulté)"
+                elif limite_atteinte:
+                    acces = False
+                    if gratuit_expire:
+                        message = f"Limite mensuelle atteinte ({limite_cours} cours/mois). Vous ne pouvez consulter que le contenu déjà vu."
+                    else:
+                        message = f"Limite atteinte : vous avez consulté {cours_ce_mois}/{limite_cours} cours ce mois-ci. Vous pouvez toujours revoir les cours déjà consultés."
+                else:
+                    acces, message = True, "Accès autorisé"
+                resultats['contenus'].append({
+                    'id': contenu_id, 'acces': acces, 'message': message, 'deja_consulte': contenu_id in consultes
+                })
+        
+        if quiz_ids:
+            quiz_ce_mois = compteurs[UsageMensuelle.RESSOURCE_QUIZ]
+            if permissions.max_quiz_par_mois > 0 and quiz_ce_mois >= permissions.max_quiz_par_mois:
+                acces, message = False, permissions.get_message_restriction_dynamique(quiz_utilises=quiz_ce_mois)
+            else:
+                acces, message = True, "Accès autorisé"
+            resultats['quiz'] = [
+                {'id': quiz_id, 'acces': acces, 'message': message, 'deja_consulte': False}
+                for quiz_id in quiz_ids
+            ]
+        
+        if examen_ids:
+            from .models import ConsultationExamen
+            
+            consultes = set(ConsultationExamen.objects.filter(
+                utilisateur=utilisateur, examen_id__in=examen_ids, annee=annee, mois=mois
+            ).values_list('examen_id', flat=True))
+            
+            examens_ce_mois = compteurs[UsageMensuelle.RESSOURCE_EXAMEN]
+            limite_examens = permissions.max_examens_par_mois
+            limite_atteinte = limite_examens > 0 and examens_ce_mois >= limite_examens
+            
+            for examen_id in examen_ids:
+                if examen_id in consultes:
+                    acces, message = True, "Accès autorisé (examen déjà consulté)"
+                elif limite_atteinte:
+                    acces = False
+                    message = f"Limite atteinte : vous avez consulté {examens_ce_mois}/{limite_examens} examens ce mois-ci. Vous pouvez toujours revoir les examens déjà consultés."
+                else:
+                    acces, message = True, "Accès autorisé"
+                resultats['examens'].append({
+                    'id': examen_id, 'acces': acces, 'message': message, 'deja_consulte': examen_id in consultes
+                })
+        
+        return resultats
+    
+    @staticmethod
+    def compter_cours_mois_courant(utilisateur):
+        """Compte le nombre de cours commencés ce mois (dès l'accès, pas seulement complétés)"""
+        return UsageMensuelleService.get_compteur(utilisateur.id, UsageMensuelle.RESSOURCE_COURS)
+    
+    @staticmethod
+    def compter_quiz_mois_courant(utilisateur):
+        """Compte le nombre de quiz réalisés ce mois"""
+        return UsageMensuelleService.get_compteur(utilisateur.id, UsageMensuelle.RESSOURCE_QUIZ)
+    
+    @staticmethod
+    def reserver_quota(utilisateur, ressource):
+        """
+        Vérifie et consomme atomiquement une unité du quota mensuel de la ressource.
+        À appeler dans la transaction qui crée l'objet consommé (marqué _quota_reserve).
+        """
+        permissions = PermissionService.get_permissions_utilisateur(utilisateur)
+        if not permissions:
+            return False, "Aucun abonnement actif"
+        
+        if ressource == UsageMensuelle.RESSOURCE_COURS:
+            limite = permissions.max_cours_par_mois
+        else:
+            limite = permissions.max_quiz_par_mois
+        
+        if UsageMensuelleService.reserver(utilisateur.id, ressource, limite):
+            return True, "Accès autorisé"
+        
+        if ressource == UsageMensuelle.RESSOURCE_COURS:
+            return False, f"Limite atteinte : vous avez consulté {limite}/{limite} cours ce mois-ci. Vous pouvez toujours revoir les cours déjà consultés."
+        return False, permissions.get_message_restriction_dynamique(quiz_utilises=limite)
     
     @staticmethod
     def compter_examens_mois_courant(utilisateur):
         """Compte le nombre d'examens consultés ce mois"""
-        try:
-            from django.core.cache import cache
-            from django.utils import timezone
-            
-            mois_courant = timezone.now().month
-            annee_courante = timezone.now().year
-            
-            # Récupérer le compteur mensuel depuis le cache
-            cache_key = f"examens_mois_{utilisateur.id}_{annee_courante}_{mois_courant}"
-            compteur_cache = cache.get(cache_key, 0)
-            
-            return compteur_cache
-            
-        except Exception:
-            return 0
+        return UsageMensuelleService.get_compteur(utilisateur.id, UsageMensuelle.RESSOURCE_EXAMEN)
     
     @staticmethod
     def incrementer_compteur_examens(utilisateur):
         """Incrémente le compteur d'examens pour le mois courant"""
-        try:
-            from django.core.cache import cache
-            from django.utils import timezone
-            import calendar
-            
-            mois_courant = timezone.now().month
-            annee_courante = timezone.now().year
-            
-            cache_key = f"examens_mois_{utilisateur.id}_{annee_courante}_{mois_courant}"
-            compteur_actuel = cache.get(cache_key, 0)
-            nouveau_compteur = compteur_actuel + 1
-            
-            # Mettre en cache jusqu'à la fin du mois
-            jours_dans_mois = calendar.monthrange(annee_courante, mois_courant)[1]
-            jours_restants = jours_dans_mois - timezone.now().day
-            timeout = max(jours_restants * 24 * 60 * 60, 86400)  # Au moins 1 jour
-            
-            cache.set(cache_key, nouveau_compteur, timeout=timeout)
-            
-            return nouveau_compteur
-            
-        except Exception:
-            return 0
+        UsageMensuelleService.incrementer(utilisateur.id, UsageMensuelle.RESSOURCE_EXAMEN)
+        return PermissionService.compter_examens_mois_courant(utilisateur)
     
     @staticmethod
     def examen_deja_consulte_cache_simple(utilisateur, examen_id):
         """
-        NOUVELLE fonction pour vérifier si un examen a été consulté (cache simple)
-        N'AFFECTE PAS la fonction examen_deja_consulte existante
+        NOUVELLE fonction pour vérifier si un examen a été consulté
+        Conservée pour compatibilité : s'appuie désormais sur le registre ConsultationExamen
         """
-        try:
-            from django.core.cache import cache
-            cache_key = f"examen_consulte_{utilisateur.id}_{examen_id}"
-            return cache.get(cache_key, False)
-        except Exception:
-            return False
+        return PermissionService.examen_deja_consulte(utilisateur, examen_id)
 
     @staticmethod
     def marquer_examen_consulte_cache_simple(utilisateur, examen_id):
         """
-        NOUVELLE fonction pour marquer un examen comme consulté (cache simple)
-        N'AFFECTE PAS la fonction marquer_examen_consulte existante
+        NOUVELLE fonction pour marquer un examen comme consulté
+        Conservée pour compatibilité : s'appuie désormais sur le registre ConsultationExamen
         """
-        try:
-            from django.core.cache import cache
-            import calendar
-            from django.utils import timezone
-            
-            # Marquer comme consulté
-            cache_key = f"examen_consulte_{utilisateur.id}_{examen_id}"
-            
-            # Cache jusqu'à la fin du mois pour cohérence avec le compteur mensuel
-            mois_courant = timezone.now().month
-            annee_courante = timezone.now().year
-            jours_dans_mois = calendar.monthrange(annee_courante, mois_courant)[1]
-            jours_restants = jours_dans_mois - timezone.now().day
-            timeout = max(jours_restants * 24 * 60 * 60, 86400)  # Au moins 1 jour
-            
-            cache.set(cache_key, True, timeout=timeout)
-            return True
-        except Exception:
-            return False
+        succes, _ = PermissionService.marquer_examen_consulte(utilisateur, examen_id)
+        return succes
 
     @staticmethod
     def verifier_acces_examen_avec_limitations(utilisateur, examen_id=None):
         """
         NOUVELLE fonction pour vérifier l'accès aux examens avec gestion correcte des limitations
-        Cette fonction N'AFFECTE PAS la fonction verifier_acces_examen existante
+        Même règle que verifier_acces_examen : un examen déjà consulté reste toujours accessible
         """
-        permissions = PermissionService.get_permissions_utilisateur(utilisateur)
-        if not permissions:
-            return False, "Aucun abonnement actif"
-        
-        # Si examen_id fourni, vérifier s'il a déjà été consulté (cache simple)
-        if examen_id:
-            deja_consulte = PermissionService.examen_deja_consulte_cache_simple(utilisateur, examen_id)
-            
-            if deja_consulte:
-                # L'utilisateur peut TOUJOURS revoir un examen déjà consulté
-                return True, "Accès autorisé (examen déjà consulté)"
-        
-        # Pour les NOUVEAUX examens, vérifier la limite mensuelle
-        if permissions.max_examens_par_mois > 0:
-            examens_ce_mois = PermissionService.compter_examens_mois_courant(utilisateur)
-            
-            if examens_ce_mois >= permissions.max_examens_par_mois:
-                message = f"Limite atteinte : vous avez consulté {examens_ce_mois}/{permissions.max_examens_par_mois} examens ce mois-ci. Vous pouvez toujours revoir les examens déjà consultés."
-                return False, message
-        
-        # Accès autorisé pour un nouvel examen
-        return True, "Accès autorisé"
+        return PermissionService.verifier_acces_examen(utilisateur, examen_id)
 
     @staticmethod
     def recalculer_progression_matiere_correctement(utilisateur, matiere):
@@ -940,20 +1406,22 @@ class PermissionService:
     @staticmethod
     def get_statut_restrictions(utilisateur):
         """Retourne le statut complet des restrictions pour l'utilisateur"""
-        permissions = PermissionService.get_permissions_utilisateur(utilisateur)
+        droits = PermissionService.get_droits(utilisateur)
+        permissions = droits.permissions
         if not permissions:
             return {
                 'abonnement_actif': False,
                 'message': 'Aucun abonnement actif'
             }
         
-        abonnement = PermissionService.get_abonnement_actuel(utilisateur)
-        jours_restants = (abonnement.date_fin.date() - timezone.now().date()).days if abonnement.date_fin else None
+        abonnement = droits.abonnement
+        jours_restants = (abonnement.date_fin.date() - timezone.now().date()).days if abonnement and abonnement.date_fin else None
         
         # Compter les utilisations du mois
-        cours_utilises = PermissionService.compter_cours_mois_courant(utilisateur)
-        quiz_utilises = PermissionService.compter_quiz_mois_courant(utilisateur)
-        examens_utilises = PermissionService.compter_examens_mois_courant(utilisateur)
+        compteurs = UsageMensuelleService.get_compteurs(utilisateur.id)
+        cours_utilises = compteurs[UsageMensuelle.RESSOURCE_COURS]
+        quiz_utilises = compteurs[UsageMensuelle.RESSOURCE_QUIZ]
+        examens_utilises = compteurs[UsageMensuelle.RESSOURCE_EXAMEN]
         
         # Calculer les pourcentages d'utilisation
         pourcentage_cours = (cours_utilises / permissions.max_cours_par_mois * 100) if permissions.max_cours_par_mois > 0 else 0
@@ -962,7 +1430,7 @@ class PermissionService:
         
         return {
             'abonnement_actif': True,
-            'pack_nom': permissions.pack.nom,
+            'pack_nom': droits.pack.nom,
             'jours_restants': jours_restants,
             'cours': {
                 'utilises': cours_utilises,
@@ -982,6 +1450,8 @@ class PermissionService:
                 'pourcentage': min(pourcentage_examens, 100),
                 'limite_atteinte': permissions.max_examens_par_mois > 0 and examens_utilises >= permissions.max_examens_par_mois
             },
+            'masque_fonctionnalites': permissions.vecteur.masque,
+            'fonctionnalites': PackPermissions.FONCTIONNALITES,
             'permissions': {
                 'cours_premium': permissions.acces_cours_premium,
                 'ia_standard': permissions.acces_ia_standard,
@@ -1001,11 +1471,80 @@ class PermissionService:
 class AbonnementService:
     """Service pour gérer les abonnements"""
     
+    @staticmethod
+    def liberer_abonnement_actif(utilisateur, statut='remplace', sauf=None):
+        """
+        Désactive l'abonnement actif de l'utilisateur avant d'en activer un autre.
+        À appeler dans une transaction : le verrou sur la référence sérialise
+        les activations concurrentes d'un même utilisateur.
+        """
+        AbonnementActuel.objects.get_or_create(utilisateur=utilisateur)
+        AbonnementActuel.objects.select_for_update().get(utilisateur=utilisateur)
+        
+        actifs = Abonnement.objects.filter(utilisateur=utilisateur, actif=True)
+        if sauf is not None:
+            actifs = actifs.exclude(pk=sauf.pk)
+        return actifs.update(actif=False, statut=statut)
+    
+    @staticmethod
+    def synchroniser_abonnements_actuels(utilisateur_ids):
+        """
+        Recale en deux requêtes la référence actuelle d'un lot d'utilisateurs après
+        une écriture ensembliste (update / bulk_create ne déclenchent pas post_save).
+        """
+        utilisateur_ids = list(utilisateur_ids)
+        if not utilisateur_ids:
+            return 0
+        actifs = dict(
+            Abonnement.objects.filter(utilisateur_id__in=utilisateur_ids, actif=True).values_list('utilisateur_id', 'id')
+        )
+        AbonnementActuel.objects.bulk_create(
+            [AbonnementActuel(utilisateur_id=uid, abonnement_id=actifs.get(uid)) for uid in utilisateur_ids],
+            update_conflicts=True,
+            unique_fields=['utilisateur'],
+            update_fields=['abonnement', 'date_mise_a_jour']
+        )
+        return len(actifs)
+    
+    @staticmethod
+    def creer_abonnements_en_masse(abonnements, maintenant=None):
+        """
+        Insère en une requête des abonnements construits en mémoire (au plus un par utilisateur),
+        chacun remplaçant l'abonnement actif de son utilisateur. À appeler dans une transaction.
+        
+        bulk_create ne passe ni par Abonnement.save() ni par post_save : dates, référence
+        actuelle, échéances, file des commissions et cache des droits sont donc traités ici, en lot.
+        
+        Returns:
+            list: abonnements créés (avec leur id), dans l'ordre reçu
+        """
+        if not abonnements:
+            return []
+        maintenant = maintenant or timezone.now()
+        utilisateur_ids = [abonnement.utilisateur_id for abonnement in abonnements]
+        
+        # Verrou sur les références puis remplacement des abonnements actifs (un seul actif par utilisateur)
+        list(AbonnementActuel.objects.select_for_update().filter(utilisateur_id__in=utilisateur_ids).values_list('pk'))
+        Abonnement.objects.filter(utilisateur_id__in=utilisateur_ids, actif=True).update(actif=False, statut='remplace')
+        
+        for abonnement in abonnements:
+            abonnement.date_debut = maintenant
+            if abonnement.date_fin is None:
+                abonnement.date_fin = maintenant + timedelta(days=abonnement.pack.duree_jours)
+        abonnements = Abonnement.objects.bulk_create(abonnements)
+        
+        AbonnementService.synchroniser_abonnements_actuels(utilisateur_ids)
+        PlanificateurService.planifier_nouveaux_abonnements(abonnements)
+        CommissionService.signaler_abonnements(abonnements)
+        transaction.on_commit(lambda: CacheDroitsService.invalider_utilisateurs(utilisateur_ids))
+        return abonnements
+    
     @staticmethod
     def creer_abonnement(utilisateur, pack, est_essai_gratuit=False, renouvellement_auto=False):
-        """Crée un nouvel abonnement"""
+        """Crée un nouvel abonnement, qui remplace l'abonnement actif éventuel"""
         try:
             with transaction.atomic():
+                AbonnementService.liberer_abonnement_actif(utilisateur)
                 abonnement = Abonnement.objects.create(
                     utilisateur=utilisateur,
                     pack=pack,
@@ -1014,6 +1553,7 @@ class AbonnementService:
                     montant_paye=0 if est_essai_gratuit else pack.prix_reduit,
                     renouvellement_auto=renouvellement_auto
                 )
+                PermissionService.invalider_droits(utilisateur)
                 return {'success': True, 'abonnement': abonnement}
         except Exception as e:
             return {'success': False, 'error': str(e)}
@@ -1115,17 +1655,21 @@ class AbonnementService:
             return {'success': False, 'error': str(e)}
     
     @staticmethod
-    def initier_paiement_abonnement_enfant(parent, enfant, pack_id, email='', renouvellement_auto=False):
-        """Initie un paiement pour un abonnement enfant - Le parent paie, l'enfant reçoit l'abonnement"""
+    def initier_paiement_abonnement_enfant(parent, enfant, pack_id, email='', renouvellement_auto=False, pack_familial=None):
+        """
+        Initie un paiement pour un abonnement enfant - Le parent paie, l'enfant reçoit l'abonnement
+        (pack_familial : pack_id désigne un PackFamilial ; sans précision, PackAbonnement d'abord)
+        """
         try:
             # 🔧 CORRECTION : Chercher d'abord dans PackAbonnement, puis dans PackFamilial
             # Car les packs spéciaux (Pack Vacances, etc.) sont dans PackAbonnement
-            try:
-                pack = PackAbonnement.objects.get(id=pack_id, actif=True)
-                print(f"📦 Pack standard trouvé: {pack.nom} - {pack.prix} FCFA")
-            except PackAbonnement.DoesNotExist:
-                pack = PackFamilial.objects.get(id=pack_id, actif=True)
-                print(f"📦 Pack familial trouvé: {pack.nom} - {pack.prix} FCFA")
+            pack = ReferentielService.get_pack_ou_pack_familial(pack_id, actif_seulement=True, pack_familial=pack_familial)
+            if not pack:
+                return {'success': False, 'error': 'Pack invalide'}
+            if isinstance(pack, PackFamilial) and ReferentielService.get_pack_provisionne(pack) is None:
+                # Les abonnements pointent vers PackAbonnement : sans équivalent, le paiement ne pourrait pas être activé
+                return {'success': False, 'error': "Aucun pack d'abonnement familial ne correspond à ce pack"}
+            print(f"📦 Pack trouvé: {pack.nom} - {pack.prix} FCFA")
             
             with transaction.atomic():
                 # 🎁 GESTION DE L'UPGRADE : Désactiver l'ancien abonnement parrainage de l'enfant
@@ -1172,6 +1716,7 @@ class AbonnementService:
                 
                 # Stocker les informations du pack, parent et enfant dans le paiement
                 paiement.pack_id = pack.id
+                paiement.pack_familial = isinstance(pack, PackFamilial)
                 paiement.utilisateur_id = enfant.id  # L'enfant recevra l'abonnement
                 paiement.parent_id = parent.id  # Le parent paie
                 paiement.renouvellement_auto = renouvellement_auto
@@ -1206,17 +1751,21 @@ class AbonnementService:
             return {'success': False, 'error': str(e)}
     
     @staticmethod
-    def initier_paiement_abonnement_famille(utilisateur, pack_id, email='', renouvellement_auto=False):
-        """Initie un paiement pour un pack familial - Le parent paie pour tous ses enfants"""
+    def initier_paiement_abonnement_famille(utilisateur, pack_id, email='', renouvellement_auto=False, pack_familial=None):
+        """
+        Initie un paiement pour un pack familial - Le parent paie pour tous ses enfants
+        (pack_familial : pack_id désigne un PackFamilial ; sans précision, PackAbonnement d'abord)
+        """
         try:
             # 🔧 CORRECTION : Chercher d'abord dans PackAbonnement, puis dans PackFamilial
             # Car les packs spéciaux (Pack Vacances, etc.) sont dans PackAbonnement
-            try:
-                pack = PackAbonnement.objects.get(id=pack_id, actif=True)
-                print(f"📦 Pack standard trouvé pour famille: {pack.nom} - {pack.prix} FCFA")
-            except PackAbonnement.DoesNotExist:
-                pack = PackFamilial.objects.get(id=pack_id, actif=True)
-                print(f"📦 Pack familial trouvé pour famille: {pack.nom} - {pack.prix} FCFA")
+            pack = ReferentielService.get_pack_ou_pack_familial(pack_id, actif_seulement=True, pack_familial=pack_familial)
+            if not pack:
+                return {'success': False, 'error': 'Pack invalide'}
+            if isinstance(pack, PackFamilial) and ReferentielService.get_pack_provisionne(pack) is None:
+                # Les abonnements pointent vers PackAbonnement : sans équivalent, le paiement ne pourrait pas être activé
+                return {'success': False, 'error': "Aucun pack d'abonnement familial ne correspond à ce pack"}
+            print(f"📦 Pack trouvé pour famille: {pack.nom} - {pack.prix} FCFA")
             
             with transaction.atomic():
                 # 🎁 GESTION DE L'UPGRADE : Désactiver l'ancien abonnement parrainage du parent
@@ -1256,6 +1805,7 @@ class AbonnementService:
                 
                 # Stocker les informations du pack et utilisateur dans le paiement
                 paiement.pack_id = pack.id
+                paiement.pack_familial = isinstance(pack, PackFamilial)
                 paiement.utilisateur_id = utilisateur.id  # Le parent reçoit l'abonnement familial
                 paiement.renouvellement_auto = renouvellement_auto
                 paiement.save()
@@ -1291,11 +1841,12 @@ class AbonnementService:
     def get_abonnement_actuel(utilisateur):
         """Récupère l'abonnement actuel de l'utilisateur"""
         try:
-            abonnement = Abonnement.objects.filter(
+            reference = AbonnementActuel.objects.filter(
                 utilisateur=utilisateur,
-                actif=True,
-                statut__in=['actif', 'essai']
-            ).first()
+                abonnement__actif=True,
+                abonnement__statut__in=['actif', 'essai']
+            ).select_related('abonnement__pack').first()
+            abonnement = reference.abonnement if reference else None
             
             if abonnement:
                 return {'success': True, 'abonnement': abonnement}
@@ -1309,10 +1860,12 @@ class AbonnementService:
     def suspendre_abonnement(abonnement_id, utilisateur):
         """Suspend un abonnement"""
         try:
-            abonnement = Abonnement.objects.get(id=abonnement_id, utilisateur=utilisateur)
-            abonnement.statut = 'suspendu'
-            abonnement.actif = False
-            abonnement.save()
+            with transaction.atomic():
+                abonnement = Abonnement.objects.select_for_update().get(id=abonnement_id, utilisateur=utilisateur)
+                abonnement.statut = 'suspendu'
+                abonnement.actif = False
+                abonnement.save()
+            PermissionService.invalider_droits(utilisateur)
             return {'success': True, 'message': 'Abonnement suspendu'}
         except Abonnement.DoesNotExist:
             return {'success': False, 'error': 'Abonnement non trouvé'}
@@ -1323,10 +1876,13 @@ class AbonnementService:
     def reactiver_abonnement(abonnement_id, utilisateur):
         """Réactive un abonnement"""
         try:
-            abonnement = Abonnement.objects.get(id=abonnement_id, utilisateur=utilisateur)
-            abonnement.statut = 'actif'
-            abonnement.actif = True
-            abonnement.save()
+            with transaction.atomic():
+                abonnement = Abonnement.objects.get(id=abonnement_id, utilisateur=utilisateur)
+                AbonnementService.liberer_abonnement_actif(utilisateur, sauf=abonnement)
+                abonnement.statut = 'actif'
+                abonnement.actif = True
+                abonnement.save()
+            PermissionService.invalider_droits(utilisateur)
             return {'success': True, 'message': 'Abonnement réactivé'}
         except Abonnement.DoesNotExist:
             return {'success': False, 'error': 'Abonnement non trouvé'}
@@ -1347,8 +1903,12 @@ class AbonnementService:
             if not abonnement.actif:
                 return {'success': False, 'error': 'Seuls les abonnements actifs peuvent être renouvelés'}
             
+            # Un abonnement illimité (pack gratuit) n'a rien à renouveler
+            if abonnement.date_fin is None:
+                return {'success': False, 'error': 'Cet abonnement est illimité'}
+            
             # Vérifier que l'abonnement peut être renouvelé (moins de 30 jours restants)
-            jours_restants = (abonnement.date_fin - timezone.now().date()).days
+            jours_restants = (abonnement.date_fin - timezone.now()).days
             if jours_restants > 30:
                 return {'success': False, 'error': f'Renouvellement disponible dans {jours_restants - 30} jours'}
             
@@ -1356,19 +1916,21 @@ class AbonnementService:
             pack = abonnement.pack
             nouvelle_date_fin = abonnement.date_fin + timedelta(days=pack.duree_jours)
             
-            # Mettre à jour l'abonnement
-            abonnement.date_fin = nouvelle_date_fin
-            abonnement.date_renouvellement = timezone.now()
-            abonnement.save()
-            
-            # Créer un historique de renouvellement
             from .models import HistoriqueRenouvellement
-            HistoriqueRenouvellement.objects.create(
-                abonnement=abonnement,
-                date_renouvellement=timezone.now(),
-                duree_ajoutee=pack.duree_jours,
-                montant_renouvellement=pack.prix
-            )
+            with transaction.atomic():
+                # Mettre à jour l'abonnement (la référence actuelle est resynchronisée à l'enregistrement)
+                abonnement.date_fin = nouvelle_date_fin
+                abonnement.date_renouvellement = timezone.now()
+                abonnement.save()
+                
+                # Créer un historique de renouvellement
+                HistoriqueRenouvellement.objects.create(
+                    abonnement=abonnement,
+                    date_renouvellement=timezone.now(),
+                    duree_ajoutee=pack.duree_jours,
+                    montant_renouvellement=pack.prix
+                )
+            PermissionService.invalider_droits(utilisateur)
             
             print(f"✅ Abonnement {abonnement.id} renouvelé: +{pack.duree_jours} jours")
             
@@ -1386,45 +1948,435 @@ class AbonnementService:
             return {'success': False, 'error': str(e)}
 
 
+class PasserelleRenouvellement:
+    """
+    Interface de paiement du moteur de renouvellement. Une passerelle reçoit les PaiementWave
+    d'un lot (déjà enregistrés, transaction_id stable servant de clé d'idempotence) et retourne
+    {transaction_id: {'statut': 'reussi' | 'en_attente' | 'echoue', 'reference': ..., 'url': ...}}.
+    Un paiement absent du résultat reste en attente et sera resoumis au passage suivant.
+    Choisie par le réglage ABONNEMENTS_PASSERELLE_RENOUVELLEMENT (chemin pointé de la classe).
+    """
+    
+    def initier_paiements(self, paiements):
+        raise NotImplementedError
+
+
+class PasserelleRenouvellementWave(PasserelleRenouvellement):
+    """
+    Liens de paiement Wave, un par intention (client_reference = transaction_id) : le lien est
+    envoyé à l'abonné, puis le callback Wave ou le relevé rapproché confirme et prolonge l'abonnement
+    """
+    
+    def initier_paiements(self, paiements):
+        wave_service = WaveService()
+        resultats = {}
+        for paiement in paiements:
+            pack = ReferentielService.get_pack(paiement.pack_id)
+            lien = wave_service.generer_lien_wave(pack, reference=paiement.transaction_id) if pack else None
+            resultats[paiement.transaction_id] = (
+                {'statut': 'en_attente', 'url': lien} if lien else {'statut': 'echoue'}
+            )
+        return resultats
+
+
+class PasserelleRenouvellementSimulee(PasserelleRenouvellement):
+    """Passerelle locale (développement, essais) : chaque paiement est accepté immédiatement"""
+    
+    def initier_paiements(self, paiements):
+        return {
+            paiement.transaction_id: {'statut': 'reussi', 'reference': f"SIMU_{paiement.transaction_id}"}
+            for paiement in paiements
+        }
+
+
+class RenouvellementService:
+    """
+    Moteur de renouvellement automatique des abonnements (renouvellement_auto).
+    
+    Les abonnements arrivant à échéance dans la fenêtre sont lus par pack, découpés en lots
+    traités en parallèle par un nombre borné de workers. Chaque lot est validé en deux points
+    de reprise : les intentions de paiement sont d'abord enregistrées (transaction_id déterministe
+    par abonnement et date de fin, donc jamais en double), puis le résultat de la passerelle est
+    appliqué (prolongation par pack, historique, échéances) dans une seconde transaction.
+    Après un arrêt brutal, les intentions restées en attente sont resoumises telles quelles.
+    Une intention en attente n'est prolongée que sur preuve de paiement (callback Wave ou relevé
+    rapproché) ; son lien de paiement est conservé et envoyé une seule fois à l'abonné.
+    """
+    PREFIXE_TRANSACTION = 'RENOUV'
+    
+    @staticmethod
+    def get_passerelle(chemin=None):
+        from django.utils.module_loading import import_string
+        chemin = chemin or getattr(
+            settings, 'ABONNEMENTS_PASSERELLE_RENOUVELLEMENT',
+            'abonnements.services.PasserelleRenouvellementWave'
+        )
+        return import_string(chemin)()
+    
+    @staticmethod
+    def get_transaction_id(abonnement_id, date_fin):
+        return f"{RenouvellementService.PREFIXE_TRANSACTION}_{abonnement_id}_{date_fin:%Y%m%d%H%M%S}"
+    
+    @staticmethod
+    def get_abonnements_a_renouveler(fenetre, maintenant=None):
+        """Abonnements payants en renouvellement automatique dont la fin tombe dans la fenêtre"""
+        maintenant = maintenant or timezone.now()
+        return Abonnement.objects.filter(
+            actif=True,
+            statut='actif',
+            renouvellement_auto=True,
+            date_fin__gt=maintenant,
+            date_fin__lte=maintenant + fenetre
+        ).exclude(
+            pack__type_pack__in=['gratuit', 'famille']
+        )
+    
+    @staticmethod
+    def preparer_lots(fenetre, taille_lot, maintenant=None):
+        """Lots d'ids d'abonnements, un même pack par lot (une requête)"""
+        lignes = RenouvellementService.get_abonnements_a_renouveler(fenetre, maintenant).order_by(
+            'pack_id', 'id'
+        ).values_list('pack_id', 'id')
+        lots, courant, pack_courant = [], [], None
+        for pack_id, abonnement_id in lignes.iterator(chunk_size=5000):
+            if courant and (pack_id != pack_courant or len(courant) >= taille_lot):
+                lots.append((pack_courant, courant))
+                courant = []
+            pack_courant = pack_id
+            courant.append(abonnement_id)
+        if courant:
+            lots.append((pack_courant, courant))
+        return lots
+    
+    @staticmethod
+    def _enregistrer_intentions(pack, abonnement_ids, maintenant):
+        """Point de reprise 1 : intentions de paiement du lot (insertion idempotente), retournées verrouillées"""
+        with transaction.atomic():
+            abonnements = list(
+                Abonnement.objects.select_for_update().filter(
+                    id__in=abonnement_ids, actif=True, renouvellement_auto=True, date_fin__gt=maintenant
+                ).values_list('id', 'utilisateur_id', 'date_fin', 'renouvellement_auto')
+            )
+            intentions = {
+                RenouvellementService.get_transaction_id(abonnement_id, date_fin): PaiementWave(
+                    abonnement_id=abonnement_id,
+                    transaction_id=RenouvellementService.get_transaction_id(abonnement_id, date_fin),
+                    montant=pack.prix_reduit,
+                    statut='en_attente',
+                    wave_phone='',
+                    pack_id=pack.id,
+                    utilisateur_id=utilisateur_id,
+                    renouvellement_auto=renouvellement_auto
+                )
+                for abonnement_id, utilisateur_id, date_fin, renouvellement_auto in abonnements
+            }
+            PaiementWave.objects.bulk_create(intentions.values(), ignore_conflicts=True)
+        # Intentions de ce passage ou d'un passage interrompu, encore à soumettre
+        return list(PaiementWave.objects.filter(transaction_id__in=list(intentions), statut='en_attente'))
+    
+    @staticmethod
+    def appliquer_paiements_reussis(paiements, references=None):
+        """
+        Prolonge les abonnements payés (une mise à jour par pack), écrit l'historique et
+        marque les paiements réussis, en lot. À appeler dans une transaction, paiements verrouillés.
+        Un abonnement qui n'est plus actif (remplacé entre-temps) reçoit un nouvel abonnement.
+        """
+        from .models import HistoriqueRenouvellement
+        
+        references = references or {}
+        maintenant = timezone.now()
+        actifs = set(
+            Abonnement.objects.select_for_update().filter(
+                id__in=[paiement.abonnement_id for paiement in paiements], actif=True, date_fin__isnull=False
+            ).values_list('id', flat=True)
+        )
+        renouveles = [paiement for paiement in paiements if paiement.abonnement_id in actifs]
+        remplaces = [paiement for paiement in paiements if paiement.abonnement_id not in actifs]
+        
+        par_pack = {}
+        for paiement in renouveles:
+            par_pack.setdefault(paiement.pack_id, []).append(paiement)
+        historiques = []
+        for pack_id, groupe in par_pack.items():
+            decalage = timedelta(days=ReferentielService.get_pack(pack_id).duree_jours)
+            abonnement_ids = [paiement.abonnement_id for paiement in groupe]
+            Abonnement.objects.filter(id__in=abonnement_ids).update(
+                date_fin=models.F('date_fin') + decalage, date_renouvellement=maintenant
+            )
+            PlanificateurService.decaler_echeances(abonnement_ids, decalage)
+            historiques.extend(
+                HistoriqueRenouvellement(
+                    abonnement_id=paiement.abonnement_id,
+                    duree_ajoutee=decalage.days,
+                    montant_renouvellement=paiement.montant
+                )
+                for paiement in groupe
+            )
+        HistoriqueRenouvellement.objects.bulk_create(historiques)
+        
+        for paiement in renouveles:
+            paiement.statut = 'reussi'
+            paiement.wave_reference = references.get(paiement.transaction_id) or paiement.wave_reference
+            paiement.date_mise_a_jour = maintenant
+        PaiementWave.objects.bulk_update(renouveles, ['statut', 'wave_reference', 'date_mise_a_jour'])
+        
+        if remplaces:
+            packs = {paiement.pack_id: ReferentielService.get_pack(paiement.pack_id) for paiement in remplaces}
+            WaveCallbackService.activer_paiements_individuels(remplaces, packs, maintenant)
+        
+        utilisateur_ids = [paiement.utilisateur_id for paiement in renouveles]
+        transaction.on_commit(lambda: CacheDroitsService.invalider_utilisateurs(utilisateur_ids))
+        return len(renouveles), len(remplaces)
+    
+    @staticmethod
+    def traiter_lot(pack_id, abonnement_ids, passerelle, appliquer=True):
+        """Traite un lot d'un même pack : intentions, passerelle, puis résultats (deux commits)"""
+        from django.db import close_old_connections
+        
+        resultats = {'renouveles': 0, 'nouveaux': 0, 'en_attente': 0, 'echoues': 0, 'erreurs': 0}
+        try:
+            pack = ReferentielService.get_pack(pack_id)
+            if pack is None:
+                resultats['erreurs'] += len(abonnement_ids)
+                return resultats
+            if not appliquer:
+                resultats['en_attente'] += len(abonnement_ids)
+                return resultats
+            
+            maintenant = timezone.now()
+            intentions = RenouvellementService._enregistrer_intentions(pack, abonnement_ids, maintenant)
+            if not intentions:
+                return resultats
+            
+            reponses = passerelle.initier_paiements(intentions)
+            
+            # Point de reprise 2 : application des réponses de la passerelle
+            with transaction.atomic():
+                verrouilles = {
+                    paiement.transaction_id: paiement
+                    for paiement in PaiementWave.objects.select_for_update().filter(
+                        id__in=[intention.id for intention in intentions], statut='en_attente'
+                    )
+                }
+                reussis, echoues, liens, references = [], [], [], {}
+                for transaction_id, paiement in verrouilles.items():
+                    reponse = reponses.get(transaction_id) or {}
+                    if reponse.get('statut') == 'reussi':
+                        reussis.append(paiement)
+                        references[transaction_id] = reponse.get('reference')
+                    elif reponse.get('statut') == 'echoue':
+                        echoues.append(paiement.id)
+                    else:
+                        resultats['en_attente'] += 1
+                        if reponse.get('url') and reponse['url'] != paiement.lien_paiement:
+                            paiement.lien_paiement = reponse['url']
+                            liens.append(paiement)
+                if liens:
+                    # Lien conservé sur l'intention : envoyé une fois, pas à chaque nouvelle soumission
+                    PaiementWave.objects.bulk_update(liens, ['lien_paiement'])
+                    transaction.on_commit(lambda: RenouvellementService.envoyer_liens_paiement(liens))
+                if reussis:
+                    renouveles, nouveaux = RenouvellementService.appliquer_paiements_reussis(reussis, references)
+                    resultats['renouveles'] += renouveles
+                    resultats['nouveaux'] += nouveaux
+                if echoues:
+                    resultats['echoues'] += PaiementWave.objects.filter(id__in=echoues).update(
+                        statut='echoue', date_mise_a_jour=timezone.now()
+                    )
+        except Exception as e:
+            logger.error(f"Lot de renouvellement (pack {pack_id}) en échec: {e}")
+            resultats['erreurs'] += len(abonnement_ids)
+        finally:
+            # Chaque worker a sa propre connexion : elle est rendue à la fin du lot
+            close_old_connections()
+        return resultats
+    
+    @staticmethod
+    def envoyer_liens_paiement(paiements):
+        """Envoie à chaque abonné le lien Wave de son renouvellement (un email par intention)"""
+        from utilisateurs.services import envoyer_notification_email
+        
+        utilisateurs = Utilisateur.objects.select_related('preferences').in_bulk(
+            {paiement.utilisateur_id for paiement in paiements}
+        )
+        envoyes = 0
+        for paiement in paiements:
+            utilisateur = utilisateurs.get(paiement.utilisateur_id)
+            pack = ReferentielService.get_pack(paiement.pack_id)
+            if utilisateur is None or pack is None:
+                continue
+            sujet = f"Renouvellement de votre abonnement {pack.nom}"
+            message = (
+                f"Bonjour {utilisateur.first_name or utilisateur.email},\n\n"
+                f"Votre abonnement {pack.nom} arrive à échéance. Pour le prolonger de {pack.duree_jours} jours, "
+                f"réglez {int(paiement.montant)} FCFA via Wave : {paiement.lien_paiement}\n\n"
+                f"Votre abonnement sera prolongé dès la confirmation du paiement."
+            )
+            if envoyer_notification_email(utilisateur, sujet, message, message):
+                envoyes += 1
+        return envoyes
+    
+    @staticmethod
+    def renouveler(fenetre=timedelta(days=3), taille_lot=200, workers=4, passerelle=None, appliquer=True):
+        """
+        Renouvelle les abonnements dus dans la fenêtre, lots traités en parallèle (pool borné).
+        
+        Returns:
+            dict: lots, abonnements, renouvelés, en attente, échoués, erreurs, durée
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        
+        debut = time.perf_counter()
+        passerelle = passerelle or RenouvellementService.get_passerelle()
+        lots = RenouvellementService.preparer_lots(fenetre, taille_lot)
+        if connection.vendor == 'sqlite' and workers > 1:
+            # SQLite sérialise les écritures : des lots parallèles ne feraient que se bloquer
+            logger.info("SQLite : lots de renouvellement traités par un seul worker")
+            workers = 1
+        
+        totaux = {'lots': len(lots), 'abonnements': sum(len(ids) for _, ids in lots),
+                  'renouveles': 0, 'nouveaux': 0, 'en_attente': 0, 'echoues': 0, 'erreurs': 0}
+        if lots:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                for resultats in pool.map(
+                    lambda lot: RenouvellementService.traiter_lot(lot[0], lot[1], passerelle, appliquer), lots
+                ):
+                    for cle, valeur in resultats.items():
+                        totaux[cle] += valeur
+        totaux['duree_secondes'] = time.perf_counter() - debut
+        return totaux
+
+
 class ExpirationService:
     """Service pour gérer l'expiration des abonnements et la transition vers pack gratuit"""
     
     @staticmethod
-    def verifier_et_traiter_expirations():
-        """Vérifie et traite tous les abonnements expirés"""
-        from .models import Abonnement, PackAbonnement
-        from django.utils import timezone
-        
-        # Trouver tous les abonnements expirés mais encore actifs
-        abonnements_expires = Abonnement.objects.filter(
+    def get_abonnements_expires(maintenant=None):
+        """Abonnements arrivés à échéance mais encore actifs (hors packs gratuits)"""
+        return Abonnement.objects.filter(
             actif=True,
-            date_fin__lt=timezone.now(),
+            date_fin__lt=maintenant or timezone.now(),
             statut__in=['actif', 'essai']
         ).exclude(
             pack__type_pack='gratuit'  # Ne pas traiter les packs gratuits
         )
+    
+    @staticmethod
+    def compter_expirations(maintenant=None):
+        """Aperçu des expirations en attente, en une requête d'agrégat"""
+        return ExpirationService.get_abonnements_expires(maintenant).aggregate(
+            total=models.Count('id'),
+            utilisateurs=models.Count('utilisateur', distinct=True),
+            plus_ancienne=models.Min('date_fin'),
+            plus_recente=models.Max('date_fin')
+        )
+    
+    @staticmethod
+    def traiter_lot_expirations(pack_gratuit, taille_lot=500, maintenant=None):
+        """
+        Expire un lot d'abonnements et crée leurs remplaçants pack gratuit, dans une transaction.
+        
+        Sélection, mise à jour et insertion sont ensemblistes (environ cinq requêtes par lot).
+        Le lot suivant repart des abonnements encore actifs : une interruption ne laisse
+        aucun état intermédiaire et la relance reprend là où le traitement s'était arrêté.
         
-        print(f"🔍 Vérification d'expiration: {abonnements_expires.count()} abonnements à traiter")
+        Returns:
+            int: nombre d'abonnements expirés (0 quand il n'y a plus rien à traiter)
+        """
+        maintenant = maintenant or timezone.now()
+        with transaction.atomic():
+            lignes = list(
+                ExpirationService.get_abonnements_expires(maintenant)
+                .select_for_update()
+                .order_by('id')
+                .values_list('id', 'utilisateur_id')[:taille_lot]
+            )
+            if not lignes:
+                return 0
+            
+            expires = ExpirationService.expirer_abonnements(lignes, pack_gratuit, maintenant)
+            # Les échéances encore en attente de ces abonnements n'ont plus d'objet
+            EcheanceAbonnement.objects.filter(
+                abonnement_id__in=[abonnement_id for abonnement_id, _ in lignes],
+                date_traitement__isnull=True
+            ).update(date_traitement=maintenant, resultat=EcheanceAbonnement.RESULTAT_OBSOLETE)
+        return expires
+    
+    @staticmethod
+    def expirer_abonnements(lignes, pack_gratuit, maintenant):
+        """
+        Expire les abonnements [(id, utilisateur_id), ...] et transfère leurs utilisateurs
+        vers le pack gratuit, en requêtes ensemblistes. À appeler dans une transaction.
+        """
+        ids = [abonnement_id for abonnement_id, _ in lignes]
+        utilisateur_ids = sorted({utilisateur_id for _, utilisateur_id in lignes})
+        
+        # actif=True re-vérifié : un abonnement expiré entre-temps n'est pas compté deux fois
+        expires = Abonnement.objects.filter(id__in=ids, actif=True).update(actif=False, statut='expire')
         
+        # Pack gratuit illimité ; un utilisateur réabonné entre-temps garde son nouvel abonnement (contrainte d'unicité)
+        Abonnement.objects.bulk_create(
+            [
+                Abonnement(
+                    utilisateur_id=utilisateur_id,
+                    pack=pack_gratuit,
+                    date_debut=maintenant,
+                    date_fin=None,  # Pack gratuit = illimité dans le temps
+                    montant_paye=0,
+                    statut='actif',
+                    actif=True,
+                    est_essai_gratuit=False,
+                    source_parrainage=False
+                )
+                for utilisateur_id in utilisateur_ids
+            ],
+            ignore_conflicts=True
+        )
+        AbonnementService.synchroniser_abonnements_actuels(utilisateur_ids)
+        # Pas d'invalidation du cache des droits : une entrée dont la date_fin est dépassée n'est jamais servie
+        return expires
+    
+    @staticmethod
+    def verifier_et_traiter_expirations(taille_lot=500, limite=None):
+        """Traite par lots tous les abonnements expirés (un commit par lot)"""
+        debut = time.perf_counter()
         resultats = {
             'traites': 0,
             'erreurs': 0,
+            'lots': 0,
+            'duree_secondes': 0.0,
             'details': []
         }
         
-        for abonnement in abonnements_expires:
+        pack_gratuit = ReferentielService.get_pack_gratuit()
+        if not pack_gratuit:
+            resultats['erreurs'] += 1
+            resultats['details'].append("❌ Pack gratuit non trouvé")
+            return resultats
+        
+        # Échéance figée au lancement : les abonnements qui expirent pendant le traitement attendront la prochaine passe
+        maintenant = timezone.now()
+        while limite is None or resultats['traites'] < limite:
+            taille = taille_lot if limite is None else min(taille_lot, limite - resultats['traites'])
             try:
-                resultat = ExpirationService.traiter_expiration_abonnement(abonnement)
-                if resultat['success']:
-                    resultats['traites'] += 1
-                    resultats['details'].append(f"✅ {abonnement.utilisateur.email}: {resultat['message']}")
-                else:
-                    resultats['erreurs'] += 1
-                    resultats['details'].append(f"❌ {abonnement.utilisateur.email}: {resultat['error']}")
+                expires = ExpirationService.traiter_lot_expirations(pack_gratuit, taille, maintenant)
             except Exception as e:
+                # Le lot en échec est annulé ; la prochaine exécution le reprendra
+                logger.error(f"Erreur lors du traitement d'un lot d'expirations: {e}")
                 resultats['erreurs'] += 1
-                resultats['details'].append(f"❌ {abonnement.utilisateur.email}: Exception {e}")
+                resultats['details'].append(f"❌ Lot {resultats['lots'] + 1}: Exception {e}")
+                break
+            if not expires:
+                break
+            resultats['lots'] += 1
+            resultats['traites'] += expires
+            resultats['details'].append(f"✅ Lot {resultats['lots']}: {expires} abonnements transférés vers le pack gratuit")
         
+        resultats['duree_secondes'] = time.perf_counter() - debut
+        logger.info(
+            f"Expirations: {resultats['traites']} abonnements en {resultats['lots']} lots "
+            f"({resultats['duree_secondes']:.2f}s)"
+        )
         return resultats
     
     @staticmethod
@@ -1439,33 +2391,31 @@ class ExpirationService:
             
             print(f"🔄 Expiration de {utilisateur.email}: {ancien_pack.nom}")
             
-            # Marquer l'ancien abonnement comme expiré
-            abonnement.actif = False
-            abonnement.statut = 'expire'
-            abonnement.save()
-            
-            # Créer un nouvel abonnement avec pack gratuit
-            pack_gratuit = PackAbonnement.objects.filter(
-                type_pack='gratuit',
-                nom='Gratuit',
-                actif=True
-            ).first()
+            pack_gratuit = ReferentielService.get_pack_gratuit()
             
             if not pack_gratuit:
                 return {'success': False, 'error': 'Pack gratuit non trouvé'}
             
-            # Créer le nouvel abonnement gratuit (illimité dans le temps)
-            nouvel_abonnement = Abonnement.objects.create(
-                utilisateur=utilisateur,
-                pack=pack_gratuit,
-                date_debut=timezone.now(),
-                date_fin=None,  # Pack gratuit = illimité dans le temps
-                montant_paye=0,
-                statut='actif',
-                actif=True,
-                est_essai_gratuit=False,
-                source_parrainage=False
-            )
+            with transaction.atomic():
+                # Marquer l'ancien abonnement comme expiré
+                abonnement.actif = False
+                abonnement.statut = 'expire'
+                abonnement.save()
+                AbonnementService.liberer_abonnement_actif(utilisateur, statut='expire')
+                
+                # Créer le nouvel abonnement gratuit (illimité dans le temps)
+                nouvel_abonnement = Abonnement.objects.create(
+                    utilisateur=utilisateur,
+                    pack=pack_gratuit,
+                    date_debut=timezone.now(),
+                    date_fin=None,  # Pack gratuit = illimité dans le temps
+                    montant_paye=0,
+                    statut='actif',
+                    actif=True,
+                    est_essai_gratuit=False,
+                    source_parrainage=False
+                )
+            PermissionService.invalider_droits(utilisateur)
             
             print(f"✅ {utilisateur.email} transféré vers pack gratuit")
             
@@ -1503,12 +2453,13 @@ class ExpirationService:
                 return True, "Contenu déjà consulté ce mois"
             
             # Vérifier les limites mensuelles
-            permissions = PermissionService.get_permissions_utilisateur(utilisateur)
+            droits = PermissionService.get_droits(utilisateur)
+            permissions = droits.permissions
             if not permissions:
                 return False, "Aucune permission trouvée"
             
             # Pack gratuit : vérifier limite mensuelle
-            if permissions.pack.type_pack == 'gratuit':
+            if droits.pack.type_pack == 'gratuit':
                 cours_ce_mois = PermissionService.compter_cours_mois_courant(utilisateur)
                 limite_cours = permissions.max_cours_par_mois
                 
@@ -1522,22 +2473,242 @@ class ExpirationService:
             return False, f"Erreur de vérification: {e}"
 
 
-class PackDecouverteService:
-    """Service pour créer automatiquement un Pack Découverte pour les nouveaux utilisateurs sans parrain"""
+class PlanificateurService:
+    """
+    Transitions d'abonnement à date fixe : fin d'essai, expiration et rappel trois jours avant la fin.
+    
+    Chaque abonnement actif à durée limitée a ses échéances dans EcheanceAbonnement,
+    replanifiées à chaque enregistrement. Le planificateur ne lit que les échéances
+    arrivées à terme (index partiel sur date_echeance) et revérifie l'abonnement avant
+    d'agir : une échéance devenue sans objet est close, une date déplacée est replanifiée.
+    """
+    NOM_BAIL = 'echeances_abonnements'
+    JOURS_RAPPEL = 3
     
     @staticmethod
-    def creer_pack_decouverte_pour_utilisateur(utilisateur):
-        """Crée un Pack Découverte pour un utilisateur sans parrain"""
-        try:
-            from .models import PackAbonnement, Abonnement
-            from django.utils import timezone
-            from datetime import timedelta
-            
-            # Vérifier que l'utilisateur n'a pas déjà un abonnement actif
-            if Abonnement.objects.filter(utilisateur=utilisateur, actif=True).exists():
-                return {
-                    'success': False, 
-                    'error': 'Utilisateur a déjà un abonnement actif'
+    def _echeances_attendues(abonnement):
+        """Échéances {type: date} que l'état actuel de l'abonnement impose"""
+        if not abonnement.actif or abonnement.date_fin is None:
+            return {}
+        if abonnement.est_essai_gratuit:
+            echeances = {EcheanceAbonnement.TYPE_FIN_ESSAI: abonnement.date_fin_essai or abonnement.date_fin}
+        else:
+            echeances = {EcheanceAbonnement.TYPE_EXPIRATION: abonnement.date_fin}
+        date_rappel = abonnement.date_fin - timedelta(days=PlanificateurService.JOURS_RAPPEL)
+        if date_rappel > abonnement.date_debut:
+            echeances[EcheanceAbonnement.TYPE_RAPPEL] = date_rappel
+        return echeances
+    
+    @staticmethod
+    def planifier_abonnement(abonnement):
+        """Met la file d'échéances d'un abonnement en accord avec son état (une requête si rien ne change)"""
+        attendues = PlanificateurService._echeances_attendues(abonnement)
+        existantes = {e.type_echeance: e for e in EcheanceAbonnement.objects.filter(abonnement=abonnement)}
+        
+        a_creer, a_replanifier = [], []
+        for type_echeance, date_echeance in attendues.items():
+            echeance = existantes.get(type_echeance)
+            if echeance is None:
+                a_creer.append(EcheanceAbonnement(
+                    abonnement=abonnement, type_echeance=type_echeance, date_echeance=date_echeance
+                ))
+            elif echeance.date_echeance != date_echeance:
+                # Date déplacée (renouvellement, prolongation) : l'échéance est remise en attente
+                echeance.date_echeance = date_echeance
+                echeance.date_traitement = None
+                echeance.resultat = ''
+                echeance.tentatives = 0
+                a_replanifier.append(echeance)
+        
+        if a_creer:
+            EcheanceAbonnement.objects.bulk_create(a_creer, ignore_conflicts=True)
+        if a_replanifier:
+            EcheanceAbonnement.objects.bulk_update(
+                a_replanifier, ['date_echeance', 'date_traitement', 'resultat', 'tentatives']
+            )
+        
+        sans_objet = [
+            e.id for type_echeance, e in existantes.items()
+            if type_echeance not in attendues and e.date_traitement is None
+        ]
+        if sans_objet:
+            EcheanceAbonnement.objects.filter(id__in=sans_objet).update(
+                date_traitement=timezone.now(), resultat=EcheanceAbonnement.RESULTAT_OBSOLETE
+            )
+    
+    @staticmethod
+    def decaler_echeances(abonnement_ids, decalage):
+        """Décale d'un même délai les échéances d'abonnements prolongés en masse, remises en attente"""
+        return EcheanceAbonnement.objects.filter(abonnement_id__in=abonnement_ids).update(
+            date_echeance=models.F('date_echeance') + decalage,
+            date_traitement=None,
+            resultat='',
+            tentatives=0
+        )
+    
+    @staticmethod
+    def planifier_nouveaux_abonnements(abonnements):
+        """Planifie en une insertion les échéances d'abonnements créés par bulk_create (sans post_save)"""
+        EcheanceAbonnement.objects.bulk_create(
+            [
+                EcheanceAbonnement(abonnement=abonnement, type_echeance=type_echeance, date_echeance=date_echeance)
+                for abonnement in abonnements
+                for type_echeance, date_echeance in PlanificateurService._echeances_attendues(abonnement).items()
+            ],
+            ignore_conflicts=True
+        )
+    
+    @staticmethod
+    def get_prochaine_echeance():
+        """Date de la prochaine échéance en attente (None si la file est vide)"""
+        return EcheanceAbonnement.objects.filter(
+            date_traitement__isnull=True
+        ).order_by('date_echeance').values_list('date_echeance', flat=True).first()
+    
+    @staticmethod
+    def acquerir_bail(detenteur, duree_secondes, nom=None):
+        """Prend ou prolonge le bail : True si ce détenteur est seul autorisé à agir jusqu'à son échéance"""
+        nom = nom or PlanificateurService.NOM_BAIL
+        maintenant = timezone.now()
+        VerrouPlanificateur.objects.get_or_create(nom=nom)
+        # Mise à jour conditionnelle : un seul détenteur peut gagner un bail libre ou échu
+        return VerrouPlanificateur.objects.filter(nom=nom).filter(
+            models.Q(expire_le__isnull=True) | models.Q(expire_le__lt=maintenant) | models.Q(detenteur=detenteur)
+        ).update(detenteur=detenteur, expire_le=maintenant + timedelta(seconds=duree_secondes)) == 1
+    
+    @staticmethod
+    def liberer_bail(detenteur, nom=None):
+        """Rend le bail pour qu'une autre instance puisse le reprendre sans attendre son échéance"""
+        VerrouPlanificateur.objects.filter(
+            nom=nom or PlanificateurService.NOM_BAIL, detenteur=detenteur
+        ).update(detenteur='', expire_le=None)
+    
+    @staticmethod
+    def _envoyer_rappel(abonnement):
+        """Prévient l'utilisateur que son abonnement se termine bientôt"""
+        from utilisateurs.services import envoyer_notification_email
+        
+        utilisateur = abonnement.utilisateur
+        jours = max(1, -int(-(abonnement.date_fin - timezone.now()).total_seconds() // 86400))
+        nom_pack = abonnement.pack.nom if abonnement.pack else 'votre pack'
+        if abonnement.est_essai_gratuit:
+            sujet = f"Votre essai gratuit se termine dans {jours} jour(s)"
+        else:
+            sujet = f"Votre abonnement {nom_pack} se termine dans {jours} jour(s)"
+        message = (
+            f"Bonjour {utilisateur.first_name or utilisateur.email},\n\n"
+            f"Votre accès {nom_pack} prendra fin le {abonnement.date_fin.strftime('%d/%m/%Y')}. "
+            f"Renouvelez-le dès maintenant pour continuer à apprendre sans interruption."
+        )
+        return envoyer_notification_email(utilisateur, sujet, message, message)
+    
+    @staticmethod
+    def traiter_echeances(limite=200, maintenant=None):
+        """
+        Traite les échéances arrivées à terme, au plus `limite`, de la plus ancienne à la plus récente.
+        
+        Returns:
+            dict: compteurs par issue (expires, rappels, replanifiees, obsoletes, erreurs, traitees)
+        """
+        maintenant = maintenant or timezone.now()
+        resultats = {'traitees': 0, 'expires': 0, 'rappels': 0, 'replanifiees': 0, 'obsoletes': 0, 'erreurs': 0}
+        
+        echeances = list(
+            EcheanceAbonnement.objects.filter(
+                date_traitement__isnull=True,
+                date_echeance__lte=maintenant
+            ).select_related(
+                'abonnement__pack', 'abonnement__utilisateur__preferences'
+            ).order_by('date_echeance')[:limite]
+        )
+        if not echeances:
+            return resultats
+        
+        pack_gratuit = ReferentielService.get_pack_gratuit()
+        issues = {EcheanceAbonnement.RESULTAT_TRAITE: [], EcheanceAbonnement.RESULTAT_OBSOLETE: []}
+        a_replanifier, fins, rappels = [], [], []
+        
+        for echeance in echeances:
+            abonnement = echeance.abonnement
+            attendue = PlanificateurService._echeances_attendues(abonnement).get(echeance.type_echeance)
+            if attendue is None:
+                issues[EcheanceAbonnement.RESULTAT_OBSOLETE].append(echeance.id)
+            elif attendue != echeance.date_echeance:
+                # Date modifiée sans passer par save() (mise à jour ensembliste) : on replanifie
+                echeance.date_echeance = attendue
+                a_replanifier.append(echeance)
+            elif echeance.type_echeance == EcheanceAbonnement.TYPE_RAPPEL:
+                if abonnement.date_fin > maintenant:
+                    rappels.append(echeance)
+                else:
+                    # Rappel en retard sur la fin elle-même (planificateur arrêté) : plus rien à annoncer
+                    issues[EcheanceAbonnement.RESULTAT_OBSOLETE].append(echeance.id)
+            elif not pack_gratuit:
+                # Laissée en attente : sans pack gratuit, l'utilisateur n'aurait plus aucun abonnement
+                logger.error(f"Pack gratuit non trouvé, échéance {echeance.id} reportée")
+            elif abonnement.pack_id != pack_gratuit.id:
+                fins.append(echeance)
+            else:
+                issues[EcheanceAbonnement.RESULTAT_OBSOLETE].append(echeance.id)
+        
+        # Fins d'essai et expirations : une transaction pour le lot
+        if fins:
+            with transaction.atomic():
+                resultats['expires'] = ExpirationService.expirer_abonnements(
+                    [(e.abonnement_id, e.abonnement.utilisateur_id) for e in fins], pack_gratuit, maintenant
+                )
+                EcheanceAbonnement.objects.filter(
+                    abonnement_id__in=[e.abonnement_id for e in fins], date_traitement__isnull=True
+                ).update(date_traitement=maintenant, resultat=EcheanceAbonnement.RESULTAT_TRAITE)
+        
+        # Rappels : envoyés hors transaction (un arrêt entre l'envoi et l'écriture peut entraîner un second envoi)
+        en_erreur = []
+        for echeance in rappels:
+            try:
+                PlanificateurService._envoyer_rappel(echeance.abonnement)
+                issues[EcheanceAbonnement.RESULTAT_TRAITE].append(echeance.id)
+                resultats['rappels'] += 1
+            except Exception as e:
+                logger.error(f"Rappel d'échéance {echeance.id} non envoyé: {e}")
+                en_erreur.append(echeance.id)
+        
+        for resultat, ids in issues.items():
+            if ids:
+                EcheanceAbonnement.objects.filter(id__in=ids).update(date_traitement=maintenant, resultat=resultat)
+        if a_replanifier:
+            EcheanceAbonnement.objects.bulk_update(a_replanifier, ['date_echeance'])
+        if en_erreur:
+            # Nouvel essai au prochain passage, trois tentatives au plus
+            EcheanceAbonnement.objects.filter(id__in=en_erreur).update(tentatives=models.F('tentatives') + 1)
+            EcheanceAbonnement.objects.filter(id__in=en_erreur, tentatives__gte=3).update(
+                date_traitement=maintenant, resultat=EcheanceAbonnement.RESULTAT_ERREUR
+            )
+        
+        resultats['replanifiees'] = len(a_replanifier)
+        resultats['obsoletes'] = len(issues[EcheanceAbonnement.RESULTAT_OBSOLETE])
+        resultats['erreurs'] = len(en_erreur)
+        resultats['traitees'] = (
+            len(fins) + len(rappels) + resultats['replanifiees'] + resultats['obsoletes']
+        )
+        return resultats
+
+
+class PackDecouverteService:
+    """Service pour créer automatiquement un Pack Découverte pour les nouveaux utilisateurs sans parrain"""
+    
+    @staticmethod
+    def creer_pack_decouverte_pour_utilisateur(utilisateur):
+        """Crée un Pack Découverte pour un utilisateur sans parrain"""
+        try:
+            from .models import PackAbonnement, Abonnement
+            from django.utils import timezone
+            from datetime import timedelta
+            
+            # Vérifier que l'utilisateur n'a pas déjà un abonnement actif (la contrainte d'unicité couvre les accès concurrents)
+            if Abonnement.objects.filter(utilisateur=utilisateur, actif=True).exists():
+                return {
+                    'success': False, 
+                    'error': 'Utilisateur a déjà un abonnement actif'
                 }
             
             # Trouver ou créer le Pack Découverte
@@ -1589,156 +2760,762 @@ class PackDecouverteService:
 
 class StatistiquesService:
     """Service pour les statistiques d'abonnement"""
+    PREFIXE = 'abonnements:statistiques'
+    
+    @staticmethod
+    def _duree_max():
+        return getattr(settings, 'ABONNEMENTS_CACHE_STATISTIQUES_SECONDES', 300)
+    
+    @staticmethod
+    def _get_cle(utilisateur_id, debut_mois):
+        """
+        Clé de cache des statistiques : elle reprend le jeton de version utilisateur des droits,
+        remplacé à chaque écriture sur ses abonnements ou ses paiements (None si le cache est indisponible)
+        """
+        try:
+            version_utilisateur, _ = CacheDroitsService._get_versions(utilisateur_id)
+            return f"{StatistiquesService.PREFIXE}:{utilisateur_id}:{version_utilisateur}:{debut_mois:%Y-%m}"
+        except Exception as e:
+            logger.warning(f"Cache des statistiques indisponible: {e}")
+            return None
+    
+    @staticmethod
+    def _calculer_statistiques(utilisateur_id, debut_mois):
+        """Agrégats abonnements et paiements : une requête conditionnelle par table, plus les packs populaires"""
+        compteurs = Abonnement.objects.filter(utilisateur_id=utilisateur_id).aggregate(
+            total_abonnements=models.Count('id'),
+            abonnements_actifs=models.Count('id', filter=models.Q(actif=True, statut='actif')),
+            abonnements_essai=models.Count('id', filter=models.Q(est_essai_gratuit=True)),
+            conversions=models.Count('id', filter=models.Q(est_essai_gratuit=True, statut='actif')),
+            abonnement_en_cours=models.Count('id', filter=models.Q(actif=True)),
+            prochaine_fin=models.Min('date_fin', filter=models.Q(actif=True))
+        )
+        
+        # Revenus du mois (intervalle sur date_creation pour rester indexable)
+        debut_mois_suivant = (debut_mois + timedelta(days=32)).replace(day=1)
+        revenus_mensuels = PaiementWave.objects.filter(
+            abonnement__utilisateur_id=utilisateur_id
+        ).aggregate(
+            total=models.Sum(
+                'montant',
+                filter=models.Q(statut='reussi', date_creation__gte=debut_mois, date_creation__lt=debut_mois_suivant)
+            )
+        )['total'] or 0
+        
+        # Packs populaires
+        packs_populaires = Abonnement.objects.filter(
+            utilisateur_id=utilisateur_id
+        ).values('pack__nom').annotate(
+            count=models.Count('id')
+        ).order_by('-count')[:5]
+        
+        # Taux de conversion (essai vers payant)
+        total_essais = compteurs['abonnements_essai']
+        taux_conversion = (compteurs['conversions'] / total_essais * 100) if total_essais > 0 else 0
+        
+        return {
+            'total_abonnements': compteurs['total_abonnements'],
+            'abonnements_actifs': compteurs['abonnements_actifs'],
+            'abonnements_essai': total_essais,
+            'revenus_mensuels': revenus_mensuels,
+            'taux_conversion': round(taux_conversion, 2),
+            'packs_populaires': [
+                {'nom': pack['pack__nom'], 'count': pack['count']}
+                for pack in packs_populaires
+            ],
+            'abonnement_en_cours': compteurs['abonnement_en_cours'] > 0,
+            'prochaine_fin': compteurs['prochaine_fin']
+        }
     
     @staticmethod
     def get_statistiques_utilisateur(utilisateur):
-        """Récupère les statistiques d'un utilisateur"""
+        """Récupère les statistiques d'un utilisateur (agrégats mis en cache jusqu'à sa prochaine écriture)"""
         try:
-            # Statistiques de base
-            total_abonnements = Abonnement.objects.filter(utilisateur=utilisateur).count()
-            abonnements_actifs = Abonnement.objects.filter(
-                utilisateur=utilisateur, 
-                actif=True, 
-                statut='actif'
-            ).count()
-            abonnements_essai = Abonnement.objects.filter(
-                utilisateur=utilisateur, 
-                est_essai_gratuit=True
-            ).count()
-            
-            # Revenus du mois
-            mois_courant = timezone.now().month
-            annee_courante = timezone.now().year
-            revenus_mensuels = PaiementWave.objects.filter(
-                abonnement__utilisateur=utilisateur,
-                statut='reussi',
-                date_creation__month=mois_courant,
-                date_creation__year=annee_courante
-            ).aggregate(total=models.Sum('montant'))['total'] or 0
+            from django.core.cache import cache
             
-            # Taux de conversion (essai vers payant)
-            total_essais = Abonnement.objects.filter(
-                utilisateur=utilisateur, 
-                est_essai_gratuit=True
-            ).count()
-            conversions = Abonnement.objects.filter(
-                utilisateur=utilisateur,
-                est_essai_gratuit=True,
-                statut='actif'
-            ).count()
-            taux_conversion = (conversions / total_essais * 100) if total_essais > 0 else 0
-            
-            # Packs populaires
-            packs_populaires = PackAbonnement.objects.filter(
-                abonnement__utilisateur=utilisateur
-            ).annotate(
-                count=models.Count('abonnement')
-            ).order_by('-count')[:5]
-            
-            # Récupérer l'utilisation mensuelle de l'abonnement actuel
-            utilisation_mensuelle = None
-            abonnement_actuel = Abonnement.objects.filter(
-                utilisateur=utilisateur, 
-                actif=True
-            ).first()
+            maintenant = timezone.now()
+            debut_mois = maintenant.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            cle = StatistiquesService._get_cle(utilisateur.id, debut_mois)
             
-            if abonnement_actuel:
-                utilisation_mensuelle = StatistiquesService.get_utilisation_mensuelle(abonnement_actuel)
-            
-            stats = {
-                'total_abonnements': total_abonnements,
-                'abonnements_actifs': abonnements_actifs,
-                'abonnements_essai': abonnements_essai,
-                'revenus_mensuels': revenus_mensuels,
-                'taux_conversion': round(taux_conversion, 2),
-                'packs_populaires': [
-                    {'nom': pack.nom, 'count': pack.count} 
-                    for pack in packs_populaires
-                ],
-                'utilisation_mensuelle': utilisation_mensuelle
-            }
+            stats = None
+            if cle is not None:
+                try:
+                    stats = cache.get(cle)
+                except Exception as e:
+                    logger.warning(f"Cache des statistiques indisponible: {e}")
+                # Une fin d'abonnement passée sans écriture (expiration en attente) périme l'entrée
+                if stats and stats['prochaine_fin'] and stats['prochaine_fin'] < maintenant:
+                    stats = None
+            
+            if stats is None:
+                stats = StatistiquesService._calculer_statistiques(utilisateur.id, debut_mois)
+                if cle is not None:
+                    try:
+                        cache.set(cle, stats, timeout=StatistiquesService._duree_max())
+                    except Exception as e:
+                        logger.warning(f"Cache des statistiques indisponible: {e}")
+            
+            # L'utilisation du mois évolue à chaque leçon : elle n'est jamais mise en cache
+            statistiques = dict(stats)
+            statistiques.pop('prochaine_fin')
+            abonnement_en_cours = statistiques.pop('abonnement_en_cours')
+            statistiques['utilisation_mensuelle'] = (
+                StatistiquesService.get_utilisation_utilisateur(utilisateur.id) if abonnement_en_cours else None
+            )
             
-            return {'success': True, 'statistiques': stats}
+            return {'success': True, 'statistiques': statistiques}
             
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
     @staticmethod
     def get_utilisation_mensuelle(abonnement):
-        """Récupère l'utilisation mensuelle d'un abonnement depuis l'app progression"""
+        """Récupère l'utilisation mensuelle d'un abonnement depuis les compteurs mensuels"""
+        return StatistiquesService.get_utilisation_utilisateur(abonnement.utilisateur_id)
+    
+    @staticmethod
+    def get_utilisation_utilisateur(utilisateur_id):
+        """Utilisation du mois courant : compteurs mensuels et temps d'étude, en deux requêtes"""
+        maintenant = timezone.now()
+        mois_reference = maintenant.month
+        annee_reference = maintenant.year
         try:
-            from progression.models import ProgressionContenu, ProgressionChapitre
-            from quiz.models import TentativeQuiz
-            
-            utilisateur = abonnement.utilisateur
-            
-            # Utiliser le mois et l'année actuels
-            mois_reference = timezone.now().month
-            annee_reference = timezone.now().year
-            
-            print(f"🔍 Utilisation du mois actuel: {mois_reference}/{annee_reference} pour {utilisateur.email}")
-            
-            print(f"🔍 Mois de référence détecté: {mois_reference}/{annee_reference} pour {utilisateur.email}")
-            
-            # Cours suivis (contenus lus ce mois)
-            cours_suivis = ProgressionContenu.objects.filter(
-                etudiant=utilisateur,
-                lu=True,
-                date_completion__month=mois_reference,
-                date_completion__year=annee_reference
-            ).count()
+            from progression.models import ProgressionContenu
             
-            # Quiz réalisés ce mois
-            quiz_realises = TentativeQuiz.objects.filter(
-                etudiant=utilisateur,
-                date_debut__month=mois_reference,
-                date_debut__year=annee_reference
-            ).count()
+            compteurs = UsageMensuelleService.get_compteurs(utilisateur_id)
             
-            # Temps d'étude ce mois (en secondes)
+            # Temps d'étude ce mois (en secondes) - filtre par intervalle pour rester indexable
+            debut_mois = maintenant.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
             temps_etude_secondes = ProgressionContenu.objects.filter(
-                etudiant=utilisateur,
-                date_completion__month=mois_reference,
-                date_completion__year=annee_reference
+                etudiant_id=utilisateur_id,
+                date_completion__gte=debut_mois
             ).aggregate(
                 total_temps=models.Sum('temps_lecture')
             )['total_temps'] or 0
             
-            # Convertir en heures pour l'affichage (optionnel)
-            temps_etude_heures = round(temps_etude_secondes / 3600, 1)
-            
-            print(f"📊 Statistiques calculées pour {mois_reference}/{annee_reference}:")
-            print(f"   - Cours suivis: {cours_suivis}")
-            print(f"   - Quiz réalisés: {quiz_realises}")
-            print(f"   - Temps d'étude: {temps_etude_heures}h ({temps_etude_secondes}s)")
-            
             return {
-                'cours_suivis': cours_suivis,
-                'quiz_realises': quiz_realises,
+                'cours_suivis': compteurs[UsageMensuelle.RESSOURCE_COURS],
+                'quiz_realises': compteurs[UsageMensuelle.RESSOURCE_QUIZ],
                 'temps_etude_secondes': temps_etude_secondes,
                 'mois_reference': mois_reference,
                 'annee_reference': annee_reference
             }
                 
         except Exception as e:
-            print(f"❌ Erreur lors du calcul de l'utilisation mensuelle: {e}")
+            logger.error(f"Erreur lors du calcul de l'utilisation mensuelle: {e}")
             return {
                 'cours_suivis': 0,
                 'quiz_realises': 0,
                 'temps_etude_secondes': 0,
-                'mois_reference': timezone.now().month,
-                'annee_reference': timezone.now().year
+                'mois_reference': mois_reference,
+                'annee_reference': annee_reference
             }
 
 
+class IndexIntervallesAbonnements:
+    """
+    Index en mémoire des intervalles d'abonnement : tableaux parallèles triés par jour de début
+    (jour de début, jour de fin exclu, type de pack, montant journalier, renouvelé ou non).
+    
+    Les jours sont des ordinaux (date.toordinal()) dans le fuseau du projet. Un abonnement remplacé
+    s'arrête au début de l'abonnement suivant de l'utilisateur ; un abonnement illimité encore actif
+    reste ouvert (FIN_OUVERTE).
+    """
+    FIN_OUVERTE = date.max.toordinal() + 1
+    
+    def __init__(self):
+        self.debuts = array('l')
+        self.fins = array('l')
+        self.types = array('B')
+        self.montants_journaliers = array('d')
+        self.renouveles = array('B')
+        self.types_pack = []
+        self._index_types = {}
+    
+    def __len__(self):
+        return len(self.debuts)
+    
+    @staticmethod
+    def _jour(valeur):
+        if valeur is None:
+            return None
+        if timezone.is_aware(valeur):
+            valeur = timezone.localtime(valeur)
+        return valeur.toordinal()
+    
+    def ajouter(self, date_debut, date_fin, date_suivant, type_pack, montant_paye, actif):
+        """Ajoute un abonnement ; les appels doivent suivre l'ordre des dates de début"""
+        jour_debut = self._jour(date_debut)
+        jour_fin_prevue = self._jour(date_fin)
+        jour_suivant = self._jour(date_suivant)
+        
+        jour_fin = jour_fin_prevue
+        if jour_suivant is not None and (jour_fin is None or jour_suivant < jour_fin):
+            jour_fin = jour_suivant
+        if jour_fin is None:
+            if not actif:
+                return  # Illimité désactivé sans successeur : fin inconnue
+            jour_fin = self.FIN_OUVERTE
+        if jour_fin <= jour_debut:
+            return
+        
+        index_type = self._index_types.get(type_pack)
+        if index_type is None:
+            index_type = self._index_types[type_pack] = len(self.types_pack)
+            self.types_pack.append(type_pack)
+        
+        # Le montant payé est réparti sur la durée prévue de l'abonnement
+        duree_prevue = (jour_fin_prevue - jour_debut) if jour_fin_prevue is not None else 0
+        montant = float(montant_paye or 0)
+        
+        self.debuts.append(jour_debut)
+        self.fins.append(jour_fin)
+        self.types.append(index_type)
+        self.montants_journaliers.append(montant / duree_prevue if montant > 0 and duree_prevue > 0 else 0.0)
+        self.renouveles.append(1 if jour_suivant is not None and jour_suivant <= jour_fin + 1 else 0)
+    
+    @classmethod
+    def construire(cls, lignes):
+        """Construit l'index à partir de tuples (date_debut, date_fin, date_suivant, type_pack, montant_paye, actif)"""
+        index = cls()
+        for ligne in lignes:
+            index.ajouter(*ligne)
+        return index
+    
+    @classmethod
+    def depuis_base(cls, taille_lot=20000):
+        """Construit l'index en une requête lue en flux (date de début de l'abonnement suivant par fonction de fenêtre)"""
+        from django.db.models.functions import Lead
+        
+        lignes = Abonnement.objects.annotate(
+            date_suivant=models.Window(
+                Lead('date_debut'),
+                partition_by=[models.F('utilisateur_id')],
+                order_by=[models.F('date_debut').asc(), models.F('id').asc()]
+            )
+        ).order_by('date_debut', 'id').values_list(
+            'date_debut', 'date_fin', 'date_suivant', 'pack__type_pack', 'montant_paye', 'actif'
+        )
+        return cls.construire(lignes.iterator(chunk_size=taille_lot))
+    
+    def balayer(self, premier_jour, dernier_jour):
+        """
+        Séries quotidiennes sur [premier_jour, dernier_jour] (dates incluses), en un passage linéaire :
+        chaque intervalle ajoute ses bornes à des tableaux de différences, puis une somme cumulée
+        donne la valeur de chaque jour. Les intervalles qui commencent après la période sont écartés par bisection.
+        """
+        origine = premier_jour.toordinal()
+        borne = dernier_jour.toordinal() + 1
+        nombre_jours = borne - origine
+        if nombre_jours <= 0:
+            return []
+        
+        actifs = [0] * (nombre_jours + 1)
+        payants = [0] * (nombre_jours + 1)
+        nouveaux = [0] * nombre_jours
+        desabonnements = [0] * nombre_jours
+        revenus = [[0.0] * (nombre_jours + 1) for _ in self.types_pack]
+        
+        debuts, fins, types = self.debuts, self.fins, self.types
+        montants, renouveles = self.montants_journaliers, self.renouveles
+        for i in range(bisect_left(debuts, borne)):
+            fin = fins[i]
+            if fin < origine:
+                continue  # Un abonnement qui finit le premier jour compte encore son désabonnement
+            debut = debuts[i]
+            a = debut - origine if debut > origine else 0
+            b = fin - origine if fin < borne else nombre_jours
+            actifs[a] += 1
+            actifs[b] -= 1
+            montant = montants[i]
+            if montant:
+                payants[a] += 1
+                payants[b] -= 1
+                serie = revenus[types[i]]
+                serie[a] += montant
+                serie[b] -= montant
+                if debut >= origine:
+                    nouveaux[a] += 1
+                if fin < borne and not renouveles[i]:
+                    desabonnements[b] += 1
+        
+        jours = []
+        actifs_jour = payants_jour = 0
+        revenus_jour = [0.0] * len(self.types_pack)
+        payants_veille = None
+        for jour in range(nombre_jours):
+            actifs_jour += actifs[jour]
+            payants_jour += payants[jour]
+            for t, serie in enumerate(revenus):
+                revenus_jour[t] += serie[jour]
+            revenu_journalier = sum(revenus_jour)
+            base_churn = payants_veille if payants_veille is not None else payants_jour
+            jours.append({
+                'date': date.fromordinal(origine + jour),
+                'actifs': actifs_jour,
+                'payants': payants_jour,
+                'nouveaux_payants': nouveaux[jour],
+                'desabonnements': desabonnements[jour],
+                'taux_desabonnement': round(desabonnements[jour] / base_churn * 100, 3) if base_churn else 0.0,
+                'revenu_journalier': round(revenu_journalier, 2),
+                'mrr': round(revenu_journalier * 30, 2),
+                'mrr_par_type': {
+                    type_pack: round(revenus_jour[t] * 30, 2)
+                    for t, type_pack in enumerate(self.types_pack) if revenus_jour[t] > 0.005
+                },
+            })
+            payants_veille = payants_jour
+        return jours
+
+
+class RapportAbonnesService:
+    """
+    Rapports quotidiens d'abonnés (actifs, payants, désabonnements, revenus / MRR par type de pack)
+    calculés par balayage de l'index d'intervalles, gardé en mémoire du processus
+    ABONNEMENTS_INDEX_INTERVALLES_SECONDES (600 par défaut) avant reconstruction.
+    """
+    _index = None
+    _construit_a = 0.0
+    _verrou = threading.Lock()
+    
+    @staticmethod
+    def _duree_max():
+        return getattr(settings, 'ABONNEMENTS_INDEX_INTERVALLES_SECONDES', 600)
+    
+    @classmethod
+    def get_index(cls, reconstruire=False):
+        with cls._verrou:
+            if reconstruire or cls._index is None or time.monotonic() - cls._construit_a > cls._duree_max():
+                cls._index = IndexIntervallesAbonnements.depuis_base()
+                cls._construit_a = time.monotonic()
+            return cls._index
+    
+    @classmethod
+    def get_series(cls, premier_jour, dernier_jour, reconstruire=False):
+        """Séries quotidiennes et totaux de la période"""
+        jours = cls.get_index(reconstruire).balayer(premier_jour, dernier_jour)
+        return {
+            'debut': premier_jour,
+            'fin': dernier_jour,
+            'jours': jours,
+            'totaux': {
+                'nouveaux_payants': sum(jour['nouveaux_payants'] for jour in jours),
+                'desabonnements': sum(jour['desabonnements'] for jour in jours),
+                'revenus': round(sum(jour['revenu_journalier'] for jour in jours), 2),
+                'payants_debut': jours[0]['payants'] if jours else 0,
+                'payants_fin': jours[-1]['payants'] if jours else 0,
+            },
+        }
+
+
+class RevenusJournaliersService:
+    """
+    Revenus et paiements servis depuis la table RevenuJournalier (cumul par jour, pack, statut,
+    famille / individuel et payeur) plutôt qu'en relisant PaiementWave.
+    
+    Comme sur le chemin de paiement, pack_id désigne un PackFamilial ou un PackAbonnement selon le type
+    enregistré sur le paiement à son initiation (PaiementWave.pack_familial) : le pack est identifié par
+    son id et sa nature (pack_familial).
+    
+    Chaque calcul réécrit des jours entiers dans une transaction (suppression puis insertion) : il peut
+    être relancé sur n'importe quelle période sans double comptage. Il recalcule aussi les jours des
+    paiements modifiés depuis le calcul précédent (repère : date_calcul la plus récente, moins
+    ABONNEMENTS_REVENUS_MARGE_SECONDES pour les transactions encore en cours à ce moment-là).
+    Les paiements supprimés ne laissent pas de trace : le calcul de nuit reprend les derniers jours.
+    """
+    VERROU = 'revenus_journaliers'
+    PREFIXE_FAMILLE = 'WAVE_FAMILLE_'
+    
+    @staticmethod
+    def _marge():
+        return timedelta(seconds=getattr(settings, 'ABONNEMENTS_REVENUS_MARGE_SECONDES', 600))
+    
+    @staticmethod
+    def _debut_jour(jour):
+        """Minuit (fuseau du projet) du jour donné"""
+        return timezone.make_aware(datetime.combine(jour, datetime.min.time()))
+    
+    @staticmethod
+    def _periodes(jours):
+        """Regroupe des jours en périodes contiguës [(premier, dernier), ...]"""
+        periodes = []
+        for jour in sorted(jours):
+            if periodes and jour == periodes[-1][1] + timedelta(days=1):
+                periodes[-1][1] = jour
+            else:
+                periodes.append([jour, jour])
+        return [tuple(periode) for periode in periodes]
+    
+    @staticmethod
+    def _agreger(premier_jour, dernier_jour, date_calcul):
+        """Cumuls d'une période contiguë : un GROUP BY sur PaiementWave (intervalle indexable sur date_creation)"""
+        from django.db.models.functions import Coalesce, TruncDate
+        
+        lignes = PaiementWave.objects.filter(
+            date_creation__gte=RevenusJournaliersService._debut_jour(premier_jour),
+            date_creation__lt=RevenusJournaliersService._debut_jour(dernier_jour + timedelta(days=1))
+        ).annotate(
+            jour=TruncDate('date_creation'),
+            pack_paye=Coalesce('pack_id', 'abonnement__pack_id', output_field=models.IntegerField()),
+            paye_par_parent=models.ExpressionWrapper(
+                models.Q(parent_id__isnull=False), output_field=models.BooleanField()
+            ),
+            paiement_famille=models.ExpressionWrapper(
+                models.Q(transaction_id__startswith=RevenusJournaliersService.PREFIXE_FAMILLE),
+                output_field=models.BooleanField()
+            )
+        ).values('jour', 'pack_paye', 'pack_familial', 'statut', 'paye_par_parent', 'paiement_famille').annotate(
+            nombre=models.Count('id'),
+            montant=models.Sum('montant')
+        ).order_by()
+        
+        cumuls = {}
+        for ligne in lignes:
+            pack_id = ligne['pack_paye']
+            pack_familial = ligne['pack_familial']
+            if pack_familial:
+                famille = True
+            else:
+                pack = ReferentielService.get_pack(pack_id) if pack_id is not None else None
+                famille = ligne['paiement_famille'] or (pack is not None and pack.type_pack == 'famille')
+            cle = (ligne['jour'], pack_id, pack_familial, ligne['statut'], famille, ligne['paye_par_parent'])
+            cumul = cumuls.get(cle)
+            if cumul is None:
+                cumul = cumuls[cle] = RevenuJournalier(
+                    jour=ligne['jour'],
+                    pack_id=pack_id,
+                    pack_familial=pack_familial,
+                    statut=ligne['statut'],
+                    famille=famille,
+                    paye_par_parent=ligne['paye_par_parent'],
+                    date_calcul=date_calcul
+                )
+            cumul.nombre += ligne['nombre']
+            cumul.montant += ligne['montant'] or 0
+        return list(cumuls.values())
+    
+    @staticmethod
+    def calculer(premier_jour=None, dernier_jour=None):
+        """
+        Réécrit les jours de [premier_jour, dernier_jour] (aucun si non fournis) et ceux des paiements
+        modifiés depuis le calcul précédent (tout l'historique lors du premier calcul).
+        Les calculs sont sérialisés par un verrou de ligne.
+        
+        Returns:
+            dict: jours recalculés et lignes écrites
+        """
+        from django.db.models.functions import TruncDate
+        
+        VerrouPlanificateur.objects.get_or_create(nom=RevenusJournaliersService.VERROU)
+        with transaction.atomic():
+            VerrouPlanificateur.objects.select_for_update().get(nom=RevenusJournaliersService.VERROU)
+            date_calcul = timezone.now()
+            
+            jours = set()
+            if premier_jour is not None and dernier_jour is not None:
+                jours.update(premier_jour + timedelta(days=n) for n in range((dernier_jour - premier_jour).days + 1))
+            
+            repere = RevenuJournalier.objects.aggregate(repere=models.Max('date_calcul'))['repere']
+            modifies = PaiementWave.objects.all()
+            if repere is not None:
+                modifies = modifies.filter(date_mise_a_jour__gte=repere - RevenusJournaliersService._marge())
+            jours.update(
+                modifies.annotate(jour=TruncDate('date_creation')).values_list('jour', flat=True).distinct().order_by()
+            )
+            
+            lignes = 0
+            for premier, dernier in RevenusJournaliersService._periodes(jours):
+                cumuls = RevenusJournaliersService._agreger(premier, dernier, date_calcul)
+                RevenuJournalier.objects.filter(jour__gte=premier, jour__lte=dernier).delete()
+                RevenuJournalier.objects.bulk_create(cumuls, batch_size=1000)
+                lignes += len(cumuls)
+        
+        logger.info(f"Revenus journaliers : {len(jours)} jours recalculés, {lignes} lignes")
+        return {'jours': len(jours), 'lignes': lignes}
+    
+    @staticmethod
+    def get_revenus(premier_jour, dernier_jour):
+        """
+        Revenus d'une période depuis les cumuls quotidiens (au plus quelques lignes par jour), en trois
+        requêtes : totaux par statut, pack, famille et payeur, série quotidienne des paiements réussis
+        et date du dernier calcul
+        """
+        from decimal import Decimal
+        
+        cumuls = RevenuJournalier.objects.filter(jour__gte=premier_jour, jour__lte=dernier_jour)
+        groupes = cumuls.values('statut', 'pack_id', 'pack_familial', 'famille', 'paye_par_parent').annotate(
+            total_nombre=models.Sum('nombre'),
+            total_montant=models.Sum('montant')
+        ).order_by()
+        serie = {
+            ligne['jour']: ligne
+            for ligne in cumuls.filter(statut='reussi').values('jour').annotate(
+                total_nombre=models.Sum('nombre'),
+                total_montant=models.Sum('montant')
+            ).order_by()
+        }
+        
+        def vide():
+            return {'nombre': 0, 'montant': Decimal('0')}
+        
+        def ajouter(cumul, ligne):
+            cumul['nombre'] += ligne['total_nombre']
+            cumul['montant'] += ligne['total_montant']
+        
+        par_statut = {code: vide() for code, _ in PaiementWave.STATUT_CHOICES}
+        par_pack, famille, individuel, paye_par_parent = {}, vide(), vide(), vide()
+        for ligne in groupes:
+            ajouter(par_statut.setdefault(ligne['statut'], vide()), ligne)
+            if ligne['statut'] != 'reussi':
+                continue
+            ajouter(par_pack.setdefault((ligne['pack_id'], ligne['pack_familial']), vide()), ligne)
+            ajouter(famille if ligne['famille'] else individuel, ligne)
+            if ligne['paye_par_parent']:
+                ajouter(paye_par_parent, ligne)
+        
+        packs = []
+        for (pack_id, pack_familial), cumul in sorted(par_pack.items(), key=lambda item: item[1]['montant'], reverse=True):
+            if pack_id is None:
+                pack = None
+            elif pack_familial:
+                pack = ReferentielService.get_pack_familial(pack_id)
+            else:
+                pack = ReferentielService.get_pack(pack_id)
+            packs.append({'pack_id': pack_id, 'pack_familial': pack_familial, 'nom': pack.nom if pack else None, **cumul})
+        
+        jours = []
+        for n in range((dernier_jour - premier_jour).days + 1):
+            jour = premier_jour + timedelta(days=n)
+            ligne = serie.get(jour)
+            jours.append({
+                'jour': jour,
+                'nombre': ligne['total_nombre'] if ligne else 0,
+                'montant': ligne['total_montant'] if ligne else Decimal('0'),
+            })
+        
+        return {
+            'debut': premier_jour,
+            'fin': dernier_jour,
+            'a_jour_au': RevenuJournalier.objects.aggregate(repere=models.Max('date_calcul'))['repere'],
+            'revenus': par_statut['reussi']['montant'],
+            'paiements_reussis': par_statut['reussi']['nombre'],
+            'par_statut': par_statut,
+            'par_pack': packs,
+            'famille': famille,
+            'individuel': individuel,
+            'paye_par_parent': paye_par_parent,
+            'jours': jours,
+        }
+
+
+class EntonnoirConversionService:
+    """
+    Entonnoir de conversion de la plateforme : inscription → essai (Pack Découverte, essai gratuit)
+    → premier paiement → renouvellement, par semaine d'inscription et par source (directe, parrainage,
+    code partenaire).
+    
+    La construction parcourt les utilisateurs par tranches d'identifiants : pour chaque tranche, une
+    requête par table (Utilisateur, Abonnement regroupé par utilisateur, PaiementWave réussis) donne les
+    jalons de chaque utilisateur, cumulés aussitôt dans leur cohorte. Seuls les cumuls par cohorte sont
+    gardés en mémoire puis écrits dans CohorteConversion, lue telle quelle par get_entonnoir.
+    """
+    
+    @staticmethod
+    def _semaine(instant):
+        jour = timezone.localtime(instant).date()
+        return jour - timedelta(days=jour.weekday())
+    
+    @staticmethod
+    def _jalons_abonnements(premier_id, dernier_id):
+        """Premier essai, premier abonnement payant, premier renouvellement et parrainage, par utilisateur"""
+        lignes = Abonnement.objects.filter(
+            utilisateur_id__gte=premier_id, utilisateur_id__lte=dernier_id
+        ).values('utilisateur_id').annotate(
+            essai=models.Min('date_debut', filter=models.Q(est_essai_gratuit=True)),
+            payant=models.Min('date_debut', filter=models.Q(montant_paye__gt=0)),
+            renouvellement=models.Min('date_renouvellement', filter=models.Q(montant_paye__gt=0)),
+            parrainages=models.Count('id', filter=models.Q(source_parrainage=True))
+        ).order_by()
+        return {ligne['utilisateur_id']: ligne for ligne in lignes}
+    
+    @staticmethod
+    def _paiements(premier_id, dernier_id):
+        """Dates des deux premiers paiements réussis de chaque utilisateur"""
+        from django.db.models.functions import Coalesce
+        
+        lignes = PaiementWave.objects.filter(
+            models.Q(utilisateur_id__gte=premier_id, utilisateur_id__lte=dernier_id)
+            | models.Q(
+                utilisateur_id__isnull=True,
+                abonnement__utilisateur_id__gte=premier_id,
+                abonnement__utilisateur_id__lte=dernier_id
+            ),
+            statut='reussi',
+            montant__gt=0
+        ).annotate(
+            payeur=Coalesce('utilisateur_id', 'abonnement__utilisateur_id', output_field=models.IntegerField())
+        ).order_by('payeur', 'date_creation').values_list('payeur', 'date_creation')
+        
+        paiements = {}
+        for utilisateur_id, date_paiement in lignes:
+            dates = paiements.setdefault(utilisateur_id, [])
+            if len(dates) < 2:
+                dates.append(date_paiement)
+        return paiements
+    
+    @staticmethod
+    def construire(taille_lot=10000):
+        """
+        Reconstruit toutes les cohortes (remplacement complet dans une transaction : relançable à volonté)
+        
+        Returns:
+            dict: utilisateurs parcourus, cohortes écrites, durée en secondes
+        """
+        debut = time.perf_counter()
+        date_calcul = timezone.now()
+        codes_partenaires = set(
+            Utilisateur.objects.filter(role='partenaire', code_parrainage__isnull=False)
+            .values_list('code_parrainage', flat=True)
+        )
+        cohortes = {}
+        parcourus = 0
+        dernier_id = 0
+        
+        while True:
+            utilisateurs = list(
+                Utilisateur.objects.filter(id__gt=dernier_id).order_by('id')
+                .values_list('id', 'date_joined', 'code_parrain_utilise')[:taille_lot]
+            )
+            if not utilisateurs:
+                break
+            premier_id, dernier_id = utilisateurs[0][0], utilisateurs[-1][0]
+            abonnements = EntonnoirConversionService._jalons_abonnements(premier_id, dernier_id)
+            paiements = EntonnoirConversionService._paiements(premier_id, dernier_id)
+            
+            for utilisateur_id, date_inscription, code_utilise in utilisateurs:
+                jalons = abonnements.get(utilisateur_id) or {}
+                dates_paiement = paiements.get(utilisateur_id, [])
+                
+                if code_utilise and code_utilise in codes_partenaires:
+                    cle_source = (CohorteConversion.SOURCE_PARTENAIRE, code_utilise)
+                elif code_utilise or jalons.get('parrainages'):
+                    cle_source = (CohorteConversion.SOURCE_PARRAINAGE, '')
+                else:
+                    cle_source = (CohorteConversion.SOURCE_DIRECT, '')
+                cle = (EntonnoirConversionService._semaine(date_inscription),) + cle_source
+                cohorte = cohortes.get(cle)
+                if cohorte is None:
+                    cohorte = cohortes[cle] = CohorteConversion(
+                        semaine=cle[0], source=cle[1], code_partenaire=cle[2], date_calcul=date_calcul
+                    )
+                
+                cohorte.inscrits += 1
+                essai = jalons.get('essai')
+                if essai:
+                    cohorte.essais += 1
+                
+                # Premier paiement : paiement Wave réussi, sinon abonnement payant (paiements antérieurs à Wave)
+                candidats = [date for date in (dates_paiement[:1] + [jalons.get('payant')]) if date]
+                if not candidats:
+                    continue
+                premier_paiement = min(candidats)
+                cohorte.payants += 1
+                delai = max((premier_paiement - date_inscription).total_seconds(), 0)
+                cohorte.secondes_avant_paiement += int(delai)
+                if delai <= 30 * 86400:
+                    cohorte.payants_30_jours += 1
+                if essai and essai <= premier_paiement:
+                    cohorte.payants_apres_essai += 1
+                if len(dates_paiement) > 1 or jalons.get('renouvellement'):
+                    cohorte.renouveles += 1
+            
+            parcourus += len(utilisateurs)
+            if len(utilisateurs) < taille_lot:
+                break
+        
+        with transaction.atomic():
+            CohorteConversion.objects.all().delete()
+            CohorteConversion.objects.bulk_create(cohortes.values(), batch_size=1000)
+        
+        duree = time.perf_counter() - debut
+        logger.info(f"Entonnoir de conversion : {parcourus} utilisateurs, {len(cohortes)} cohortes en {duree:.1f}s")
+        return {'utilisateurs': parcourus, 'cohortes': len(cohortes), 'duree': round(duree, 2)}
+    
+    @staticmethod
+    def _taux(numerateur, denominateur):
+        return round(numerateur / denominateur * 100, 2) if denominateur else 0
+    
+    @staticmethod
+    def _etapes(cumul):
+        """Étapes de l'entonnoir et taux de passage d'un cumul de cohortes"""
+        taux = EntonnoirConversionService._taux
+        return {
+            **cumul,
+            'taux_essai': taux(cumul['essais'], cumul['inscrits']),
+            'taux_conversion': taux(cumul['payants'], cumul['inscrits']),
+            'taux_conversion_essai': taux(cumul['payants_apres_essai'], cumul['essais']),
+            'taux_conversion_30_jours': taux(cumul['payants_30_jours'], cumul['inscrits']),
+            'taux_renouvellement': taux(cumul['renouveles'], cumul['payants']),
+            'jours_avant_paiement': (
+                round(cumul['secondes_avant_paiement'] / cumul['payants'] / 86400, 1) if cumul['payants'] else None
+            ),
+        }
+    
+    @staticmethod
+    def get_entonnoir(premiere_semaine=None, derniere_semaine=None, source=None, code_partenaire=None):
+        """
+        Entonnoir des cohortes inscrites entre deux semaines (incluses), filtrable par source ou code
+        partenaire : une requête sur les cohortes pré-calculées, regroupées par semaine et par source
+        """
+        cohortes = CohorteConversion.objects.all()
+        if premiere_semaine:
+            cohortes = cohortes.filter(semaine__gte=premiere_semaine - timedelta(days=premiere_semaine.weekday()))
+        if derniere_semaine:
+            cohortes = cohortes.filter(semaine__lte=derniere_semaine)
+        if source:
+            cohortes = cohortes.filter(source=source)
+        if code_partenaire:
+            cohortes = cohortes.filter(code_partenaire=code_partenaire)
+        
+        compteurs = ('inscrits', 'essais', 'payants', 'payants_apres_essai', 'payants_30_jours', 'renouveles',
+                     'secondes_avant_paiement')
+        
+        def vide():
+            return dict.fromkeys(compteurs, 0)
+        
+        total, par_semaine, par_source = vide(), {}, {}
+        date_calcul = None
+        for cohorte in cohortes.order_by('semaine', 'source', 'code_partenaire'):
+            date_calcul = cohorte.date_calcul
+            cumuls = (
+                total,
+                par_semaine.setdefault(cohorte.semaine, vide()),
+                par_source.setdefault((cohorte.source, cohorte.code_partenaire), vide()),
+            )
+            for cumul in cumuls:
+                for compteur in compteurs:
+                    cumul[compteur] += getattr(cohorte, compteur)
+        
+        etapes = EntonnoirConversionService._etapes
+        return {
+            'date_calcul': date_calcul,
+            'total': etapes(total),
+            'par_semaine': [{'semaine': semaine, **etapes(cumul)} for semaine, cumul in par_semaine.items()],
+            'par_source': [
+                {'source': source_cohorte, 'code_partenaire': code, **etapes(cumul)}
+                for (source_cohorte, code), cumul in sorted(par_source.items(), key=lambda item: -item[1]['inscrits'])
+            ],
+        }
+
+
 class PackService:
-    """Service pour gérer les packs d'abonnement"""
+    """Service pour gérer les packs d'abonnement (servis depuis le référentiel en mémoire)"""
     
     @staticmethod
     def get_packs_actifs():
         """Récupère tous les packs actifs"""
         try:
-            packs = PackAbonnement.objects.filter(actif=True)
+            packs = [pack for pack in ReferentielService.get_packs() if pack.actif]
             return {'success': True, 'packs': packs}
         except Exception as e:
             return {'success': False, 'error': str(e)}
@@ -1747,7 +3524,7 @@ class PackService:
     def get_packs_speciaux():
         """Récupère les packs spéciaux"""
         try:
-            packs = PackAbonnement.objects.filter(actif=True, pack_special=True)
+            packs = [pack for pack in ReferentielService.get_packs() if pack.actif and pack.pack_special]
             return {'success': True, 'packs': packs}
         except Exception as e:
             return {'success': False, 'error': str(e)}
@@ -1756,7 +3533,7 @@ class PackService:
     def get_packs_avec_essai_gratuit():
         """Récupère les packs avec essai gratuit"""
         try:
-            packs = PackAbonnement.objects.filter(actif=True, offre_semaine_gratuite=True)
+            packs = [pack for pack in ReferentielService.get_packs() if pack.actif and pack.offre_semaine_gratuite]
             return {'success': True, 'packs': packs}
         except Exception as e:
             return {'success': False, 'error': str(e)}
@@ -1765,29 +3542,281 @@ class PackService:
     def get_packs_familiaux():
         """Récupère les packs familiaux"""
         try:
-            packs = PackFamilial.objects.filter(actif=True)
+            packs = [pack for pack in ReferentielService.get_packs_familiaux() if pack.actif]
             return {'success': True, 'packs': packs}
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
 
-class ParrainageService:
-    """Service pour gérer le système de parrainage"""
+class CataloguePacksService:
+    """
+    Catalogues de packs servis par les vues de liste (page d'accueil, paiements enfants, familles).
+    
+    Chaque catalogue est sérialisé une seule fois par version du référentiel, avec un ETag fort
+    calculé sur son contenu : il change dès qu'un PackAbonnement, PackFamilial ou PackPermissions
+    est modifié, et reste identique d'un worker à l'autre tant que le contenu ne change pas.
+    """
+    PACK_BIENVENUE = "Pack de Bienvenue Parrainage"
+    
+    # Catalogue de repli de UtilisateurViewSet.packs_speciaux quand aucun pack ne correspond
+    PACKS_INDIVIDUELS_PAR_DEFAUT = [
+        {
+            'id': 'pack-gratuit',
+            'nom': 'Gratuit',
+            'prix': 0,
+            'prix_reduit': 0,
+            'devise': 'FCFA',
+            'type_pack': 'standard',
+            'description': 'Accès limité aux fonctionnalités de base',
+            'duree_jours': 30,
+            'periode': 'mois',
+            'reduction_pourcentage': 0,
+            'offre_semaine_gratuite': False,
+            'conditions_speciales': None
+        },
+        {
+            'id': 'pack-standard',
+            'nom': 'Standard',
+            'prix': 500,
+            'prix_reduit': 500,
+            'devise': 'FCFA',
+            'type_pack': 'standard',
+            'description': 'Pack standard avec accès aux cours et quiz',
+            'duree_jours': 7,
+            'periode': 'semaine',
+            'reduction_pourcentage': 0,
+            'offre_semaine_gratuite': False,
+            'conditions_speciales': None
+        },
+        {
+            'id': 'pack-premium',
+            'nom': 'Premium',
+            'prix': 1500,
+            'prix_reduit': 1500,
+            'devise': 'FCFA',
+            'type_pack': 'standard',
+            'description': 'Pack premium avec toutes les fonctionnalités',
+            'duree_jours': 30,
+            'periode': 'mois',
+            'reduction_pourcentage': 0,
+            'offre_semaine_gratuite': False,
+            'conditions_speciales': None
+        }
+    ]
+    
+    # Exclusions de UtilisateurViewSet.packs_speciaux (packs gratuits, découverte et familiaux)
+    NOMS_EXCLUS_INDIVIDUELS = {
+        "Pack de Bienvenue Parrainage",
+        "Pack Découverte",
+        "Pack Famille 3 Enfants",
+        "Pack Famille 5+ Enfants",
+    }
+    DESCRIPTIONS_EXCLUES_INDIVIDUELS = (
+        "pack gratuit d'une semaine offert grâce au parrainage",
+        "pack de découverte gratuit",
+        "famille",
+    )
     
     @staticmethod
-    def creer_parrainage(filleul, code_parrainage):
-        """Crée une relation de parrainage"""
-        try:
-            # Vérifier que le code de parrainage existe
-            parrain = Utilisateur.objects.filter(code_parrainage=code_parrainage).first()
-            if not parrain:
-                return {'success': False, 'error': 'Code de parrainage invalide'}
-            
-            # Vérifier que l'utilisateur ne se parraine pas lui-même
-            if parrain == filleul:
-                return {'success': False, 'error': 'Vous ne pouvez pas vous parrainer vous-même'}
-            
-            # Vérifier qu'il n'y a pas déjà un parrainage
+    def _duree_max_age():
+        return getattr(settings, 'ABONNEMENTS_CATALOGUE_MAX_AGE_SECONDES', 60)
+    
+    @classmethod
+    def get_cache_control(cls):
+        """
+        Contenu identique pour tous les utilisateurs, mais servi aux seuls utilisateurs authentifiés :
+        réservé au cache du client (private), un CDN ne doit pas le resservir sans authentification
+        """
+        return f"private, max-age={cls._duree_max_age()}, must-revalidate"
+    
+    @staticmethod
+    def _serialiser_packs(packs):
+        from .serializers import PackAbonnementSerializer
+        return [dict(ligne) for ligne in PackAbonnementSerializer(packs, many=True).data]
+    
+    @classmethod
+    def _packs_paiement_enfant(cls, pack_special=None):
+        """Packs actifs hors pack de bienvenue et packs familiaux, filtrés sur pack_special si précisé"""
+        return [
+            pack for pack in ReferentielService.get_packs()
+            if pack.actif
+            and pack.nom != cls.PACK_BIENVENUE
+            and pack.type_pack != 'famille'
+            and (pack_special is None or pack.pack_special == pack_special)
+        ]
+    
+    @classmethod
+    def _construire_speciaux(cls):
+        return cls._serialiser_packs(cls._packs_paiement_enfant(pack_special=True))
+    
+    @classmethod
+    def _construire_standards(cls):
+        return cls._serialiser_packs(cls._packs_paiement_enfant(pack_special=False))
+    
+    @classmethod
+    def _construire_tous(cls):
+        return cls._serialiser_packs(cls._packs_paiement_enfant())
+    
+    @classmethod
+    def _construire_speciaux_avec_bienvenue(cls):
+        """Catalogue de PackAbonnementViewSet.packs_speciaux (familiaux inclus)"""
+        return cls._serialiser_packs([
+            pack for pack in ReferentielService.get_packs()
+            if pack.actif and pack.pack_special and pack.nom != cls.PACK_BIENVENUE
+        ])
+    
+    @classmethod
+    def _construire_essai_gratuit(cls):
+        return cls._serialiser_packs(PackService.get_packs_avec_essai_gratuit()['packs'])
+    
+    @staticmethod
+    def _familles_depuis_packs():
+        """Packs familiaux définis comme PackAbonnement de type 'famille', du moins cher au plus cher"""
+        packs = sorted(
+            (pack for pack in ReferentielService.get_packs() if pack.type_pack == 'famille' and pack.actif),
+            key=lambda pack: (pack.prix, pack.id)
+        )
+        lignes = []
+        for i, pack in enumerate(packs):
+            # Calculer le prix réduit
+            prix_original = float(pack.prix)
+            prix_reduit = float(pack.prix_reduit) if pack.reduction_pourcentage > 0 else prix_original
+            
+            lignes.append({
+                'id': f'pack-famille-{pack.id}',
+                'real_id': pack.id,  # ID réel de la base de données
+                'nom': pack.nom,
+                'prix': prix_original,  # Prix original (barré)
+                'prix_reduit': prix_reduit,  # Prix avec réduction (affiché)
+                'nombre_enfants': 2 + i,  # 2, 3, 4 enfants
+                'type_pack': 'famille',
+                'pack_familial': False,  # real_id désigne un PackAbonnement
+                'description': pack.description,
+                'popular': i == 1,  # Le deuxième pack est populaire
+                'actif': pack.actif,
+                'duree_jours': pack.duree_jours,
+                'periode': pack.periode,
+                'reduction_pourcentage': pack.reduction_pourcentage,
+                'economie': prix_original - prix_reduit  # Montant économisé
+            })
+        return lignes
+    
+    @staticmethod
+    def _familles_depuis_packs_familiaux():
+        """Packs du modèle PackFamilial, par nombre d'enfants"""
+        packs = sorted(
+            (pack for pack in ReferentielService.get_packs_familiaux() if pack.actif),
+            key=lambda pack: (pack.nombre_enfants, pack.id)
+        )
+        return [{
+            'id': f'pack-famille-{pack.nombre_enfants}',
+            'real_id': pack.id,  # ID réel de la base de données
+            'nom': pack.nom,
+            'prix': float(pack.prix),
+            'prix_reduit': float(pack.prix_reduit) if pack.prix_reduit else None,
+            'nombre_enfants': pack.nombre_enfants,
+            'type_pack': 'famille',
+            'pack_familial': True,  # real_id désigne un PackFamilial (à renvoyer à l'initiation du paiement)
+            'description': pack.description,
+            'popular': pack.nombre_enfants == 3,  # Pack 3 enfants populaire
+            'actif': pack.actif,
+            'duree_jours': pack.duree_jours,
+            'periode': pack.periode,
+            'reduction_pourcentage': pack.reduction_pourcentage
+        } for pack in packs]
+    
+    @classmethod
+    def _construire_familiaux(cls):
+        return cls._familles_depuis_packs()
+    
+    @classmethod
+    def _construire_packs_famille(cls):
+        """Catalogue de AbonnementViewSet.packs_famille : PackFamilial, sinon les PackAbonnement familiaux"""
+        packs_data = cls._familles_depuis_packs_familiaux()
+        if not packs_data:
+            packs_data = [
+                {cle: valeur for cle, valeur in ligne.items() if cle not in ('prix_reduit', 'economie')}
+                for ligne in cls._familles_depuis_packs()
+            ]
+        return {
+            'packs': packs_data,
+            'total': len(packs_data),
+            'message': f'{len(packs_data)} packs famille disponibles'
+        }
+    
+    @classmethod
+    def _construire_individuels(cls):
+        """Catalogue de UtilisateurViewSet.packs_speciaux (renouvellement d'un pack individuel)"""
+        packs_data = []
+        for pack in ReferentielService.get_packs():
+            description = (pack.description or '').lower()
+            if (
+                not pack.actif
+                or pack.nom in cls.NOMS_EXCLUS_INDIVIDUELS
+                or any(exclue in description for exclue in cls.DESCRIPTIONS_EXCLUES_INDIVIDUELS)
+            ):
+                continue
+            packs_data.append({
+                'id': pack.id,
+                'nom': pack.nom,
+                'prix': float(pack.prix),
+                'prix_reduit': float(pack.prix_reduit) if pack.prix_reduit else float(pack.prix),
+                'devise': 'FCFA',
+                'type_pack': 'standard',
+                'description': pack.description or f"Pack {pack.nom}",
+                'duree_jours': pack.duree_jours or 30,
+                'periode': pack.periode or 'mois',
+                'reduction_pourcentage': 0,
+                'offre_semaine_gratuite': False,
+                'conditions_speciales': None
+            })
+        return {'packs': packs_data or cls.PACKS_INDIVIDUELS_PAR_DEFAUT}
+    
+    CATALOGUES = {
+        'speciaux': '_construire_speciaux',
+        'standards': '_construire_standards',
+        'tous': '_construire_tous',
+        'speciaux_avec_bienvenue': '_construire_speciaux_avec_bienvenue',
+        'essai_gratuit': '_construire_essai_gratuit',
+        'familiaux': '_construire_familiaux',
+        'packs_famille': '_construire_packs_famille',
+        'familiaux_modele': '_familles_depuis_packs_familiaux',
+        'individuels': '_construire_individuels',
+    }
+    
+    @classmethod
+    def _construire(cls, nom):
+        donnees = getattr(cls, cls.CATALOGUES[nom])()
+        contenu = json.dumps(donnees, sort_keys=True, cls=DjangoJSONEncoder, ensure_ascii=False)
+        etag = '"%s"' % hashlib.sha256(f"{nom}:{contenu}".encode()).hexdigest()[:32]
+        return {'donnees': donnees, 'etag': etag}
+    
+    @classmethod
+    def get_catalogue(cls, nom):
+        """
+        Retourne {'donnees', 'etag'} pour le catalogue demandé (clé de CATALOGUES).
+        Les données sont partagées entre requêtes : ne pas les modifier.
+        """
+        return ReferentielService.get_derive(f'catalogue:{nom}', lambda: cls._construire(nom))
+
+
+class ParrainageService:
+    """Service pour gérer le système de parrainage"""
+    
+    @staticmethod
+    def creer_parrainage(filleul, code_parrainage):
+        """Crée une relation de parrainage"""
+        try:
+            # Vérifier que le code de parrainage existe
+            parrain = Utilisateur.objects.filter(code_parrainage=code_parrainage).first()
+            if not parrain:
+                return {'success': False, 'error': 'Code de parrainage invalide'}
+            
+            # Vérifier que l'utilisateur ne se parraine pas lui-même
+            if parrain == filleul:
+                return {'success': False, 'error': 'Vous ne pouvez pas vous parrainer vous-même'}
+            
+            # Vérifier qu'il n'y a pas déjà un parrainage
             if hasattr(filleul, 'parrain'):
                 return {'success': False, 'error': 'Cet utilisateur a déjà un parrain'}
             
@@ -1823,6 +3852,39 @@ class ParrainageService:
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
+    @staticmethod
+    def attribuer_bonus_parrainages(filleul_ids):
+        """
+        Attribue en une passe le bonus (1 semaine) aux parrains d'un lot de filleuls qui paient.
+        À appeler dans une transaction.
+        
+        Returns:
+            int: nombre de bonus attribués
+        """
+        from collections import Counter
+        
+        parrainages = list(
+            Parrainage.objects.select_for_update().filter(
+                filleul_id__in=filleul_ids, bonus_attribue=False
+            ).values_list('id', 'parrain_id')
+        )
+        if not parrainages:
+            return 0
+        
+        Parrainage.objects.filter(id__in=[pk for pk, _ in parrainages]).update(
+            bonus_attribue=True, date_bonus_attribue=timezone.now()
+        )
+        par_parrain = Counter(parrain_id for _, parrain_id in parrainages)
+        BonusParrainage.objects.bulk_create(
+            [BonusParrainage(utilisateur_id=parrain_id) for parrain_id in par_parrain],
+            ignore_conflicts=True
+        )
+        for parrain_id, nombre in par_parrain.items():
+            BonusParrainage.objects.filter(utilisateur_id=parrain_id).update(
+                bonus_accumules=models.F('bonus_accumules') + nombre, date_dernier_bonus=timezone.now()
+            )
+        return len(parrainages)
+    
     @staticmethod
     def utiliser_bonus_parrainage(utilisateur, nombre_semaines=1):
         """Utilise les bonus de parrainage pour prolonger l'abonnement"""
@@ -1892,45 +3954,60 @@ class ParrainageService:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
+    @staticmethod
+    def _requete_statistiques(parrain_id):
+        """
+        Statistiques de parrainage d'un utilisateur en une requête : chaque compte est une sous-requête
+        scalaire à agrégation conditionnelle sur ses filleuls (abonnement actif via Exists()),
+        sans GROUP BY sur la ligne du parrain
+        """
+        from django.db.models import Count, Exists, IntegerField, OuterRef, Q, Subquery, Value
+        from django.db.models.functions import Coalesce
+        
+        def compte(queryset, filtre=None):
+            sous_requete = queryset.order_by().values(cle=Value(1)).annotate(total=Count('id', filter=filtre)).values('total')
+            return Coalesce(Subquery(sous_requete, output_field=IntegerField()), Value(0))
+        
+        filleuls = Parrainage.objects.filter(parrain_id=OuterRef('pk'))
+        filleul_actif = Abonnement.objects.filter(utilisateur_id=OuterRef('filleul_id'), actif=True)
+        
+        return Utilisateur.objects.filter(pk=parrain_id).annotate(
+            nombre_filleuls=compte(filleuls),
+            filleuls_payants=compte(filleuls, Q(bonus_attribue=True)),
+            filleuls_actifs=compte(filleuls, Q(Exists(filleul_actif))),
+            inscrits_avec_code=compte(Utilisateur.objects.filter(code_parrain_utilise=OuterRef('code_parrainage'))),
+        ).values(
+            'nombre_filleuls', 'filleuls_payants', 'filleuls_actifs', 'inscrits_avec_code',
+            'bonus_parrainage__bonus_utilises',
+        ).order_by().first()
+    
     @staticmethod
     def get_statistiques_parrainage(utilisateur):
-        """Récupère les statistiques de parrainage d'un utilisateur"""
+        """
+        Récupère les statistiques de parrainage d'un utilisateur (lecture seule, une requête).
+        
+        Les bonus accumulés sont les parrainages dont le bonus a été attribué : c'est la valeur
+        que BonusParrainage.bonus_accumules suit à chaque attribution.
+        """
         try:
-            # Récupérer ou créer le bonus de parrainage
-            bonus, created = BonusParrainage.objects.get_or_create(utilisateur=utilisateur)
+            ligne = ParrainageService._requete_statistiques(utilisateur.pk)
+            if ligne is None:
+                return {'success': False, 'error': 'Utilisateur introuvable'}
             
-            # Compter les filleuls
-            nombre_filleuls = Parrainage.objects.filter(parrain=utilisateur).count()
-            
-            # Compter les filleuls qui ont payé (bonus attribués)
-            filleuls_payants = Parrainage.objects.filter(
-                parrain=utilisateur, 
-                bonus_attribue=True
-            ).count()
-            
-            # CORRECTION : Mettre à jour les bonus accumulés basés sur les parrainages
-            # Recalculer les bonus accumulés depuis les parrainages
-            bonus_accumules_reels = Parrainage.objects.filter(
-                parrain=utilisateur,
-                bonus_attribue=True
-            ).count()
-            
-            # Mettre à jour le modèle BonusParrainage si nécessaire
-            if bonus.bonus_accumules != bonus_accumules_reels:
-                bonus.bonus_accumules = bonus_accumules_reels
-                bonus.save()
-                print(f"🔄 Bonus mis à jour: {bonus_accumules_reels} bonus accumulés")
-            else:
-                print(f"✅ Bonus déjà à jour: {bonus_accumules_reels} bonus accumulés")
+            bonus_accumules = ligne['filleuls_payants']
+            bonus_utilises = ligne['bonus_parrainage__bonus_utilises'] or 0
+            bonus_disponibles = max(0, bonus_accumules - bonus_utilises)
             
             return {
                 'success': True,
-                'bonus_accumules': bonus.bonus_accumules,
-                'bonus_utilises': bonus.bonus_utilises,
-                'bonus_disponibles': bonus.bonus_disponibles,
-                'peut_utiliser_bonus': bonus.peut_utiliser_bonus,
-                'nombre_filleuls': nombre_filleuls,
-                'filleuls_payants': filleuls_payants,
+                'bonus_accumules': bonus_accumules,
+                'bonus_utilises': bonus_utilises,
+                'bonus_disponibles': bonus_disponibles,
+                'peut_utiliser_bonus': bonus_disponibles > 0,
+                'nombre_filleuls': ligne['nombre_filleuls'],
+                'filleuls_payants': ligne['filleuls_payants'],
+                'filleuls_actifs': ligne['filleuls_actifs'],
+                'inscrits_avec_code': ligne['inscrits_avec_code'],
                 'limite_atteinte': False  # Plus de limite
             }
             
@@ -1939,39 +4016,37 @@ class ParrainageService:
 
     @staticmethod
     def get_filleuls(utilisateur):
-        """Récupère la liste des filleuls d'un utilisateur"""
+        """Récupère la liste des filleuls d'un utilisateur (une requête, abonnement actif via Exists())"""
+        from django.db.models import Exists, OuterRef
+        
         try:
-            filleuls = Parrainage.objects.filter(parrain=utilisateur)
+            parrainages = Parrainage.objects.filter(parrain=utilisateur).annotate(
+                abonnement_actif=Exists(
+                    Abonnement.objects.filter(utilisateur_id=OuterRef('filleul_id'), actif=True)
+                )
+            ).order_by('id').values(
+                'filleul_id', 'filleul__email', 'filleul__first_name', 'filleul__last_name',
+                'filleul__date_joined', 'abonnement_actif', 'bonus_attribue', 'date_bonus_attribue',
+            )
             
-            if not filleuls.exists():
+            # Préparer les données des filleuls
+            liste_filleuls = [{
+                'id': ligne['filleul_id'],
+                'email': ligne['filleul__email'],
+                'nom_complet': f"{ligne['filleul__first_name'] or ''} {ligne['filleul__last_name'] or ''}".strip() or 'Utilisateur',
+                'date_inscription': ligne['filleul__date_joined'],
+                'abonnement_actif': ligne['abonnement_actif'],
+                'bonus_attribue': ligne['bonus_attribue'],
+                'date_bonus_attribue': ligne['date_bonus_attribue'] if ligne['bonus_attribue'] else None
+            } for ligne in parrainages]
+            
+            if not liste_filleuls:
                 return {
                     'success': True,
                     'filleuls': [],
                     'message': 'Aucun filleul pour le moment'
                 }
             
-            # Préparer les données des filleuls
-            liste_filleuls = []
-            for parrainage in filleuls:
-                filleul = parrainage.filleul
-                
-                # Vérifier si le filleul a un abonnement actif
-                abonnement_actif = Abonnement.objects.filter(
-                    utilisateur=filleul,
-                    actif=True
-                ).exists()
-                
-                filleul_data = {
-                    'id': filleul.id,
-                    'email': filleul.email,
-                    'nom_complet': f"{filleul.first_name or ''} {filleul.last_name or ''}".strip() or 'Utilisateur',
-                    'date_inscription': filleul.date_joined,
-                    'abonnement_actif': abonnement_actif,
-                    'bonus_attribue': parrainage.bonus_attribue,
-                    'date_bonus_attribue': parrainage.date_bonus_attribue if parrainage.bonus_attribue else None
-                }
-                liste_filleuls.append(filleul_data)
-            
             return {
                 'success': True,
                 'filleuls': liste_filleuls,
@@ -2060,17 +4135,20 @@ class PackDecouverteService:
             date_debut = timezone.now()
             date_fin = date_debut + timedelta(days=3)
             
-            abonnement = Abonnement.objects.create(
-                utilisateur=utilisateur,
-                pack=pack_decouverte,
-                date_debut=date_debut,
-                date_fin=date_fin,
-                statut='actif',
-                actif=True,
-                montant_paye=0,
-                est_essai_gratuit=True,
-                source_parrainage=False  # Pas de parrainage
-            )
+            with transaction.atomic():
+                # Un abonnement encore actif mais échu est clos avant l'activation
+                AbonnementService.liberer_abonnement_actif(utilisateur, statut='expire')
+                abonnement = Abonnement.objects.create(
+                    utilisateur=utilisateur,
+                    pack=pack_decouverte,
+                    date_debut=date_debut,
+                    date_fin=date_fin,
+                    statut='actif',
+                    actif=True,
+                    montant_paye=0,
+                    est_essai_gratuit=True,
+                    source_parrainage=False  # Pas de parrainage
+                )
             
             print(f"✅ Pack Découverte créé pour {utilisateur.email}: {abonnement}")
             
@@ -2094,8 +4172,112 @@ class PackDecouverteService:
 class WaveCallbackService:
     """Service pour gérer les callbacks Wave et l'activation automatique des abonnements"""
     
+    MAX_TENTATIVES_EVENEMENT = 5
+    
+    @staticmethod
+    def get_cle_dedoublonnage(donnees):
+        """Identifiant d'événement fourni par Wave, sinon couple transaction / statut"""
+        if donnees.get('id'):
+            return f"evt:{donnees['id']}"[:150]
+        return f"{donnees.get('transaction_id')}:{donnees.get('status', '')}"[:150]
+    
+    @staticmethod
+    def enregistrer_evenement(donnees):
+        """
+        Enregistre un callback Wave brut, sans aucun traitement métier.
+        
+        Returns:
+            tuple: (evenement, cree) - cree vaut False pour un callback déjà reçu
+        """
+        return EvenementWave.objects.get_or_create(
+            cle_dedoublonnage=WaveCallbackService.get_cle_dedoublonnage(donnees),
+            defaults={
+                'transaction_id': str(donnees.get('transaction_id'))[:100],
+                'statut_wave': str(donnees.get('status', ''))[:50],
+                'donnees': donnees,
+            }
+        )
+    
     @staticmethod
-    def traiter_paiement_reussi(transaction_id, montant_paye, reference_wave):
+    def traiter_evenement(evenement_id):
+        """
+        Traite un événement reçu dans une transaction unique : l'événement est verrouillé,
+        le paiement aussi (dans traiter_paiement_reussi), et leurs nouveaux états sont validés ensemble.
+        
+        Returns:
+            str: statut final de l'événement, ou None s'il est déjà pris par un autre worker
+        """
+        with transaction.atomic():
+            verrou = EvenementWave.objects.select_for_update(
+                skip_locked=connection.features.has_select_for_update_skip_locked
+            )
+            evenement = verrou.filter(id=evenement_id, statut=EvenementWave.STATUT_RECU).first()
+            if evenement is None:
+                return None
+            
+            evenement.tentatives += 1
+            if evenement.statut_wave != 'success':
+                evenement.statut = EvenementWave.STATUT_IGNORE
+                evenement.derniere_erreur = 'Paiement non réussi'
+            else:
+                donnees = evenement.donnees
+                resultat = WaveCallbackService.traiter_paiement_reussi(
+                    evenement.transaction_id,
+                    donnees.get('amount') or 0,
+                    donnees.get('reference'),
+                    donnees_callback=donnees
+                )
+                if resultat['success']:
+                    evenement.statut = EvenementWave.STATUT_TRAITE
+                    evenement.derniere_erreur = ''
+                elif resultat['error'] == 'Paiement non trouvé':
+                    # Paiement inconnu ou déjà confirmé : rien à rejouer
+                    evenement.statut = EvenementWave.STATUT_IGNORE
+                    evenement.derniere_erreur = resultat['error']
+                else:
+                    evenement.derniere_erreur = resultat['error']
+                    if evenement.tentatives >= WaveCallbackService.MAX_TENTATIVES_EVENEMENT:
+                        evenement.statut = EvenementWave.STATUT_ERREUR
+            
+            if evenement.statut != EvenementWave.STATUT_RECU:
+                evenement.date_traitement = timezone.now()
+            evenement.save(update_fields=['statut', 'tentatives', 'derniere_erreur', 'date_traitement'])
+            return evenement.statut
+    
+    @staticmethod
+    def traiter_evenements(limite=100):
+        """Traite un lot d'événements reçus, du plus ancien au plus récent (une transaction par événement)"""
+        resultats = {'lus': 0, EvenementWave.STATUT_TRAITE: 0, EvenementWave.STATUT_IGNORE: 0,
+                     EvenementWave.STATUT_ERREUR: 0, EvenementWave.STATUT_RECU: 0}
+        
+        evenement_ids = list(
+            EvenementWave.objects.filter(
+                statut=EvenementWave.STATUT_RECU,
+                tentatives__lt=WaveCallbackService.MAX_TENTATIVES_EVENEMENT
+            ).order_by('date_reception').values_list('id', flat=True)[:limite]
+        )
+        resultats['lus'] = len(evenement_ids)
+        
+        for evenement_id in evenement_ids:
+            try:
+                statut = WaveCallbackService.traiter_evenement(evenement_id)
+            except Exception as e:
+                # Erreur isolée à cet événement : il reste dans la file pour une nouvelle tentative
+                logger.error(f"Erreur lors du traitement de l'événement Wave {evenement_id}: {e}")
+                EvenementWave.objects.filter(id=evenement_id).update(
+                    tentatives=models.F('tentatives') + 1, derniere_erreur=str(e)
+                )
+                statut = EvenementWave.STATUT_RECU
+                if EvenementWave.objects.filter(
+                    id=evenement_id, tentatives__gte=WaveCallbackService.MAX_TENTATIVES_EVENEMENT
+                ).update(statut=EvenementWave.STATUT_ERREUR, date_traitement=timezone.now()):
+                    statut = EvenementWave.STATUT_ERREUR
+            if statut is not None:
+                resultats[statut] += 1
+        return resultats
+    
+    @staticmethod
+    def traiter_paiement_reussi(transaction_id, montant_paye, reference_wave, donnees_callback=None):
         """
         Traite un paiement Wave réussi et active l'abonnement
         
@@ -2103,104 +4285,127 @@ class WaveCallbackService:
             transaction_id: ID de la transaction Wave
             montant_paye: Montant payé via Wave
             reference_wave: Référence Wave de la transaction
+            donnees_callback: Données brutes du callback, conservées sur le paiement
             
         Returns:
             dict: Résultat du traitement
         """
         try:
-            # Chercher le paiement en attente
-            paiement = PaiementWave.objects.filter(
-                transaction_id=transaction_id,
-                statut='en_attente'
-            ).first()
-            
-            if not paiement:
-                logger.error(f"Paiement Wave non trouvé pour transaction_id: {transaction_id}")
-                return {
-                    'success': False,
-                    'error': 'Paiement non trouvé'
-                }
-            
-            # Récupérer le pack et l'utilisateur depuis les informations stockées
-            if not paiement.pack_id or not paiement.utilisateur_id:
-                logger.error(f"Informations manquantes dans le paiement {transaction_id}")
-                return {
-                    'success': False,
-                    'error': 'Informations du paiement incomplètes'
-                }
-            
-            # 🔧 CORRECTION : Chercher d'abord dans PackAbonnement, puis dans PackFamilial
-            # Car les packs spéciaux (Pack Vacances, etc.) sont dans PackAbonnement
-            try:
-                pack = PackAbonnement.objects.get(id=paiement.pack_id)
-                print(f"📦 Pack standard trouvé pour callback: {pack.nom} - {pack.prix} FCFA")
-            except PackAbonnement.DoesNotExist:
-                pack = PackFamilial.objects.get(id=paiement.pack_id)
-                print(f"📦 Pack familial trouvé pour callback: {pack.nom} - {pack.prix} FCFA")
-            
-            utilisateur = Utilisateur.objects.get(id=paiement.utilisateur_id)
-            
-            # Vérifier si c'est un paiement pour un enfant (parent_id présent)
-            parent_info = ""
-            if paiement.parent_id:
-                try:
-                    parent = Utilisateur.objects.get(id=paiement.parent_id)
-                    parent_info = f" (paiement effectué par {parent.first_name or parent.email})"
-                except Utilisateur.DoesNotExist:
-                    logger.warning(f"Parent {paiement.parent_id} non trouvé pour le paiement {transaction_id}")
-            
-            # Calculer le montant attendu
-            if hasattr(pack, 'reduction_pourcentage') and pack.reduction_pourcentage and pack.reduction_pourcentage > 0:
-                montant_attendu = int(float(pack.prix) * (1 - float(pack.reduction_pourcentage) / 100))
-            else:
-                montant_attendu = int(pack.prix)
-            
-            if int(montant_paye) != montant_attendu:
-                logger.warning(f"Montant payé ({montant_paye}) ne correspond pas au montant attendu ({montant_attendu})")
-                # On accepte quand même le paiement pour éviter les problèmes de centimes
-            
-            # Marquer le paiement comme réussi
-            paiement.statut = 'reussi'
-            paiement.wave_reference = reference_wave
-            paiement.save()
-            
-            # Créer l'abonnement MAINTENANT (après confirmation du paiement)
-            resultat_creation = AbonnementService.creer_abonnement(
-                utilisateur=utilisateur,
-                pack=pack,
-                est_essai_gratuit=False,
-                renouvellement_auto=paiement.renouvellement_auto
-            )
-            
-            if not resultat_creation['success']:
-                logger.error(f"Erreur lors de la création de l'abonnement: {resultat_creation['error']}")
-                return {
-                    'success': False,
-                    'error': f"Erreur lors de la création de l'abonnement: {resultat_creation['error']}"
-                }
-            
-            abonnement = resultat_creation['abonnement']
-            
-            # Lier le paiement à l'abonnement créé
-            paiement.abonnement = abonnement
-            paiement.save()
-            
-            logger.info(f"Abonnement créé avec succès pour {utilisateur.email}: {abonnement.id}{parent_info}")
-            
-            # Vérifier si c'est un pack familial
-            if pack.type_pack == 'famille':
-                # Traiter comme un paiement familial
-                return WaveCallbackService.traiter_paiement_familial_reussi(
-                    paiement, pack, utilisateur, parent_info
+            # Paiement, abonnement et référence actuelle sont validés ensemble
+            with transaction.atomic():
+                # Chercher le paiement en attente
+                paiement = PaiementWave.objects.select_for_update().filter(
+                    transaction_id=transaction_id,
+                    statut='en_attente'
+                ).first()
+                
+                if not paiement:
+                    logger.error(f"Paiement Wave non trouvé pour transaction_id: {transaction_id}")
+                    return {
+                        'success': False,
+                        'error': 'Paiement non trouvé'
+                    }
+                
+                # Récupérer le pack et l'utilisateur depuis les informations stockées
+                if not paiement.pack_id or not paiement.utilisateur_id:
+                    logger.error(f"Informations manquantes dans le paiement {transaction_id}")
+                    return {
+                        'success': False,
+                        'error': 'Informations du paiement incomplètes'
+                    }
+                
+                # Pack payé (PackFamilial ou PackAbonnement, selon le type enregistré à l'initiation)
+                # et PackAbonnement des abonnements créés
+                pack_paye = ReferentielService.get_pack_paye(paiement)
+                pack = pack_paye
+                if paiement.pack_familial and pack_paye:
+                    pack = ReferentielService.get_pack_provisionne(pack_paye)
+                if not pack:
+                    logger.error(f"Pack {paiement.pack_id} introuvable pour le paiement {transaction_id}")
+                    return {
+                        'success': False,
+                        'error': 'Pack non trouvé'
+                    }
+                print(f"📦 Pack trouvé pour callback: {pack.nom} - {pack.prix} FCFA")
+                
+                # Intention du moteur de renouvellement : l'abonnement lié est prolongé
+                if paiement.abonnement_id:
+                    if donnees_callback is not None:
+                        paiement.callback_data = donnees_callback
+                        paiement.save(update_fields=['callback_data'])
+                    RenouvellementService.appliquer_paiements_reussis([paiement], {transaction_id: reference_wave})
+                    paiement.refresh_from_db(fields=['abonnement'])
+                    return {
+                        'success': True,
+                        'abonnement_id': paiement.abonnement_id,
+                        'message': 'Paiement confirmé et abonnement renouvelé'
+                    }
+                
+                utilisateur = Utilisateur.objects.get(id=paiement.utilisateur_id)
+                
+                # Vérifier si c'est un paiement pour un enfant (parent_id présent)
+                parent_info = ""
+                if paiement.parent_id:
+                    try:
+                        parent = Utilisateur.objects.get(id=paiement.parent_id)
+                        parent_info = f" (paiement effectué par {parent.first_name or parent.email})"
+                    except Utilisateur.DoesNotExist:
+                        logger.warning(f"Parent {paiement.parent_id} non trouvé pour le paiement {transaction_id}")
+                
+                # Calculer le montant attendu
+                if hasattr(pack_paye, 'reduction_pourcentage') and pack_paye.reduction_pourcentage and pack_paye.reduction_pourcentage > 0:
+                    montant_attendu = int(float(pack_paye.prix) * (1 - float(pack_paye.reduction_pourcentage) / 100))
+                else:
+                    montant_attendu = int(pack_paye.prix)
+                
+                if int(montant_paye) != montant_attendu:
+                    logger.warning(f"Montant payé ({montant_paye}) ne correspond pas au montant attendu ({montant_attendu})")
+                    # On accepte quand même le paiement pour éviter les problèmes de centimes
+                
+                # Marquer le paiement comme réussi
+                paiement.statut = 'reussi'
+                paiement.wave_reference = reference_wave
+                if donnees_callback is not None:
+                    paiement.callback_data = donnees_callback
+                paiement.save()
+                
+                # Pack familial : parent et enfants sont provisionnés ensemble, en lot
+                if pack.type_pack == 'famille':
+                    return WaveCallbackService.traiter_paiement_familial_reussi(
+                        paiement, pack, utilisateur, parent_info, pack_paye=pack_paye
+                    )
+                
+                # Créer l'abonnement MAINTENANT (après confirmation du paiement)
+                resultat_creation = AbonnementService.creer_abonnement(
+                    utilisateur=utilisateur,
+                    pack=pack,
+                    est_essai_gratuit=False,
+                    renouvellement_auto=paiement.renouvellement_auto
                 )
-            else:
-                # Traitement normal pour les packs individuels
+                
+                if not resultat_creation['success']:
+                    logger.error(f"Erreur lors de la création de l'abonnement: {resultat_creation['error']}")
+                    # Le paiement reste en attente pour un nouveau traitement
+                    transaction.set_rollback(True)
+                    return {
+                        'success': False,
+                        'error': f"Erreur lors de la création de l'abonnement: {resultat_creation['error']}"
+                    }
+                
+                abonnement = resultat_creation['abonnement']
+                
+                # Lier le paiement à l'abonnement créé
+                paiement.abonnement = abonnement
+                paiement.save()
+                
+                logger.info(f"Abonnement créé avec succès pour {utilisateur.email}: {abonnement.id}{parent_info}")
+                
                 return {
                     'success': True,
                     'abonnement_id': abonnement.id,
                     'message': f'Paiement confirmé et abonnement activé pour {utilisateur.first_name or utilisateur.email}{parent_info}'
                 }
-            
+                
         except Exception as e:
             logger.error(f"Erreur lors du traitement du paiement Wave: {e}")
             return {
@@ -2209,7 +4414,7 @@ class WaveCallbackService:
             }
     
     @staticmethod
-    def traiter_paiement_familial_reussi(paiement, pack, parent, parent_info):
+    def traiter_paiement_familial_reussi(paiement, pack, parent, parent_info, pack_paye=None):
         """
         Traite un paiement familial réussi et active les abonnements pour le parent et tous ses enfants
         
@@ -2218,9 +4423,13 @@ class WaveCallbackService:
             pack: Instance PackAbonnement (pack familial)
             parent: Instance Utilisateur (parent)
             parent_info: String d'information sur le parent
+            pack_paye: PackFamilial choisi à l'initiation, pack par défaut
             
         Returns:
             dict: Résultat du traitement
+        
+        À appeler dans la transaction de traiter_paiement_reussi : en cas d'échec du provisionnement,
+        elle est annulée et le paiement reste en attente pour une nouvelle tentative.
         """
         try:
             from utilisateurs.models import LienParentEnfant
@@ -2233,85 +4442,26 @@ class WaveCallbackService:
             
             enfants = [lien.enfant for lien in liens_enfants]
             
-            if not enfants:
-                logger.warning(f"Aucun enfant trouvé pour le parent {parent.email}")
-                return {
-                    'success': False,
-                    'error': 'Aucun enfant trouvé pour ce parent'
-                }
-            
             # Vérifier que le nombre d'enfants correspond au pack
-            nombre_enfants_pack = getattr(pack, 'nombre_enfants', 0)
+            nombre_enfants_pack = getattr(pack_paye or pack, 'nombre_enfants', 0)
             if nombre_enfants_pack > 0 and len(enfants) != nombre_enfants_pack:
                 logger.warning(f"Nombre d'enfants ({len(enfants)}) ne correspond pas au pack ({nombre_enfants_pack})")
                 # On continue quand même, on prend les enfants disponibles
             
-            abonnements_crees = []
-            
-            # 1. Créer l'abonnement pour le parent
-            resultat_parent = AbonnementService.creer_abonnement(
-                utilisateur=parent,
-                pack=pack,
-                est_essai_gratuit=False,
-                renouvellement_auto=paiement.renouvellement_auto
-            )
+            with transaction.atomic():
+                abonnements_crees = WaveCallbackService.provisionner_famille(
+                    paiement, pack, parent, enfants, pack_paye=pack_paye
+                )
+            abonnement_parent = abonnements_crees[0]['abonnement']
             
-            if resultat_parent['success']:
-                abonnement_parent = resultat_parent['abonnement']
-                abonnements_crees.append({
-                    'utilisateur': parent,
-                    'abonnement': abonnement_parent,
-                    'type': 'parent'
-                })
-                logger.info(f"✅ Abonnement familial créé pour le parent {parent.email}: {abonnement_parent.id}")
-            else:
-                logger.error(f"❌ Erreur création abonnement parent: {resultat_parent['error']}")
+            if not enfants:
+                # Le parent garde l'abonnement payé
+                logger.warning(f"Aucun enfant trouvé pour le parent {parent.email}")
                 return {
                     'success': False,
-                    'error': f"Erreur création abonnement parent: {resultat_parent['error']}"
+                    'error': 'Aucun enfant trouvé pour ce parent'
                 }
             
-            # 2. Créer les abonnements pour tous les enfants
-            for enfant in enfants:
-                resultat_enfant = AbonnementService.creer_abonnement(
-                    utilisateur=enfant,
-                    pack=pack,
-                    est_essai_gratuit=False,
-                    renouvellement_auto=paiement.renouvellement_auto
-                )
-                
-                if resultat_enfant['success']:
-                    abonnement_enfant = resultat_enfant['abonnement']
-                    abonnements_crees.append({
-                        'utilisateur': enfant,
-                        'abonnement': abonnement_enfant,
-                        'type': 'enfant'
-                    })
-                    logger.info(f"✅ Abonnement familial créé pour l'enfant {enfant.email}: {abonnement_enfant.id}")
-                else:
-                    logger.error(f"❌ Erreur création abonnement enfant {enfant.email}: {resultat_enfant['error']}")
-                    # On continue avec les autres enfants même si un échoue
-            
-            # 3. Lier le paiement au premier abonnement (parent)
-            paiement.abonnement = abonnement_parent
-            paiement.save()
-            
-            # 4. Créer des enregistrements PaiementWave pour chaque enfant (pour traçabilité)
-            for abonnement_info in abonnements_crees[1:]:  # Skip parent (déjà fait)
-                PaiementWave.objects.create(
-                    abonnement=abonnement_info['abonnement'],
-                    transaction_id=f"{paiement.transaction_id}_ENFANT_{abonnement_info['utilisateur'].id}",
-                    montant=0,  # Pas de montant séparé, déjà payé par le parent
-                    wave_phone='',
-                    wave_email=paiement.wave_email,
-                    statut='reussi',
-                    wave_reference=paiement.wave_reference,
-                    pack_id=pack.id,
-                    utilisateur_id=abonnement_info['utilisateur'].id,
-                    parent_id=parent.id,
-                    renouvellement_auto=paiement.renouvellement_auto
-                )
-            
             logger.info(f"🎉 Paiement familial traité avec succès: {len(abonnements_crees)} abonnements créés")
             
             return {
@@ -2324,140 +4474,720 @@ class WaveCallbackService:
             
         except Exception as e:
             logger.error(f"Erreur lors du traitement du paiement familial: {e}")
+            # Le paiement ne doit pas rester réussi sans abonnements : il reste en attente
+            transaction.set_rollback(True)
             return {
                 'success': False,
                 'error': str(e)
             }
     
     @staticmethod
-    def verifier_paiements_en_attente():
+    def provisionner_famille(paiement, pack, parent, enfants, pack_paye=None):
         """
-        Vérifie les paiements en attente et les active si nécessaire
-        Cette méthode peut être appelée périodiquement pour vérifier les paiements
+        Crée en lot les abonnements du parent et des enfants, puis les PaiementWave de traçabilité
+        des enfants ; bonus de parrainage attribués en une passe pour la famille, commissions mises
+        en file (creer_abonnements_en_masse) pour le worker traiter_commissions.
+        À appeler dans une transaction.
+        
+        pack est le PackAbonnement des abonnements créés ; pack_paye, le PackFamilial payé le cas
+        échéant (montant du parent, pack des paiements de traçabilité).
+        
+        Returns:
+            list: [{'utilisateur', 'abonnement', 'type'}], le parent en premier
         """
+        maintenant = timezone.now()
+        pack_paye = pack_paye or pack
+        membres = [(parent, 'parent')] + [(enfant, 'enfant') for enfant in enfants]
+        
+        # L'abonnement du parent peut déjà exister pour ce paiement (ancien chemin de traitement)
+        existant = paiement.abonnement if paiement.abonnement_id else None
+        if existant and not (existant.utilisateur_id == parent.id and existant.actif):
+            existant = None
+        
+        nouveaux = AbonnementService.creer_abonnements_en_masse([
+            Abonnement(
+                utilisateur_id=membre.id,
+                pack=pack,
+                statut='actif',
+                actif=True,
+                # Seul le parent paie : les enfants ne comptent pas dans le chiffre d'affaires
+                montant_paye=pack_paye.prix_reduit if type_membre == 'parent' else 0,
+                renouvellement_auto=paiement.renouvellement_auto
+            )
+            for membre, type_membre in membres
+            if not (existant and type_membre == 'parent')
+        ], maintenant)
+        abonnements = ([existant] if existant else []) + nouveaux
+        abonnements_crees = [
+            {'utilisateur': membre, 'abonnement': abonnement, 'type': type_membre}
+            for (membre, type_membre), abonnement in zip(membres, abonnements)
+        ]
+        
+        # Lier le paiement à l'abonnement du parent
+        paiement.abonnement = abonnements[0]
+        paiement.save(update_fields=['abonnement', 'date_mise_a_jour'])
+        
+        # Enregistrements PaiementWave pour chaque enfant (traçabilité), en une insertion
+        PaiementWave.objects.bulk_create([
+            PaiementWave(
+                abonnement=abonnement_info['abonnement'],
+                transaction_id=f"{paiement.transaction_id}_ENFANT_{abonnement_info['utilisateur'].id}",
+                montant=0,  # Pas de montant séparé, déjà payé par le parent
+                wave_phone='',
+                wave_email=paiement.wave_email,
+                statut='reussi',
+                wave_reference=paiement.wave_reference,
+                pack_id=pack_paye.id,
+                pack_familial=isinstance(pack_paye, PackFamilial),
+                utilisateur_id=abonnement_info['utilisateur'].id,
+                parent_id=parent.id,
+                renouvellement_auto=paiement.renouvellement_auto
+            )
+            for abonnement_info in abonnements_crees[1:]
+        ])
+        
+        ParrainageService.attribuer_bonus_parrainages([membre.id for membre, _ in membres])
+        return abonnements_crees
+    
+    @staticmethod
+    def activer_paiements_individuels(paiements, packs, maintenant=None):
+        """
+        Active en requêtes ensemblistes les abonnements d'un lot de paiements (packs individuels).
+        À appeler dans une transaction, paiements verrouillés, au plus un paiement par utilisateur.
+        
+        Args:
+            paiements: PaiementWave en attente
+            packs: dict {pack_id: PackAbonnement}
+        
+        Returns:
+            list: abonnements créés, dans l'ordre des paiements
+        """
+        maintenant = maintenant or timezone.now()
+        abonnements = AbonnementService.creer_abonnements_en_masse([
+            Abonnement(
+                utilisateur_id=paiement.utilisateur_id,
+                pack=packs[paiement.pack_id],
+                montant_paye=packs[paiement.pack_id].prix_reduit,
+                statut='actif',
+                actif=True,
+                renouvellement_auto=paiement.renouvellement_auto
+            )
+            for paiement in paiements
+        ], maintenant)
+        
+        for paiement, abonnement in zip(paiements, abonnements):
+            paiement.statut = 'reussi'
+            paiement.abonnement = abonnement
+            if not paiement.wave_reference:
+                paiement.wave_reference = f"AUTO_{paiement.transaction_id}"
+            paiement.date_mise_a_jour = maintenant
+        PaiementWave.objects.bulk_update(paiements, ['statut', 'abonnement', 'wave_reference', 'date_mise_a_jour'])
+        return abonnements
+    
+    @staticmethod
+    def activer_lot_paiements(lot):
+        """
+        Active en lot des paiements en attente verrouillés (à appeler dans une transaction) :
+        une requête pour les utilisateurs, les packs venant du référentiel en mémoire.
+        
+        Returns:
+            tuple: (nombre activé, paiements à reprendre un par un après le lot, nombre incomplet)
+        """
+        # Intentions du moteur de renouvellement : prolongation de l'abonnement lié
+        # (la référence Wave du relevé rapproché est conservée)
+        renouvellements = [paiement for paiement in lot if paiement.abonnement_id]
+        if renouvellements:
+            RenouvellementService.appliquer_paiements_reussis(
+                renouvellements,
+                {p.transaction_id: p.wave_reference or f"AUTO_{p.transaction_id}" for p in renouvellements}
+            )
+        lot = [paiement for paiement in lot if not paiement.abonnement_id]
+        
+        utilisateurs = Utilisateur.objects.in_bulk({p.utilisateur_id for p in lot if p.utilisateur_id})
+        groupes, unitaires, incomplets, vus = [], [], 0, set()
+        for paiement in lot:
+            pack = ReferentielService.get_pack_paye(paiement) if paiement.pack_id else None
+            if paiement.pack_familial and pack is not None:
+                pack = ReferentielService.get_pack_provisionne(pack)
+            if paiement.utilisateur_id not in utilisateurs or pack is None:
+                logger.error(f"Informations du paiement {paiement.transaction_id} incomplètes")
+                incomplets += 1
+            elif paiement.pack_familial or pack.type_pack == 'famille' or paiement.utilisateur_id in vus:
+                # Packs familiaux et second paiement d'un même utilisateur : chemin unitaire après le lot
+                unitaires.append(paiement)
+            else:
+                vus.add(paiement.utilisateur_id)
+                groupes.append(paiement)
+        
+        if groupes:
+            packs = {p.pack_id: ReferentielService.get_pack(p.pack_id) for p in groupes}
+            WaveCallbackService.activer_paiements_individuels(groupes, packs)
+        return len(groupes) + len(renouvellements), unitaires, incomplets
+    
+    @staticmethod
+    def _activer_un_paiement(paiement):
+        """Chemin unitaire (packs familiaux, lot en échec) : une transaction par paiement"""
         try:
-            # Récupérer les paiements en attente depuis plus de 5 minutes
-            limite_temps = timezone.now() - timedelta(minutes=5)
-            paiements_en_attente = PaiementWave.objects.filter(
-                statut='en_attente',
-                date_creation__lt=limite_temps
+            resultat = WaveCallbackService.traiter_paiement_reussi(
+                paiement.transaction_id,
+                int(paiement.montant),
+                paiement.wave_reference or f"AUTO_{paiement.transaction_id}"
             )
-            
-            for paiement in paiements_en_attente:
-                # Simuler une vérification Wave (à remplacer par un vrai appel API)
-                # Pour l'instant, on active automatiquement après 5 minutes
-                logger.info(f"Activation automatique du paiement {paiement.transaction_id}")
-                
-                # Récupérer le montant depuis les informations stockées
-                montant = int(paiement.montant)
+        except Exception as e:
+            resultat = {'success': False, 'error': str(e)}
+        if resultat['success']:
+            logger.info(f"Paiement {paiement.transaction_id} activé automatiquement")
+        else:
+            logger.error(f"Erreur activation automatique {paiement.transaction_id}: {resultat['error']}")
+        return resultat['success']
+    
+    @staticmethod
+    def verifier_paiements_en_attente(taille_lot=200, limite=None):
+        """
+        Vérifie les paiements en attente et les active si nécessaire, par lots.
+        Cette méthode peut être appelée périodiquement pour vérifier les paiements
+        
+        Aucun paiement n'est activé sans preuve tant que WAVE_ACTIVATION_AUTOMATIQUE est désactivé
+        (production) : le passage compte alors seulement les paiements en attente, activés par le
+        callback Wave ou le rapprochement du relevé.
+        
+        Par lot : une requête pour les paiements (verrouillés), une pour les utilisateurs,
+        les packs venant du référentiel en mémoire ; abonnements créés par bulk_create et
+        un commit par lot. Si le lot échoue, ses paiements sont repris un par un pour isoler l'erreur.
+        
+        Returns:
+            dict: lus, activés, erreurs, lots, durée et débit (paiements par seconde)
+        """
+        debut = time.perf_counter()
+        resultats = {
+            'lus': 0, 'actives': 0, 'erreurs': 0, 'lots': 0, 'duree_secondes': 0.0, 'paiements_par_seconde': 0.0,
+            'activation_automatique': settings.WAVE_ACTIVATION_AUTOMATIQUE, 'en_attente': 0,
+        }
+        
+        # Récupérer les paiements en attente depuis plus de 5 minutes ; les intentions de renouvellement
+        # (abonnement lié) attendent toujours la confirmation de Wave
+        limite_temps = timezone.now() - timedelta(minutes=5)
+        en_attente = PaiementWave.objects.filter(
+            statut='en_attente', date_creation__lt=limite_temps, abonnement__isnull=True
+        )
+        if not settings.WAVE_ACTIVATION_AUTOMATIQUE:
+            resultats['en_attente'] = en_attente.count()
+            resultats['duree_secondes'] = time.perf_counter() - debut
+            return resultats
+        
+        # Sandbox : simulation d'une vérification Wave, activation automatique après 5 minutes
+        verrou = {'skip_locked': connection.features.has_select_for_update_skip_locked}
+        
+        dernier_id = 0
+        while limite is None or resultats['lus'] < limite:
+            taille = taille_lot if limite is None else min(taille_lot, limite - resultats['lus'])
+            lot, unitaires = [], []
+            try:
+                with transaction.atomic():
+                    lot = list(
+                        en_attente.select_for_update(**verrou).filter(id__gt=dernier_id).order_by('id')[:taille]
+                    )
+                    if not lot:
+                        break
+                    dernier_id = lot[-1].id
+                    actives, unitaires, incomplets = WaveCallbackService.activer_lot_paiements(lot)
+                resultats['actives'] += actives
+                resultats['erreurs'] += incomplets
+            except Exception as e:
+                if not lot:
+                    logger.error(f"Lecture des paiements en attente impossible: {e}")
+                    break
+                # Le lot a été annulé : ses paiements sont relus et repris un par un
+                logger.error(f"Lot de paiements en échec, reprise paiement par paiement: {e}")
+                unitaires = list(en_attente.filter(id__in=[paiement.id for paiement in lot]).order_by('id'))
+            
+            resultats['lus'] += len(lot)
+            resultats['lots'] += 1
+            for paiement in unitaires:
+                if WaveCallbackService._activer_un_paiement(paiement):
+                    resultats['actives'] += 1
+                else:
+                    resultats['erreurs'] += 1
+        
+        resultats['duree_secondes'] = time.perf_counter() - debut
+        if resultats['duree_secondes'] > 0:
+            resultats['paiements_par_seconde'] = resultats['lus'] / resultats['duree_secondes']
+        return resultats
+
+class RapprochementWaveService:
+    """
+    Rapprochement des relevés Wave exportés (CSV, JSON ou JSON Lines) avec les PaiementWave.
+    
+    Le relevé est lu en flux par lots : chaque lot est indexé en mémoire par transaction_id
+    puis confronté aux paiements du lot lus en une requête (jointure par hachage). La mémoire
+    reste bornée par la taille du lot, quelle que soit la longueur du relevé.
+    """
+    ALIAS = {
+        'transaction_id': ('transaction_id', 'client_reference', 'merchant_reference', 'reference_client'),
+        'montant': ('amount', 'montant'),
+        'telephone': ('mobile', 'phone', 'sender_mobile', 'telephone'),
+        'statut': ('status', 'payment_status', 'statut'),
+        'reference': ('id', 'wave_reference', 'transaction_reference', 'reference'),
+        'date': ('when', 'timestamp', 'created_at', 'transaction_date', 'date'),
+    }
+    STATUTS_REUSSIS = {'succeeded', 'success', 'successful', 'completed', 'reussi'}
+    # Chiffres comparés en fin de numéro (indépendant de l'indicatif pays et du format)
+    CHIFFRES_TELEPHONE = 8
+    
+    @staticmethod
+    def lire_releve(fichier, format_releve):
+        """Itère sur les lignes normalisées d'un relevé ouvert en texte ('csv', 'json' ou 'jsonl')"""
+        if format_releve == 'csv':
+            lignes = csv.DictReader(fichier)
+        elif format_releve == 'jsonl':
+            lignes = (json.loads(ligne) for ligne in fichier if ligne.strip())
+        elif format_releve == 'json':
+            lignes = RapprochementWaveService._lire_tableau_json(fichier)
+        else:
+            raise ValueError(f"Format de relevé inconnu : {format_releve}")
+        for ligne in lignes:
+            yield RapprochementWaveService._normaliser(ligne)
+    
+    @staticmethod
+    def _lire_tableau_json(fichier, taille_bloc=65536):
+        """Décode un tableau JSON élément par élément, sans charger le fichier entier"""
+        decodeur = json.JSONDecoder()
+        tampon = ''
+        while True:
+            morceau = fichier.read(taille_bloc)
+            tampon += morceau
+            position = 0
+            while True:
+                while position < len(tampon) and tampon[position] in ' \t\r\n,[':
+                    position += 1
+                if position >= len(tampon):
+                    break
+                if tampon[position] == ']':
+                    return
+                try:
+                    element, position_fin = decodeur.raw_decode(tampon, position)
+                except json.JSONDecodeError:
+                    if not morceau:
+                        raise ValueError("Relevé JSON invalide ou tronqué")
+                    break  # Élément incomplet : lire la suite
+                yield element
+                position = position_fin
+            tampon = tampon[position:]
+            if not morceau:
+                return
+    
+    @staticmethod
+    def _normaliser(ligne):
+        normalisee = {}
+        for champ, alias in RapprochementWaveService.ALIAS.items():
+            valeur = next((ligne[nom] for nom in alias if ligne.get(nom) not in (None, '')), None)
+            normalisee[champ] = str(valeur).strip() if valeur is not None else ''
+        return normalisee
+    
+    @staticmethod
+    def _telephone(valeur):
+        chiffres = ''.join(caractere for caractere in (valeur or '') if caractere.isdigit())
+        return chiffres[-RapprochementWaveService.CHIFFRES_TELEPHONE:]
+    
+    @staticmethod
+    def _montant(valeur):
+        from decimal import Decimal, InvalidOperation
+        try:
+            return Decimal(valeur.replace(' ', '').replace(',', '.'))
+        except (InvalidOperation, AttributeError):
+            return None
+    
+    @staticmethod
+    def _par_lots(lignes, taille_lot):
+        lot = []
+        for ligne in lignes:
+            lot.append(ligne)
+            if len(lot) >= taille_lot:
+                yield lot
+                lot = []
+        if lot:
+            yield lot
+    
+    @staticmethod
+    def rapprocher(lignes, taille_lot=5000, appliquer=True, signaler=None):
+        """
+        Rapproche un relevé (itérable de lignes normalisées) avec les paiements.
+        
+        Les paiements rapprochés sont marqués (date_rapprochement, référence Wave) en une écriture
+        par lot ; ceux encore en attente, désormais prouvés, sont activés en lot.
+        signaler(type_anomalie, transaction_id, details) reçoit chaque anomalie au fil de l'eau :
+        doublon_releve, sans_identifiant, orphelin_releve, ecart_montant, ecart_telephone,
+        ecart_statut, puis orphelin_base (paiement réussi absent du relevé sur sa période).
+        
+        Returns:
+            dict: compteurs par résultat, lignes lues, durée et débit
+        """
+        from collections import Counter
+        from django.utils.dateparse import parse_datetime
+        
+        debut = time.perf_counter()
+        maintenant = timezone.now()
+        signaler = signaler or (lambda type_anomalie, transaction_id, details: None)
+        compteurs = Counter()
+        periode = [None, None]
+        # Présents au relevé mais en écart : exclus des orphelins côté base (en pratique peu nombreux)
+        en_ecart = set()
+        
+        for lot in RapprochementWaveService._par_lots(lignes, taille_lot):
+            compteurs['lignes'] += len(lot)
+            
+            # Construction : le lot du relevé, indexé par transaction_id
+            releve = {}
+            for ligne in lot:
+                if ligne['statut'].lower() not in RapprochementWaveService.STATUTS_REUSSIS:
+                    compteurs['ignores'] += 1
+                    continue
+                date_ligne = parse_datetime(ligne['date']) if ligne['date'] else None
+                if date_ligne is not None:
+                    if timezone.is_naive(date_ligne):
+                        date_ligne = timezone.make_aware(date_ligne)
+                    periode[0] = min(periode[0] or date_ligne, date_ligne)
+                    periode[1] = max(periode[1] or date_ligne, date_ligne)
+                transaction_id = ligne['transaction_id']
+                if not transaction_id:
+                    compteurs['sans_identifiant'] += 1
+                    signaler('sans_identifiant', '', {'reference': ligne['reference'], 'montant_releve': ligne['montant']})
+                elif transaction_id in releve:
+                    compteurs['doublon_releve'] += 1
+                    signaler('doublon_releve', transaction_id, {'montant_releve': ligne['montant']})
+                else:
+                    releve[transaction_id] = ligne
+            
+            # Sondage : les paiements correspondants, en une requête
+            rapproches, a_activer = [], []
+            for paiement in PaiementWave.objects.filter(transaction_id__in=list(releve)).only(
+                'id', 'transaction_id', 'montant', 'wave_phone', 'statut', 'wave_reference', 'date_rapprochement'
+            ):
+                ligne = releve.pop(paiement.transaction_id)
+                montant_releve = RapprochementWaveService._montant(ligne['montant'])
+                telephone_releve = RapprochementWaveService._telephone(ligne['telephone'])
+                telephone_base = RapprochementWaveService._telephone(paiement.wave_phone)
+                details = {
+                    'montant_releve': ligne['montant'], 'montant_base': paiement.montant,
+                    'telephone_releve': ligne['telephone'], 'telephone_base': paiement.wave_phone or '',
+                    'statut_base': paiement.statut,
+                }
                 
-                resultat = WaveCallbackService.traiter_paiement_reussi(
-                    paiement.transaction_id,
-                    montant,
-                    f"AUTO_{paiement.transaction_id}"
-                )
+                if montant_releve is None or abs(montant_releve - paiement.montant) >= 1:
+                    anomalie = 'ecart_montant'
+                elif telephone_releve and telephone_base and telephone_releve != telephone_base:
+                    anomalie = 'ecart_telephone'
+                elif paiement.statut in ('echoue', 'annule'):
+                    anomalie = 'ecart_statut'
+                else:
+                    anomalie = None
                 
-                if resultat['success']:
-                    logger.info(f"Paiement {paiement.transaction_id} activé automatiquement")
+                if anomalie:
+                    compteurs[anomalie] += 1
+                    en_ecart.add(paiement.transaction_id)
+                    signaler(anomalie, paiement.transaction_id, details)
+                elif paiement.date_rapprochement == maintenant:
+                    # Déjà rapproché par un lot précédent de ce même relevé
+                    compteurs['doublon_releve'] += 1
+                    signaler('doublon_releve', paiement.transaction_id, details)
+                elif paiement.date_rapprochement:
+                    compteurs['deja_rapproches'] += 1
                 else:
-                    logger.error(f"Erreur activation automatique {paiement.transaction_id}: {resultat['error']}")
-                    
-        except Exception as e:
-            logger.error(f"Erreur lors de la vérification des paiements en attente: {e}")
+                    compteurs['rapproches'] += 1
+                    paiement.date_rapprochement = maintenant
+                    paiement.wave_reference = paiement.wave_reference or ligne['reference'] or None
+                    rapproches.append(paiement)
+                    if paiement.statut == 'en_attente':
+                        a_activer.append(paiement.id)
+            
+            # Lignes du relevé sans paiement correspondant
+            for transaction_id, ligne in releve.items():
+                compteurs['orphelin_releve'] += 1
+                signaler('orphelin_releve', transaction_id, {
+                    'montant_releve': ligne['montant'], 'telephone_releve': ligne['telephone'], 'reference': ligne['reference']
+                })
+            
+            if not appliquer or not rapproches:
+                continue
+            PaiementWave.objects.bulk_update(rapproches, ['date_rapprochement', 'wave_reference'], batch_size=1000)
+            if not a_activer:
+                continue
+            
+            # Activation dans sa propre transaction : un échec ne défait pas le rapprochement du lot
+            unitaires = []
+            try:
+                with transaction.atomic():
+                    verrou = {'skip_locked': connection.features.has_select_for_update_skip_locked}
+                    en_attente = list(
+                        PaiementWave.objects.select_for_update(**verrou).filter(id__in=a_activer, statut='en_attente').order_by('id')
+                    )
+                    actives, unitaires, incomplets = WaveCallbackService.activer_lot_paiements(en_attente)
+                compteurs['actives'] += actives
+                compteurs['erreurs_activation'] += incomplets
+            except Exception as e:
+                # Le lot a été annulé : ses paiements sont relus et repris un par un
+                logger.error(f"Activation du lot rapproché en échec, reprise paiement par paiement: {e}")
+                unitaires = list(PaiementWave.objects.filter(id__in=a_activer, statut='en_attente').order_by('id'))
+            for paiement in unitaires:
+                if WaveCallbackService._activer_un_paiement(paiement):
+                    compteurs['actives'] += 1
+                else:
+                    compteurs['erreurs_activation'] += 1
+        
+        # Paiements réussis de la période absents du relevé (lus en flux)
+        if appliquer and periode[0] is not None:
+            absents = PaiementWave.objects.filter(
+                statut='reussi',
+                montant__gt=0,
+                date_creation__range=(periode[0], periode[1]),
+                date_rapprochement__isnull=True
+            ).values_list('transaction_id', 'montant', 'wave_phone').order_by('id')
+            for transaction_id, montant, telephone in absents.iterator(chunk_size=taille_lot):
+                if transaction_id in en_ecart:
+                    continue
+                compteurs['orphelin_base'] += 1
+                signaler('orphelin_base', transaction_id, {'montant_base': montant, 'telephone_base': telephone or ''})
+        
+        resultats = dict(compteurs)
+        resultats['duree_secondes'] = time.perf_counter() - debut
+        resultats['lignes_par_seconde'] = (
+            compteurs['lignes'] / resultats['duree_secondes'] if resultats['duree_secondes'] > 0 else 0.0
+        )
+        resultats['periode'] = tuple(periode)
+        return resultats
+
 
 class CommissionService:
     """Service pour gérer les commissions des partenaires"""
     
+    MAX_TENTATIVES_EVENEMENT = 5
+    
     @staticmethod
     def attribuer_commission(abonnement):
-        """Attribue une commission au partenaire si l'abonnement provient d'un parrainage partenaire"""
+        """
+        Met en file l'attribution de la commission d'un abonnement payant ; le worker
+        traiter_commissions l'attribue hors du chemin de paiement (une seule fois par abonnement)
+        """
         try:
-            # Vérifier si l'utilisateur a un parrain et si ce parrain est un partenaire
-            if not hasattr(abonnement.utilisateur, 'parrain') or not abonnement.utilisateur.parrain:
-                return {'success': False, 'message': 'Aucun parrain trouvé'}
-            
-            parrain = abonnement.utilisateur.parrain.parrain
-            
-            # Vérifier si le parrain est un partenaire
-            if parrain.role != 'partenaire':
-                return {'success': False, 'message': 'Le parrain n\'est pas un partenaire'}
-            
-            # Vérifier que l'abonnement n'est pas gratuit
             if abonnement.montant_paye <= 0:
                 return {'success': False, 'message': 'Aucune commission sur les abonnements gratuits'}
-            
-            # Récupérer la configuration pour le pourcentage
-            from utilisateurs.models import ConfigurationPartenaire
-            config = ConfigurationPartenaire.get_configuration_active()
-            pourcentage = config.pourcentage_commission_default
-            
-            # Calculer la commission
-            from decimal import Decimal
-            montant_commission = Decimal(str(abonnement.montant_paye)) * Decimal(str(pourcentage)) / Decimal('100')
-            
-            # Créer l'enregistrement de commission
-            from utilisateurs.models import Commission
-            commission = Commission.objects.create(
-                partenaire=parrain,
-                montant_abonnement=Decimal(str(abonnement.montant_paye)),
-                montant_commission=montant_commission,
-                abonnement_id=abonnement.id
-            )
-            
-            # Mettre à jour le champ commission_totale_accumulee
-            parrain.commission_totale_accumulee += montant_commission
-            parrain.save()
-            
-            print(f"✅ Commission de {montant_commission} FCFA ({pourcentage}%) attribuée au partenaire {parrain.email}")
-            
-            return {
-                'success': True,
-                'commission': float(montant_commission),
-                'pourcentage': float(pourcentage),
-                'partenaire': parrain.email,
-                'message': f'Commission de {montant_commission} FCFA ({pourcentage}%) attribuée'
-            }
-            
+            CommissionService.signaler_abonnements([abonnement])
+            return {'success': True, 'message': 'Attribution de la commission planifiée'}
         except Exception as e:
-            print(f"❌ Erreur lors de l'attribution de la commission: {e}")
+            logger.error(f"Erreur lors de la mise en file de la commission de l'abonnement {abonnement.id}: {e}")
             return {
                 'success': False,
                 'error': str(e)
             }
     
+    @staticmethod
+    def signaler_abonnements(abonnements):
+        """Met en file les abonnements payants créés sans post_save (bulk_create), en une insertion"""
+        EvenementCommission.objects.bulk_create(
+            [EvenementCommission(abonnement_id=abonnement.id) for abonnement in abonnements if abonnement.montant_paye > 0],
+            ignore_conflicts=True
+        )
+    
+    @staticmethod
+    def attribuer_commissions(abonnements):
+        """
+        Attribue en une passe les commissions d'un lot d'abonnements payants :
+        une requête pour les parrains partenaires, une insertion, un UPDATE F() par partenaire
+        (les abonnements d'un même partenaire sont cumulés). À appeler dans une transaction.
+        """
+        from decimal import Decimal
+        from collections import defaultdict
+        from utilisateurs.models import ConfigurationPartenaire
+        
+        payants = [abonnement for abonnement in abonnements if abonnement.montant_paye > 0]
+        if not payants:
+            return []
+        partenaires = dict(
+            Parrainage.objects.filter(
+                filleul_id__in={abonnement.utilisateur_id for abonnement in payants}, parrain__role='partenaire'
+            ).values_list('filleul_id', 'parrain_id')
+        )
+        if not partenaires:
+            return []
+        
+        pourcentage = ConfigurationPartenaire.get_configuration_active().pourcentage_commission_default
+        commissions = []
+        totaux = defaultdict(Decimal)
+        for abonnement in payants:
+            partenaire_id = partenaires.get(abonnement.utilisateur_id)
+            if partenaire_id is None:
+                continue
+            montant_abonnement = Decimal(str(abonnement.montant_paye))
+            montant_commission = montant_abonnement * Decimal(str(pourcentage)) / Decimal('100')
+            commissions.append(Commission(
+                partenaire_id=partenaire_id,
+                montant_abonnement=montant_abonnement,
+                montant_commission=montant_commission,
+                abonnement_id=abonnement.id
+            ))
+            totaux[partenaire_id] += montant_commission
+        
+        Commission.objects.bulk_create(commissions)
+        # bulk_create ne déclenche pas post_save : report explicite dans les soldes et cumuls quotidiens
+        enregistrer_commissions(commissions)
+        for partenaire_id, total in totaux.items():
+            Utilisateur.objects.filter(pk=partenaire_id).update(
+                commission_totale_accumulee=models.F('commission_totale_accumulee') + total
+            )
+        logger.info(f"{len(commissions)} commissions attribuées à {len(totaux)} partenaires")
+        return commissions
+    
+    @staticmethod
+    def _traiter_lot_evenements(evenement_ids):
+        """
+        Traite un lot d'événements dans une transaction : événements verrouillés, commissions
+        attribuées en une passe, événements marqués. Retourne (traités, ignorés).
+        """
+        with transaction.atomic():
+            verrou = EvenementCommission.objects.select_for_update(
+                skip_locked=connection.features.has_select_for_update_skip_locked
+            )
+            evenements = dict(
+                verrou.filter(id__in=evenement_ids, statut=EvenementCommission.STATUT_A_TRAITER)
+                .values_list('id', 'abonnement_id')
+            )
+            if not evenements:
+                return 0, 0
+            abonnements = list(
+                Abonnement.objects.filter(id__in=evenements.values()).only('id', 'utilisateur_id', 'montant_paye')
+            )
+            commissionnes = {commission.abonnement_id for commission in CommissionService.attribuer_commissions(abonnements)}
+            
+            maintenant = timezone.now()
+            traites = [pk for pk, abonnement_id in evenements.items() if abonnement_id in commissionnes]
+            ignores = [pk for pk, abonnement_id in evenements.items() if abonnement_id not in commissionnes]
+            EvenementCommission.objects.filter(id__in=traites).update(
+                statut=EvenementCommission.STATUT_TRAITE, date_traitement=maintenant,
+                tentatives=models.F('tentatives') + 1, derniere_erreur=''
+            )
+            EvenementCommission.objects.filter(id__in=ignores).update(
+                statut=EvenementCommission.STATUT_IGNORE, date_traitement=maintenant,
+                tentatives=models.F('tentatives') + 1, derniere_erreur='Aucun parrain partenaire'
+            )
+            return len(traites), len(ignores)
+    
+    @staticmethod
+    def traiter_evenements(limite=500):
+        """
+        Traite la file des abonnements payants créés, du plus ancien au plus récent, en une
+        transaction pour tout le lot : les rafales d'un même partenaire donnent un seul UPDATE.
+        Si le lot échoue, ses événements sont repris un par un pour isoler l'événement fautif.
+        """
+        resultats = {'lus': 0, EvenementCommission.STATUT_TRAITE: 0, EvenementCommission.STATUT_IGNORE: 0,
+                     EvenementCommission.STATUT_ERREUR: 0, EvenementCommission.STATUT_A_TRAITER: 0}
+        evenement_ids = list(
+            EvenementCommission.objects.filter(statut=EvenementCommission.STATUT_A_TRAITER)
+            .order_by('id').values_list('id', flat=True)[:limite]
+        )
+        resultats['lus'] = len(evenement_ids)
+        if not evenement_ids:
+            return resultats
+        
+        try:
+            traites, ignores = CommissionService._traiter_lot_evenements(evenement_ids)
+            resultats[EvenementCommission.STATUT_TRAITE] += traites
+            resultats[EvenementCommission.STATUT_IGNORE] += ignores
+            return resultats
+        except Exception as e:
+            logger.error(f"Lot de {len(evenement_ids)} événements de commission en erreur, reprise unitaire: {e}")
+        
+        for evenement_id in evenement_ids:
+            try:
+                traites, ignores = CommissionService._traiter_lot_evenements([evenement_id])
+                resultats[EvenementCommission.STATUT_TRAITE] += traites
+                resultats[EvenementCommission.STATUT_IGNORE] += ignores
+            except Exception as e:
+                logger.error(f"Erreur lors de l'attribution de commission (événement {evenement_id}): {e}")
+                EvenementCommission.objects.filter(id=evenement_id).update(
+                    tentatives=models.F('tentatives') + 1, derniere_erreur=str(e)
+                )
+                if EvenementCommission.objects.filter(
+                    id=evenement_id, tentatives__gte=CommissionService.MAX_TENTATIVES_EVENEMENT
+                ).update(statut=EvenementCommission.STATUT_ERREUR, date_traitement=timezone.now()):
+                    resultats[EvenementCommission.STATUT_ERREUR] += 1
+                else:
+                    resultats[EvenementCommission.STATUT_A_TRAITER] += 1
+        return resultats
+    
+    @staticmethod
+    def get_filleuls_partenaire(partenaire_id):
+        """
+        Filleuls d'un partenaire en une requête (champs de FilleulSerializer + id de parrainage) :
+        abonnement actif via Exists(), commission totale via une sous-requête Sum sur les
+        commissions du partenaire liées aux abonnements du filleul
+        """
+        from decimal import Decimal
+        from django.db.models import DecimalField, Exists, F, OuterRef, Subquery, Sum, Value
+        from django.db.models.functions import Coalesce
+        
+        abonnements_filleul = Abonnement.objects.filter(utilisateur_id=OuterRef(OuterRef('filleul_id'))).values('id')
+        commissions = Commission.objects.filter(
+            partenaire_id=OuterRef('parrain_id'), abonnement_id__in=abonnements_filleul
+        ).order_by().values('partenaire_id').annotate(total=Sum('montant_commission')).values('total')
+        
+        return Parrainage.objects.filter(parrain_id=partenaire_id).annotate(
+            abonnement_actif=Exists(Abonnement.objects.filter(utilisateur_id=OuterRef('filleul_id'), statut='actif')),
+            commission_totale=Coalesce(
+                Subquery(commissions, output_field=DecimalField(max_digits=10, decimal_places=2)),
+                Value(Decimal('0')), output_field=DecimalField(max_digits=10, decimal_places=2)
+            ),
+        ).values(
+            'id', 'abonnement_actif', 'commission_totale',
+            nom=F('filleul__last_name'), prenom=F('filleul__first_name'), email=F('filleul__email'),
+            date_inscription=F('date_parrainage'),
+        )
+    
+    @staticmethod
+    def get_solde(partenaire_id):
+        """Solde matérialisé d'un partenaire (un solde vide s'il n'a encore rien gagné)"""
+        from utilisateurs.models import SoldeCommission
+        return SoldeCommission.objects.filter(partenaire_id=partenaire_id).first() or SoldeCommission(partenaire_id=partenaire_id)
+    
     @staticmethod
     def get_statistiques_partenaire(partenaire):
-        """Récupère les statistiques d'un partenaire"""
+        """
+        Récupère les statistiques d'un partenaire en deux requêtes, quel que soit son historique :
+        le solde matérialisé et les cumuls quotidiens du mois en cours et des 30 derniers jours
+        """
+        from decimal import Decimal
+        from django.db.models import Q, Sum
+        from utilisateurs.models import CommissionJournaliere, ConfigurationPartenaire
+        
         try:
-            commissions = Commission.objects.filter(partenaire=partenaire)
+            solde = CommissionService.get_solde(partenaire.pk)
             
-            # Statistiques générales
-            total_commissions = sum(c.montant_commission for c in commissions)
-            total_abonnements = commissions.count()
-            
-            # Commissions du mois en cours
-            maintenant = timezone.now()
-            debut_mois = maintenant.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            commissions_mois = commissions.filter(date_commission__gte=debut_mois)
-            commissions_mois_total = sum(c.montant_commission for c in commissions_mois)
+            aujourd_hui = timezone.localdate()
+            debut_mois = aujourd_hui.replace(day=1)
+            il_y_a_30_jours = aujourd_hui - timedelta(days=30)
+            periodes = CommissionJournaliere.objects.filter(
+                partenaire_id=partenaire.pk, jour__gte=min(debut_mois, il_y_a_30_jours)
+            ).aggregate(
+                mois=Sum('montant', filter=Q(jour__gte=debut_mois)),
+                trente_jours=Sum('montant', filter=Q(jour__gte=il_y_a_30_jours)),
+            )
             
-            # Commissions des 30 derniers jours
-            il_y_a_30_jours = maintenant - timedelta(days=30)
-            commissions_30j = commissions.filter(date_commission__gte=il_y_a_30_jours)
-            commissions_30j_total = sum(c.montant_commission for c in commissions_30j)
+            config = ConfigurationPartenaire.get_configuration_active()
+            multiple = Decimal(str(config.montant_retrait_multiple))
+            disponible = Decimal(str(solde.disponible))
+            montant_retrait_maximum = (disponible // multiple) * multiple if multiple > 0 else disponible
             
             return {
-                'total_commissions': float(total_commissions),
-                'total_abonnements': total_abonnements,
-                'commissions_mois': float(commissions_mois_total),
-                'commissions_30j': float(commissions_30j_total),
-                'commission_disponible': float(partenaire.commission_disponible),
-                'peut_retirer': partenaire.peut_retirer,
-                'montant_retrait_maximum': float(partenaire.montant_retrait_maximum)
+                'total_commissions': float(solde.total_gagne),
+                'total_abonnements': solde.nombre_commissions,
+                'commissions_mois': float(periodes['mois'] or 0),
+                'commissions_30j': float(periodes['trente_jours'] or 0),
+                'commission_disponible': float(disponible),
+                'peut_retirer': solde.total_gagne >= config.seuil_retrait_minimum,
+                'montant_retrait_maximum': float(montant_retrait_maximum)
             }
             
         except Exception as e:
-            print(f"❌ Erreur lors du calcul des statistiques: {e}")
+            logger.error(f"Erreur lors du calcul des statistiques du partenaire {partenaire.pk}: {e}")
             return {
                 'error': str(e)
             }
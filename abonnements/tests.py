@@ -1,3 +1,956 @@
-from django.test import TestCase
+import os
+import random
+import time
+from datetime import date, datetime, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from utilisateurs.models import LienParentEnfant, PreferencesUtilisateur, Utilisateur
+from utilisateurs.views import UtilisateurViewSet
+from .views import WaveCallbackView, get_packs_standards
+from .models import (
+    Abonnement, AbonnementActuel, BonusParrainage, CohorteConversion, EcheanceAbonnement, EvenementWave, PackAbonnement, PackFamilial, PackPermissions, PaiementWave,
+    Parrainage, RevenuJournalier, UsageMensuelle, VerrouPlanificateur,
+)
+from .checks import verifier_cache_partage
+from .services import (
+    AbonnementService, CacheDroitsService, EntonnoirConversionService, ExpirationService, IndexIntervallesAbonnements, ParrainageService, PasserelleRenouvellement, RapprochementWaveService,
+    PermissionService, PlanificateurService, ReferentielService, RenouvellementService, RevenusJournaliersService, UsageMensuelleService, WaveCallbackService,
+)
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def instant(jour):
+    """Midi (fuseau du projet) du jour donné"""
+    return timezone.make_aware(datetime.combine(jour, datetime.min.time()) + timedelta(hours=12))
+
+
+class IndexIntervallesAbonnementsTests(SimpleTestCase):
+    """Balayage de l'index d'intervalles, comparé à un décompte jour par jour"""
+
+    DEBUT = date(2025, 3, 1)
+    FIN = date(2025, 3, 31)
+
+    def balayer(self, *lignes):
+        return IndexIntervallesAbonnements.construire(
+            sorted(lignes, key=lambda ligne: ligne[0])
+        ).balayer(self.DEBUT, self.FIN)
+
+    def jour(self, jours, valeur):
+        return jours[(valeur - self.DEBUT).days]
+
+    def test_successeur_commencant_le_jour_de_fin(self):
+        fin = date(2025, 3, 10)
+        jours = self.balayer(
+            (instant(date(2025, 3, 5)), instant(fin), instant(fin), 'standard', 3000, False),
+            (instant(fin), instant(fin + timedelta(days=30)), None, 'standard', 3000, True),
+        )
+        # Relais sans trou ni chevauchement : un seul actif, aucun désabonnement
+        self.assertEqual([j['actifs'] for j in jours[4:15]], [1] * 11)
+        self.assertEqual(sum(j['desabonnements'] for j in jours), 0)
+        self.assertEqual(self.jour(jours, fin)['nouveaux_payants'], 1)
+
+    def test_desabonnement_sans_successeur(self):
+        fin = date(2025, 3, 10)
+        jours = self.balayer((instant(date(2025, 3, 5)), instant(fin), None, 'standard', 3000, False))
+        self.assertEqual(self.jour(jours, fin - timedelta(days=1))['payants'], 1)
+        self.assertEqual(self.jour(jours, fin)['payants'], 0)
+        self.assertEqual(self.jour(jours, fin)['desabonnements'], 1)
+        self.assertEqual(self.jour(jours, fin)['taux_desabonnement'], 100.0)
+
+    def test_abonnement_illimite_actif(self):
+        jours = self.balayer((instant(date(2025, 1, 1)), None, None, 'gratuit', 0, True))
+        self.assertEqual({j['actifs'] for j in jours}, {1})
+        self.assertEqual({j['payants'] for j in jours}, {0})
+        self.assertEqual(sum(j['desabonnements'] for j in jours), 0)
+
+    def test_illimite_desactive_sans_successeur_ignore(self):
+        jours = self.balayer((instant(date(2025, 1, 1)), None, None, 'gratuit', 0, False))
+        self.assertEqual({j['actifs'] for j in jours}, {0})
+
+    def test_fin_le_premier_jour(self):
+        jours = self.balayer((instant(date(2025, 2, 1)), instant(self.DEBUT), None, 'standard', 3000, False))
+        self.assertEqual(jours[0]['actifs'], 0)
+        self.assertEqual(jours[0]['desabonnements'], 1)
+
+    def test_intervalle_a_cheval_sur_le_debut(self):
+        jours = self.balayer((instant(date(2025, 2, 20)), instant(date(2025, 3, 22)), None, 'premium', 6000, False))
+        self.assertEqual(jours[0]['actifs'], 1)
+        self.assertEqual(jours[0]['payants'], 1)
+        # Commencé avant la période : pas un nouveau payant de la période
+        self.assertEqual(sum(j['nouveaux_payants'] for j in jours), 0)
+        self.assertEqual(jours[0]['revenu_journalier'], 200.0)
+        self.assertEqual(jours[0]['mrr_par_type'], {'premium': 6000.0})
+        self.assertEqual(self.jour(jours, date(2025, 3, 22))['desabonnements'], 1)
+
+    def test_balayage_conforme_au_decompte(self):
+        aleatoire = random.Random(16)
+        lignes = []
+        for _ in range(300):
+            debut = date(2025, 1, 1) + timedelta(days=aleatoire.randint(0, 120))
+            fin = debut + timedelta(days=aleatoire.choice([7, 30, 90])) if aleatoire.random() < 0.9 else None
+            suivant = None
+            if aleatoire.random() < 0.4:
+                suivant = (fin or debut + timedelta(days=60)) - timedelta(days=aleatoire.randint(-1, 3))
+                suivant = max(suivant, debut + timedelta(days=1))
+            montant = aleatoire.choice([0, 1000, 3000])
+            lignes.append((debut, fin, suivant, montant, aleatoire.random() < 0.5))
+
+        jours = self.balayer(*[
+            (instant(debut), instant(fin) if fin else None, instant(suivant) if suivant else None,
+             'standard', montant, actif)
+            for debut, fin, suivant, montant, actif in lignes
+        ])
+
+        attendus = {jour: {'actifs': 0, 'payants': 0, 'nouveaux_payants': 0, 'desabonnements': 0}
+                    for jour in (self.DEBUT + timedelta(days=n) for n in range((self.FIN - self.DEBUT).days + 1))}
+        for debut, fin_prevue, suivant, montant, actif in lignes:
+            fin = min(d for d in (fin_prevue, suivant) if d) if (fin_prevue or suivant) else None
+            if fin is None and not actif:
+                continue
+            if fin is not None and fin <= debut:
+                continue
+            payant = montant > 0 and fin_prevue is not None
+            renouvele = suivant is not None and fin is not None and suivant <= fin + timedelta(days=1)
+            for jour, compteurs in attendus.items():
+                if debut <= jour and (fin is None or jour < fin):
+                    compteurs['actifs'] += 1
+                    compteurs['payants'] += payant
+                if payant and jour == debut:
+                    compteurs['nouveaux_payants'] += 1
+                if payant and jour == fin and not renouvele:
+                    compteurs['desabonnements'] += 1
+
+        for jour in jours:
+            with self.subTest(jour=jour['date']):
+                self.assertEqual(
+                    {cle: jour[cle] for cle in ('actifs', 'payants', 'nouveaux_payants', 'desabonnements')},
+                    attendus[jour['date']]
+                )
+
+
+class RapprochementWaveTests(TestCase):
+    """Rapprochement du relevé fixtures/releve_wave.csv avec les paiements"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pack = PackAbonnement.objects.create(
+            nom='Standard', type_pack='standard', description='Pack standard', prix=3000, periode='mois', duree_jours=30
+        )
+        # Le référentiel se recharge au commit, jamais atteint dans un TestCase
+        ReferentielService.invalider()
+        cls.utilisateur = Utilisateur.objects.create(email='eleve@example.com', first_name='Awa', last_name='Diop')
+        paiements = [
+            ('WAVE_RAPPROCHE', 'reussi', '771111111'),
+            ('WAVE_MONTANT', 'reussi', '772222222'),
+            ('WAVE_TELEPHONE', 'reussi', '771234567'),
+            ('WAVE_EN_ATTENTE', 'en_attente', '775555555'),
+            ('WAVE_ABSENT', 'reussi', '777777777'),
+        ]
+        PaiementWave.objects.bulk_create([
+            PaiementWave(
+                transaction_id=transaction_id, montant=3000, statut=statut, wave_phone=telephone,
+                pack_id=cls.pack.id, utilisateur_id=cls.utilisateur.id
+            )
+            for transaction_id, statut, telephone in paiements
+        ])
+        PaiementWave.objects.update(date_creation=timezone.make_aware(datetime(2025, 6, 1, 9, 30)))
+        # Paiement réussi créé pendant la période couverte par le relevé, mais absent de celui-ci
+        PaiementWave.objects.filter(transaction_id='WAVE_ABSENT').update(
+            date_creation=timezone.make_aware(datetime(2025, 6, 1, 12, 30))
+        )
+
+    def rapprocher(self, **options):
+        anomalies = []
+        with open(os.path.join(FIXTURES, 'releve_wave.csv'), newline='', encoding='utf-8') as fichier:
+            resultats = RapprochementWaveService.rapprocher(
+                RapprochementWaveService.lire_releve(fichier, 'csv'),
+                signaler=lambda anomalie, transaction_id, details: anomalies.append((anomalie, transaction_id)),
+                **options
+            )
+        return resultats, anomalies
+
+    def test_rapprochement(self):
+        resultats, anomalies = self.rapprocher()
+
+        self.assertEqual(resultats['lignes'], 7)
+        self.assertEqual(resultats['ignores'], 1)
+        self.assertEqual(resultats['rapproches'], 2)
+        self.assertEqual(resultats['actives'], 1)
+        self.assertEqual(sorted(anomalies), [
+            ('doublon_releve', 'WAVE_RAPPROCHE'),
+            ('ecart_montant', 'WAVE_MONTANT'),
+            ('ecart_telephone', 'WAVE_TELEPHONE'),
+            ('orphelin_base', 'WAVE_ABSENT'),
+            ('orphelin_releve', 'WAVE_INCONNU'),
+        ])
+
+        rapproche = PaiementWave.objects.get(transaction_id='WAVE_RAPPROCHE')
+        self.assertIsNotNone(rapproche.date_rapprochement)
+        self.assertEqual(rapproche.wave_reference, 'T_W1')
+        self.assertIsNone(PaiementWave.objects.get(transaction_id='WAVE_MONTANT').date_rapprochement)
+
+        # Le paiement en attente, prouvé par le relevé, est activé avec la référence Wave
+        active = PaiementWave.objects.get(transaction_id='WAVE_EN_ATTENTE')
+        self.assertEqual(active.statut, 'reussi')
+        self.assertEqual(active.wave_reference, 'T_W5')
+        self.assertTrue(Abonnement.objects.filter(id=active.abonnement_id, utilisateur=self.utilisateur, actif=True).exists())
+
+    def test_releve_relu(self):
+        self.rapprocher()
+        resultats, anomalies = self.rapprocher()
+        self.assertEqual(resultats['deja_rapproches'], 2)
+        self.assertNotIn('rapproches', resultats)
+        self.assertNotIn('actives', resultats)
+        self.assertEqual(Abonnement.objects.filter(utilisateur=self.utilisateur).count(), 1)
+
+    def test_activation_en_echec_isolee(self):
+        with mock.patch.object(WaveCallbackService, 'activer_lot_paiements', side_effect=RuntimeError('lot')):
+            resultats, anomalies = self.rapprocher()
+        # Lot annulé puis repris paiement par paiement ; le rapprochement est conservé
+        self.assertEqual(resultats['actives'], 1)
+        self.assertEqual(PaiementWave.objects.filter(date_rapprochement__isnull=False).count(), 2)
+
+    def test_activation_impossible_sans_interrompre_le_releve(self):
+        with mock.patch.object(WaveCallbackService, 'activer_lot_paiements', side_effect=RuntimeError('lot')), \
+                mock.patch.object(WaveCallbackService, 'traiter_paiement_reussi', side_effect=RuntimeError('paiement')):
+            resultats, anomalies = self.rapprocher()
+        self.assertEqual(resultats['erreurs_activation'], 1)
+        self.assertNotIn('actives', resultats)
+        self.assertIn(('orphelin_base', 'WAVE_ABSENT'), anomalies)
+        self.assertEqual(PaiementWave.objects.filter(date_rapprochement__isnull=False).count(), 2)
+        self.assertEqual(PaiementWave.objects.get(transaction_id='WAVE_EN_ATTENTE').statut, 'en_attente')
+
+    def test_mode_test(self):
+        resultats, anomalies = self.rapprocher(appliquer=False)
+        self.assertEqual(resultats['rapproches'], 2)
+        self.assertNotIn('orphelin_base', resultats)
+        self.assertFalse(PaiementWave.objects.filter(date_rapprochement__isnull=False).exists())
+        self.assertEqual(PaiementWave.objects.get(transaction_id='WAVE_EN_ATTENTE').statut, 'en_attente')
+
+    def test_pas_d_activation_sans_preuve(self):
+        resultats = WaveCallbackService.verifier_paiements_en_attente()
+        self.assertFalse(resultats['activation_automatique'])
+        self.assertEqual(resultats['en_attente'], 1)
+        self.assertEqual(resultats['actives'], 0)
+        self.assertEqual(PaiementWave.objects.get(transaction_id='WAVE_EN_ATTENTE').statut, 'en_attente')
+
+    @override_settings(WAVE_ACTIVATION_AUTOMATIQUE=True)
+    def test_activation_automatique_sandbox(self):
+        resultats = WaveCallbackService.verifier_paiements_en_attente()
+        self.assertEqual(resultats['actives'], 1)
+        self.assertEqual(PaiementWave.objects.get(transaction_id='WAVE_EN_ATTENTE').statut, 'reussi')
+
+
+class PasserelleRenouvellementTest(PasserelleRenouvellement):
+    """Réponse fixée par abonnement ; panne simulée quand `panne` est vrai"""
+
+    def __init__(self, statuts, panne=False):
+        self.statuts = statuts
+        self.panne = panne
+
+    def initier_paiements(self, paiements):
+        if self.panne:
+            raise ConnectionError("Passerelle injoignable")
+        reponses = {}
+        for paiement in paiements:
+            statut = self.statuts[paiement.abonnement_id]
+            reponses[paiement.transaction_id] = {
+                'statut': statut,
+                'reference': f"REF_{paiement.abonnement_id}" if statut == 'reussi' else None,
+                'url': f"https://pay.wave.com/test?client_reference={paiement.transaction_id}",
+            }
+        return reponses
+
+
+class RenouvellementTests(TransactionTestCase):
+    """Moteur de renouvellement : seul un paiement prouvé prolonge l'abonnement"""
+
+    def setUp(self):
+        pack = PackAbonnement.objects.create(
+            nom='Standard', type_pack='standard', description='Pack standard', prix=3000, periode='mois', duree_jours=30
+        )
+        self.fin = timezone.now() + timedelta(days=2)
+        self.abonnements = {}
+        for statut in ('reussi', 'echoue', 'en_attente'):
+            utilisateur = Utilisateur.objects.create(email=f'{statut}@example.com', first_name=statut, last_name='Test')
+            PreferencesUtilisateur.objects.create(utilisateur=utilisateur)
+            self.abonnements[statut] = Abonnement.objects.create(
+                utilisateur=utilisateur, pack=pack, statut='actif', actif=True, renouvellement_auto=True,
+                montant_paye=3000, date_fin=self.fin
+            )
+        self.passerelle = PasserelleRenouvellementTest(
+            {abonnement.id: statut for statut, abonnement in self.abonnements.items()}
+        )
+
+    def renouveler(self, passerelle=None):
+        return RenouvellementService.renouveler(passerelle=passerelle or self.passerelle, workers=1)
+
+    def date_fin(self, statut):
+        return Abonnement.objects.get(id=self.abonnements[statut].id).date_fin
+
+    def intention(self, statut):
+        return PaiementWave.objects.get(abonnement_id=self.abonnements[statut].id)
+
+    def test_reponses_de_la_passerelle(self):
+        resultats = self.renouveler()
+
+        self.assertEqual(
+            (resultats['renouveles'], resultats['echoues'], resultats['en_attente'], resultats['erreurs']), (1, 1, 1, 0)
+        )
+        self.assertEqual(self.date_fin('reussi'), self.fin + timedelta(days=30))
+        self.assertEqual(self.intention('reussi').wave_reference, f"REF_{self.abonnements['reussi'].id}")
+        self.assertEqual(self.date_fin('echoue'), self.fin)
+        self.assertEqual(self.intention('echoue').statut, 'echoue')
+
+        # En attente : non prolongé, lien lié à la transaction conservé et envoyé à l'abonné
+        intention = self.intention('en_attente')
+        self.assertEqual(self.date_fin('en_attente'), self.fin)
+        self.assertEqual(intention.statut, 'en_attente')
+        self.assertTrue(intention.lien_paiement.endswith(f"client_reference={intention.transaction_id}"))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['en_attente@example.com'])
+        self.assertIn(intention.lien_paiement, mail.outbox[0].body)
+
+    @override_settings(WAVE_ACTIVATION_AUTOMATIQUE=True)
+    def test_en_attente_prolonge_seulement_sur_confirmation(self):
+        self.renouveler()
+        intention = self.intention('en_attente')
+        PaiementWave.objects.filter(id=intention.id).update(date_creation=timezone.now() - timedelta(hours=1))
+
+        # Le passage de vérification n'active pas une intention de renouvellement sans preuve
+        WaveCallbackService.verifier_paiements_en_attente()
+        self.assertEqual(self.intention('en_attente').statut, 'en_attente')
+        self.assertEqual(self.date_fin('en_attente'), self.fin)
+
+        resultat = WaveCallbackService.traiter_paiement_reussi(intention.transaction_id, 3000, 'WAVE_CONFIRME')
+        self.assertTrue(resultat['success'])
+        self.assertEqual(self.date_fin('en_attente'), self.fin + timedelta(days=30))
+        self.assertEqual(self.intention('en_attente').wave_reference, 'WAVE_CONFIRME')
+
+    def test_reprise_apres_panne(self):
+        resultats = self.renouveler(PasserelleRenouvellementTest(self.passerelle.statuts, panne=True))
+        self.assertEqual(resultats['erreurs'], 3)
+        self.assertEqual(PaiementWave.objects.filter(statut='en_attente').count(), 3)
+        self.assertEqual(self.date_fin('reussi'), self.fin)
+
+        # Relances : intentions resoumises sans doublon, prolongation et email une seule fois
+        self.renouveler()
+        self.renouveler()
+        self.assertEqual(PaiementWave.objects.count(), 3)
+        self.assertEqual(self.date_fin('reussi'), self.fin + timedelta(days=30))
+        self.assertEqual(self.date_fin('en_attente'), self.fin)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class StatistiquesParrainageTests(TestCase):
+    """Statistiques de parrainage en une requête, quel que soit le nombre de filleuls"""
+
+    FILLEULS = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.parrain = Utilisateur.objects.create(
+            email='parrain@example.com', role='partenaire', code_parrainage='PARRAIN1'
+        )
+        filleuls = Utilisateur.objects.bulk_create([
+            Utilisateur(email=f'filleul-{i}@example.com', code_parrain_utilise='PARRAIN1')
+            for i in range(cls.FILLEULS)
+        ])
+        maintenant = timezone.now()
+        Parrainage.objects.bulk_create([
+            Parrainage(
+                parrain=cls.parrain, filleul=filleul, code_parrainage='PARRAIN1',
+                bonus_attribue=i % 3 == 0, date_bonus_attribue=maintenant if i % 3 == 0 else None
+            )
+            for i, filleul in enumerate(filleuls)
+        ])
+        BonusParrainage.objects.create(utilisateur=cls.parrain, bonus_accumules=334, bonus_utilises=1)
+        # Un filleul sur deux abonné : le chemin Exists() des filleuls actifs est exercé
+        pack = PackAbonnement.objects.create(
+            nom='Standard', type_pack='standard', description='Pack standard', prix=3000, periode='mois', duree_jours=30
+        )
+        Abonnement.objects.bulk_create([
+            Abonnement(utilisateur=filleul, pack=pack, statut='actif', actif=True, date_fin=maintenant + timedelta(days=30))
+            for filleul in filleuls[::2]
+        ])
+
+    def test_statistiques(self):
+        with self.assertNumQueries(1):
+            stats = ParrainageService.get_statistiques_parrainage(self.parrain)
+        self.assertTrue(stats['success'])
+        self.assertEqual(stats['nombre_filleuls'], 1000)
+        self.assertEqual(stats['filleuls_actifs'], 500)
+        self.assertEqual(stats['filleuls_payants'], 334)
+        self.assertEqual(stats['inscrits_avec_code'], 1000)
+        self.assertEqual(stats['bonus_disponibles'], 333)
+
+    def test_filleuls(self):
+        with self.assertNumQueries(1):
+            resultat = ParrainageService.get_filleuls(self.parrain)
+        self.assertEqual(resultat['total'], 1000)
+        self.assertEqual(sum(filleul['abonnement_actif'] for filleul in resultat['filleuls']), 500)
+
+    def test_action_parrainage(self):
+        requete = APIRequestFactory().get('/')
+        force_authenticate(requete, user=self.parrain)
+        with self.assertNumQueries(1):
+            reponse = UtilisateurViewSet.as_view({'get': 'parrainage'})(requete)
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(reponse.data['total_parrainages'], 1000)
+
+
+class RevenusJournaliersTests(TestCase):
+    """Cumuls quotidiens : le pack est résolu selon le type enregistré sur le paiement, même à id égal"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pack = PackAbonnement.objects.create(
+            nom='Standard', type_pack='standard', description='Pack standard', prix=3000, periode='mois', duree_jours=30
+        )
+        # Même id que le PackAbonnement : seul le type enregistré sur le paiement les distingue
+        cls.pack_familial = PackFamilial.objects.create(
+            id=cls.pack.id, nom='Famille 2 enfants', description='Pack familial', prix=10000
+        )
+        ReferentielService.invalider()
+        parent = Utilisateur.objects.create(email='parent@example.com', role='parent')
+        enfant = Utilisateur.objects.create(email='enfant@example.com')
+        paiements = [
+            ('WAVE_INDIVIDUEL', 3000, parent.id, None, False),
+            ('WAVE_ENFANT_INDIVIDUEL', 3000, enfant.id, parent.id, False),
+            ('WAVE_FAMILLE_A', 8000, parent.id, None, True),
+            (f'WAVE_FAMILLE_A_ENFANT_{enfant.id}', 0, enfant.id, parent.id, True),
+            # Paiement familial sur le PackAbonnement : résolu comme sur le chemin de paiement
+            ('WAVE_FAMILLE_B', 3000, parent.id, None, False),
+        ]
+        PaiementWave.objects.bulk_create([
+            PaiementWave(
+                transaction_id=transaction_id, montant=montant, statut='reussi', pack_id=cls.pack.id,
+                pack_familial=pack_familial, utilisateur_id=utilisateur_id, parent_id=parent_id
+            )
+            for transaction_id, montant, utilisateur_id, parent_id, pack_familial in paiements
+        ])
+
+    def test_paiement_familial(self):
+        jour = timezone.localdate()
+        RevenusJournaliersService.calculer(jour, jour)
+
+        self.assertEqual(
+            set(RevenuJournalier.objects.values_list('pack_familial', 'famille', 'paye_par_parent', 'nombre', 'montant')),
+            {
+                (False, False, False, 1, 3000), (False, False, True, 1, 3000), (True, True, False, 1, 8000),
+                (True, True, True, 1, 0), (False, True, False, 1, 3000),
+            }
+        )
+
+        revenus = RevenusJournaliersService.get_revenus(jour, jour)
+        self.assertEqual(revenus['revenus'], 17000)
+        self.assertEqual((revenus['famille']['nombre'], revenus['famille']['montant']), (3, 11000))
+        self.assertEqual((revenus['individuel']['nombre'], revenus['individuel']['montant']), (2, 6000))
+        self.assertEqual((revenus['paye_par_parent']['nombre'], revenus['paye_par_parent']['montant']), (2, 3000))
+        self.assertEqual(
+            [(pack['pack_id'], pack['pack_familial'], pack['nom'], pack['montant']) for pack in revenus['par_pack']],
+            [(self.pack.id, False, 'Standard', 9000), (self.pack.id, True, 'Famille 2 enfants', 8000)]
+        )
+
+    def test_recalcul_sans_double_comptage(self):
+        jour = timezone.localdate()
+        RevenusJournaliersService.calculer(jour, jour)
+        RevenusJournaliersService.calculer(jour, jour)
+        self.assertEqual(RevenusJournaliersService.get_revenus(jour, jour)['revenus'], 17000)
+
+
+class EntonnoirConversionTests(TestCase):
+    """Reconstruction des cohortes de conversion (semaine d'inscription, source, code partenaire)"""
+
+    CODE_PARTENAIRE = 'ECOLE-PLATEAU-2026'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.inscription = timezone.now() - timedelta(days=10)
+        pack = PackAbonnement.objects.create(
+            nom='Standard', type_pack='standard', description='Pack standard', prix=3000, periode='mois', duree_jours=30
+        )
+
+        def utilisateur(email, **champs):
+            return Utilisateur.objects.create(email=email, date_joined=cls.inscription, **champs)
+
+        utilisateur('partenaire@example.com', role='partenaire', code_parrainage=cls.CODE_PARTENAIRE)
+        utilisateur('parent@example.com', role='parent', code_parrainage='PARENT01')
+        utilisateur('direct@example.com')
+        fidele = utilisateur('fidele@example.com')
+        eleve_partenaire = utilisateur('eleve@example.com', code_parrain_utilise=cls.CODE_PARTENAIRE)
+        utilisateur('filleul@example.com', code_parrain_utilise='PARENT01')
+
+        Abonnement.objects.create(
+            utilisateur=eleve_partenaire, pack=pack, statut='essai', est_essai_gratuit=True,
+            date_debut=cls.inscription + timedelta(days=1)
+        )
+        PaiementWave.objects.bulk_create([
+            PaiementWave(transaction_id=transaction_id, montant=3000, statut='reussi', pack_id=pack.id,
+                         utilisateur_id=utilisateur_id)
+            for transaction_id, utilisateur_id in (
+                ('WAVE_FIDELE_1', fidele.id), ('WAVE_FIDELE_2', fidele.id), ('WAVE_ELEVE_1', eleve_partenaire.id)
+            )
+        ])
+
+    def cohortes(self):
+        return {
+            (cohorte.source, cohorte.code_partenaire): (
+                cohorte.inscrits, cohorte.essais, cohorte.payants, cohorte.payants_apres_essai, cohorte.renouveles
+            )
+            for cohorte in CohorteConversion.objects.all()
+        }
+
+    def test_construire(self):
+        resultats = EntonnoirConversionService.construire(taille_lot=2)
+
+        self.assertEqual((resultats['utilisateurs'], resultats['cohortes']), (6, 3))
+        semaine = EntonnoirConversionService._semaine(self.inscription)
+        self.assertEqual(set(CohorteConversion.objects.values_list('semaine', flat=True)), {semaine})
+        self.assertEqual(self.cohortes(), {
+            (CohorteConversion.SOURCE_DIRECT, ''): (4, 0, 1, 0, 1),
+            (CohorteConversion.SOURCE_PARTENAIRE, self.CODE_PARTENAIRE): (1, 1, 1, 1, 0),
+            (CohorteConversion.SOURCE_PARRAINAGE, ''): (1, 0, 0, 0, 0),
+        })
+
+        entonnoir = EntonnoirConversionService.get_entonnoir(code_partenaire=self.CODE_PARTENAIRE)['total']
+        self.assertEqual((entonnoir['inscrits'], entonnoir['payants']), (1, 1))
+
+    def test_reconstruction_sans_double_comptage(self):
+        EntonnoirConversionService.construire()
+        premiere = self.cohortes()
+        EntonnoirConversionService.construire()
+        self.assertEqual(self.cohortes(), premiere)
+
+
+class CacheDroitsTests(SimpleTestCase):
+    """Le cache des droits n'est utilisé qu'avec un cache partagé entre les workers"""
+
+    CACHE_PARTAGE = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache:6379'}}
+
+    def test_cache_local_contourne(self):
+        self.assertFalse(CacheDroitsService.cache_partage())
+        self.assertIsNone(CacheDroitsService.get_cle(1))
+        with self.settings(DEBUG=False):
+            self.assertEqual([alerte.id for alerte in verifier_cache_partage(None)], ['abonnements.W001'])
+
+    @override_settings(CACHES=CACHE_PARTAGE)
+    def test_cache_partage(self):
+        self.assertTrue(CacheDroitsService.cache_partage())
+        self.assertEqual(verifier_cache_partage(None), [])
+
+
+class ReferentielTests(TestCase):
+    """Registre en mémoire : rechargé après un âge borné, même sans changement de version"""
+
+    def test_rechargement_apres_age_max(self):
+        ReferentielService.invalider()
+        ReferentielService.get_packs()
+        # Écriture sans signal : aucune version changée
+        pack = PackAbonnement.objects.bulk_create([PackAbonnement(
+            nom='Premium', type_pack='premium', description='Pack premium', prix=6000, periode='mois', duree_jours=30
+        )])[0]
+        self.assertIsNone(ReferentielService.get_pack(pack.id))
+
+        ReferentielService._verifie_a = ReferentielService._charge_a = time.monotonic() - ReferentielService._age_max()
+        self.assertEqual(ReferentielService.get_pack(pack.id).nom, 'Premium')
+
+
+class WaveCallbackViewTests(TestCase):
+    """Enregistrement des callbacks Wave, en JSON comme en formulaire"""
+
+    def poster(self, donnees, format_requete):
+        return WaveCallbackView.as_view()(APIRequestFactory().post('/', donnees, format=format_requete))
+
+    def test_callback_formulaire(self):
+        reponse = self.poster({'transaction_id': 'WAVE_FORMULAIRE', 'status': 'success'}, 'multipart')
+        self.assertEqual(reponse.data, {'status': 'success', 'doublon': False})
+        evenement = EvenementWave.objects.get()
+        self.assertEqual(evenement.transaction_id, 'WAVE_FORMULAIRE')
+        self.assertEqual(evenement.cle_dedoublonnage, 'WAVE_FORMULAIRE:success')
+
+        self.assertTrue(self.poster({'transaction_id': 'WAVE_FORMULAIRE', 'status': 'success'}, 'json').data['doublon'])
+        self.assertEqual(EvenementWave.objects.count(), 1)
+
+
+class CatalogueTests(TestCase):
+    """Catalogues de packs : réservés aux utilisateurs authentifiés, donc jamais en cache partagé"""
+
+    def test_cache_prive_et_etag(self):
+        utilisateur = Utilisateur.objects.create(email='eleve@example.com')
+        requete = APIRequestFactory().get('/')
+        force_authenticate(requete, user=utilisateur)
+        reponse = get_packs_standards(requete)
+        self.assertEqual(reponse.status_code, 200)
+        self.assertTrue(reponse['Cache-Control'].startswith('private,'))
+
+        requete = APIRequestFactory().get('/', HTTP_IF_NONE_MATCH=reponse['ETag'])
+        force_authenticate(requete, user=utilisateur)
+        self.assertEqual(get_packs_standards(requete).status_code, 304)
+
+
+class PaiementFamilialTests(TestCase):
+    """Confirmation d'un paiement familial : parent et enfants provisionnés ensemble, ou rien"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pack = PackAbonnement.objects.create(
+            nom='Famille', type_pack='famille', description='Pack famille', prix=8000, periode='mois', duree_jours=30
+        )
+        cls.pack_familial = PackFamilial.objects.create(
+            nom='Famille 2 enfants', nombre_enfants=2, description='Pack familial', prix=10000
+        )
+        cls.pack_familial_sans_equivalent = PackFamilial.objects.create(
+            nom='Famille 4 enfants', type_familial='familial_4', nombre_enfants=4, description='Pack familial', prix=15000
+        )
+        ReferentielService.invalider()
+        cls.parent = Utilisateur.objects.create(email='parent@example.com', role='parent')
+        cls.enfant = Utilisateur.objects.create(email='enfant@example.com')
+        LienParentEnfant.objects.create(parent=cls.parent, enfant=cls.enfant)
+        PaiementWave.objects.create(
+            transaction_id='WAVE_FAMILLE_TEST', montant=8000, pack_id=cls.pack.id, utilisateur_id=cls.parent.id
+        )
+        cls.evenement, _ = WaveCallbackService.enregistrer_evenement(
+            {'transaction_id': 'WAVE_FAMILLE_TEST', 'status': 'success', 'amount': 8000, 'reference': 'T_FAMILLE'}
+        )
+
+    def test_provisionnement_en_echec(self):
+        with mock.patch.object(ParrainageService, 'attribuer_bonus_parrainages', side_effect=RuntimeError('bonus')):
+            statut = WaveCallbackService.traiter_evenement(self.evenement.id)
+
+        # Le paiement reste en attente, sans abonnement ; l'événement sera rejoué
+        self.assertEqual(statut, EvenementWave.STATUT_RECU)
+        self.assertEqual(PaiementWave.objects.get(transaction_id='WAVE_FAMILLE_TEST').statut, 'en_attente')
+        self.assertFalse(Abonnement.objects.exists())
+
+        self.assertEqual(WaveCallbackService.traiter_evenement(self.evenement.id), EvenementWave.STATUT_TRAITE)
+        paiement = PaiementWave.objects.get(transaction_id='WAVE_FAMILLE_TEST')
+        self.assertEqual((paiement.statut, paiement.wave_reference), ('reussi', 'T_FAMILLE'))
+        self.assertEqual(
+            set(Abonnement.objects.filter(actif=True).values_list('utilisateur_id', flat=True)),
+            {self.parent.id, self.enfant.id}
+        )
+
+    def test_paiement_pack_familial(self):
+        resultat = AbonnementService.initier_paiement_abonnement_famille(self.parent, self.pack_familial.id, pack_familial=True)
+        self.assertTrue(resultat['success'], resultat)
+        paiement = PaiementWave.objects.get(transaction_id=resultat['transaction_id'])
+        self.assertEqual((paiement.pack_id, paiement.pack_familial), (self.pack_familial.id, True))
+
+        # Balayage des paiements en attente : chemin unitaire des packs familiaux, puis activation
+        self.assertEqual(WaveCallbackService.activer_lot_paiements([paiement]), (0, [paiement], 0))
+        self.assertTrue(WaveCallbackService._activer_un_paiement(paiement))
+        # Abonnements sur le PackAbonnement familial équivalent, montant du PackFamilial payé
+        abonnements = Abonnement.objects.filter(actif=True)
+        self.assertEqual(
+            set(abonnements.values_list('utilisateur_id', 'pack_id', 'montant_paye')),
+            {(self.parent.id, self.pack.id, self.pack_familial.prix_reduit), (self.enfant.id, self.pack.id, 0)}
+        )
+        tracabilite = PaiementWave.objects.get(transaction_id=f'{paiement.transaction_id}_ENFANT_{self.enfant.id}')
+        self.assertEqual((tracabilite.pack_id, tracabilite.pack_familial), (self.pack_familial.id, True))
+
+    def test_pack_familial_sans_equivalent_refuse(self):
+        resultat = AbonnementService.initier_paiement_abonnement_famille(self.parent, self.pack_familial_sans_equivalent.id, pack_familial=True)
+        self.assertFalse(resultat['success'])
+        self.assertFalse(PaiementWave.objects.filter(pack_familial=True).exists())
+
+
+class QuotaMensuelTests(TestCase):
+    """Réservation du quota mensuel : une mise à jour conditionnelle, annulée avec la transaction appelante"""
+
+    @classmethod
+    def setUpTestData(cls):
+        pack = PackAbonnement.objects.create(
+            nom='Standard', type_pack='standard', description='Pack standard', prix=3000, periode='mois', duree_jours=30
+        )
+        PackPermissions.objects.create(pack=pack, max_quiz_par_mois=2)
+        ReferentielService.invalider()
+        cls.eleve = Utilisateur.objects.create(email='eleve@example.com')
+        AbonnementService.creer_abonnement(cls.eleve, pack)
+
+    def compteur(self):
+        return UsageMensuelleService.get_compteur(self.eleve.id, UsageMensuelle.RESSOURCE_QUIZ)
+
+    def test_reservation_jusqu_a_la_limite(self):
+        self.assertEqual(PermissionService.reserver_quota(self.eleve, UsageMensuelle.RESSOURCE_QUIZ)[0], True)
+        self.assertEqual(PermissionService.reserver_quota(self.eleve, UsageMensuelle.RESSOURCE_QUIZ)[0], True)
+
+        reserve, message = PermissionService.reserver_quota(self.eleve, UsageMensuelle.RESSOURCE_QUIZ)
+        self.assertFalse(reserve)
+        self.assertTrue(message)
+        # Le refus ne consomme rien
+        self.assertEqual(self.compteur(), 2)
+
+    def test_reservation_annulee_avec_la_transaction(self):
+        # Comme dans QuizViewSet.commencer : l'objet consommé n'est pas créé, le quota est rendu
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.assertTrue(PermissionService.reserver_quota(self.eleve, UsageMensuelle.RESSOURCE_QUIZ)[0])
+            raise RuntimeError('tentative')
+        self.assertEqual(self.compteur(), 0)
+
+    def test_limite_atteinte_par_un_autre_processus(self):
+        UsageMensuelle.objects.create(
+            utilisateur=self.eleve, annee=timezone.now().year, mois=timezone.now().month,
+            ressource=UsageMensuelle.RESSOURCE_QUIZ, compteur=2
+        )
+        self.assertFalse(UsageMensuelleService.reserver(self.eleve.id, UsageMensuelle.RESSOURCE_QUIZ, 2))
+        self.assertEqual(self.compteur(), 2)
+
+    def test_illimite(self):
+        for _ in range(3):
+            self.assertTrue(UsageMensuelleService.reserver(self.eleve.id, UsageMensuelle.RESSOURCE_QUIZ, 0))
+        self.assertEqual(self.compteur(), 3)
+
+    def test_sans_abonnement(self):
+        sans_abonnement = Utilisateur.objects.create(email='visiteur@example.com')
+        self.assertEqual(
+            PermissionService.reserver_quota(sans_abonnement, UsageMensuelle.RESSOURCE_QUIZ),
+            (False, 'Aucun abonnement actif')
+        )
+        self.assertFalse(UsageMensuelle.objects.filter(utilisateur=sans_abonnement).exists())
+
+
+class AbonnementActifUniqueTests(TestCase):
+    """Un seul abonnement actif par utilisateur, référencé par AbonnementActuel"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.standard = PackAbonnement.objects.create(
+            nom='Standard', type_pack='standard', description='Pack standard', prix=3000, periode='mois', duree_jours=30
+        )
+        cls.premium = PackAbonnement.objects.create(
+            nom='Premium', type_pack='premium', description='Pack premium', prix=6000, periode='mois', duree_jours=30
+        )
+        cls.eleve = Utilisateur.objects.create(email='eleve@example.com')
+
+    def reference(self, utilisateur=None):
+        return AbonnementActuel.objects.get(utilisateur=utilisateur or self.eleve).abonnement_id
+
+    def test_nouvel_abonnement_remplace_l_actif(self):
+        premier = AbonnementService.creer_abonnement(self.eleve, self.standard)['abonnement']
+        self.assertEqual(self.reference(), premier.id)
+
+        second = AbonnementService.creer_abonnement(self.eleve, self.premium)['abonnement']
+        premier.refresh_from_db()
+        self.assertEqual((premier.actif, premier.statut), (False, 'remplace'))
+        self.assertEqual(self.reference(), second.id)
+
+    def test_doublon_actif_refuse_par_la_base(self):
+        AbonnementService.creer_abonnement(self.eleve, self.standard)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Abonnement.objects.create(utilisateur=self.eleve, pack=self.premium, statut='actif', actif=True)
+        self.assertEqual(Abonnement.objects.filter(utilisateur=self.eleve, actif=True).count(), 1)
+
+    def test_desactivation_libere_la_reference(self):
+        abonnement = AbonnementService.creer_abonnement(self.eleve, self.standard)['abonnement']
+        abonnement.actif = False
+        abonnement.statut = 'expire'
+        abonnement.save()
+        self.assertIsNone(self.reference())
+
+    def test_creation_en_masse(self):
+        autre = Utilisateur.objects.create(email='autre@example.com')
+        ancien = AbonnementService.creer_abonnement(self.eleve, self.standard)['abonnement']
+        with transaction.atomic():
+            nouveaux = AbonnementService.creer_abonnements_en_masse([
+                Abonnement(utilisateur_id=utilisateur.id, pack=self.premium, statut='actif', actif=True)
+                for utilisateur in (self.eleve, autre)
+            ])
+
+        ancien.refresh_from_db()
+        self.assertEqual((ancien.actif, ancien.statut), (False, 'remplace'))
+        self.assertEqual([self.reference(), self.reference(autre)], [abonnement.id for abonnement in nouveaux])
+        self.assertEqual(Abonnement.objects.filter(actif=True).count(), 2)
+
+
+class ExpirationTests(TestCase):
+    """Expiration par lots : chaque lot est validé seul, un lot en échec est repris à la passe suivante"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.gratuit = PackAbonnement.objects.create(
+            nom='Gratuit', type_pack='gratuit', description='Pack gratuit', prix=0, periode='mois', duree_jours=0
+        )
+        standard = PackAbonnement.objects.create(
+            nom='Standard', type_pack='standard', description='Pack standard', prix=3000, periode='mois', duree_jours=30
+        )
+        ReferentielService.invalider()
+        hier = timezone.now() - timedelta(days=1)
+        cls.expires = [
+            Abonnement.objects.create(
+                utilisateur=Utilisateur.objects.create(email=f'eleve{i}@example.com'),
+                pack=standard, statut='actif', actif=True, montant_paye=3000, date_fin=hier
+            )
+            for i in range(5)
+        ]
+        cls.en_cours = AbonnementService.creer_abonnement(
+            Utilisateur.objects.create(email='abonne@example.com'), standard
+        )['abonnement']
+
+    def verifier_transferes(self, abonnements):
+        for abonnement in abonnements:
+            abonnement.refresh_from_db()
+            self.assertEqual((abonnement.actif, abonnement.statut), (False, 'expire'))
+            actuel = AbonnementActuel.objects.select_related('abonnement').get(utilisateur_id=abonnement.utilisateur_id)
+            self.assertEqual((actuel.abonnement.pack_id, actuel.abonnement.date_fin), (self.gratuit.id, None))
+        self.assertFalse(EcheanceAbonnement.objects.filter(
+            abonnement__in=abonnements, date_traitement__isnull=True
+        ).exists())
+
+    def test_expiration_par_lots(self):
+        self.assertEqual(ExpirationService.compter_expirations()['total'], 5)
+
+        resultats = ExpirationService.verifier_et_traiter_expirations(taille_lot=2)
+        self.assertEqual((resultats['traites'], resultats['lots'], resultats['erreurs']), (5, 3, 0))
+        self.verifier_transferes(self.expires)
+        # Les abonnements en cours ne sont pas touchés
+        self.en_cours.refresh_from_db()
+        self.assertTrue(self.en_cours.actif)
+        self.assertEqual(ExpirationService.compter_expirations()['total'], 0)
+
+    def test_limite(self):
+        resultats = ExpirationService.verifier_et_traiter_expirations(taille_lot=2, limite=3)
+        self.assertEqual((resultats['traites'], resultats['lots']), (3, 2))
+        self.assertEqual(ExpirationService.compter_expirations()['total'], 2)
+
+    def test_lot_en_echec_repris(self):
+        expirer = ExpirationService.expirer_abonnements
+        appels = []
+
+        def expirer_sauf_second_lot(*args):
+            appels.append(args)
+            if len(appels) == 2:
+                raise RuntimeError('lot')
+            return expirer(*args)
+
+        with mock.patch.object(ExpirationService, 'expirer_abonnements', side_effect=expirer_sauf_second_lot):
+            resultats = ExpirationService.verifier_et_traiter_expirations(taille_lot=2)
+        # Le premier lot est validé, le second annulé en entier
+        self.assertEqual((resultats['traites'], resultats['lots'], resultats['erreurs']), (2, 1, 1))
+        self.assertEqual(ExpirationService.compter_expirations()['total'], 3)
+
+        self.assertEqual(ExpirationService.verifier_et_traiter_expirations(taille_lot=2)['traites'], 3)
+        self.verifier_transferes(self.expires)
+
+
+class NettoyageAbonnementsTests(TestCase):
+    """Commande nettoyer_abonnements : mises à jour ensemblistes par lots"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.gratuit = PackAbonnement.objects.create(
+            nom='Gratuit', type_pack='gratuit', description='Pack gratuit', prix=0, periode='mois', duree_jours=30
+        )
+        cls.standard = PackAbonnement.objects.create(
+            nom='Standard', type_pack='standard', description='Pack standard', prix=3000, periode='mois', duree_jours=30
+        )
+        hier = timezone.now() - timedelta(days=1)
+        cls.expires = [
+            Abonnement.objects.create(
+                utilisateur=Utilisateur.objects.create(email=f'eleve{i}@example.com'),
+                pack=cls.standard, statut='actif', actif=True, date_fin=hier
+            )
+            for i in range(3)
+        ]
+        # Pack gratuit échu : jamais désactivé
+        cls.gratuit_echu = Abonnement.objects.create(
+            utilisateur=Utilisateur.objects.create(email='gratuit@example.com'),
+            pack=cls.gratuit, statut='actif', actif=True, date_fin=hier
+        )
+        cls.date_incoherente = Abonnement.objects.create(
+            utilisateur=Utilisateur.objects.create(email='abonne@example.com'),
+            pack=cls.standard, statut='actif', actif=True, date_fin=timezone.now() + timedelta(days=90)
+        )
+
+    def test_nettoyage_par_lots(self):
+        sortie = StringIO()
+        call_command('nettoyer_abonnements', chunk_size=2, summary=True, stdout=sortie)
+        self.assertIn('3 abonnements expirés désactivés', sortie.getvalue())
+        self.assertIn('1 dates de fin corrigées', sortie.getvalue())
+
+        for abonnement in self.expires:
+            abonnement.refresh_from_db()
+            self.assertEqual((abonnement.actif, abonnement.statut), (False, 'expire'))
+            self.assertIsNone(AbonnementActuel.objects.get(utilisateur_id=abonnement.utilisateur_id).abonnement_id)
+        self.assertFalse(EcheanceAbonnement.objects.filter(
+            abonnement__in=self.expires, date_traitement__isnull=True
+        ).exists())
+
+        self.gratuit_echu.refresh_from_db()
+        self.assertTrue(self.gratuit_echu.actif)
+
+        self.date_incoherente.refresh_from_db()
+        self.assertEqual(self.date_incoherente.date_fin, self.date_incoherente.date_debut + timedelta(days=30))
+
+    def test_relance_sans_effet(self):
+        call_command('nettoyer_abonnements', chunk_size=2, summary=True, stdout=StringIO())
+        sortie = StringIO()
+        call_command('nettoyer_abonnements', chunk_size=2, summary=True, stdout=sortie)
+        self.assertIn('0 abonnements expirés désactivés', sortie.getvalue())
+        self.assertIn('0 dates de fin corrigées', sortie.getvalue())
+
+
+class PlanificateurTests(TestCase):
+    """Bail exclusif du planificateur et traitement des échéances arrivées à terme"""
+
+    def test_bail_exclusif(self):
+        self.assertTrue(PlanificateurService.acquerir_bail('instance-a', 60))
+        self.assertFalse(PlanificateurService.acquerir_bail('instance-b', 60))
+        # Le détenteur prolonge son bail
+        self.assertTrue(PlanificateurService.acquerir_bail('instance-a', 60))
+
+        # Seul le détenteur peut le rendre
+        PlanificateurService.liberer_bail('instance-b')
+        self.assertFalse(PlanificateurService.acquerir_bail('instance-b', 60))
+        PlanificateurService.liberer_bail('instance-a')
+        self.assertTrue(PlanificateurService.acquerir_bail('instance-b', 60))
+
+    def test_bail_echu_repris(self):
+        self.assertTrue(PlanificateurService.acquerir_bail('instance-a', 60))
+        VerrouPlanificateur.objects.filter(nom=PlanificateurService.NOM_BAIL).update(
+            expire_le=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertTrue(PlanificateurService.acquerir_bail('instance-b', 60))
+        self.assertFalse(PlanificateurService.acquerir_bail('instance-a', 60))
+        self.assertEqual(VerrouPlanificateur.objects.get().detenteur, 'instance-b')
+
+    def test_traitement_des_echeances(self):
+        gratuit = PackAbonnement.objects.create(
+            nom='Gratuit', type_pack='gratuit', description='Pack gratuit', prix=0, periode='mois', duree_jours=0
+        )
+        standard = PackAbonnement.objects.create(
+            nom='Standard', type_pack='standard', description='Pack standard', prix=3000, periode='mois', duree_jours=30
+        )
+        ReferentielService.invalider()
+        hier = timezone.now() - timedelta(days=1)
+        expire = Abonnement.objects.create(
+            utilisateur=Utilisateur.objects.create(email='eleve@example.com'),
+            pack=standard, statut='actif', actif=True, date_fin=hier
+        )
+        # Date de fin déplacée sans save() : l'échéance est replanifiée, pas exécutée
+        prolonge = Abonnement.objects.create(
+            utilisateur=Utilisateur.objects.create(email='abonne@example.com'),
+            pack=standard, statut='actif', actif=True, date_fin=hier
+        )
+        Abonnement.objects.filter(pk=prolonge.pk).update(date_fin=timezone.now() + timedelta(days=30))
+
+        resultats = PlanificateurService.traiter_echeances()
+        self.assertEqual((resultats['expires'], resultats['replanifiees'], resultats['erreurs']), (1, 1, 0))
+
+        expire.refresh_from_db()
+        self.assertEqual((expire.actif, expire.statut), (False, 'expire'))
+        self.assertEqual(Abonnement.objects.get(utilisateur=expire.utilisateur, actif=True).pack_id, gratuit.id)
+        prolonge.refresh_from_db()
+        self.assertTrue(prolonge.actif)
+        self.assertEqual(PlanificateurService.get_prochaine_echeance(), prolonge.date_fin)
+        # Rien de plus à traiter
+        self.assertEqual(PlanificateurService.traiter_echeances()['traitees'], 0)
@@ -22,6 +22,12 @@ urlpatterns = [
     path('packs-tous/', views.get_all_packs, name='packs-tous'),
     # Packs familiaux uniquement - AVANT le router pour éviter les conflits
     path('packs-familiaux/', views.get_packs_familiaux, name='packs-familiaux'),
+    # Rapport quotidien des abonnés (administrateurs)
+    path('rapports/abonnes/', views.rapport_abonnes, name='rapport-abonnes'),
+    # Revenus et paiements par période, depuis les cumuls quotidiens (administrateurs)
+    path('rapports/revenus/', views.rapport_revenus, name='rapport-revenus'),
+    # Entonnoir de conversion par cohorte d'inscription (administrateurs)
+    path('rapports/conversion/', views.rapport_conversion, name='rapport-conversion'),
     # Callback Wave (doit rester séparé car pas d'authentification)
     path('abonnements/wave-callback/', views.wave_callback, name='wave-callback'),
     # Router Django REST Framework
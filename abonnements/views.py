@@ -8,16 +8,17 @@ from django.utils import timezone
 from django.db import transaction, models
 from rest_framework import viewsets, status, generics
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.http import JsonResponse, QueryDict
+from django.utils.cache import parse_etags
 
 from .models import (
-    Abonnement, PackAbonnement, PaiementWave, 
-    PackFamilial, BonusParrainage, Parrainage
+    Abonnement, AbonnementActuel, PackAbonnement, PaiementWave, 
+    PackFamilial, BonusParrainage, Parrainage, CohorteConversion
 )
 from .serializers import (
     AbonnementSerializer, AbonnementDetailSerializer, PackAbonnementSerializer,
@@ -27,7 +28,8 @@ from .serializers import (
 )
 from .services import (
     WaveService, AbonnementService, StatistiquesService, PackService,
-    ParrainageService
+    ParrainageService, RapportAbonnesService, RevenusJournaliersService, EntonnoirConversionService,
+    CataloguePacksService, ReferentielService
 )
 from utilisateurs.models import Utilisateur
 
@@ -35,6 +37,24 @@ from utilisateurs.models import Utilisateur
 
 
 
+def reponse_catalogue(request, nom):
+    """
+    Réponse d'un catalogue de packs avec ETag fort et Cache-Control ;
+    304 sans corps si le client (ou le CDN) détient déjà cette version
+    """
+    catalogue = CataloguePacksService.get_catalogue(nom)
+    etag = catalogue['etag']
+    etags_client = parse_etags(request.headers.get('If-None-Match', ''))
+    # If-None-Match se compare faiblement : W/"x" correspond à "x"
+    if '*' in etags_client or etag in {e.removeprefix('W/') for e in etags_client}:
+        reponse = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        reponse = Response(catalogue['donnees'])
+    reponse['ETag'] = etag
+    reponse['Cache-Control'] = CataloguePacksService.get_cache_control()
+    return reponse
+
+
 class PackAbonnementViewSet(viewsets.ModelViewSet):
     """ViewSet pour gérer les packs d'abonnement"""
     queryset = PackAbonnement.objects.filter(actif=True)
@@ -44,24 +64,12 @@ class PackAbonnementViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def packs_speciaux(self, request):
         """Récupère les packs spéciaux"""
-        packs = PackAbonnement.objects.filter(
-            pack_special=True,
-            actif=True
-        ).exclude(
-            nom="Pack de Bienvenue Parrainage"
-        )
-        serializer = self.get_serializer(packs, many=True)
-        return Response(serializer.data)
+        return reponse_catalogue(request, 'speciaux_avec_bienvenue')
     
     @action(detail=False, methods=['get'], url_path='avec-essai-gratuit')
     def avec_essai_gratuit(self, request):
         """Récupère les packs avec essai gratuit"""
-        packs = PackAbonnement.objects.filter(
-            actif=True, 
-            offre_semaine_gratuite=True
-        )
-        serializer = self.get_serializer(packs, many=True)
-        return Response(serializer.data)
+        return reponse_catalogue(request, 'essai_gratuit')
 
 
 class PackFamilialViewSet(viewsets.ModelViewSet):
@@ -73,27 +81,7 @@ class PackFamilialViewSet(viewsets.ModelViewSet):
     def list(self, request):
         """Récupérer les packs familiaux avec real_id"""
         try:
-            packs_famille = PackFamilial.objects.filter(actif=True).order_by('nombre_enfants')
-            
-            packs_data = []
-            for pack in packs_famille:
-                packs_data.append({
-                    'id': f'pack-famille-{pack.nombre_enfants}',
-                    'real_id': pack.id,  # 🔧 AJOUT : ID réel de la base de données
-                    'nom': pack.nom,
-                    'prix': float(pack.prix),
-                    'prix_reduit': float(pack.prix_reduit) if pack.prix_reduit else None,  # 🔧 AJOUT : Prix réduit
-                    'nombre_enfants': pack.nombre_enfants,
-                    'type_pack': 'famille',
-                    'description': pack.description,
-                    'popular': pack.nombre_enfants == 3,  # Pack 3 enfants populaire
-                    'actif': pack.actif,
-                    'duree_jours': pack.duree_jours,
-                    'periode': pack.periode,
-                    'reduction_pourcentage': pack.reduction_pourcentage
-                })
-            
-            return Response(packs_data)
+            return reponse_catalogue(request, 'familiaux_modele')
             
         except Exception as e:
             return Response({
@@ -135,6 +123,9 @@ class AbonnementViewSet(viewsets.ModelViewSet):
     """ViewSet pour gérer les abonnements"""
     serializer_class = AbonnementSerializer
     permission_classes = [IsAuthenticated]
+    
+    # Nombre maximal d'identifiants par liste pour verifier-acces-multiple
+    MAX_IDS_VERIFICATION = 200
 
     def get_queryset(self):
         return Abonnement.objects.filter(utilisateur=self.request.user)
@@ -166,40 +157,33 @@ class AbonnementViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'])
     def suspendre(self, request, pk=None):
         """Suspendre un abonnement"""
-        try:
-            abonnement = Abonnement.objects.get(id=pk, utilisateur=request.user)
-            abonnement.statut = 'suspendu'
-            abonnement.actif = False
-            abonnement.save()
+        resultat = AbonnementService.suspendre_abonnement(pk, request.user)
+        if resultat['success']:
             return Response({'detail': 'Abonnement suspendu avec succès'})
-        except Abonnement.DoesNotExist:
-            return Response({'detail': 'Abonnement non trouvé'}, status=404)
-        except Exception as e:
-            return Response({'detail': str(e)}, status=500)
+        if resultat['error'] == 'Abonnement non trouvé':
+            return Response({'detail': resultat['error']}, status=404)
+        return Response({'detail': resultat['error']}, status=500)
     
     @action(detail=True, methods=['post'])
     def reactiver(self, request, pk=None):
         """Réactiver un abonnement"""
-        try:
-            abonnement = Abonnement.objects.get(id=pk, utilisateur=request.user)
-            abonnement.statut = 'actif'
-            abonnement.actif = True
-            abonnement.save()
+        resultat = AbonnementService.reactiver_abonnement(pk, request.user)
+        if resultat['success']:
             return Response({'detail': 'Abonnement réactivé avec succès'})
-        except Abonnement.DoesNotExist:
-            return Response({'detail': 'Abonnement non trouvé'}, status=404)
-        except Exception as e:
-            return Response({'detail': str(e)}, status=500)
+        if resultat['error'] == 'Abonnement non trouvé':
+            return Response({'detail': resultat['error']}, status=404)
+        return Response({'detail': resultat['error']}, status=500)
     
     @action(detail=False, methods=['get'], url_path='mon-abonnement')
     def mon_abonnement(self, request):
         """Récupérer l'abonnement actuel de l'utilisateur connecté"""
         try:
-            # Récupérer l'abonnement actif de l'utilisateur
-            abonnement = Abonnement.objects.filter(
-                utilisateur=request.user,
-                actif=True
-            ).select_related('pack').first()
+            # Récupérer l'abonnement actif de l'utilisateur via sa référence (une jointure par clé primaire)
+            reference = AbonnementActuel.objects.filter(
+                utilisateur_id=request.user.pk,
+                abonnement__actif=True
+            ).select_related('abonnement__pack').first()
+            abonnement = reference.abonnement if reference else None
             
             if not abonnement:
                 # Si aucun abonnement actif, retourner des valeurs par défaut
@@ -231,59 +215,7 @@ class AbonnementViewSet(viewsets.ModelViewSet):
     def packs_famille(self, request):
         """Récupérer les packs famille disponibles"""
         try:
-            # Récupérer tous les packs famille depuis le modèle PackFamilial
-            packs_famille = PackFamilial.objects.filter(
-                actif=True
-            ).order_by('nombre_enfants')
-            
-            packs_data = []
-            for pack in packs_famille:
-                packs_data.append({
-                    'id': f'pack-famille-{pack.nombre_enfants}',
-                    'real_id': pack.id,  # 🔧 AJOUT : ID réel de la base de données
-                    'nom': pack.nom,
-                    'prix': float(pack.prix),
-                    'prix_reduit': float(pack.prix_reduit) if pack.prix_reduit else None,  # 🔧 AJOUT : Prix réduit
-                    'nombre_enfants': pack.nombre_enfants,
-                    'type_pack': 'famille',
-                    'description': pack.description,
-                    'popular': pack.nombre_enfants == 3,  # Pack 3 enfants populaire
-                    'actif': pack.actif,
-                    'duree_jours': pack.duree_jours,
-                    'periode': pack.periode,
-                    'reduction_pourcentage': pack.reduction_pourcentage
-                })
-            
-            # Si aucun pack famille en base, retourner des packs par défaut
-            if not packs_data:
-                # Récupérer les packs familiaux depuis la base de données
-                packs_familiaux_db = PackAbonnement.objects.filter(
-                    type_pack='famille',
-                    actif=True
-                ).order_by('prix')
-                
-                packs_data = []
-                for i, pack in enumerate(packs_familiaux_db):
-                    packs_data.append({
-                        'id': f'pack-famille-{pack.id}',
-                        'real_id': pack.id,  # ID réel de la base de données
-                        'nom': pack.nom,
-                        'prix': float(pack.prix),
-                        'nombre_enfants': 2 + i,  # 2, 3, 4 enfants
-                        'type_pack': 'famille',
-                        'description': pack.description,
-                        'popular': i == 1,  # Le deuxième pack est populaire
-                        'actif': pack.actif,
-                        'duree_jours': pack.duree_jours,
-                        'periode': pack.periode,
-                        'reduction_pourcentage': pack.reduction_pourcentage
-                    })
-            
-            return Response({
-                'packs': packs_data,
-                'total': len(packs_data),
-                'message': f'{len(packs_data)} packs famille disponibles'
-            })
+            return reponse_catalogue(request, 'packs_famille')
             
         except Exception as e:
             return Response({
@@ -359,16 +291,14 @@ class AbonnementViewSet(viewsets.ModelViewSet):
     def statistiques(self, request):
         """Récupère les statistiques d'utilisation de l'abonnement"""
         try:
-            # Récupérer l'abonnement actuel
-            abonnement = Abonnement.objects.filter(
-                utilisateur=request.user,
-                actif=True
-            ).first()
+            # Abonnement actuel via la référence (une requête), puis compteurs et temps d'étude (deux requêtes)
+            abonnement_en_cours = AbonnementActuel.objects.filter(
+                utilisateur_id=request.user.id,
+                abonnement__actif=True
+            ).exists()
             
-            if abonnement:
-                # Utiliser le service existant
-                from .services import StatistiquesService
-                stats = StatistiquesService.get_utilisation_mensuelle(abonnement)
+            if abonnement_en_cours:
+                stats = StatistiquesService.get_utilisation_utilisateur(request.user.id)
                 return Response(stats)
             else:
                 # Retourner des statistiques vides si pas d'abonnement
@@ -515,6 +445,42 @@ class AbonnementViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return Response({'detail': str(e)}, status=500)
     
+    @action(detail=False, methods=['post'], url_path='verifier-acces-multiple')
+    def verifier_acces_multiple(self, request):
+        """
+        Vérifie en un seul appel l'accès à une liste de contenus, quiz et examens
+        (icônes de verrouillage d'une page de chapitre, par exemple). Ne marque rien comme consulté.
+        """
+        try:
+            from .services import PermissionService
+            
+            listes = {}
+            for champ in ('contenu_ids', 'quiz_ids', 'examen_ids'):
+                valeurs = request.data.get(champ) or []
+                if not isinstance(valeurs, list):
+                    return Response({'detail': f'{champ} doit être une liste'}, status=400)
+                if len(valeurs) > self.MAX_IDS_VERIFICATION:
+                    return Response(
+                        {'detail': f'{champ} : {self.MAX_IDS_VERIFICATION} identifiants maximum'},
+                        status=400
+                    )
+                try:
+                    # Dédoublonner en conservant l'ordre
+                    listes[champ] = list(dict.fromkeys(int(valeur) for valeur in valeurs))
+                except (TypeError, ValueError):
+                    return Response({'detail': f'{champ} doit contenir des identifiants entiers'}, status=400)
+            
+            resultats = PermissionService.verifier_acces_multiple(
+                request.user,
+                contenu_ids=listes['contenu_ids'],
+                quiz_ids=listes['quiz_ids'],
+                examen_ids=listes['examen_ids']
+            )
+            return Response(resultats)
+            
+        except Exception as e:
+            return Response({'detail': str(e)}, status=500)
+    
     @action(detail=False, methods=['post'], url_path='verifier-examen-limitations')
     def verifier_acces_examen_limitations(self, request):
         """
@@ -545,18 +511,20 @@ class AbonnementViewSet(viewsets.ModelViewSet):
             }
             
             if acces:
-                # Vérifier s'il était déjà consulté (NOUVELLE fonction cache simple)
-                deja_consulte = PermissionService.examen_deja_consulte_cache_simple(
+                # Vérifier s'il était déjà consulté ce mois
+                deja_consulte = PermissionService.examen_deja_consulte(
                     request.user, examen_id
                 )
                 response_data['deja_consulte'] = deja_consulte
                 
-                # Si pas déjà consulté, marquer comme consulté
+                # Si pas déjà consulté, marquer comme consulté (réserve le quota)
                 if not deja_consulte:
-                    PermissionService.marquer_examen_consulte_cache_simple(request.user, examen_id)
-                    nouveau_compteur = PermissionService.incrementer_compteur_examens(request.user)
-                    response_data['marque_comme_consulte'] = True
-                    response_data['nouveau_compteur'] = nouveau_compteur
+                    success, message_marquage = PermissionService.marquer_examen_consulte(request.user, examen_id)
+                    response_data['marque_comme_consulte'] = success
+                    response_data['nouveau_compteur'] = PermissionService.compter_examens_mois_courant(request.user)
+                    if not success:
+                        response_data['acces'] = False
+                        response_data['message'] = message_marquage
             
             return Response(response_data)
             
@@ -603,6 +571,10 @@ class AbonnementViewSet(viewsets.ModelViewSet):
                     )
                     response_data['marque_comme_consulte'] = success
                     response_data['message_marquage'] = message_marquage
+                    if not success:
+                        # Quota consommé entre-temps par une requête concurrente
+                        response_data['acces'] = False
+                        response_data['message'] = message_marquage
             
             return Response(response_data)
             
@@ -751,6 +723,10 @@ class AbonnementViewSet(viewsets.ModelViewSet):
                     )
                     response_data['marque_comme_consulte'] = success
                     response_data['message_marquage'] = message_marquage
+                    if not success:
+                        # Quota consommé entre-temps par une requête concurrente
+                        response_data['acces'] = False
+                        response_data['message'] = message_marquage
                     
                     # Mettre à jour le compteur dans la réponse
                     nouveau_compteur = PermissionService.compter_examens_mois_courant(request.user)
@@ -803,15 +779,16 @@ class WaveCallbackView(APIView):
     permission_classes = []
     
     def post(self, request):
-        """Traite un callback Wave"""
+        """Enregistre un callback Wave ; le traitement est fait par le worker traiter_evenements_wave"""
         try:
-            # Traiter le callback
-            resultat = WaveService().traiter_callback(request.data)
-            
-            if resultat['success']:
-                return Response({'status': 'success'})
-            else:
-                return Response({'status': 'error', 'message': resultat['error']})
+            if not request.data.get('transaction_id'):
+                return Response({'status': 'error', 'message': 'transaction_id requis'}, status=400)
+            
+            from .services import WaveCallbackService
+            # Formulaire (QueryDict) : une valeur par champ, pas des listes
+            donnees = request.data.dict() if isinstance(request.data, QueryDict) else dict(request.data)
+            evenement, cree = WaveCallbackService.enregistrer_evenement(donnees)
+            return Response({'status': 'success', 'doublon': not cree})
                 
         except Exception as e:
             return Response({'status': 'error', 'message': str(e)})
@@ -926,21 +903,100 @@ def initier_paiement_wave(request):
         }, status=500)
 
 
+# Période maximale d'un rapport d'abonnés (en jours)
+RAPPORT_ABONNES_JOURS_MAX = 3660
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def rapport_abonnes(request):
+    """
+    Séries quotidiennes d'abonnés (actifs, payants, désabonnements, MRR par type de pack) - réservé aux administrateurs
+    Paramètres : debut et fin (AAAA-MM-JJ, 90 derniers jours par défaut), reconstruire=1 pour relire la base
+    """
+    try:
+        aujourd_hui = timezone.localdate()
+        try:
+            fin = datetime.strptime(request.query_params['fin'], '%Y-%m-%d').date() if request.query_params.get('fin') else aujourd_hui
+            debut = datetime.strptime(request.query_params['debut'], '%Y-%m-%d').date() if request.query_params.get('debut') else fin - timedelta(days=89)
+        except ValueError:
+            return Response({'error': 'Dates invalides (format attendu : AAAA-MM-JJ)'}, status=400)
+        
+        if debut > fin:
+            return Response({'error': 'La date de début doit précéder la date de fin'}, status=400)
+        if (fin - debut).days >= RAPPORT_ABONNES_JOURS_MAX:
+            return Response({'error': f'Période limitée à {RAPPORT_ABONNES_JOURS_MAX} jours'}, status=400)
+        
+        rapport = RapportAbonnesService.get_series(
+            debut, fin, reconstruire=request.query_params.get('reconstruire') == '1'
+        )
+        return Response(rapport)
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# Période maximale d'un rapport de revenus (en jours)
+RAPPORT_REVENUS_JOURS_MAX = 3660
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def rapport_revenus(request):
+    """
+    Revenus et paiements d'une période (par statut, pack, famille / individuel, payés par un parent, série
+    quotidienne) lus dans les cumuls quotidiens - réservé aux administrateurs
+    Paramètres : debut et fin (AAAA-MM-JJ, 30 derniers jours par défaut)
+    """
+    try:
+        aujourd_hui = timezone.localdate()
+        try:
+            fin = datetime.strptime(request.query_params['fin'], '%Y-%m-%d').date() if request.query_params.get('fin') else aujourd_hui
+            debut = datetime.strptime(request.query_params['debut'], '%Y-%m-%d').date() if request.query_params.get('debut') else fin - timedelta(days=29)
+        except ValueError:
+            return Response({'error': 'Dates invalides (format attendu : AAAA-MM-JJ)'}, status=400)
+        
+        if debut > fin:
+            return Response({'error': 'La date de début doit précéder la date de fin'}, status=400)
+        if (fin - debut).days >= RAPPORT_REVENUS_JOURS_MAX:
+            return Response({'error': f'Période limitée à {RAPPORT_REVENUS_JOURS_MAX} jours'}, status=400)
+        
+        return Response(RevenusJournaliersService.get_revenus(debut, fin))
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def rapport_conversion(request):
+    """
+    Entonnoir inscription → essai → premier paiement → renouvellement par semaine d'inscription et par
+    source, lu dans les cohortes pré-calculées - réservé aux administrateurs
+    Paramètres : debut et fin (AAAA-MM-JJ, semaines d'inscription), source (direct, parrainage, partenaire), code_partenaire
+    """
+    try:
+        try:
+            debut = datetime.strptime(request.query_params['debut'], '%Y-%m-%d').date() if request.query_params.get('debut') else None
+            fin = datetime.strptime(request.query_params['fin'], '%Y-%m-%d').date() if request.query_params.get('fin') else None
+        except ValueError:
+            return Response({'error': 'Dates invalides (format attendu : AAAA-MM-JJ)'}, status=400)
+        
+        source = request.query_params.get('source')
+        if source and source not in dict(CohorteConversion.SOURCE_CHOICES):
+            return Response({'error': f'Source inconnue : {source}'}, status=400)
+        
+        return Response(EntonnoirConversionService.get_entonnoir(
+            debut, fin, source=source, code_partenaire=request.query_params.get('code_partenaire')
+        ))
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_packs_speciaux(request):
     """Récupère les packs spéciaux pour les paiements d'enfants - EXCLUT les packs familiaux"""
     try:
-        packs = PackAbonnement.objects.filter(
-            pack_special=True,
-            actif=True
-        ).exclude(
-            nom="Pack de Bienvenue Parrainage"
-        ).exclude(
-            type_pack='famille'  # 🔧 EXCLUSION : Les packs familiaux ne doivent pas apparaître dans les paiements d'enfants individuels
-        )
-        serializer = PackAbonnementSerializer(packs, many=True)
-        return Response(serializer.data)
+        return reponse_catalogue(request, 'speciaux')
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -949,16 +1005,7 @@ def get_packs_speciaux(request):
 def get_packs_standards(request):
     """Récupère les packs standards pour les paiements d'enfants - EXCLUT les packs familiaux"""
     try:
-        packs = PackAbonnement.objects.filter(
-            pack_special=False,
-            actif=True
-        ).exclude(
-            nom="Pack de Bienvenue Parrainage"
-        ).exclude(
-            type_pack='famille'  # 🔧 EXCLUSION : Les packs familiaux ne doivent pas apparaître dans les paiements d'enfants individuels
-        )
-        serializer = PackAbonnementSerializer(packs, many=True)
-        return Response(serializer.data)
+        return reponse_catalogue(request, 'standards')
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -967,15 +1014,7 @@ def get_packs_standards(request):
 def get_all_packs(request):
     """Récupère tous les packs (standards + spéciaux) pour les paiements d'enfants - EXCLUT les packs familiaux"""
     try:
-        packs = PackAbonnement.objects.filter(
-            actif=True
-        ).exclude(
-            nom="Pack de Bienvenue Parrainage"
-        ).exclude(
-            type_pack='famille'  # 🔧 EXCLUSION : Les packs familiaux ne doivent pas apparaître dans les paiements d'enfants individuels
-        )
-        serializer = PackAbonnementSerializer(packs, many=True)
-        return Response(serializer.data)
+        return reponse_catalogue(request, 'tous')
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -984,36 +1023,7 @@ def get_all_packs(request):
 def get_packs_familiaux(request):
     """Récupère UNIQUEMENT les packs familiaux pour les paiements familiaux"""
     try:
-        packs = PackAbonnement.objects.filter(
-            type_pack='famille',
-            actif=True
-        ).order_by('prix')
-        
-        # Formater les données comme attendu par le frontend
-        packs_data = []
-        for i, pack in enumerate(packs):
-            # Calculer le prix réduit
-            prix_original = float(pack.prix)
-            prix_reduit = float(pack.prix_reduit) if pack.reduction_pourcentage > 0 else prix_original
-            
-            packs_data.append({
-                'id': f'pack-famille-{pack.id}',
-                'real_id': pack.id,  # ID réel de la base de données
-                'nom': pack.nom,
-                'prix': prix_original,  # Prix original (barré)
-                'prix_reduit': prix_reduit,  # Prix avec réduction (affiché)
-                'nombre_enfants': 2 + i,  # 2, 3, 4 enfants
-                'type_pack': 'famille',
-                'description': pack.description,
-                'popular': i == 1,  # Le deuxième pack est populaire
-                'actif': pack.actif,
-                'duree_jours': pack.duree_jours,
-                'periode': pack.periode,
-                'reduction_pourcentage': pack.reduction_pourcentage,
-                'economie': prix_original - prix_reduit  # Montant économisé
-            })
-        
-        return Response(packs_data)
+        return reponse_catalogue(request, 'familiaux')
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -1029,6 +1039,10 @@ def initier_paiement_wave_enfant(request):
         enfant_id = request.data.get('enfant_id')
         email = request.data.get('email', '')
         renouvellement_auto = request.data.get('renouvellement_auto', False)
+        # Drapeau 'pack_familial' du catalogue packs-famille : pack_id désigne alors un PackFamilial
+        pack_familial = request.data.get('pack_familial')
+        if isinstance(pack_familial, str):
+            pack_familial = pack_familial.lower() in ('true', '1')
         
         if not pack_id or not enfant_id:
             return Response({
@@ -1066,7 +1080,8 @@ def initier_paiement_wave_enfant(request):
             enfant=enfant,
             pack_id=pack_id,
             email=email,
-            renouvellement_auto=renouvellement_auto
+            renouvellement_auto=renouvellement_auto,
+            pack_familial=pack_familial
         )
         
         if resultat['success']:
@@ -1094,31 +1109,22 @@ def wave_callback(request):
         # Récupérer les données du callback Wave
         data = json.loads(request.body)
         
-        # Extraire les informations importantes
-        transaction_id = data.get('transaction_id')
-        montant_paye = data.get('amount')
-        reference_wave = data.get('reference')
-        statut = data.get('status')
+        if not isinstance(data, dict) or not data.get('transaction_id'):
+            return JsonResponse({'error': 'transaction_id requis'}, status=400)
         
-        if statut != 'success':
+        if data.get('status') != 'success':
             return JsonResponse({'error': 'Paiement non réussi'}, status=400)
         
-        # Traiter le paiement réussi
+        # Enregistrer l'événement brut et répondre tout de suite : l'activation de l'abonnement
+        # est faite par le worker (python manage.py traiter_evenements_wave), une seule fois par transaction
         from .services import WaveCallbackService
-        resultat = WaveCallbackService.traiter_paiement_reussi(
-            transaction_id, montant_paye, reference_wave
-        )
+        evenement, cree = WaveCallbackService.enregistrer_evenement(data)
         
-        if resultat['success']:
-            return JsonResponse({
-                'success': True,
-                'message': 'Paiement confirmé et abonnement activé'
-            })
-        else:
-            return JsonResponse({
-                'success': False,
-                'error': resultat['error']
-            }, status=400)
+        return JsonResponse({
+            'success': True,
+            'doublon': not cree,
+            'message': 'Paiement reçu, activation de l\'abonnement en cours'
+        })
             
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Données JSON invalides'}, status=400)
@@ -1138,19 +1144,25 @@ def initier_paiement_wave_famille(request):
         pack_id = data.get('pack_id')
         email = data.get('email', '')
         renouvellement_auto = data.get('renouvellement_auto', False)
+        # Drapeau 'pack_familial' du catalogue packs-famille : pack_id désigne alors un PackFamilial
+        pack_familial = bool(data.get('pack_familial', False))
         
         if not pack_id:
             return JsonResponse({'error': 'ID du pack requis'}, status=400)
         
-        # Vérifier que le pack existe et est un pack familial
-        try:
-            pack = PackAbonnement.objects.get(id=pack_id, actif=True)
-        except PackAbonnement.DoesNotExist:
-            return JsonResponse({'error': 'Pack non trouvé'}, status=404)
-        
-        # Vérifier que c'est bien un pack familial
-        if pack.type_pack != 'famille':
-            return JsonResponse({'error': 'Ce pack n\'est pas un pack familial'}, status=400)
+        if pack_familial:
+            if ReferentielService.get_pack_familial(pack_id, actif_seulement=True) is None:
+                return JsonResponse({'error': 'Pack non trouvé'}, status=404)
+        else:
+            # Vérifier que le pack existe et est un pack familial
+            try:
+                pack = PackAbonnement.objects.get(id=pack_id, actif=True)
+            except PackAbonnement.DoesNotExist:
+                return JsonResponse({'error': 'Pack non trouvé'}, status=404)
+            
+            # Vérifier que c'est bien un pack familial
+            if pack.type_pack != 'famille':
+                return JsonResponse({'error': 'Ce pack n\'est pas un pack familial'}, status=400)
         
         # Utiliser le service pour initier le paiement familial
         from .services import AbonnementService
@@ -1158,7 +1170,8 @@ def initier_paiement_wave_famille(request):
             utilisateur=request.user,
             pack_id=pack_id,
             email=email,
-            renouvellement_auto=renouvellement_auto
+            renouvellement_auto=renouvellement_auto,
+            pack_familial=pack_familial
         )
         
         if resultat['success']:
@@ -13,6 +13,10 @@ class NiveauScolaireSerializer(serializers.ModelSerializer):
         fields = ['id', 'nom', 'ordre', 'description', 'nombre_matieres']
     
     def get_nombre_matieres(self, obj):
+        # Comptes précalculés en une requête par la vue liste, sinon une requête par niveau
+        nombre_matieres = self.context.get('nombre_matieres')
+        if nombre_matieres is not None:
+            return nombre_matieres.get(obj.id, 0)
         return obj.matiere_set.filter(active=True).count()
 
 class MatiereSerializer(serializers.ModelSerializer):
@@ -9,14 +9,19 @@ from .models import NiveauScolaire, Matiere
 from .serializers import NiveauScolaireSerializer, MatiereSerializer
 from cours.serializers import ChapitreSerializer
 from progression.models import ProgressionChapitre
+from abonnements.mixins import ListeReferentielMixin
 
-class NiveauScolaireViewSet(viewsets.ReadOnlyModelViewSet):
+class NiveauScolaireViewSet(ListeReferentielMixin, viewsets.ReadOnlyModelViewSet):
     """
     ViewSet pour les niveaux scolaires (lecture seule)
     """
     queryset = NiveauScolaire.objects.all()
     serializer_class = NiveauScolaireSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    referentiel = 'get_niveaux'
+    cle_compteurs = 'nombre_matieres'
+    champ_compteurs = 'niveau'
+    queryset_compteurs = Matiere.objects.filter(active=True)
 
 class MatiereViewSet(viewsets.ReadOnlyModelViewSet):
     """
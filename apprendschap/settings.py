@@ -90,6 +90,34 @@ DATABASES = {
 # Pour Render → utilise Postgres quand tu passeras à dj-database-url
 # DATABASES['default'] = dj_database_url.config(default=os.getenv('DATABASE_URL'))
 
+# Cache partagé entre les workers gunicorn (droits d'abonnement, version du référentiel...)
+# Redis si REDIS_URL est défini (obligatoire en production avec plusieurs workers), sinon cache
+# en mémoire du processus (développement) : le cache des droits est alors contourné et le référentiel
+# rechargé toutes les ABONNEMENTS_REFERENTIEL_VERIFICATION_SECONDES (avertissement abonnements.W001)
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'apprendschap',
+        }
+    }
+
+# Durée maximale (secondes) de mise en cache des droits d'abonnement résolus
+ABONNEMENTS_CACHE_DROITS_SECONDES = int(os.getenv('ABONNEMENTS_CACHE_DROITS_SECONDES', '300'))
+
+# Intervalle (secondes) entre deux vérifications de la version du référentiel en mémoire (packs, configuration...)
+ABONNEMENTS_REFERENTIEL_VERIFICATION_SECONDES = int(os.getenv('ABONNEMENTS_REFERENTIEL_VERIFICATION_SECONDES', '5'))
+
+# Âge maximal (secondes) du référentiel en mémoire : rechargé au-delà, même sans changement de version
+ABONNEMENTS_REFERENTIEL_AGE_MAX_SECONDES = int(os.getenv('ABONNEMENTS_REFERENTIEL_AGE_MAX_SECONDES', '300'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -150,6 +178,9 @@ WAVE_API_KEY = os.getenv('WAVE_API_KEY', 'your_wave_api_key')
 WAVE_BUSINESS_ID = os.getenv('WAVE_BUSINESS_ID', 'your_business_id')
 WAVE_CALLBACK_URL = os.getenv('WAVE_CALLBACK_URL', 'https://apprendschap-back.onrender.com/api/abonnements/wave-callback/')
 WAVE_ENVIRONMENT = os.getenv('WAVE_ENVIRONMENT', 'sandbox')
+# Activation sans preuve de paiement des paiements en attente depuis 5 minutes (sandbox uniquement) ;
+# sinon seuls le callback Wave et le rapprochement du relevé activent un paiement
+WAVE_ACTIVATION_AUTOMATIQUE = os.getenv('WAVE_ACTIVATION_AUTOMATIQUE', 'False') == 'True'
 
 # Swagger / drf-spectacular
 SPECTACULAR_SETTINGS = {
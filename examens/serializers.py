@@ -11,6 +11,10 @@ class TypeExamenSerializer(serializers.ModelSerializer):
         fields = ['id', 'nom', 'description', 'nombre_examens']
     
     def get_nombre_examens(self, obj):
+        # Comptes précalculés en une requête par la vue liste, sinon une requête par type
+        nombre_examens = self.context.get('nombre_examens')
+        if nombre_examens is not None:
+            return nombre_examens.get(obj.id, 0)
         return obj.examens.filter(actif=True).count()
 
 class ExamenSerializer(serializers.ModelSerializer):
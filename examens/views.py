@@ -8,6 +8,7 @@ from django.db.models import F
 from django.http import FileResponse, Http404
 from examens.models import Examen, TypeExamen
 from examens.serializers import ExamenSerializer, TypeExamenSerializer
+from abonnements.mixins import ListeReferentielMixin
 import os
 import uuid
 
@@ -84,10 +85,14 @@ class ExamenViewSet(viewsets.ReadOnlyModelViewSet):
         return response
 
 
-class TypeExamenViewSet(viewsets.ReadOnlyModelViewSet):
+class TypeExamenViewSet(ListeReferentielMixin, viewsets.ReadOnlyModelViewSet):
     """
     ViewSet pour les types d'examens
     """
     queryset = TypeExamen.objects.all()
     serializer_class = TypeExamenSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    referentiel = 'get_types_examen'
+    cle_compteurs = 'nombre_examens'
+    champ_compteurs = 'type_examen'
+    queryset_compteurs = Examen.objects.filter(actif=True)
@@ -5,6 +5,7 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from django_filters.rest_framework import DjangoFilterBackend
 from django.utils import timezone
+from django.db import transaction
 from quiz.models import Quiz, QuestionQuiz, ReponseQuestion, TentativeQuiz, ReponseEtudiant
 from quiz.serializers import (
     QuizSerializer, QuestionQuizAvecExplicationSerializer,
@@ -74,12 +75,24 @@ class QuizViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Créer nouvelle tentative
-        tentative = TentativeQuiz.objects.create(
-            etudiant=request.user,
-            quiz=quiz,
-            numero_tentative=tentatives_existantes + 1
-        )
+        # Créer nouvelle tentative (le quota mensuel est réservé dans la même transaction)
+        with transaction.atomic():
+            try:
+                from abonnements.models import UsageMensuelle
+                from abonnements.services import PermissionService
+                reserve, message = PermissionService.reserver_quota(request.user, UsageMensuelle.RESSOURCE_QUIZ)
+                if not reserve:
+                    return Response({'error': message}, status=status.HTTP_403_FORBIDDEN)
+            except ImportError:
+                reserve = False
+            
+            tentative = TentativeQuiz(
+                etudiant=request.user,
+                quiz=quiz,
+                numero_tentative=tentatives_existantes + 1
+            )
+            tentative._quota_reserve = reserve
+            tentative.save()
         
         # Retourner le quiz avec les questions (sans les bonnes réponses)
         serializer = QuizSerializer(quiz, context={'request': request})
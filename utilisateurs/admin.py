@@ -1,7 +1,7 @@
 # utilisateurs/admin.py
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import Utilisateur, InscriptionEnAttente, Commission, RetraitCommission, ConfigurationPartenaire, LienParentEnfant
+from .models import Utilisateur, InscriptionEnAttente, Commission, RetraitCommission, ConfigurationPartenaire, LienParentEnfant, SoldeCommission
 
 @admin.register(Utilisateur)
 class UtilisateurAdmin(UserAdmin):
@@ -46,6 +46,14 @@ class CommissionAdmin(admin.ModelAdmin):
     # fields = ('partenaire', 'montant_abonnement', 'montant_commission', 'abonnement_id', 'notes')
 
 
+@admin.register(SoldeCommission)
+class SoldeCommissionAdmin(admin.ModelAdmin):
+    list_display = ('partenaire', 'total_gagne', 'total_retire', 'disponible', 'nombre_commissions')
+    search_fields = ('partenaire__email', 'partenaire__first_name', 'partenaire__last_name')
+    # Maintenu par les écritures de Commission et RetraitCommission
+    readonly_fields = ('partenaire', 'total_gagne', 'total_retire', 'nombre_commissions')
+
+
 @admin.register(RetraitCommission)
 class RetraitCommissionAdmin(admin.ModelAdmin):
     list_display = ('partenaire', 'montant', 'statut', 'date_demande')
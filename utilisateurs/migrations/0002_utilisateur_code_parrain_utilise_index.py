@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-17 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='utilisateur',
+            name='code_parrain_utilise',
+            field=models.CharField(blank=True, db_index=True, help_text="Code de parrainage utilisé lors de l'inscription", max_length=20, null=True),
+        ),
+    ]
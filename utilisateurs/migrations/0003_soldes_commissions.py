@@ -0,0 +1,75 @@
+# Generated by Django 5.1.2 on 2026-10-17 02:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def initialiser_soldes(apps, schema_editor):
+    """Construit les soldes et les cumuls quotidiens à partir de l'historique existant"""
+    Commission = apps.get_model('utilisateurs', 'Commission')
+    RetraitCommission = apps.get_model('utilisateurs', 'RetraitCommission')
+    SoldeCommission = apps.get_model('utilisateurs', 'SoldeCommission')
+    CommissionJournaliere = apps.get_model('utilisateurs', 'CommissionJournaliere')
+
+    soldes = {}
+    for ligne in Commission.objects.values('partenaire_id').annotate(total=Sum('montant_commission'), nombre=Count('id')).order_by():
+        soldes[ligne['partenaire_id']] = SoldeCommission(
+            partenaire_id=ligne['partenaire_id'], total_gagne=ligne['total'] or 0, nombre_commissions=ligne['nombre']
+        )
+    retraits = RetraitCommission.objects.values('partenaire_id').annotate(
+        total=Sum('montant', filter=Q(statut='approuve'))
+    ).order_by()
+    for ligne in retraits:
+        solde = soldes.setdefault(ligne['partenaire_id'], SoldeCommission(partenaire_id=ligne['partenaire_id']))
+        solde.total_retire = ligne['total'] or 0
+    SoldeCommission.objects.bulk_create(soldes.values(), batch_size=1000)
+
+    jours = Commission.objects.annotate(jour=TruncDate('date_commission')).values('partenaire_id', 'jour').annotate(
+        montant=Sum('montant_commission'), nombre=Count('id')
+    ).order_by()
+    CommissionJournaliere.objects.bulk_create(
+        (CommissionJournaliere(**ligne) for ligne in jours), batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0002_utilisateur_code_parrain_utilise_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SoldeCommission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_gagne', models.DecimalField(decimal_places=2, default=0, help_text='Total des commissions gagnées (en FCFA)', max_digits=12)),
+                ('total_retire', models.DecimalField(decimal_places=2, default=0, help_text='Total des retraits approuvés (en FCFA)', max_digits=12)),
+                ('nombre_commissions', models.PositiveIntegerField(default=0, help_text='Nombre de commissions gagnées')),
+                ('partenaire', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='solde_commission', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Solde de commissions',
+                'verbose_name_plural': 'Soldes de commissions',
+            },
+        ),
+        migrations.CreateModel(
+            name='CommissionJournaliere',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jour', models.DateField()),
+                ('montant', models.DecimalField(decimal_places=2, default=0, help_text='Commissions du jour (en FCFA)', max_digits=12)),
+                ('nombre', models.IntegerField(default=0, help_text='Nombre de commissions du jour')),
+                ('partenaire', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='commissions_journalieres', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Commissions du jour',
+                'verbose_name_plural': 'Commissions journalières',
+                'constraints': [models.UniqueConstraint(fields=('partenaire', 'jour'), name='commission_journaliere_unique')],
+            },
+        ),
+        migrations.RunPython(initialiser_soldes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-17 02:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utilisateurs', '0003_soldes_commissions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='commission',
+            index=models.Index(fields=['partenaire', 'abonnement_id'], name='commission_partenaire_abo'),
+        ),
+    ]
@@ -1,8 +1,11 @@
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.db import models
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.utils import timezone
 import random
 import string
+from decimal import Decimal
 
 class UtilisateurManager(BaseUserManager):
     def _create_user(self, email, password, **extra_fields):
@@ -76,7 +79,7 @@ class Utilisateur(AbstractBaseUser, PermissionsMixin):
     
     # Système de parrainage
     code_parrainage = models.CharField(max_length=20, unique=True, blank=True, null=True, help_text="Code de parrainage unique de l'utilisateur")
-    code_parrain_utilise = models.CharField(max_length=20, blank=True, null=True, help_text="Code de parrainage utilisé lors de l'inscription")
+    code_parrain_utilise = models.CharField(max_length=20, blank=True, null=True, db_index=True, help_text="Code de parrainage utilisé lors de l'inscription")
     
     # Champs pour les parents
     objectifs_apprentissage = models.TextField(blank=True, null=True, help_text="Objectifs d'apprentissage définis par le parent")
@@ -184,9 +187,10 @@ class InscriptionEnAttente(models.Model):
             abonnement_id=abonnement_id
         )
         
-        # Mettre à jour le champ commission_totale_accumulee
-        self.commission_totale_accumulee += montant_commission
-        self.save()
+        # Mettre à jour le champ commission_totale_accumulee (F() : pas de mise à jour perdue)
+        Utilisateur.objects.filter(pk=self.pk).update(
+            commission_totale_accumulee=models.F('commission_totale_accumulee') + montant_commission
+        )
         
         return montant_commission
 
@@ -203,6 +207,10 @@ class Commission(models.Model):
         verbose_name = "Commission"
         verbose_name_plural = "Commissions"
         ordering = ['-date_commission']
+        indexes = [
+            # Commission d'un partenaire par abonnement (liste des filleuls et de leurs commissions)
+            models.Index(fields=['partenaire', 'abonnement_id'], name='commission_partenaire_abo'),
+        ]
 
     def __str__(self):
         return f"Commission {self.partenaire.get_full_name()} - {self.montant_commission} FCFA"
@@ -235,6 +243,99 @@ class RetraitCommission(models.Model):
         return f"Retrait {self.partenaire.get_full_name()} - {self.montant} FCFA"
 
 
+class SoldeCommission(models.Model):
+    """
+    Solde matérialisé des commissions d'un partenaire : total gagné et total retiré (retraits approuvés).
+    Mis à jour par expressions F() dans la transaction qui écrit la Commission ou le RetraitCommission.
+    """
+    partenaire = models.OneToOneField(Utilisateur, on_delete=models.CASCADE, related_name='solde_commission')
+    total_gagne = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Total des commissions gagnées (en FCFA)")
+    total_retire = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Total des retraits approuvés (en FCFA)")
+    nombre_commissions = models.PositiveIntegerField(default=0, help_text="Nombre de commissions gagnées")
+
+    class Meta:
+        verbose_name = "Solde de commissions"
+        verbose_name_plural = "Soldes de commissions"
+
+    def __str__(self):
+        return f"Solde {self.partenaire.email} - {self.disponible} FCFA disponibles"
+
+    @property
+    def disponible(self):
+        """Commission disponible pour retrait (jamais négative)"""
+        return max(0, self.total_gagne - self.total_retire)
+
+    @classmethod
+    def appliquer(cls, mouvements):
+        """
+        Applique des mouvements {partenaire_id: (gagne, retire, nombre)} : crée les soldes manquants
+        puis un UPDATE par partenaire avec F(), sans lecture préalable (pas de mise à jour perdue)
+        """
+        mouvements = {pk: valeurs for pk, valeurs in mouvements.items() if any(valeurs)}
+        if not mouvements:
+            return
+        cls.objects.bulk_create([cls(partenaire_id=pk) for pk in mouvements], ignore_conflicts=True)
+        for partenaire_id, (gagne, retire, nombre) in mouvements.items():
+            cls.objects.filter(partenaire_id=partenaire_id).update(
+                total_gagne=models.F('total_gagne') + gagne,
+                total_retire=models.F('total_retire') + retire,
+                nombre_commissions=models.F('nombre_commissions') + nombre,
+            )
+
+
+class CommissionJournaliere(models.Model):
+    """Cumul quotidien des commissions d'un partenaire (sommes du mois et des 30 derniers jours)"""
+    partenaire = models.ForeignKey(Utilisateur, on_delete=models.CASCADE, related_name='commissions_journalieres')
+    jour = models.DateField()
+    montant = models.DecimalField(max_digits=12, decimal_places=2, default=0, help_text="Commissions du jour (en FCFA)")
+    nombre = models.IntegerField(default=0, help_text="Nombre de commissions du jour")
+
+    class Meta:
+        verbose_name = "Commissions du jour"
+        verbose_name_plural = "Commissions journalières"
+        constraints = [
+            models.UniqueConstraint(fields=['partenaire', 'jour'], name='commission_journaliere_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.partenaire.email} - {self.jour} : {self.montant} FCFA"
+
+    @classmethod
+    def appliquer(cls, mouvements):
+        """Applique des mouvements {(partenaire_id, jour): (montant, nombre)} avec F()"""
+        mouvements = {cle: valeurs for cle, valeurs in mouvements.items() if any(valeurs)}
+        if not mouvements:
+            return
+        cls.objects.bulk_create(
+            [cls(partenaire_id=pk, jour=jour) for pk, jour in mouvements], ignore_conflicts=True
+        )
+        for (partenaire_id, jour), (montant, nombre) in mouvements.items():
+            cls.objects.filter(partenaire_id=partenaire_id, jour=jour).update(
+                montant=models.F('montant') + montant, nombre=models.F('nombre') + nombre
+            )
+
+
+def enregistrer_commissions(commissions, signe=1):
+    """
+    Reporte des commissions écrites (ou supprimées, signe=-1) dans le solde et le cumul quotidien
+    des partenaires : un UPDATE F() par partenaire et par jour. Appelé par les signaux de Commission
+    et directement après un bulk_create.
+    """
+    from collections import defaultdict
+
+    soldes = defaultdict(lambda: [Decimal('0'), Decimal('0'), 0])
+    jours = defaultdict(lambda: [Decimal('0'), 0])
+    for commission in commissions:
+        montant = Decimal(str(commission.montant_commission)) * signe
+        soldes[commission.partenaire_id][0] += montant
+        soldes[commission.partenaire_id][2] += signe
+        jour = timezone.localdate(commission.date_commission or timezone.now())
+        jours[(commission.partenaire_id, jour)][0] += montant
+        jours[(commission.partenaire_id, jour)][1] += signe
+    SoldeCommission.appliquer({pk: tuple(valeurs) for pk, valeurs in soldes.items()})
+    CommissionJournaliere.appliquer({cle: tuple(valeurs) for cle, valeurs in jours.items()})
+
+
 class ConfigurationPartenaire(models.Model):
     """Configuration centralisée pour les partenaires"""
     nom = models.CharField(max_length=100, help_text="Nom de la configuration")
@@ -283,7 +384,13 @@ class ConfigurationPartenaire(models.Model):
 
     @classmethod
     def get_configuration_active(cls):
-        """Retourne la configuration active"""
+        """Retourne la configuration active (servie depuis le référentiel en mémoire)"""
+        from abonnements.services import ReferentielService
+        return ReferentielService.get_configuration_partenaire()
+
+    @classmethod
+    def charger_configuration_active(cls):
+        """Lit la configuration active en base (la crée si besoin)"""
         try:
             return cls.objects.filter(actif=True).latest('date_creation')
         except cls.DoesNotExist:
@@ -369,3 +476,52 @@ class PreferencesUtilisateur(models.Model):
 
     def __str__(self):
         return f"Préférences de {self.utilisateur.get_full_name()}"
+
+
+@receiver(pre_save, sender=Commission)
+@receiver(pre_save, sender=RetraitCommission)
+def memoriser_etat_commission(sender, instance, raw=False, **kwargs):
+    """Mémorise l'état en base avant une modification, pour n'appliquer au solde que la différence"""
+    instance._etat_precedent = None
+    if raw or instance.pk is None:
+        return
+    champs = ('partenaire_id', 'montant_commission', 'date_commission') if sender is Commission else ('partenaire_id', 'montant', 'statut')
+    instance._etat_precedent = sender.objects.filter(pk=instance.pk).values(*champs).first()
+
+
+@receiver(post_save, sender=Commission)
+def commission_enregistree(sender, instance, created, raw=False, **kwargs):
+    """Reporte la commission (ou sa modification) dans le solde et le cumul quotidien du partenaire"""
+    if raw:
+        return
+    precedent = getattr(instance, '_etat_precedent', None)
+    if precedent:
+        enregistrer_commissions([Commission(**precedent)], signe=-1)
+    enregistrer_commissions([instance])
+
+
+@receiver(post_delete, sender=Commission)
+def commission_supprimee(sender, instance, **kwargs):
+    enregistrer_commissions([instance], signe=-1)
+
+
+@receiver(post_save, sender=RetraitCommission)
+def retrait_enregistre(sender, instance, created, raw=False, **kwargs):
+    """Seuls les retraits approuvés comptent dans le total retiré : applique la différence d'état"""
+    if raw:
+        return
+    from collections import Counter
+
+    retire = Counter()
+    precedent = getattr(instance, '_etat_precedent', None)
+    if precedent and precedent['statut'] == 'approuve':
+        retire[precedent['partenaire_id']] -= Decimal(str(precedent['montant']))
+    if instance.statut == 'approuve':
+        retire[instance.partenaire_id] += Decimal(str(instance.montant))
+    SoldeCommission.appliquer({pk: (0, montant, 0) for pk, montant in retire.items()})
+
+
+@receiver(post_delete, sender=RetraitCommission)
+def retrait_supprime(sender, instance, **kwargs):
+    if instance.statut == 'approuve':
+        SoldeCommission.appliquer({instance.partenaire_id: (0, -Decimal(str(instance.montant)), 0)})
@@ -102,62 +102,35 @@ class UtilisateurPartenaireSerializer(serializers.ModelSerializer):
         except:
             return ['wave', 'orange_money', 'mtn_money', 'moov_money']
     
+    def _get_solde(self, obj):
+        """Solde matérialisé du partenaire, lu une fois par objet sérialisé"""
+        if not hasattr(self, '_soldes'):
+            self._soldes = {}
+        if obj.pk not in self._soldes:
+            from abonnements.services import CommissionService
+            self._soldes[obj.pk] = CommissionService.get_solde(obj.pk)
+        return self._soldes[obj.pk]
+    
     def get_commission_disponible(self, obj):
-        """Calcule la commission disponible pour retrait"""
+        """Commission disponible pour retrait (commissions - retraits approuvés)"""
         try:
-            from django.db.models import Sum
-            from .models import Commission, RetraitCommission
-            
-            # Calculer le total des commissions
-            total_commissions = Commission.objects.filter(
-                partenaire=obj
-            ).aggregate(total=Sum('montant_commission'))['total'] or 0
-            
-            # Calculer le total des retraits approuvés
-            total_retraits = RetraitCommission.objects.filter(
-                partenaire=obj,
-                statut='approuve'
-            ).aggregate(total=Sum('montant'))['total'] or 0
-            
-            # Commission disponible = total commissions - total retraits approuvés
-            commission_disponible = float(total_commissions) - float(total_retraits)
-            
-            
-            return max(0, commission_disponible)  # Ne pas retourner de valeur négative
+            return float(self._get_solde(obj).disponible)
         except Exception as e:
             return 0.0
     
     def get_commission_totale(self, obj):
-        """Calcule le total des commissions gagnées"""
+        """Total des commissions gagnées"""
         try:
-            from django.db.models import Sum
-            from .models import Commission
-            
-            total_commissions = Commission.objects.filter(
-                partenaire=obj
-            ).aggregate(total=Sum('montant_commission'))['total'] or 0
-            
-            return float(total_commissions)
+            return float(self._get_solde(obj).total_gagne)
         except Exception as e:
             return 0.0
     
     def get_peut_retirer(self, obj):
         """Détermine si le partenaire peut retirer ses commissions"""
         try:
-            # Calculer le total des commissions (pas la commission disponible)
-            from django.db.models import Sum
-            from .models import Commission
-            
-            total_commissions = Commission.objects.filter(
-                partenaire=obj
-            ).aggregate(total=Sum('montant_commission'))['total'] or 0
-            
-            # Récupérer le seuil minimum
-            config = ConfigurationPartenaire.get_configuration_active()
-            seuil_minimum = config.seuil_retrait_minimum
-            
             # Le partenaire peut retirer si ses commissions totales >= seuil minimum
-            return float(total_commissions) >= float(seuil_minimum)
+            config = ConfigurationPartenaire.get_configuration_active()
+            return float(self._get_solde(obj).total_gagne) >= float(config.seuil_retrait_minimum)
         except Exception as e:
             return False
     
@@ -9,6 +9,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.authtoken.models import Token
+from rest_framework.pagination import CursorPagination
 from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import make_password
 from django.utils import timezone
@@ -17,11 +18,14 @@ from django.db import models, transaction
 from django.db.models import Avg, Sum, F
 from django.core.exceptions import ValidationError
 from django.utils.crypto import get_random_string
+from django.http import StreamingHttpResponse
+import csv
 import logging
 
 # Imports des modèles
 from .models import Utilisateur, InscriptionEnAttente, Commission, RetraitCommission, LienParentEnfant
 from academic_structure.models import NiveauScolaire
+from academic_structure.views import NiveauScolaireViewSet as BaseNiveauScolaireViewSet
 from progression.models import ProgressionChapitre, ProgressionMatiere
 from cours.models import Chapitre
 from quiz.models import Quiz, TentativeQuiz
@@ -185,14 +189,22 @@ class UtilisateurViewSet(viewsets.ModelViewSet):
                 return Response({'error': 'Accès non autorisé'}, status=status.HTTP_403_FORBIDDEN)
             
             print("DEBUG: Authentification OK")
-            enfants = Utilisateur.objects.filter(liens_enfant__parent=request.user).distinct()
-            print(f"DEBUG: {enfants.count()} enfants trouvés")
+            enfants = list(Utilisateur.objects.filter(liens_enfant__parent=request.user).distinct())
+            print(f"DEBUG: {len(enfants)} enfants trouvés")
             
             # Récupérer les vraies données des enfants depuis la base
             from progression.models import ProgressionChapitre, ProgressionMatiere
-            from abonnements.models import Abonnement
+            from abonnements.models import AbonnementActuel
             from academic_structure.models import NiveauScolaire
             
+            # Abonnements actuels de tous les enfants via leur référence, en une requête
+            abonnements_actuels = {
+                reference.utilisateur_id: reference.abonnement
+                for reference in AbonnementActuel.objects.filter(
+                    utilisateur__in=enfants, abonnement__actif=True
+                ).select_related('abonnement__pack')
+            }
+            
             enfants_data = []
             for enfant in enfants:
                 # Récupérer les statistiques réelles
@@ -211,10 +223,7 @@ class UtilisateurViewSet(viewsets.ModelViewSet):
                 moyenne = scores_chapitres
                 
                 # Récupérer l'abonnement actuel
-                abonnement_actuel = Abonnement.objects.filter(
-                    utilisateur=enfant, 
-                    actif=True
-                ).first()
+                abonnement_actuel = abonnements_actuels.get(enfant.id)
                 
                 # Récupérer le niveau scolaire de l'enfant
                 # On va chercher le niveau le plus fréquent parmi les matières étudiées
@@ -380,13 +389,15 @@ class UtilisateurViewSet(viewsets.ModelViewSet):
         if request.user.role not in ['parent', 'partenaire']:
             return Response({'error': 'Accès non autorisé'}, status=status.HTTP_403_FORBIDDEN)
         
-        # Récupérer les vraies données de parrainage depuis la base
-        from django.db.models import Count, Sum
+        # Statistiques de parrainage en une requête (lecture seule)
+        from abonnements.services import ParrainageService
         
-        # Compter les parrainages réussis
-        parrainages_reussis = Utilisateur.objects.filter(
-            code_parrain_utilise=request.user.code_parrainage
-        ).count()
+        stats = ParrainageService.get_statistiques_parrainage(request.user)
+        if not stats['success']:
+            return Response({'error': stats['error']}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        # Inscriptions réalisées avec le code de parrainage de l'utilisateur
+        parrainages_reussis = stats['inscrits_avec_code']
         
         # Calculer les bonus (logique métier)
         bonus_accumules = parrainages_reussis * 100  # 100 points par parrainage
@@ -512,13 +523,14 @@ class UtilisateurViewSet(viewsets.ModelViewSet):
             # Récupérer les détails de l'enfant
             from progression.models import ProgressionChapitre, ProgressionMatiere
             from academic_structure.models import NiveauScolaire, Matiere
-            from abonnements.models import Abonnement
+            from abonnements.models import AbonnementActuel
             
-            # Récupérer l'abonnement actuel de l'enfant
-            abonnement_actuel = Abonnement.objects.filter(
-                utilisateur=enfant,
-                statut='actif'
-            ).select_related('pack').first()
+            # Récupérer l'abonnement actuel de l'enfant via sa référence (une jointure par clé primaire)
+            reference = AbonnementActuel.objects.filter(
+                utilisateur_id=enfant.id,
+                abonnement__actif=True
+            ).select_related('abonnement__pack').first()
+            abonnement_actuel = reference.abonnement if reference else None
             
             # Statistiques de base
             chapitres_termines = ProgressionChapitre.objects.filter(
@@ -605,92 +617,9 @@ class UtilisateurViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Non authentifié'}, status=status.HTTP_401_UNAUTHORIZED)
         
         try:
-            from abonnements.models import PackAbonnement
-            
-            # Récupérer tous les packs individuels (non spéciaux familiaux)
-            packs_queryset = PackAbonnement.objects.filter(
-                actif=True
-            ).exclude(
-                nom__in=[
-                    "Pack de Bienvenue Parrainage",
-                    "Pack Découverte",
-                    "Pack Famille 3 Enfants",
-                    "Pack Famille 5+ Enfants"
-                ]
-            ).exclude(
-                description__icontains="Pack gratuit d'une semaine offert grâce au parrainage"
-            ).exclude(
-                description__icontains="Pack de découverte gratuit"
-            ).exclude(
-                description__icontains="famille"
-            )
+            from abonnements.views import reponse_catalogue
             
-            # Convertir en format API
-            packs_data = []
-            for pack in packs_queryset:
-                packs_data.append({
-                    'id': pack.id,
-                    'nom': pack.nom,
-                    'prix': float(pack.prix),
-                    'prix_reduit': float(pack.prix_reduit) if pack.prix_reduit else float(pack.prix),
-                    'devise': 'FCFA',
-                    'type_pack': 'standard',
-                    'description': pack.description or f"Pack {pack.nom}",
-                    'duree_jours': pack.duree_jours or 30,
-                    'periode': pack.periode or 'mois',
-                    'reduction_pourcentage': 0,
-                    'offre_semaine_gratuite': False,
-                    'conditions_speciales': None
-                })
-            
-            # Si aucun pack trouvé, retourner des packs par défaut
-            if not packs_data:
-                packs_data = [
-                    {
-                        'id': 'pack-gratuit',
-                        'nom': 'Gratuit',
-                        'prix': 0,
-                        'prix_reduit': 0,
-                        'devise': 'FCFA',
-                        'type_pack': 'standard',
-                        'description': 'Accès limité aux fonctionnalités de base',
-                        'duree_jours': 30,
-                        'periode': 'mois',
-                        'reduction_pourcentage': 0,
-                        'offre_semaine_gratuite': False,
-                        'conditions_speciales': None
-                    },
-                    {
-                        'id': 'pack-standard',
-                        'nom': 'Standard',
-                        'prix': 500,
-                        'prix_reduit': 500,
-                        'devise': 'FCFA',
-                        'type_pack': 'standard',
-                        'description': 'Pack standard avec accès aux cours et quiz',
-                        'duree_jours': 7,
-                        'periode': 'semaine',
-                        'reduction_pourcentage': 0,
-                        'offre_semaine_gratuite': False,
-                        'conditions_speciales': None
-                    },
-                    {
-                        'id': 'pack-premium',
-                        'nom': 'Premium',
-                        'prix': 1500,
-                        'prix_reduit': 1500,
-                        'devise': 'FCFA',
-                        'type_pack': 'standard',
-                        'description': 'Pack premium avec toutes les fonctionnalités',
-                        'duree_jours': 30,
-                        'periode': 'mois',
-                        'reduction_pourcentage': 0,
-                        'offre_semaine_gratuite': False,
-                        'conditions_speciales': None
-                    }
-                ]
-            
-            return Response({'packs': packs_data})
+            return reponse_catalogue(request, 'individuels')
             
         except Exception as e:
             logger.error(f"Erreur lors de la récupération des packs: {str(e)}")
@@ -2412,14 +2341,25 @@ class UtilisateurViewSet(viewsets.ModelViewSet):
                 'error': 'Erreur lors du chargement du profil public'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class NiveauScolaireViewSet(viewsets.ReadOnlyModelViewSet):
-    """ViewSet pour les niveaux scolaires"""
-    from academic_structure.models import NiveauScolaire
-    queryset = NiveauScolaire.objects.all()
-    serializer_class = NiveauScolaireSerializer
+class NiveauScolaireViewSet(BaseNiveauScolaireViewSet):
+    """ViewSet pour les niveaux scolaires (ouvert sans authentification)"""
     permission_classes = [AllowAny]
 
 
+class FilleulsPagination(CursorPagination):
+    """Pagination par curseur des filleuls d'un partenaire (stable malgré les nouvelles inscriptions)"""
+    ordering = '-id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class TamponEcho:
+    """Pseudo-fichier pour csv.writer : retourne la ligne écrite au lieu de la stocker"""
+    def write(self, valeur):
+        return valeur
+
+
 class PartenaireViewSet(viewsets.ModelViewSet):
     """ViewSet pour la gestion des partenaires"""
     serializer_class = UtilisateurPartenaireSerializer
@@ -2474,51 +2414,49 @@ class PartenaireViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def mes_filleuls(self, request):
-        """Récupérer les filleuls du partenaire"""
+        """
+        Récupérer les filleuls du partenaire (une requête, du plus récent au plus ancien).
+        ?page_size=N ou ?cursor=... : pagination par curseur ; ?export=csv : export CSV en flux.
+        """
         if request.user.role != 'partenaire':
-                return Response(
+            return Response(
                 {'error': 'Accès refusé. Rôle partenaire requis'}, 
-                    status=status.HTTP_403_FORBIDDEN
-                )
-            
-        from abonnements.models import Parrainage
-        from abonnements.models import Abonnement
+                status=status.HTTP_403_FORBIDDEN
+            )
         
-        # Récupérer les parrainages du partenaire
-        parrainages = Parrainage.objects.filter(parrain=request.user).select_related('filleul')
+        from abonnements.services import CommissionService
+        filleuls = CommissionService.get_filleuls_partenaire(request.user.pk)
         
-        filleuls_data = []
-        for parrainage in parrainages:
-            filleul = parrainage.filleul
-            
-            # Vérifier si le filleul a un abonnement actif
-            abonnement_actif = Abonnement.objects.filter(
-                utilisateur=filleul,
-                statut='actif'
-            ).exists()
-            
-            # Calculer la commission totale pour ce filleul
-            # Récupérer les abonnements du filleul pour trouver les commissions
-            abonnements_filleul = Abonnement.objects.filter(utilisateur=filleul)
-            abonnement_ids = [ab.id for ab in abonnements_filleul]
-            
-            commission_totale = Commission.objects.filter(
-                partenaire=request.user,
-                abonnement_id__in=abonnement_ids
-            ).aggregate(total=Sum('montant_commission'))['total'] or 0
-            
-            filleuls_data.append({
-                'nom': filleul.last_name,
-                'prenom': filleul.first_name,
-                'email': filleul.email,
-                'date_inscription': parrainage.date_parrainage,
-                'abonnement_actif': abonnement_actif,
-                'commission_totale': commission_totale
-            })
+        if request.query_params.get('export') == 'csv':
+            return self._export_filleuls_csv(filleuls.order_by('-id'))
+        
+        if 'cursor' in request.query_params or 'page_size' in request.query_params:
+            pagination = FilleulsPagination()
+            page = pagination.paginate_queryset(filleuls, request, view=self)
+            return pagination.get_paginated_response(FilleulSerializer(page, many=True).data)
         
-        serializer = FilleulSerializer(filleuls_data, many=True)
+        serializer = FilleulSerializer(filleuls.order_by('-id'), many=True)
         return Response(serializer.data)
     
+    def _export_filleuls_csv(self, filleuls):
+        """Flux CSV des filleuls : les lignes sont lues par lots, jamais toutes en mémoire"""
+        champs = ['nom', 'prenom', 'email', 'date_inscription', 'abonnement_actif', 'commission_totale']
+        ecrivain = csv.writer(TamponEcho())
+        
+        def lignes():
+            yield ecrivain.writerow(champs)
+            for filleul in filleuls.iterator(chunk_size=1000):
+                yield ecrivain.writerow([
+                    filleul['nom'], filleul['prenom'], filleul['email'],
+                    filleul['date_inscription'].isoformat() if filleul['date_inscription'] else '',
+                    'oui' if filleul['abonnement_actif'] else 'non',
+                    filleul['commission_totale'],
+                ])
+        
+        reponse = StreamingHttpResponse(lignes(), content_type='text/csv; charset=utf-8')
+        reponse['Content-Disposition'] = 'attachment; filename="filleuls.csv"'
+        return reponse
+    
     @action(detail=False, methods=['get'], permission_classes=[AllowAny])
     def configuration_partenaire(self, request):
         """Récupérer la configuration partenaire pour l'inscription (accessible sans authentification)"""
@@ -2583,20 +2521,10 @@ class PartenaireViewSet(viewsets.ModelViewSet):
                 'error': f'Le montant doit être un multiple de {config.montant_retrait_multiple} FCFA'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Vérifier que le partenaire a suffisamment de commission disponible
-        from django.db.models import Sum
-        from .models import Commission, RetraitCommission
-        
-        total_commissions = Commission.objects.filter(
-            partenaire=request.user
-        ).aggregate(total=Sum('montant_commission'))['total'] or 0
-        
-        total_retraits_approuves = RetraitCommission.objects.filter(
-            partenaire=request.user,
-            statut='approuve'
-        ).aggregate(total=Sum('montant'))['total'] or 0
+        # Vérifier que le partenaire a suffisamment de commission disponible (solde matérialisé)
+        from abonnements.services import CommissionService
         
-        commission_disponible = float(total_commissions) - float(total_retraits_approuves)
+        commission_disponible = float(CommissionService.get_solde(request.user.pk).disponible)
         
         if montant > commission_disponible:
             return Response({